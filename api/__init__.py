@@ -1,6 +1,16 @@
-from db import modulepath, logger, helpers, get_database, DataBase
+from db import modulepath, logger, helpers, get_database, DataBase, get_icon_store
+from db import classification_queue, classification_cache
+from db.models import IReclassificationRun
+from db.metadata_fetcher import MetadataFetcher
+from db import search
+from ml.classification_worker import ClassificationWorkerPool
+from ml import reclassification
+from ml.title_classifier import TitleClassifier, category_split
+from ml.batch_classification import BatchClassifier
+from ml.embedding_classifier import EmbeddingClassifier
+from ml.providers import get_provider
 from . import models
-from fastapi import FastAPI, HTTPException, Depends, Query, Path, status
+from fastapi import FastAPI, HTTPException, Depends, Query, Path, Request, Response, status
 from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -10,17 +20,64 @@ import sqlite3
 # from contextlib import contextmanager
 import base64
 import os
+import hashlib
 import requests
 from datetime import datetime, timedelta, time, timezone
-from .chatbot import app as chatbot_router
+from contextlib import asynccontextmanager
+from .chatbot import app as chatbot_router, chat_tasks, database as chatbot_database, activity_tools
+from ml.chat_tools import PERIODS
+import asyncio
+import json
 
 DEFAULT_BLOCK_ID = 1 # BlockId=1 for "Permanent Block" rule
 
+# Database connection
+DATABASE_PATH = modulepath.joinpath('..', 'instance', 'database.db')
+# modulepath.joinpath('..', 'instance', 'icons_url').mkdir(parents=True, exist_ok=True)
+
+# Classifies new apps / baseURLs off the request path (see db/classification_queue.py)
+# Confident local predictions skip the LLM, kept in sync with manual category edits
+# Most used apps / sites first, one-off visits wait for enough usage or the off-peak hours
+usage_priority = classification_queue.UsagePriority()
+local_classifier = EmbeddingClassifier()
+classification_pool = ClassificationWorkerPool(
+    db_path=DATABASE_PATH, classifier=BatchClassifier(), batch_size=64, local=local_classifier, priority=usage_priority
+)
+# Bulk reclassification runs of this process by RunId, for progress and cancellation
+reclassification_jobs: Dict[int, reclassification.ReclassificationJob] = {}
+
+# Title / Description / icon of new baseURLs, fetched off the insert path (see db/metadata_fetcher.py)
+metadata_fetcher = MetadataFetcher(db_path=DATABASE_PATH, on_fetched=classification_pool.notify, priority=usage_priority)
+
+# Category of browser tabs by their title (cache -> keywords -> local model -> LLM), see ml/title_classifier.py
+title_classifier = TitleClassifier(db_path=DATABASE_PATH, classifier=BatchClassifier())
+
+# Full-text search over notes and the chat history, rows older than their index (or a rebuild) are indexed in the background
+search_indexer = search.SearchIndexer({str(DATABASE_PATH): ('Notes', ), chatbot_database.path: ('Chats', 'Messages')})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    classification_pool.start()
+    metadata_fetcher.start()
+    title_classifier.start()
+    chat_tasks.start()
+    search_indexer.start()
+    try:
+        yield
+    finally:
+        search_indexer.stop()
+        await chat_tasks.stop()
+        activity_tools.close()
+        title_classifier.stop()
+        metadata_fetcher.stop()
+        classification_pool.stop()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Efficia API",
     description="API for Efficia Productivity Tracking Application",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -34,11 +91,6 @@ app.add_middleware(
 
 app.include_router(chatbot_router, prefix="/api")
 
-# Database connection
-DATABASE_PATH = modulepath.joinpath('..', 'instance', 'database.db')
-# modulepath.joinpath('..', 'instance', 'icons_url').mkdir(parents=True, exist_ok=True)
-
-
 # @contextmanager
 def get_db():
     database = DataBase(
@@ -51,11 +103,73 @@ def get_db():
 
 # app.mount("/static/icons", StaticFiles(directory=icons_directory), name="static")
 
-@app.get("/api/static/icons/{image_name}")
-async def get_icon(image_name: str):
-    image_path = modulepath.joinpath('..', 'instance', 'icons', image_name)
-    if image_path.exists():
-        return FileResponse(image_path)
+ICON_CACHE_CONTROL = "public, max-age=86400"                       # by name, revalidated with the ETag
+ICON_BLOB_CACHE_CONTROL = "public, max-age=31536000, immutable"     # by content hash, never changes
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match: return False
+    return etag in (tag.strip() for tag in if_none_match.split(',')) or if_none_match.strip() == '*'
+
+def icon_response(request: Request, digest: str, cache_control: str) -> Response:
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    data = get_icon_store().get_blob(digest)
+    if data is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Icon not found")
+    return Response(content=data, media_type="image/png", headers=headers)
+
+@app.get("/api/static/icons/batch", tags=["Icons"], response_model=models.IconBatchResponse)
+async def get_icons_batch(
+    request: Request,
+    names: List[str] = Query(..., description="Icon names, e.g. the ICON field of /api/apps/"),
+    size: Optional[int] = Query(None, description="Pre-sized thumbnail (e.g. 16, 32)")
+):
+    """Returns many icons (as data uris) in one cacheable response."""
+    store = get_icon_store()
+    lookup_names = {
+        name: f"{name.removesuffix('.png')}.{size}.png" if size is not None else name
+        for name in names
+    }
+    hashes = store.get_hashes(lookup_names.values())
+    if size is not None: # fallback to the full size icon
+        hashes.update(store.get_hashes(
+            name for name, thumbnail in lookup_names.items() if thumbnail not in hashes
+        ))
+    resolved = {name: hashes.get(lookup_names[name], hashes.get(name)) for name in lookup_names}
+    etag = '"' + hashlib.sha256(
+        "\n".join(f"{name}:{digest}" for name, digest in sorted(resolved.items())).encode('utf-8')
+    ).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": ICON_CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    blobs = store.get_blobs(digest for digest in resolved.values() if digest)
+    response = models.IconBatchResponse(
+        icons={
+            name: models.IconBatchItem(hash=digest, data=f"data:image/png;base64,{base64.b64encode(blobs[digest]).decode('utf-8')}")
+            for name, digest in resolved.items() if digest and digest in blobs
+        },
+        missing=[name for name, digest in resolved.items() if not digest or digest not in blobs]
+    )
+    return Response(content=response.model_dump_json(), media_type="application/json", headers=headers)
+
+@app.get("/api/static/icons/blob/{digest}", tags=["Icons"])
+async def get_icon_blob(request: Request, digest: str):
+    return icon_response(request, digest, ICON_BLOB_CACHE_CONTROL)
+
+@app.get("/api/static/icons/{image_name}", tags=["Icons"])
+async def get_icon(request: Request, image_name: str, size: Optional[int] = Query(None, description="Pre-sized thumbnail (e.g. 16, 32)")):
+    store = get_icon_store()
+    digest = None
+    if size is not None:
+        digest = store.get_hash(f"{image_name.removesuffix('.png')}.{size}.png")
+    if digest is None:
+        digest = store.get_hash(image_name)
+    if digest is not None:
+        return icon_response(request, digest, ICON_CACHE_CONTROL)
     return FileResponse(modulepath.joinpath('..', 'assets', 'img', 'null.png'))
 
 # API Routes
@@ -89,6 +203,7 @@ async def set_url_block_status(
         if not cursor.fetchone():
             cursor.execute("INSERT INTO Blocks (BlockId, permanent) VALUES (?, TRUE)", (DEFAULT_BLOCK_ID,))
             database.commit()
+    search_indexer.notify() # notes of a database older than its index
     
     return models.SimpleSuccessResponse(success=True, message=f"done.")
 
@@ -251,6 +366,7 @@ async def add_app(
 ):
     with database.cursor_context() as cursor:
         database.insert_app(app=app.model_dump(), commit=True)
+    classification_pool.notify()
     return models.BoolResponse(sucess=True)
 
 @app.put("/api/apps/{app_id}/block", tags=["Apps"], response_model=models.SimpleSuccessResponse)
@@ -469,6 +585,7 @@ async def update_url_category(
             # Unassign category
             cursor.execute("UPDATE BaseURLs SET Category = NULL WHERE baseURL = ?", (url_category.baseURL,))
             database.commit()
+            local_classifier.forget('url', url_category.baseURL)
             return None
         else:
             # Assign category - check if category exists
@@ -478,7 +595,9 @@ async def update_url_category(
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Category '{url_category.Category}' not found")
 
             cursor.execute("UPDATE BaseURLs SET Category = ? WHERE baseURL = ?", (url_category.Category, url_category.baseURL))
+            classification_cache.store_url(cursor, url_category.baseURL, url_category.Category, 'user')
             database.commit()
+            local_classifier.sync(cursor, 'url', url_category.baseURL)
             # Recalculate itemCount for response (optional, or handle in GET)
             cursor.execute("SELECT COUNT(AppId) as count FROM Apps WHERE Category = ?", (category_record['Category'],))
             app_count = cursor.fetchone()['count']
@@ -518,11 +637,12 @@ async def add_manual_base_url(
                      base_url_data.Description,
                      base_url_data.Category,
                      base_url_data.BlockId,
-                     False, # Let background fetching handle this if needed
+                     False, # fetched in the background by metadata_fetcher
                      None # Or allow setting icon manually
                  )
              )
              database.commit()
+             metadata_fetcher.notify()
              # Fetch the inserted record to return it
              cursor.execute("SELECT * FROM BaseURLs WHERE baseURL = ?", (base_url_data.baseURL,))
              new_record = cursor.fetchone()
@@ -537,6 +657,14 @@ async def add_manual_base_url(
              logger.error(f"Error adding manual BaseURL: {e}")
              raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not add BaseURL")
 
+@app.get("/api/baseUrls/metadata/status", tags=["BaseUrl"], response_model=models.MetadataFetcherStats)
+async def get_metadata_fetcher_status(
+    database: DataBase = Depends(get_db)
+):
+    """Background Title / Description / icon fetching: counters of this process and the backlog."""
+    with database.cursor_context() as cursor:
+        return models.MetadataFetcherStats(**metadata_fetcher.stats(cursor))
+
 
 #####################################################################################
 #                                  Activity                                         #
@@ -639,8 +767,301 @@ async def add_activity(
             EntryId=data.EntryId,
             commit=True
         )
+    if data.activity.URL: # may have added a new baseURL, or enqueued a known one
+        metadata_fetcher.notify()
+        classification_pool.notify()
+        title_classifier.notify()
     return models.AddActivityResponse(sucess=True, EntryId=EntryId)
 
+@app.get("/api/activity/categories", tags=["Activity"], response_model=List[models.ActivityCategorySplit])
+async def get_activity_categories(
+    start_date: Optional[str] = Query(None, description="Start date (YYYY-MM-DD)"),
+    end_date: Optional[str] = Query(None, description="End date (YYYY-MM-DD)"),
+    database: DataBase = Depends(get_db)
+):
+    """Active time per category, browser tabs counted by their title's category when it has one (else their site's)."""
+    with database.cursor_context() as cursor:
+        return [models.ActivityCategorySplit(**split) for split in category_split(cursor, start_date, end_date)]
+
+@app.get("/api/activity/titles/status", tags=["Activity"], response_model=models.TitleClassifierStats)
+async def get_title_classifier_status(
+    database: DataBase = Depends(get_db)
+):
+    with database.cursor_context() as cursor:
+        return models.TitleClassifierStats(**title_classifier.stats(cursor))
+
+@app.get("/api/activity/{entry_id}/category", tags=["Activity"], response_model=models.ActivityTitleCategory)
+async def get_activity_title_category(
+    entry_id: int = Path(..., description="EntryId of a browser tab"),
+    database: DataBase = Depends(get_db)
+):
+    with database.cursor_context() as cursor:
+        cursor.execute("SELECT * FROM ActivityTitleCategories WHERE EntryId = ?", (entry_id, ))
+        row = cursor.fetchone()
+        if not row: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Entry not classified by title")
+        return models.ActivityTitleCategory(**row)
+
+@app.put("/api/activity/{entry_id}/category", tags=["Activity"], response_model=models.SimpleSuccessResponse)
+async def set_activity_title_category(
+    data: models.SetTitleCategory,
+    entry_id: int = Path(..., description="EntryId of a browser tab"),
+    database: DataBase = Depends(get_db)
+):
+    """Sets the category of the entry's title, for every entry with the same title on the same site."""
+    with database.cursor_context() as cursor:
+        cursor.execute("SELECT TitleKey FROM ActivityTitleCategories WHERE EntryId = ?", (entry_id, ))
+        row = cursor.fetchone()
+        if not row: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Entry not classified by title")
+        count = title_classifier.set_category(cursor, row['TitleKey'], data.Category)
+        database.commit()
+    return models.SimpleSuccessResponse(success=True, message=f"{count} entries updated.")
+
+#####################################################################################
+#                               LLM Provider                                        #
+#####################################################################################
+
+@app.get("/api/llm/provider", tags=["LLM"], response_model=models.LLMProviderStats)
+async def get_llm_provider_stats():
+    """Requests of this process through the configured provider (ml/providers.py)."""
+    return models.LLMProviderStats(**get_provider().stats())
+
+#####################################################################################
+#                           ClassificationQueue                                     #
+#####################################################################################
+
+@app.get("/api/classification/queue", tags=["Classification"], response_model=models.ClassificationQueueMetrics)
+async def get_classification_queue_metrics(
+    database: DataBase = Depends(get_db)
+):
+    with database.cursor_context() as cursor:
+        return models.ClassificationQueueMetrics(
+            **classification_queue.metrics(cursor, priority=usage_priority),
+            llm=models.ClassificationBatchStats(**classification_pool.batch_stats()),
+            local=models.ClassificationLocalStats(**local_stats) if (local_stats := classification_pool.local_stats()) else None
+        )
+
+@app.get("/api/classification/queue/dead", tags=["Classification"], response_model=List[models.ClassificationJob])
+async def get_classification_dead_letters(
+    limit: int = Query(100, ge=1, le=1000),
+    database: DataBase = Depends(get_db)
+):
+    with database.cursor_context() as cursor:
+        return [models.ClassificationJob(**job) for job in classification_queue.dead_letters(cursor, limit=limit)]
+
+@app.post("/api/classification/queue/retry", tags=["Classification"], response_model=models.SimpleSuccessResponse)
+async def retry_classification_dead_letters(
+    job_id: Optional[int] = Query(None, description="Retry only this dead-lettered job"),
+    database: DataBase = Depends(get_db)
+):
+    with database.cursor_context() as cursor:
+        count = classification_queue.retry_dead(cursor, job_id=job_id)
+        database.commit()
+    if count: classification_pool.notify()
+    return models.SimpleSuccessResponse(success=True, message=f"{count} job(s) requeued.")
+
+@app.post("/api/classification/reclassify", tags=["Classification"], response_model=models.ReclassificationRun)
+async def start_reclassification(
+    request: models.ReclassificationRequest,
+    database: DataBase = Depends(get_db)
+):
+    """
+    Reclassifies existing apps / baseURLs in the background. With dry_run (the default) the changes
+    are only recorded, review them with GET .../{run_id}/changes and write them with POST .../{run_id}/apply.
+    """
+    if request.scope == 'category' and not request.category:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="scope 'category' needs a category")
+    if not request.kinds:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="kinds cannot be empty")
+    if any(job.is_alive() for job in reclassification_jobs.values()):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A reclassification is already running")
+    with database.cursor_context() as cursor:
+        run_id = reclassification.create_run(cursor, IReclassificationRun(
+            Scope=request.scope, Category=request.category if request.scope == 'category' else None,
+            Kinds=','.join(sorted(set(request.kinds))), DryRun=request.dry_run, IncludeManual=request.include_manual
+        ))
+        database.commit()
+        job = reclassification.ReclassificationJob(
+            db_path=DATABASE_PATH, classifier=classification_pool.classifier, run_id=run_id,
+            on_done=None if request.dry_run else local_classifier.fit
+        )
+        reclassification_jobs[run_id] = job
+        job.start()
+        run = reclassification.get_run(cursor, run_id)
+        assert run is not None
+        return models.ReclassificationRun(**run, active=True)
+
+@app.get("/api/classification/reclassify/{run_id}", tags=["Classification"], response_model=models.ReclassificationRun)
+async def get_reclassification(
+    run_id: int = Path(..., description="The reclassification run"),
+    database: DataBase = Depends(get_db)
+):
+    with database.cursor_context() as cursor:
+        run = reclassification.get_run(cursor, run_id)
+    if run is None: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reclassification run not found")
+    job = reclassification_jobs.get(run_id)
+    return models.ReclassificationRun(**run, active=job is not None and job.is_alive())
+
+@app.get("/api/classification/reclassify/{run_id}/changes", tags=["Classification"], response_model=List[models.ReclassificationChange])
+async def get_reclassification_changes(
+    run_id: int = Path(..., description="The reclassification run"),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    database: DataBase = Depends(get_db)
+):
+    """The diff found by the run: OldCategory -> NewCategory per app / baseURL."""
+    with database.cursor_context() as cursor:
+        return [models.ReclassificationChange(**change) for change in reclassification.get_changes(cursor, run_id, limit=limit, offset=offset)]
+
+@app.post("/api/classification/reclassify/{run_id}/cancel", tags=["Classification"], response_model=models.SimpleSuccessResponse)
+async def cancel_reclassification(
+    run_id: int = Path(..., description="The reclassification run")
+):
+    """Stops after the chunks in flight, the chunks already written stay written."""
+    job = reclassification_jobs.get(run_id)
+    if job is None or not job.is_alive():
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Reclassification run is not running")
+    job.cancel()
+    return models.SimpleSuccessResponse(success=True, message=f"Reclassification run {run_id} is being cancelled.")
+
+@app.post("/api/classification/reclassify/{run_id}/apply", tags=["Classification"], response_model=models.SimpleSuccessResponse)
+async def apply_reclassification(
+    run_id: int = Path(..., description="The finished dry run to apply"),
+    database: DataBase = Depends(get_db)
+):
+    """Writes the changes of a dry run, skipping items whose category was edited since."""
+    with database.cursor_context() as cursor:
+        run = reclassification.get_run(cursor, run_id)
+    if run is None: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reclassification run not found")
+    if not run['DryRun'] or run['Status'] not in ('done', 'cancelled'):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Only a finished dry run can be applied (status: {run['Status']})")
+    count = reclassification.apply_changes(database, run_id)
+    with database.cursor_context() as cursor:
+        local_classifier.fit(cursor)
+    return models.SimpleSuccessResponse(success=True, message=f"{count} of {run['Changed']} changes applied.")
+
+@app.get("/api/classification/cache", tags=["Classification"], response_model=models.ClassificationCacheStats)
+async def get_classification_cache_stats(
+    database: DataBase = Depends(get_db)
+):
+    with database.cursor_context() as cursor:
+        return models.ClassificationCacheStats(**classification_cache.stats(cursor))
+
+@app.get("/api/classification/cache/export", tags=["Classification"], response_model=List[models.ClassificationCacheEntry])
+async def export_classification_cache(
+    database: DataBase = Depends(get_db)
+):
+    """Live cache entries, to be imported into another database with POST /api/classification/cache/import."""
+    with database.cursor_context() as cursor:
+        return [models.ClassificationCacheEntry(**entry) for entry in classification_cache.export_entries(cursor)]
+
+@app.post("/api/classification/cache/import", tags=["Classification"], response_model=models.SimpleSuccessResponse)
+async def import_classification_cache(
+    entries: List[models.ClassificationCacheEntry],
+    database: DataBase = Depends(get_db)
+):
+    """Imported entries never replace this database's own manual choices."""
+    with database.cursor_context() as cursor:
+        count = classification_cache.import_entries(cursor, (entry.model_dump() for entry in entries))
+        database.commit()
+    if count: classification_pool.notify() # pending jobs may be answered by the new entries
+    return models.SimpleSuccessResponse(success=True, message=f"{count} of {len(entries)} entries imported.")
+
+@app.post("/api/classification/cache/purge", tags=["Classification"], response_model=models.SimpleSuccessResponse)
+async def purge_classification_cache(
+    database: DataBase = Depends(get_db)
+):
+    with database.cursor_context() as cursor:
+        count = classification_cache.purge_expired(cursor)
+        database.commit()
+    return models.SimpleSuccessResponse(success=True, message=f"{count} expired entries removed.")
+
+#####################################################################################
+#                               ResourceSample                                      #
+#####################################################################################
+
+@app.post("/api/resources/samples", tags=["Resources"], response_model=models.BoolResponse)
+async def add_resource_samples(
+    data: models.CreateResourceSamples,
+    database: DataBase = Depends(get_db)
+):
+    with database.cursor_context() as cursor:
+        database.insert_resource_samples(
+            samples=[sample.model_dump() for sample in data.samples],
+            commit=True
+        )
+    return models.BoolResponse(sucess=True)
+
+@app.post("/api/resources/downsample", tags=["Resources"], response_model=models.DownsampleResponse)
+async def downsample_resource_samples(
+    database: DataBase = Depends(get_db)
+):
+    with database.cursor_context() as cursor:
+        rolled = database.downsample_resource_samples(commit=True)
+    return models.DownsampleResponse(sucess=True, rolled=rolled)
+
+@app.get("/api/resources/apps", tags=["Resources"], response_model=List[models.AppResourceUsage])
+async def get_app_resources(
+    start_date: Optional[str] = Query(None, description="Start date (YYYY-MM-DD)"),
+    end_date: Optional[str] = Query(None, description="End date (YYYY-MM-DD)"),
+    app_id: Optional[str] = Query(None, description="Filter by AppId"),
+    limit: int = Query(100, ge=1, le=1000),
+    database: DataBase = Depends(get_db)
+):
+    """Resource cost per app (summed over every downsampling tier) next to its usage time."""
+    with database.cursor_context() as cursor:
+        resource_where, resource_params = [], []
+        usage_where, usage_params = [], []
+        if start_date:
+            resource_where.append("BucketStart >= CAST(strftime('%s', ?) AS INTEGER)")
+            resource_params.append(start_date)
+            usage_where.append("date(EndTime) >= ?")
+            usage_params.append(start_date)
+        if end_date:
+            resource_where.append("BucketStart < CAST(strftime('%s', ?, '+1 day') AS INTEGER)")
+            resource_params.append(end_date)
+            usage_where.append("date(EndTime) <= ?")
+            usage_params.append(end_date)
+        if app_id:
+            resource_where.append("AppId = ?")
+            resource_params.append(app_id)
+            usage_where.append("AppId = ?")
+            usage_params.append(app_id)
+
+        query = f"""--sql
+            WITH Resources AS (
+                SELECT
+                    AppId, SUM(CpuTime) AS CpuTime, SUM(RssSum) AS RssSum, MAX(RssMax) AS RssMax,
+                    SUM(ReadBytes) AS ReadBytes, SUM(WriteBytes) AS WriteBytes, SUM(Samples) AS Samples
+                FROM ResourceSamples
+                {"WHERE " + " AND ".join(resource_where) if resource_where else ""}
+                GROUP BY AppId
+            ), Usage AS (
+                SELECT AppId, SUM(Duration) AS UsageDuration
+                FROM ActivityEntries
+                {"WHERE " + " AND ".join(usage_where) if usage_where else ""}
+                GROUP BY AppId
+            )
+            SELECT r.*, COALESCE(u.UsageDuration, 0) AS UsageDuration
+            FROM Resources AS r
+            LEFT JOIN Usage AS u ON u.AppId = r.AppId
+            ORDER BY r.CpuTime DESC
+            LIMIT ?
+        """
+        cursor.execute(query, (*resource_params, *usage_params, limit))
+        return [
+            models.AppResourceUsage(
+                AppId=row['AppId'],
+                CpuTime=row['CpuTime'],
+                RssAvg=row['RssSum'] / row['Samples'] if row['Samples'] else 0.0,
+                RssMax=row['RssMax'],
+                ReadBytes=row['ReadBytes'],
+                WriteBytes=row['WriteBytes'],
+                Samples=row['Samples'],
+                UsageDuration=row['UsageDuration']
+            )
+            for row in cursor.fetchall()
+        ]
+
 #####################################################################################
 #                                   _Todo                                           #
 #####################################################################################
@@ -846,7 +1267,9 @@ async def delete_category(
              # Then delete the category
              cursor.execute("DELETE FROM Categories WHERE Category = ?", (category_name,))
              database.commit()
-             if cursor.rowcount == 0: # Should not happen after existence check, but good practice
+             deleted = cursor.rowcount
+             local_classifier.fit(cursor)
+             if deleted == 0: # Should not happen after existence check, but good practice
                   raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found during delete")
              return models.DeleteResponse(success=True, id=category_name, message="Category deleted successfully")
         except sqlite3.IntegrityError as e:
@@ -892,6 +1315,7 @@ def update_app_category(
                 """, (app_category.AppId, )
             )
             database.commit()
+            local_classifier.forget('app', app_category.AppId)
             return None
         cursor.execute("""--sql
                 SELECT * FROM Categories WHERE Category = ?
@@ -906,7 +1330,11 @@ def update_app_category(
             WHERE AppId = ?
             """, (app_category.Category, app_category.AppId)
         )
+        cursor.execute("SELECT * FROM Apps WHERE AppId = ?", (app_category.AppId, ))
+        app_record = cursor.fetchone()
+        if app_record is not None: classification_cache.store_app(cursor, app_record, app_category.Category, 'user')
         database.commit()
+        local_classifier.sync(cursor, 'app', app_category.AppId)
         return models.Category(Category=category_record['Category'], BlockId=category_record['BlockId'], Timestamp=category_record['Timestamp'])
 
 @app.put("/api/todos/{todo_id}/toggle", tags=["Todo"], response_model=models.TodoToggleResponse)
@@ -1133,6 +1561,68 @@ async def get_all_tags(database: DataBase = Depends(get_db)):
 
 
 
+#####################################################################################
+#                                   Search                                          #
+#####################################################################################
+
+@app.get("/api/search", tags=["Search"], response_model=models.SearchResponse)
+async def search_history(
+    q: str = Query(..., description='Words to find, "a phrase" or a prefix* (the last word is a prefix too)'),
+    kind: Optional[List[search.SearchKind]] = Query(None, description="Only these kinds of hits (default: all)"),
+    chat_id: Optional[int] = Query(None, description="Only in this chat (messages and chat titles)"),
+    role: Optional[str] = Query(None, description="Only messages by this author (USER / AI)"),
+    start_date: Optional[str] = Query(None, description="Start date (YYYY-MM-DD)"),
+    end_date: Optional[str] = Query(None, description="End date (YYYY-MM-DD)"),
+    limit: int = Query(20, ge=1, le=100),
+    database: DataBase = Depends(get_db)
+):
+    """Messages, chat titles and notes ranked by bm25 (best first), with the matches highlighted."""
+    started = datetime.now()
+    query = search.match_query(q)
+    kinds = tuple(kind or ('message', 'chat', 'note'))
+    if role is not None or chat_id is not None: kinds = tuple(k for k in kinds if k != 'note')
+    try:
+        until = (datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d') if end_date else None
+        if start_date: datetime.strptime(start_date, '%Y-%m-%d')
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Dates must be YYYY-MM-DD")
+    hits: List[search.SearchHit] = []
+    if query is not None:
+        if 'message' in kinds or 'chat' in kinds:
+            hits += chatbot_database.search_history(query, limit, kinds, chat_id=chat_id, role=role, since=start_date, until=until)
+        if 'note' in kinds:
+            with database.cursor_context() as cursor:
+                hits += database.search_notes(query, limit, since=start_date, until=until)
+        hits = sorted(hits, key=lambda hit: hit['score'])[:limit]
+    return models.SearchResponse(
+        query=query, hits=[models.SearchHit(**hit) for hit in hits],
+        took_ms=(datetime.now() - started).total_seconds() * 1000
+    )
+
+@app.get("/api/search/status", tags=["Search"], response_model=models.SearchStatus)
+async def get_search_status(
+    database: DataBase = Depends(get_db)
+):
+    """Rows of every index not indexed yet (older than the index, or since a rebuild)."""
+    with database.cursor_context() as cursor:
+        indexes = database.get_search_status()
+    return models.SearchStatus(
+        indexes=[models.SearchIndexStatus(**index) for index in indexes + chatbot_database.get_search_status()],
+        indexed=search_indexer.indexed
+    )
+
+@app.post("/api/search/rebuild", tags=["Search"], response_model=models.SimpleSuccessResponse)
+async def rebuild_search_index(
+    database: DataBase = Depends(get_db)
+):
+    """Empties the indexes, the background indexer fills them again batch by batch (see /api/search/status)."""
+    with database.cursor_context() as cursor:
+        database.rebuild_search_index(commit=True)
+    chatbot_database.rebuild_search_index()
+    search_indexer.notify()
+    return models.SimpleSuccessResponse(success=True, message="Rebuilding the search indexes.")
+
+
 # === Placeholder Endpoints for Other Features ===
 # Add basic GET endpoints for Goals, Sessions, Notes, Timers, Alarms
 # They will initially return empty lists or mock data until fully implemented.
@@ -1194,9 +1684,32 @@ async def get_settings():
     # TODO: Implement fetching user settings
     return {"message": "Settings endpoint not yet implemented"}
 
-# === AI Assistant (Complex - Deferred) ===
-@app.post("/api/ai/insights", tags=["AI"], response_model=dict)
-async def get_ai_insights():
-    raise NotImplementedError("Not Implemented")
-    # TODO: Implement AI analysis logic
-    return {"message": "AI insights endpoint not yet implemented"}
\ No newline at end of file
+# === AI Assistant ===
+INSIGHTS_PROMPT = (
+    "You are a productivity assistant. The user message is JSON with the user's tracked computer usage "
+    "(top apps, active time per day against the period before) and their todos due. Write 3 to 5 short, "
+    "specific insights or suggestions as a markdown list. Only use numbers that are in the JSON."
+)
+
+@app.post("/api/ai/insights", tags=["AI"], response_model=models.AIInsights)
+async def get_ai_insights(
+    period: Literal[PERIODS] = Query('last_7_days', description="Period of the activity to look at"), # type: ignore
+):
+    """Insights the model writes from the numbers of the chatbot's tools (ml/chat_tools.py), returned with them."""
+    started = datetime.now()
+    facts = {}
+    for name, arguments in (('top_apps', {'period': period}), ('usage_trend', {'period': period}), ('todos_due', {'days': 7})):
+        facts[name], _ = await asyncio.to_thread(activity_tools.call, name, arguments)
+    if all('error' in fact for fact in facts.values()): # no activity database yet, nothing for the model to read
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=facts['top_apps']['error'])
+    try:
+        response = await get_provider().acreate([
+            {'role': 'system', 'content': INSIGHTS_PROMPT}, {'role': 'user', 'content': json.dumps(facts)}
+        ])
+    except Exception as e:
+        logger.error(msg=f"AI insights: {e}")
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail="The LLM provider did not answer")
+    return models.AIInsights(
+        period=period, facts=facts, insights=response.choices[0].message.content or '',
+        took_ms=(datetime.now() - started).total_seconds() * 1000
+    )
\ No newline at end of file
@@ -1,38 +1,50 @@
 
-from fastapi import APIRouter, Request, HTTPException, status
+from fastapi import APIRouter, Request, HTTPException, Query, status
 from fastapi.responses import StreamingResponse, JSONResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import logging
-from openai import AsyncOpenAI
 import os
 import logging
 from json import decoder
 import uuid
+import asyncio
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Callable, Awaitable
 
+from db import modulepath
 from db.chatbot import get_database
 from db.chatbot.helpers import change_time_to_local
 from .models import BranchPickerRequest
-from .utils import formate_assistant, formate_user
-from ml.langchain_generate_title import generate_title
+from .utils import format_message, chat_page, PAGE_SIZE
+from .streaming import ChatStream, AnswerWriter, delta_texts, failed_texts
+from .tasks import ChatTaskWorker, heuristic_title
+from ml.providers import get_provider
+from ml.context_builder import ContextBuilder, count_tokens
+from ml.response_cache import ResponseCache
+from ml.chat_tools import ActivityTools, ToolChat, TOOL_NAMES
 
 database = get_database()
+# history sent with each request: newest messages in a token budget, the rest as a rolling summary
+context_builder = ContextBuilder(database)
+# the final write of answers and the model's chat titles, after the response closed (started in the API lifespan)
+chat_tasks = ChatTaskWorker(database)
+# answers of requests asked before (a repeated question, a regenerate after another chat asked it) replayed from memory
+response_cache = ResponseCache()
+# the tracked activity and todos the model reads by tool calls (ml/chat_tools.py), also the facts of /api/ai/insights
+activity_tools = ActivityTools(db_path=modulepath.joinpath('..', 'instance', 'database.db'))
 
-# TODO/BUG/ERROR: [-15] may give some error on the chats whose depth is more then 15 so i have to see the code again and coprate offset there
-# DUE TO load more feature which i am thing to add in the chats when scroll above 
+# long chats load by pages of the visible branch on scroll: GET /chat/{chatId}/messages
 
-groq_client = AsyncOpenAI(
-    base_url="https://api.groq.com/openai/v1",
-    api_key=os.environ["GROQ_API_KEY"]
-)
 
 app = APIRouter(prefix='/chatbot')
 
-async def stream_chat_response(messages: list, chat_id: str, new_chat: bool):
-        """Stream chat response from Groq"""
+async def stream_chat_response(messages: list, chat_id: str, new_chat: bool,
+                               is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None):
+        """Stream chat response from the configured provider (ml/providers.py)"""
         is_add_user_message_id: Optional[int] = None
+        if not new_chat: await chat_tasks.settle(chat_id)
     # try:
         if new_chat:
             # Convert the 'messages' format to what Groq expects (flatten content)
@@ -48,13 +60,7 @@ async def stream_chat_response(messages: list, chat_id: str, new_chat: bool):
             headId = database.get_current_active_child_id(chat_id=chat_id, message_id=None)
             first_active_msg = database.get_chat_message(chat_id=chat_id, message_id=headId)
             if first_active_msg['content'] == messages[0]['content'][0]['text']: # regenerating first message
-                formatted_messages = [
-                    {
-                        "role": "user" if message['message_by'] == 'USER' else "assistant",
-                        "content": message['content']
-                    }
-                    for message in reversed(database.get_chats_above(chat_id, headId, max_result=15))
-                ]
+                formatted_messages = (await context_builder.build(chat_id, headId))['messages']
                 is_add_user_message_id = headId
             else:
                 formatted_messages = []
@@ -72,13 +78,8 @@ async def stream_chat_response(messages: list, chat_id: str, new_chat: bool):
             chatinfo = database.get_chat_info(chat_id=chat_id)
             if chatinfo['active_depth'] + 1 == len(messages):
                 headId = chatinfo['leaf_node_id']
-                formatted_messages = [
-                    {
-                        "role": "user" if message['message_by'] == 'USER' else "assistant",
-                        "content": message['content']
-                    }
-                    for message in reversed(database.get_chats_above(chat_id, headId, max_result=15))
-                ]
+                reserve = count_tokens(messages[-1]['content'][0]['text'])
+                formatted_messages = (await context_builder.build(chat_id, headId, reserve=reserve))['messages']
                 msg = messages[-1]
                 assert msg['role'] == 'user', "Last Msg Must be User"
                 for content_item in msg['content']:
@@ -92,24 +93,13 @@ async def stream_chat_response(messages: list, chat_id: str, new_chat: bool):
                 leaf_node_parent_msg = database.get_chat_message(chat_id=chat_id, message_id=leaf_node_msg['parent_id'])
                 if leaf_node_parent_msg['content'] == messages[-1]['content'][0]['text']: # regenerating some message other then first message
                     all_messages = database.get_chats_down(chat_id=chat_id, message_id=None, max_result=len(messages))
-                    formatted_messages = [
-                        {
-                            "role": "user" if message['message_by'] == 'USER' else "assistant",
-                            "content": message['content']
-                        }
-                        for message in all_messages[-15:]
-                    ]
                     is_add_user_message_id = all_messages[-1]['MessageId']
+                    formatted_messages = (await context_builder.build(chat_id, is_add_user_message_id))['messages']
                 else: # edit some message other then first message 
                     all_messages = database.get_chats_down(chat_id=chat_id, message_id=None, max_result=len(messages))
-                    formatted_messages = [
-                        {
-                            "role": "user" if message['message_by'] == 'USER' else "assistant",
-                            "content": message['content']
-                        }
-                        for message in all_messages[-15:]
-                    ]
-                    headId = all_messages[-2]['MessageId']
+                    headId = all_messages[-2]['MessageId'] # the edited message is replaced, not sent
+                    reserve = count_tokens(messages[-1]['content'][0]['text'])
+                    formatted_messages = (await context_builder.build(chat_id, headId, reserve=reserve))['messages']
                     msg = messages[-1]
                     assert msg['role'] == 'user', "Last Msg Must be User"
                     for content_item in msg['content']:
@@ -119,46 +109,36 @@ async def stream_chat_response(messages: list, chat_id: str, new_chat: bool):
                                 "content": content_item['text']
                             })
             
-        response = await groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=formatted_messages,
-            stream=True
-        )
+        provider = get_provider()
+        chat = ToolChat(provider, activity_tools, formatted_messages)
+        cache_key = response_cache.key(chat.messages, f"{provider.name}/{provider.model}", {'tools': sorted(TOOL_NAMES)})
+        # a regenerate wants another answer than the ones already under the question
+        shown = database.get_children_contents(chat_id, is_add_user_message_id) if is_add_user_message_id is not None else []
+        cached = response_cache.get(cache_key, exclude=shown)
         
-        # Yield each chunk of the response as it streams
+        # Frames of the response as it streams, the answer is checkpointed to the database meanwhile
         async def generate_stream():
-            first = await response.__anext__()
-            messageId = first.to_dict().get('id')
-            aiResponse = ""
-            if messageId:
-                yield f'f:{{"messageId":"{messageId.replace("chatcmpl-", "msg-")}"}}\n'
-            async for data in response:
-                chunk = data.to_dict()
-                choices = chunk.get("choices")
-                if choices and len(choices) != 0:
-                    delta = choices[0].get("delta")
-                    if delta:
-                        content = delta.get('content')
-                        if content: 
-                            aiResponse += content
-                            d = content.replace("\\", "\\\\").replace("\n", "\\n").replace("\t", "\\t").replace("\"", "\\\"")
-                            yield f'0: "{d}"\n'
-            yield 'e:{"finishReason":"stop","usage":{"promptTokens":null,"completionTokens":null},"isContinued":false}\n'
-            yield 'd:{"finishReason":"stop","usage":{"promptTokens":null,"completionTokens":null}}\n'
-            if new_chat:
-                title = await generate_title(messages[0]['content'][0]['text'])
-                database.update_chat_title(chat_id=chat_id, title=title)
-                if is_add_user_message_id == None: 
-                    user_message = database.new_message(chat_id, content=formatted_messages[0]['content'], message_by='USER', commit=False)
-                else:
-                    user_message = is_add_user_message_id
-                database.new_message(chat_id, content=aiResponse, message_by='AI', parent_message_id=user_message, commit=True)
+            if cached is not None:
+                messageId, texts = f"msg-{uuid.uuid4().hex}", response_cache.replay(cached)
             else:
-                if is_add_user_message_id == None: 
-                    user_message = database.new_message(chat_id, content=formatted_messages[-1]['content'], message_by='USER', parent_message_id=headId, commit=False)
+                response = chat.astream()
+                try:
+                    first = await response.__anext__()
+                except Exception as e: # the provider or a tool failed before any text: an error part, not a cut response
+                    messageId, texts = f"msg-{uuid.uuid4().hex}", failed_texts(e)
                 else:
-                    user_message = is_add_user_message_id
-                database.new_message(chat_id, content=aiResponse, message_by='AI', parent_message_id=user_message, commit=True)
+                    messageId = first.id.replace("chatcmpl-", "msg-") if first.id else None
+                    # an answer from tool results is about data that moves on, only the others are cached
+                    texts = response_cache.record(cache_key, delta_texts(response, first), cacheable=lambda: not chat.calls)
+            writer = AnswerWriter(database, chat_id,
+                                  user_content=formatted_messages[0 if new_chat else -1]['content'],
+                                  parent_id=None if new_chat else headId, user_message_id=is_add_user_message_id)
+            if new_chat: # the heuristic title is shown until the model's replaces it
+                query = messages[0]['content'][0]['text']
+                chat_tasks.submit_title(chat_id, query=query, heuristic=heuristic_title(query))
+            answer = ChatStream(texts, writer, is_disconnected=is_disconnected, finish=chat_tasks.submit_answer)
+            async for part in answer.response(messageId):
+                yield part
 
         return generate_stream
     
@@ -176,7 +156,7 @@ async def generate(req: Request):
     chat_id = req.headers.get('chatid')
     new_chat = chat_id is None
     if chat_id is None:
-        db_chat_id = database.new_chat(title='New Chat', commit=False)
+        db_chat_id = database.new_chat(title=heuristic_title(messages[0]['content'][0]['text']) if messages else 'New Chat')
     
     try:
 
@@ -184,17 +164,18 @@ async def generate(req: Request):
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Messages content is required")
 
         # Get the stream of chat response
-        stream = await stream_chat_response(messages, db_chat_id if new_chat else chat_id, new_chat)
+        stream = await stream_chat_response(messages, db_chat_id if new_chat else chat_id, new_chat, is_disconnected=req.is_disconnected)
 
         if not stream:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Error getting response from Groq API")
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Error getting response from the LLM provider")
 
     
         # Expose the 'chatid' header in CORS
+        # the answer and the title are written by chat_tasks once the response closed
         return StreamingResponse(stream(), media_type="text/plain", headers={
             'chatid': f"{db_chat_id}" if new_chat else chat_id,
             "Access-Control-Expose-Headers": "chatid"
-        })
+        }, background=BackgroundTask(chat_tasks.notify))
     
     except decoder.JSONDecodeError: 
         raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail="Request must be ")
@@ -209,27 +190,38 @@ async def generate(req: Request):
 async def get_chat(chatId: str):    
     if chatId == '':
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="chatId was not given")
+    await chat_tasks.settle(chatId)
     try:
         chatinfo = database.get_chat_info(chat_id=chatId)
         db_messages = database.get_lazy_chat_messages(chat_id=chatId)
     except AssertionError:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="chat Not found")
-    messages = [
-        {
-            "message": formate_user(message) if message['message_by'] == "USER" else formate_assistant(message),
-            "parentId": str(message['parent_id']) if message['parent_id'] else None
-        }
-        for message in db_messages
-    ]
+    messages = [format_message(message) for message in db_messages]
     return {
             "headId": str(chatinfo['leaf_node_id']),
             "messages": messages
         }
 
+@app.get("/chat/{chatId}/messages")
+async def get_chat_messages_page(
+    chatId: int,
+    limit: int = Query(PAGE_SIZE, ge=1, le=500, description="Messages of the visible branch per page"),
+    cursor: Optional[str] = Query(None, description="`cursor` of the previous page, for the older messages")
+):
+    """The newest messages of the visible branch first, then older pages by cursor."""
+    await chat_tasks.settle(chatId)
+    try:
+        return chat_page(database, chat_id=chatId, limit=limit, cursor=cursor)
+    except AssertionError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="chat Not found")
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"{e}, reload the chat")
+
 @app.delete("/chat/{chatId}", response_model=models.DeleteResponse)
 async def delete_chat(chatId: str):    
     if chatId == '':
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="chatId was not given")
+    await chat_tasks.settle(chatId)
     try:
         database.delete_chat_info(chat_id=chatId, commit=True)
     except AssertionError:
@@ -241,6 +233,7 @@ async def delete_chat(chatId: str):
 async def branch_picker(chatId: str, request: BranchPickerRequest):
     if chatId == '':
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="chatId was not given")
+    await chat_tasks.settle(chatId)
     # print(chatId, request.message_pos, request.action) 1 1
     message_id = database.get_chats_down(chat_id=chatId, message_id=None, max_result=request.message_pos)[-1]['MessageId']
     if request.action == 'NEXT':
@@ -249,13 +242,7 @@ async def branch_picker(chatId: str, request: BranchPickerRequest):
         head_id = database.prev_message(chat_id=int(chatId), message_id=message_id, return_type='prev_message_leaf_id', commit=True)
     
     db_messages = database.get_lazy_chat_messages(chat_id=chatId)
-    messages = [
-        {
-            "message": formate_user(message) if message['message_by'] == "USER" else formate_assistant(message),
-            "parentId": str(message['parent_id']) if message['parent_id'] else None
-        }
-        for message in db_messages
-    ]
+    messages = [format_message(message) for message in db_messages]
 
     return {
         "chatId": chatId,
@@ -274,4 +261,23 @@ async def get_chats():
         }
         for chat in database.get_all_chats()
     ]
-    return chats
\ No newline at end of file
+    return chats
+@app.get("/tasks/status", response_model=models.ChatTaskStats)
+async def get_chat_tasks_status():
+    """Answers and titles written after their response closed (api/chatbot/tasks.py)."""
+    return models.ChatTaskStats(**chat_tasks.stats())
+
+@app.get("/cache/status", response_model=models.ResponseCacheStats)
+async def get_response_cache_status():
+    """Answers replayed from the response cache (ml/response_cache.py) instead of asking the model."""
+    return models.ResponseCacheStats(**response_cache.stats())
+
+@app.post("/cache/clear", response_model=models.ResponseCacheStats)
+async def clear_response_cache():
+    response_cache.clear()
+    return models.ResponseCacheStats(**response_cache.stats())
+
+@app.get("/tools/status", response_model=models.ActivityToolStats)
+async def get_activity_tools_status():
+    """Tool calls of the chatbot over the tracked data (ml/chat_tools.py), their cache and the daily rollups."""
+    return models.ActivityToolStats(**await asyncio.to_thread(activity_tools.stats))
@@ -11,3 +11,36 @@ class DeleteResponse(BaseModel):
     success: bool
     id: Union[int, str]
     message: str
+
+class ChatTaskStats(BaseModel):
+    pending: int
+    running: int
+    done: int
+    dead: int
+    submitted: int
+    ran: int
+    failed: int
+    latency_avg: Optional[float] = None
+
+class ResponseCacheStats(BaseModel):
+    entries: int
+    bytes: int
+    max_entries: int
+    max_bytes: int
+    near_duplicates: bool
+    hits: int
+    near_hits: int
+    misses: int
+    skipped: int
+    stored: int
+    evictions: int
+    hit_rate: Optional[float] = None
+
+class ActivityToolStats(BaseModel):
+    calls: int
+    cached: int
+    errors: int
+    latency_avg: Optional[float] = None
+    cache_entries: int
+    rollup_days: int
+    rolled_until: Optional[str] = None
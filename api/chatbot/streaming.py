@@ -0,0 +1,206 @@
+"""
+Streamed chat answers in the data stream format of the chat UI (one `<code>:<json>` part per line).
+Tokens are coalesced into text frames on a size / latency budget, and the partial answer is
+checkpointed to the database while it streams, so a client that drops the connection loses nothing.
+"""
+import asyncio
+import json
+import time
+from typing import TypedDict, Optional, List, Tuple, Any, AsyncIterator, Callable, Awaitable
+
+from db.chatbot import DataBase
+from db.helpers import logger
+from ml.context_builder import message_tokens
+from .utils import formatted_messages
+
+FRAME_BYTES: int = 512              # a text frame is written once this many bytes are buffered...
+FRAME_LATENCY: float = 0.05         # ... or its first token waited this long (sec)
+CHECKPOINT_INTERVAL: float = 2.0    # sec between writes of the partial answer
+
+FINISH_USAGE = {"promptTokens": None, "completionTokens": None}
+END = object()      # end of the upstream in the token queue
+FLUSH = object()    # the oldest buffered token waited `frame_latency`
+
+def text_part(text: str) -> str:
+    return f"0:{json.dumps(text, ensure_ascii=False)}\n"
+
+def data_part(code: str, payload: Any) -> str:
+    return f"{code}:{json.dumps(payload, ensure_ascii=False, separators=(',', ':'))}\n"
+
+async def delta_texts(chunks: AsyncIterator[Any], first: Optional[Any] = None) -> AsyncIterator[str]:
+    """Text of each completion chunk, `first` is a chunk already read from `chunks`; closing it closes `chunks`."""
+    try:
+        if first is not None and first.choices and first.choices[0].delta.content:
+            yield first.choices[0].delta.content
+        async for chunk in chunks:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        await chunks.aclose() # type: ignore
+
+async def failed_texts(error: Exception) -> AsyncIterator[str]:
+    """Texts of an upstream that failed before its first chunk: ChatStream sends its error part."""
+    raise error
+    yield # an async generator
+
+class StreamStats(TypedDict):
+    tokens: int
+    frames: int
+    checkpoints: int
+    disconnected: bool
+    error: Optional[str]
+
+class Answer(TypedDict):
+    chat_id: int
+    user_content: str
+    parent_id: Optional[int]
+    user_message_id: Optional[int]  # None: inserted with the answer
+    message_id: Optional[int]       # None: not checkpointed yet
+    content: str
+
+def save_answer(database: DataBase, answer: Answer, commit: bool = True) -> Tuple[int, int]:
+    """Inserts the answer (and the user message it answers) or updates its content, returns both ids."""
+    user_message_id, message_id = answer['user_message_id'], answer['message_id']
+    with database.writer(commit): # both messages or neither
+        if message_id is None:
+            if user_message_id is None:
+                user_message_id = database.new_message(answer['chat_id'], content=answer['user_content'], message_by='USER',
+                                                       parent_message_id=answer['parent_id'])
+            message_id = database.new_message(answer['chat_id'], content=answer['content'], message_by='AI',
+                                              parent_message_id=user_message_id)
+        else:
+            assert user_message_id is not None
+            database.update_message_content(answer['chat_id'], message_id, answer['content'])
+        formatted_messages.pop(message_id)
+        message_tokens.pop(message_id)
+    return user_message_id, message_id
+
+class AnswerWriter:
+    """The answer message, and the user message it answers: inserted on the first checkpoint, updated on the next ones."""
+    def __init__(self, database: DataBase, chat_id: int, user_content: str, parent_id: Optional[int] = None,
+                 user_message_id: Optional[int] = None):
+        self.database = database
+        self.chat_id = chat_id
+        self.user_content = user_content
+        self.parent_id = parent_id
+        self.user_message_id = user_message_id  # already stored (regenerating an answer)
+        self.message_id: Optional[int] = None
+
+    def answer(self, text: str) -> Answer:
+        return Answer(chat_id=self.chat_id, user_content=self.user_content, parent_id=self.parent_id,
+                      user_message_id=self.user_message_id, message_id=self.message_id, content=text)
+
+    def save(self, text: str) -> int:
+        self.user_message_id, self.message_id = save_answer(self.database, self.answer(text))
+        return self.message_id
+
+class ChatStream:
+    """
+    Text frames of one streamed answer. Tokens are kept in a list (joined once per checkpoint) and
+    written together once `frame_bytes` are buffered or the oldest waited `frame_latency`, even if the
+    model stalls. The upstream is read by one task (`pump`) and a frame has one timer, nothing is timed per token.
+    A disconnected client (`is_disconnected`, checked before each frame) or a cancelled response closes the
+    upstream stream, and the partial answer is saved however the stream ends, by `finish` if given (handed to
+    a background task: the response does not wait on the write).
+    """
+    def __init__(self, texts: AsyncIterator[str], writer: AnswerWriter,
+                 is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None, frame_bytes: int = FRAME_BYTES,
+                 frame_latency: float = FRAME_LATENCY, checkpoint_interval: float = CHECKPOINT_INTERVAL,
+                 finish: Optional[Callable[[Answer], None]] = None):
+        self.texts = texts
+        self.writer = writer
+        self.finish = finish
+        self.is_disconnected = is_disconnected
+        self.frame_bytes = frame_bytes
+        self.frame_latency = frame_latency
+        self.checkpoint_interval = checkpoint_interval
+        self.parts: List[str] = []
+        self.saved = 0 # len(self.parts) at the last checkpoint
+        self.last_checkpoint = time.monotonic()
+        self.stats = StreamStats(tokens=0, frames=0, checkpoints=0, disconnected=False, error=None)
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.parts)
+
+    def checkpoint(self) -> None:
+        if self.writer.message_id is not None and self.saved == len(self.parts): return
+        self.writer.save(self.text)
+        self.saved = len(self.parts)
+        self.last_checkpoint = time.monotonic()
+        self.stats['checkpoints'] += 1
+
+    def end(self) -> None:
+        if self.finish is None: return self.checkpoint()
+        if self.writer.message_id is not None and self.saved == len(self.parts): return
+        self.finish(self.writer.answer(self.text))
+
+    async def pump(self, queue: "asyncio.Queue[Any]") -> None:
+        """Reads the upstream into `queue` (the frame loop drains whatever arrived without waiting on each token)."""
+        try:
+            async for text in self.texts:
+                queue.put_nowait(text)
+        except Exception as e:
+            queue.put_nowait(e)
+        finally:
+            queue.put_nowait(END)
+
+    async def frames(self) -> AsyncIterator[str]:
+        queue: "asyncio.Queue[Any]" = asyncio.Queue()
+        reader = asyncio.ensure_future(self.pump(queue))
+        buffer: List[str] = []
+        loop = asyncio.get_running_loop()
+        timer: Optional[asyncio.TimerHandle] = None # one per frame, not a timed wait per token
+        size, item = 0, None
+        finished = False
+        try:
+            while item is not END:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    item = await queue.get()
+                if isinstance(item, Exception): raise item
+                if isinstance(item, str):
+                    if timer is None: timer = loop.call_later(self.frame_latency, queue.put_nowait, FLUSH)
+                    self.parts.append(item)
+                    self.stats['tokens'] += 1
+                    buffer.append(item)
+                    size += len(item.encode())
+                    if size < self.frame_bytes: continue
+                if timer is not None: timer.cancel()
+                timer = None
+                if not buffer: continue
+                if self.is_disconnected is not None and await self.is_disconnected():
+                    self.stats['disconnected'] = True
+                    return
+                yield text_part(''.join(buffer))
+                self.stats['frames'] += 1
+                buffer.clear()
+                size = 0
+                if time.monotonic() - self.last_checkpoint >= self.checkpoint_interval: self.checkpoint()
+            finished = True
+        except Exception as e:
+            logger.error(msg=f"Chat stream failed after {self.stats['tokens']} tokens: {e}")
+            self.stats['error'] = str(e)
+            yield data_part('3', str(e))
+        finally:
+            if timer is not None: timer.cancel()
+            reader.cancel()
+            await asyncio.wait((reader,))
+            aclose = getattr(self.texts, 'aclose', None)
+            if aclose is not None: await aclose()
+            if self.parts or finished or self.stats['error']: self.end() # a failed answer keeps its question
+
+    async def response(self, message_id: Optional[str] = None) -> AsyncIterator[str]:
+        """All the parts of the response: message id, text frames, error and finish parts."""
+        if message_id: yield data_part('f', {"messageId": message_id})
+        frames = self.frames()
+        try:
+            async for frame in frames:
+                yield frame
+        finally:
+            await frames.aclose() # also when the response is cancelled while a frame is being sent
+        if self.stats['disconnected']: return
+        reason = "error" if self.stats['error'] else "stop"
+        yield data_part('e', {"finishReason": reason, "usage": FINISH_USAGE, "isContinued": False})
+        yield data_part('d', {"finishReason": reason, "usage": FINISH_USAGE})
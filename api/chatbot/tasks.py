@@ -0,0 +1,215 @@
+"""
+Work of a chat response done once it closed: the final write of the answer and the chat title
+from the model. Both are ChatTasks rows (at least once: a task is marked done in the transaction
+applying it, a failed one is retried with backoff, a crashed one claimed again), run by one
+asyncio task on the loop of the API.
+"""
+import asyncio
+import json
+import re
+import time
+from typing import TypedDict, Optional, List, Dict, Tuple, Union, Callable, Awaitable
+
+from db.chatbot import DataBase
+from db.chatbot.models import IChatTask, IFetchChatTask, ChatTaskKind
+from db.helpers import logger
+from .streaming import Answer, save_answer
+
+#####################################################################################
+#                                   Constants                                       #
+#####################################################################################
+
+MAX_ATTEMPTS: int = 5           # a task failing this many times is dead-lettered
+BACKOFF_BASE: float = 5.0       # sec, doubled after every failed attempt
+BACKOFF_MAX: float = 60*10
+LEASE: float = 60*5             # a running task older than this was abandoned, it is claimed again
+POLL: float = 30.0              # sec between looks at the queue without a notify (retries)
+BATCH: int = 16                 # tasks claimed at a time
+TITLE_CHARS: int = 48           # of the heuristic title
+
+#####################################################################################
+#                                   Types                                           #
+#####################################################################################
+
+class TitlePayload(TypedDict):
+    query: str      # first user message
+    heuristic: str  # title shown until the generated one replaces it
+
+class ChatTaskStats(TypedDict):
+    pending: int
+    running: int
+    done: int
+    dead: int
+    submitted: int  # handed over by responses, not in ChatTasks yet
+    ran: int        # by this process
+    failed: int
+    latency_avg: Optional[float] # sec from hand over to done
+
+TitleGenerator = Callable[[str], Awaitable[str]]
+
+#####################################################################################
+#                                   Titles                                          #
+#####################################################################################
+
+MARKUP = re.compile(r"[`*_#>\[\]()~|]+")
+
+def heuristic_title(text: str, max_chars: int = TITLE_CHARS) -> str:
+    """First line of the message without markup, cut on a word: shown until the model's title arrives."""
+    line = next((line for line in text.splitlines() if line.strip()), '')
+    line = ' '.join(MARKUP.sub(' ', line).split())
+    if len(line) > max_chars: line = line[:max_chars].rsplit(' ', 1)[0].rstrip(' ,.;:-') + '…'
+    return (line[:1].upper() + line[1:]) or 'New Chat'
+
+async def generate_title(query: str) -> str:
+    from ml.langchain_generate_title import generate_title
+    return await generate_title(query)
+
+#####################################################################################
+#                                   Worker                                          #
+#####################################################################################
+
+class ChatTaskWorker:
+    """
+    Runs ChatTasks off the response: `submit_*` only hold the task in memory (a response hands it
+    over while closing), the worker writes and applies it afterwards. Reads of a chat call `settle`
+    first, which applies the chat's answers right away.
+    """
+    def __init__(self, database: DataBase, title_generator: Optional[TitleGenerator] = None, poll: float = POLL,
+                 max_attempts: int = MAX_ATTEMPTS, backoff_base: float = BACKOFF_BASE, backoff_max: float = BACKOFF_MAX,
+                 lease: float = LEASE):
+        self.database = database
+        self.title_generator: TitleGenerator = title_generator or generate_title
+        self.poll = poll
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self.submitted: List[Tuple[IChatTask, float]] = []
+        self.unsettled: Dict[int, int] = {} # ChatId -> answers not applied yet
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.ran = self.failed = 0
+        self.latency = 0.0
+
+    def submit_answer(self, answer: Answer) -> None:
+        chat_id = int(answer['chat_id'])
+        self.submit(IChatTask(ChatId=chat_id, Kind='answer', Payload=json.dumps(answer)))
+        self.unsettled[chat_id] = self.unsettled.get(chat_id, 0) + 1
+
+    def submit_title(self, chat_id: int, query: str, heuristic: str) -> None:
+        self.submit(IChatTask(ChatId=int(chat_id), Kind='title', Payload=json.dumps(TitlePayload(query=query, heuristic=heuristic))))
+
+    def submit(self, task: IChatTask) -> None:
+        self.submitted.append((task, time.time()))
+
+    def notify(self) -> None:
+        if self.wakeup is not None: self.wakeup.set()
+
+    def persist(self) -> int:
+        """Writes the submitted tasks to ChatTasks, in one transaction."""
+        submitted, self.submitted = self.submitted, []
+        if not submitted: return 0
+        with self.database.transaction():
+            for task, at in submitted:
+                self.database.enqueue_task(task, now=at)
+        return len(submitted)
+
+    def backoff(self, attempts: int) -> float:
+        return min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+
+    async def run_task(self, task: IFetchChatTask) -> None:
+        if task['Kind'] == 'answer':
+            answer: Answer = json.loads(task['Payload'])
+            with self.database.transaction():
+                save_answer(self.database, answer)
+                self.database.complete_task(task['TaskId'], now=time.time())
+        else:
+            payload: TitlePayload = json.loads(task['Payload'])
+            title = await self.title_generator(payload['query']) # outside the transaction: the writer is not held across awaits
+            with self.database.transaction():
+                self.database.update_chat_title(task['ChatId'], title, expected=payload['heuristic'])
+                self.database.complete_task(task['TaskId'], now=time.time())
+
+    def settled(self, task: IFetchChatTask) -> None:
+        if task['Kind'] != 'answer': return
+        left = self.unsettled.get(task['ChatId'], 0) - 1
+        if left > 0: self.unsettled[task['ChatId']] = left
+        else: self.unsettled.pop(task['ChatId'], None)
+
+    async def run_once(self, now: Optional[float] = None, chat_id: Optional[int] = None,
+                       kind: Optional[ChatTaskKind] = None) -> int:
+        """Runs the ready tasks (of a chat / kind), returns how many were done. Answers first, titles wait on the model."""
+        self.persist()
+        if kind is None: return await self.run_kind('answer', now, chat_id) + await self.run_kind('title', now, chat_id)
+        return await self.run_kind(kind, now, chat_id)
+
+    async def run_kind(self, kind: ChatTaskKind, now: Optional[float], chat_id: Optional[int]) -> int:
+        done = 0
+        while True:
+            claimed_at = time.time() if now is None else now
+            tasks = self.database.claim_tasks(now=claimed_at, limit=BATCH, lease=self.lease, chat_id=chat_id, kind=kind)
+            for task in tasks:
+                try:
+                    await self.run_task(task)
+                    self.settled(task)
+                    done += 1
+                    self.ran += 1
+                    self.latency += time.time() - task['EnqueuedAt']
+                except Exception as e:
+                    self.failed += 1
+                    status = self.database.fail_task(task, str(e), now=time.time(), max_attempts=self.max_attempts,
+                                                     backoff=self.backoff(task['Attempts']))
+                    if status == 'dead': self.settled(task)
+                    logger.error(msg=f"Chat task {task['TaskId']} ({task['Kind']}) failed, {status}: {e}")
+            if len(tasks) < BATCH: return done
+
+    async def settle(self, chat_id: Union[int, str]) -> int:
+        """Applies the answers of the chat still waiting (read your writes), nothing to do for most reads."""
+        key = int(chat_id) if str(chat_id).isdigit() else None
+        if key not in self.unsettled: return 0
+        return await self.run_once(chat_id=key, kind='answer')
+
+    def stats(self) -> ChatTaskStats:
+        counts: Dict[str, int] = self.database.get_task_counts()
+        return ChatTaskStats(
+            pending=counts.get('pending', 0),
+            running=counts.get('running', 0),
+            done=counts.get('done', 0),
+            dead=counts.get('dead', 0),
+            submitted=len(self.submitted),
+            ran=self.ran,
+            failed=self.failed,
+            latency_avg=self.latency / self.ran if self.ran else None
+        )
+
+    async def _run(self) -> None:
+        assert self.wakeup is not None
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(msg=f"Chat task worker: {e}")
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.poll)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+    def start(self) -> None:
+        """On the running loop (the API lifespan), tasks of a previous process are claimed again."""
+        if self.task is not None: return
+        self.database.release_tasks()
+        for chat_id, count in self.database.get_unfinished_tasks('answer').items():
+            self.unsettled[chat_id] = self.unsettled.get(chat_id, 0) + count
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is None: return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        self.persist() # handed over but not run: done by the next process
@@ -1,5 +1,19 @@
-from db.chatbot import GetMessages
+from db.chatbot import GetMessages, DataBase
 from db.chatbot.helpers import format_timestamp
+from db.helpers import LRUCache
+from typing import TypedDict, Optional, List, Tuple
+import base64
+
+PAGE_SIZE = 30 # messages of the visible branch per page of /chat/{chatId}/messages
+
+# MessageId -> formatted message, only streamed answers change (evicted on each checkpoint)
+formatted_messages: LRUCache[int, dict] = LRUCache(maxsize=4096)
+
+class ChatPage(TypedDict):
+    headId: Optional[str]
+    messages: List[dict]    # oldest first, with the siblings of each message of the visible branch
+    cursor: Optional[str]   # of the next (older) page, None at the first message
+    hasMore: bool
 
 def formate_user(message: GetMessages) -> dict:
     return {
@@ -53,3 +67,51 @@ def formate_assistant(message: GetMessages) -> dict:
                 },
                 "createdAt": format_timestamp(message['Timestamp'])
             }
+
+
+def format_message(message: GetMessages) -> dict:
+    """`{"message", "parentId"}` of the chat responses, cached by MessageId."""
+    payload = formatted_messages.get(message['MessageId'])
+    if payload is None:
+        payload = {
+            "message": formate_user(message) if message['message_by'] == "USER" else formate_assistant(message),
+            "parentId": str(message['parent_id']) if message['parent_id'] else None
+        }
+        formatted_messages.put(message['MessageId'], payload)
+    return payload
+
+def encode_cursor(depth: int, message_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{depth}:{message_id}".encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    try:
+        depth, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        return int(depth), int(message_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+def chat_page(database: DataBase, chat_id: int, limit: int = PAGE_SIZE, cursor: Optional[str] = None) -> ChatPage:
+    """
+    The newest `limit` messages of the visible branch (older than the cursor's if given), read by depth
+    range from ChatActivePath. The cursor names the oldest message of the page, it is stale (ValueError)
+    once that message left the visible branch.
+    """
+    chatinfo = database.get_chat_info(chat_id)
+    if cursor is None:
+        leaf_node_id = database.get_last_active_message_id(chat_id)
+        max_depth = database.get_active_depth(chat_id, leaf_node_id) if leaf_node_id is not None else 0
+    else:
+        depth, message_id = decode_cursor(cursor)
+        if database.get_active_message_id(chat_id, depth) != message_id: raise ValueError("The visible branch changed")
+        max_depth = depth - 1
+    assert max_depth is not None
+    min_depth = max(1, max_depth - limit + 1)
+    messages = database.get_lazy_chat_messages(chat_id, min_depth=min_depth, max_depth=max_depth) if max_depth >= 1 else []
+    oldest = database.get_active_message_id(chat_id, min_depth) if min_depth > 1 else None
+    next_cursor = encode_cursor(min_depth, oldest) if oldest is not None else None
+    return ChatPage(
+        headId=str(chatinfo['leaf_node_id']) if chatinfo['leaf_node_id'] is not None else None,
+        messages=[format_message(message) for message in messages],
+        cursor=next_cursor,
+        hasMore=next_cursor is not None
+    )
@@ -1,4 +1,4 @@
-from typing import Optional, Dict, List, Union
+from typing import Optional, Dict, List, Union, Literal, Any
 from pydantic import BaseModel
 from datetime import datetime, time
 
@@ -83,6 +83,18 @@ class GetAppResponse(BaseModel):
     hour_22: float
     hour_23: float
 
+#####################################################################################
+#                                   Icon                                            #
+#####################################################################################
+
+class IconBatchItem(BaseModel):
+    hash: str
+    data: str # data:image/png;base64,...
+
+class IconBatchResponse(BaseModel):
+    icons: Dict[str, IconBatchItem]
+    missing: List[str]
+
 #####################################################################################
 #                                   BaseUrl                                         #
 #####################################################################################
@@ -99,6 +111,14 @@ class BaseUrlResponse(BaseModel):
     visitCount: Optional[int] = None
     lastVisited: Optional[datetime] = None
 
+class MetadataFetcherStats(BaseModel):
+    fetched: int
+    failed: int
+    pending: int
+    backing_off: int
+    deferred: int = 0 # due but held back until the site is used more (or off-peak)
+    latency_avg: Optional[float] = None
+
 class GetBaseUrlResponse(BaseModel):
     baseurl: BaseUrlResponse
     total_uses_this_week: float
@@ -164,6 +184,165 @@ class CreateUpdateActivity(BaseModel):
     activity: IActivity
     EntryId: Optional[int] = None
 
+class ActivityCategorySplit(BaseModel):
+    Category: Optional[str] = None
+    Duration: float
+    TitleDuration: float # part of Duration categorized by the tab title
+
+class ActivityTitleCategory(BaseModel):
+    EntryId: int
+    TitleKey: str
+    Category: Optional[str] = None
+    Source: Literal['user', 'llm', 'keyword', 'local', 'pending']
+    Confidence: Optional[float] = None
+
+class SetTitleCategory(BaseModel):
+    Category: str
+
+class TitleClassifierStats(BaseModel):
+    processed: int
+    cached: int
+    keyword: int
+    local: int
+    llm: int
+    pending: int
+    dead: int
+    llm_requests: int
+    documents: int
+
+#####################################################################################
+#                           ClassificationQueue                                     #
+#####################################################################################
+
+class ClassificationJob(BaseModel):
+    JobId: int
+    Kind: Literal['app', 'url']
+    Key: str
+    Status: Literal['pending', 'running', 'done', 'dead']
+    Attempts: int
+    NextAttempt: float
+    LastError: Optional[str] = None
+    Result: Optional[str] = None
+    EnqueuedAt: float
+    StartedAt: Optional[float] = None
+    FinishedAt: Optional[float] = None
+
+class ClassificationCacheEntry(BaseModel):
+    CacheKey: str
+    Category: str
+    Source: Literal['user', 'llm', 'local', 'import']
+    ExpiresAt: Optional[float] = None
+
+class ClassificationCacheStats(BaseModel):
+    entries: int
+    expired: int
+    by_source: Dict[str, int]
+    hits_total: int
+    hits: int
+    misses: int
+    expired_hits: int
+
+class LLMProviderStats(BaseModel):
+    name: str
+    model: str
+    requests: int
+    errors: int
+    in_flight: int
+    max_in_flight: int
+    latency_avg: Optional[float] = None
+
+class ClassificationBatchStats(BaseModel):
+    requests: int
+    items: int
+    failed: int
+    latency_avg: Optional[float] = None
+    prompt_tokens: int
+    completion_tokens: int
+
+class ClassificationLocalStats(BaseModel):
+    documents: int
+    categories: int
+    min_confidence: float
+    predicted: int
+    deferred: int
+    latency_avg: Optional[float] = None
+
+class ClassificationQueueMetrics(BaseModel):
+    depth: int
+    ready: int
+    running: int
+    done: int
+    dead: int
+    oldest_pending_age: Optional[float] = None
+    latency_avg: Optional[float] = None
+    latency_p95: Optional[float] = None
+    attempts_avg: Optional[float] = None
+    deferred: int = 0 # pending jobs held back until the app / site is used more (or off-peak)
+    llm: Optional[ClassificationBatchStats] = None # latest batched requests of this process
+    local: Optional[ClassificationLocalStats] = None
+
+class ReclassificationRequest(BaseModel):
+    scope: Literal['all', 'uncategorized', 'category'] = 'uncategorized'
+    category: Optional[str] = None # with scope 'category'
+    kinds: List[Literal['app', 'url']] = ['app', 'url']
+    dry_run: bool = True
+    include_manual: bool = False # also reclassify categories chosen by the user
+
+class ReclassificationRun(BaseModel):
+    RunId: int
+    Scope: Literal['all', 'uncategorized', 'category']
+    Category: Optional[str] = None
+    Kinds: str
+    DryRun: bool
+    IncludeManual: bool
+    Status: Literal['running', 'done', 'cancelled', 'failed', 'applied']
+    Total: int
+    Processed: int
+    Changed: int
+    Failed: int
+    Error: Optional[str] = None
+    CreatedAt: float
+    FinishedAt: Optional[float] = None
+    active: bool # running in this process
+
+class ReclassificationChange(BaseModel):
+    RunId: int
+    Kind: Literal['app', 'url']
+    Key: str
+    OldCategory: Optional[str] = None
+    NewCategory: str
+    Applied: bool
+
+#####################################################################################
+#                               ResourceSample                                      #
+#####################################################################################
+
+class ResourceSample(BaseModel):
+    AppId: str
+    BucketStart: int
+    CpuTime: float
+    RssSum: int
+    RssMax: int
+    ReadBytes: int
+    WriteBytes: int
+    Samples: int
+
+class CreateResourceSamples(BaseModel):
+    samples: List[ResourceSample]
+
+class DownsampleResponse(BoolResponse):
+    rolled: int
+
+class AppResourceUsage(BaseModel):
+    AppId: str
+    CpuTime: float          # cpu seconds
+    RssAvg: float           # bytes
+    RssMax: int             # bytes
+    ReadBytes: int
+    WriteBytes: int
+    Samples: int
+    UsageDuration: float    # foreground seconds from ActivityEntries
+
 #####################################################################################
 #                               _TODO                                               #
 #####################################################################################
@@ -273,3 +452,35 @@ class DeleteResponse(BaseModel):
     message: str
 
 
+#####################################################################################
+#                                   Search                                          #
+#####################################################################################
+
+class SearchHit(BaseModel):
+    kind: Literal['message', 'chat', 'note']
+    id: int
+    chat_id: Optional[int] = None
+    title: str
+    snippet: str # matches in <mark></mark>
+    role: Optional[str] = None
+    timestamp: str
+    score: float
+
+class SearchResponse(BaseModel):
+    query: Optional[str] # as sent to FTS5, None when nothing was searched
+    hits: List[SearchHit]
+    took_ms: float
+
+class SearchIndexStatus(BaseModel):
+    name: str
+    pending: int
+
+class SearchStatus(BaseModel):
+    indexes: List[SearchIndexStatus]
+    indexed: int # rows indexed by the background indexer of this process
+
+class AIInsights(BaseModel):
+    period: str
+    facts: Dict[str, Any] # results of the chatbot's tools the insights are written from
+    insights: str # markdown
+    took_ms: float
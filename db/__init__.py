@@ -1,8 +1,9 @@
 from .helpers import Path, modulepath, logger
 from .database import DataBase
-from typing import Optional
+from .iconstore import IconStore
+from typing import Optional, List
 from . import chatbot
-from .models import IActivityEntry, IApp
+from .models import IActivityEntry, IApp, IResourceSample
 import requests
 
 if not modulepath.joinpath('..', 'instance').exists(): 
@@ -16,6 +17,18 @@ def get_database(memory: bool = False, path: Optional[Path] = None) -> DataBase:
             db_path=(modulepath.joinpath('..', 'instance', 'database.db') if not path else path) if not memory else ':memory:'
         )
     return global_database
+
+global_icon_store: Optional[IconStore] = None
+def get_icon_store(path: Optional[Path] = None, legacy_icon_dir: Optional[Path] = None) -> IconStore:
+    global global_icon_store
+    if global_icon_store is None:
+        global_icon_store = IconStore(
+            db_path=modulepath.joinpath('..', 'instance', 'icons.db') if not path else path
+        )
+        global_icon_store.import_directory(
+            modulepath.joinpath('..', 'instance', 'icons') if not legacy_icon_dir else legacy_icon_dir
+        )
+    return global_icon_store
 class DataBase_Api:
     def __init__(self, url: str, check_server_status: bool = True):
         self.url = url.removesuffix('/')
@@ -37,5 +50,14 @@ class DataBase_Api:
         EntryId: Optional[int] = resp.json().get('EntryId')
         assert EntryId is not None, "Something Went EntryId is None"
         return EntryId
+    def insert_resource_samples(self, samples: List[IResourceSample]):
+        resp = requests.post(f"{self.url}/api/resources/samples", json={
+            "samples": samples
+        })
+        assert resp.ok
+    def downsample_resource_samples(self) -> int:
+        resp = requests.post(f"{self.url}/api/resources/downsample")
+        assert resp.ok
+        return resp.json().get('rolled', 0)
 def get_database_Api(check_server_status: bool = True) -> DataBase_Api:
     return DataBase_Api('http://127.0.0.1:8000', check_server_status=check_server_status)
\ No newline at end of file
@@ -0,0 +1,188 @@
+"""
+Activity totals over periods (the chatbot's tools, the insights): time per app, per site, per day.
+The days that are over are summed once into ActivityRollups (`refresh`, incremental: the days after
+the last rolled one only); the recent days, whose entries the tracker still rewrites (REPLACE moves
+the running entry's EndTime forward), are read from ActivityEntries by its EndTime index. A period is
+one read of each, whatever its length.
+"""
+import sqlite3
+from typing import TypedDict, Optional, List, Dict, Tuple, Literal, Any
+from .classification_cache import normalize_host
+
+#####################################################################################
+#                                   Constants                                       #
+#####################################################################################
+
+ROLLUP_LAG_DAYS: int = 1        # a day is rolled up once it ended this long ago (the entry running at midnight moves on)
+NO_ROLLUP: str = '0000-00-00'   # boundary when nothing is rolled up yet: every day is read from the entries
+
+#####################################################################################
+#                                   Types                                           #
+#####################################################################################
+
+TrendBucket = Literal['day', 'week']
+
+class AppUsage(TypedDict):
+    AppId: str
+    name: str
+    ActiveDuration: float   # sec
+    Duration: float
+
+class DayUsage(TypedDict):
+    period: str             # YYYY-MM-DD, the monday of a week
+    ActiveDuration: float
+    Duration: float
+
+class RollupStatus(TypedDict):
+    days: int
+    rows: int
+    rolled_until: Optional[str] # first day read from the entries
+
+#####################################################################################
+#                                   Rollup                                          #
+#####################################################################################
+
+def boundary(cursor: sqlite3.Cursor) -> str:
+    """First day that is not rolled up (days before it are in ActivityRollups)."""
+    cursor.execute("SELECT date(MAX(Day), '+1 day') AS boundary FROM ActivityRollups")
+    row = cursor.fetchone()
+    return row['boundary'] or NO_ROLLUP
+
+def refresh(cursor: sqlite3.Cursor, now: Optional[str] = None) -> int:
+    """Rolls up the days that are over and not rolled yet (commit after it), returns the rows added."""
+    start = boundary(cursor)
+    cursor.execute("SELECT date(COALESCE(?, 'now'), ?) AS cutoff", (now, f"-{ROLLUP_LAG_DAYS} days"))
+    cutoff = cursor.fetchone()['cutoff']
+    if start >= cutoff: return 0
+    cursor.execute("""--sql
+    INSERT INTO ActivityRollups (Day, AppId, baseURL, Duration, ActiveDuration, Entries)
+    SELECT date(e.EndTime), e.AppId, COALESCE(u.baseURL, ''), SUM(e.Duration),
+        SUM(CASE WHEN e.IsActive THEN e.Duration ELSE 0 END), COUNT(*)
+    FROM ActivityEntries AS e
+    LEFT JOIN URLs AS u ON u.URL = e.URL
+    WHERE e.EndTime >= ? AND e.EndTime < ?
+    GROUP BY 1, 2, 3
+    """, (start, cutoff))
+    rows = cursor.rowcount
+    if rows > 0:
+        cursor.execute("""--sql
+        INSERT INTO DataVersions (name, version) VALUES ('ActivityRollups', 1)
+        ON CONFLICT (name) DO UPDATE SET version = version + 1
+        """)
+    return rows
+
+def status(cursor: sqlite3.Cursor) -> RollupStatus:
+    cursor.execute("SELECT COUNT(DISTINCT Day) AS days, COUNT(*) AS rows FROM ActivityRollups")
+    row = cursor.fetchone()
+    rolled_until = boundary(cursor)
+    return RollupStatus(days=row['days'], rows=row['rows'], rolled_until=None if rolled_until == NO_ROLLUP else rolled_until)
+
+def version(cursor: sqlite3.Cursor, end: str) -> Tuple[int, ...]:
+    """
+    Version of the data a read of the days up to `end` depends on: the rollups, and the entries if the
+    period reaches the days read from them (a cached result of a period that is over outlives new entries).
+    """
+    cursor.execute("SELECT name, version FROM DataVersions WHERE name IN ('ActivityRollups', 'ActivityEntries')")
+    versions = {row['name']: row['version'] for row in cursor.fetchall()}
+    live = end >= boundary(cursor)
+    return (versions.get('ActivityRollups', 0), versions.get('ActivityEntries', 0) if live else -1)
+
+def table_version(cursor: sqlite3.Cursor, name: str) -> int:
+    cursor.execute("SELECT version FROM DataVersions WHERE name = ?", (name, ))
+    row = cursor.fetchone()
+    return row['version'] if row else 0
+
+#####################################################################################
+#                                   Queries                                         #
+#####################################################################################
+
+def usage_rows(cursor: sqlite3.Cursor, start: str, end: str, app_ids: Optional[List[str]] = None,
+               baseURLs: Optional[List[str]] = None) -> Tuple[str, List[Any]]:
+    """
+    SQL (and its parameters) of the (Day, AppId, baseURL, Duration, ActiveDuration) rows of the days
+    `start`..`end` (inclusive): rollups before the boundary, entries from it on.
+    """
+    rolled, raw, params_rolled, params_raw = [], [], [], []
+    if app_ids is not None:
+        marks = ', '.join('?' * len(app_ids))
+        rolled.append(f"AppId IN ({marks})"); params_rolled += app_ids
+        raw.append(f"e.AppId IN ({marks})"); params_raw += app_ids
+    if baseURLs is not None:
+        marks = ', '.join('?' * len(baseURLs))
+        rolled.append(f"baseURL IN ({marks})"); params_rolled += baseURLs
+        raw.append(f"u.baseURL IN ({marks})"); params_raw += baseURLs
+    edge = boundary(cursor)
+    sql = f"""--sql
+        SELECT Day, AppId, baseURL, Duration, ActiveDuration FROM ActivityRollups
+        WHERE Day >= ? AND Day <= ? AND Day < ? {''.join(' AND ' + c for c in rolled)}
+        UNION ALL
+        SELECT date(e.EndTime) AS Day, e.AppId, COALESCE(u.baseURL, '') AS baseURL, e.Duration,
+            CASE WHEN e.IsActive THEN e.Duration ELSE 0 END AS ActiveDuration
+        FROM ActivityEntries AS e
+        LEFT JOIN URLs AS u ON u.URL = e.URL
+        WHERE e.EndTime >= MAX(?, ?) AND e.EndTime < date(?, '+1 day') {''.join(' AND ' + c for c in raw)}
+    """
+    return sql, [start, end, edge, *params_rolled, start, edge, end, *params_raw]
+
+def top_apps(cursor: sqlite3.Cursor, start: str, end: str, limit: int = 5) -> List[AppUsage]:
+    rows, params = usage_rows(cursor, start, end)
+    cursor.execute(f"""--sql
+    WITH Usage AS ({rows})
+    SELECT s.AppId, COALESCE(a.ProductName, a.FileDescription, a.ExeFileName, s.AppId) AS name,
+        s.ActiveDuration, s.Duration
+    FROM (
+        SELECT AppId, SUM(ActiveDuration) AS ActiveDuration, SUM(Duration) AS Duration FROM Usage GROUP BY AppId
+    ) AS s
+    LEFT JOIN Apps AS a ON a.AppId = s.AppId
+    ORDER BY s.ActiveDuration DESC
+    LIMIT ?
+    """, (*params, limit))
+    return [AppUsage(**row) for row in cursor.fetchall()]
+
+def trend(cursor: sqlite3.Cursor, start: str, end: str, bucket: TrendBucket = 'day', app_ids: Optional[List[str]] = None,
+          baseURLs: Optional[List[str]] = None) -> List[DayUsage]:
+    """Time per day (or week, from monday) of the period, every bucket of it included (0 when nothing was tracked)."""
+    rows, params = usage_rows(cursor, start, end, app_ids=app_ids, baseURLs=baseURLs)
+    period = "d.Day" if bucket == 'day' else "date(d.Day, '-6 days', 'weekday 1')"
+    cursor.execute(f"""--sql
+    WITH RECURSIVE Days(Day) AS (
+        SELECT date(?) UNION ALL SELECT date(Day, '+1 day') FROM Days WHERE Day < date(?)
+    ), Usage AS ({rows})
+    SELECT {period} AS period, COALESCE(SUM(u.ActiveDuration), 0) AS ActiveDuration, COALESCE(SUM(u.Duration), 0) AS Duration
+    FROM Days AS d
+    LEFT JOIN (SELECT Day, SUM(ActiveDuration) AS ActiveDuration, SUM(Duration) AS Duration FROM Usage GROUP BY Day) AS u
+        ON u.Day = d.Day
+    GROUP BY 1
+    ORDER BY 1
+    """, (start, end, *params))
+    return [DayUsage(**row) for row in cursor.fetchall()]
+
+def site_baseurls(cursor: sqlite3.Cursor, domain: str) -> List[str]:
+    """baseURLs of `domain` and its subdomains (`youtube.com` -> www.youtube.com, m.youtube.com, ...)."""
+    host = normalize_host(domain.removeprefix('http://').removeprefix('https://').split('/', 1)[0])
+    if not host: return []
+    cursor.execute("""--sql
+    SELECT baseURL FROM BaseURLs
+    WHERE baseURL = ?1 OR baseURL LIKE '%.' || ?1 OR baseURL LIKE ?1 || ':%' OR baseURL LIKE '%.' || ?1 || ':%'
+    """, (host, ))
+    return [row['baseURL'] for row in cursor.fetchall()]
+
+def find_apps(cursor: sqlite3.Cursor, name: str) -> List[AppUsage]:
+    """Apps whose name or executable contains `name` (case insensitive), durations 0."""
+    pattern = f"%{name.strip()}%"
+    cursor.execute("""--sql
+    SELECT AppId, COALESCE(ProductName, FileDescription, ExeFileName, AppId) AS name, 0.0 AS ActiveDuration, 0.0 AS Duration
+    FROM Apps
+    WHERE ProductName LIKE ?1 OR FileDescription LIKE ?1 OR ExeFileName LIKE ?1
+    """, (pattern, ))
+    return [AppUsage(**row) for row in cursor.fetchall()]
+
+def todos_due(cursor: sqlite3.Cursor, until: str, overdue: bool = True) -> List[Dict[str, Any]]:
+    """Open todos due until `until` (a date, inclusive), the overdue ones too unless `overdue` is False."""
+    cursor.execute("""--sql
+    SELECT todo_id, title, duedate, parent_id, duedate < datetime('now') AS overdue
+    FROM Todos
+    WHERE NOT completed AND duedate IS NOT NULL AND duedate < date(?, '+1 day') AND (? OR duedate >= datetime('now'))
+    ORDER BY duedate
+    """, (until, overdue))
+    return [dict(row) for row in cursor.fetchall()]
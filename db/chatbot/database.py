@@ -1,367 +1,468 @@
 import sqlite3
-from typing import Optional, Literal, List
+import threading
+from contextlib import contextmanager
+from typing import Optional, Literal, List, Tuple, Dict, Iterator
 from . import models
+from .. import search
 
 class GetMessages(models.IFetchMessage):
     depth: int
 
-# TODO: insted of get_current_leaf_node_id safe headId into the chats database and update it so max_result matters
-# TODO: also save curr depts into the database
+MESSAGE_COLUMNS = """m.MessageId, m.ChatId, m.content, m.message_by, m.message_model, m.message_rating,
+    m.level, m.parent_id, m.siblings, m.position, m.childs, m.is_active, m.active_child_id, m.Timestamp"""
 
 class DataBase:
+    """
+    Shared by concurrent requests (and threads): every operation has its own cursor. Writes go through
+    one connection behind a lock, a block of them is one transaction (`transaction`, nested writes join
+    it). Reads use a connection per thread which, in WAL mode, reads the last committed state without
+    waiting on the writer; inside a transaction, or while writes wait on a later commit (`commit=False`),
+    they read on the writer (its uncommitted writes). An in-memory database has the writer connection only.
+    """
     def __init__(self, db_path: str):
+        self.path = str(db_path)
+        self.memory = self.path == ':memory:'
         # Connect to SQLite database
-        self.conn = sqlite3.connect(db_path)
-        self.conn.row_factory = sqlite3.Row # Set row_factory to sqlite3.Row so that results are returned as dictionaries
-        self.cursor = self.conn.cursor()
+        self.conn = self.connect()
+        if not self.memory:
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.lock = threading.RLock()
+        self.local = threading.local() # depth: transactions of the thread, conn: its reader
+        self.readers: List[sqlite3.Connection] = []
         self.create_table()
-        
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30.0)
+        conn.row_factory = sqlite3.Row # Set row_factory to sqlite3.Row so that results are returned as dictionaries
+        return conn
+
+    @contextmanager
+    def writer(self, commit: bool = True) -> Iterator[sqlite3.Cursor]:
+        """
+        A cursor on the writer connection. Outermost, the writes are committed at the end (left for a later
+        commit with `commit=False`, which also leaves them to the caller on an exception) and rolled back on
+        an exception; nested, they are part of the outer ones.
+        """
+        with self.lock:
+            depth = getattr(self.local, 'depth', 0)
+            self.local.depth = depth + 1
+            cursor = self.conn.cursor()
+            try:
+                yield cursor
+                if depth == 0 and commit: self.conn.commit()
+            except BaseException:
+                if depth == 0 and commit: self.conn.rollback()
+                raise
+            finally:
+                self.local.depth = depth
+                cursor.close()
+
+    def transaction(self):
+        """`with database.transaction():` the operations of the block are committed together, or none."""
+        return self.writer(commit=True)
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Cursor]:
+        if self.memory or getattr(self.local, 'depth', 0) or self.conn.in_transaction:
+            with self.lock:
+                cursor = self.conn.cursor()
+                try:
+                    yield cursor
+                finally:
+                    cursor.close()
+            return
+        conn: Optional[sqlite3.Connection] = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = self.connect()
+            conn.execute("PRAGMA query_only = ON")
+            with self.lock: self.readers.append(conn)
+        cursor = conn.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
     def close(self, commit: bool = False) -> None:
-        if commit: self.conn.commit()
-        self.conn.close()
+        with self.lock:
+            if commit: self.conn.commit()
+            for conn in self.readers: conn.close()
+            self.readers.clear()
+            self.conn.close()
     
     def create_table(self):
-        models.create_chat(self.cursor)
-        models.create_message(self.cursor)
-        # Commit initial table creation
-        self.conn.commit()
+        with self.writer() as cursor:
+            models.create_chat(cursor)
+            models.create_message(cursor)
+            models.create_chat_active_path(cursor)
+            models.create_chat_summary(cursor)
+            models.create_chat_task(cursor)
+            search.create_search_index(cursor, 'Chats')
+            search.create_search_index(cursor, 'Messages')
+            # Commit initial table creation
     
     def new_chat(self, title: str, commit: bool = True) -> int:
-        chat = models.IChat(title=title, leaf_node_id=None, active_depth=0)
-        self.cursor.execute("""--sql
-            INSERT INTO Chats (
-                title
-            ) VALUES (?)
-        """, (
-           chat['title'],
-        ))
-        if commit: self.conn.commit()
-        assert self.cursor.lastrowid is not None, "Something went wrong..."
-        return self.cursor.lastrowid
-    def update_chat_title(self, chat_id: int, title: str, commit: bool = True):
-        self.cursor.execute("""--sql
-            UPDATE Chats
-            SET title = ?
-            WHERE ChatId = ?
-        """, (
-           title, chat_id
-        ))
-        if commit: self.conn.commit() 
-    
-    def new_message(self, chat_id: int, content: str, message_by: Literal['USER', 'SYSTEM', 'AI'], parent_message_id: Optional[int] = None,
-                    message_model: Literal[None, 'GPT4', 'LLAMA3'] = None, commit: bool = True) -> int:
-        if parent_message_id is None:
-            self.cursor.execute("""--sql
-                SELECT COUNT(MessageId) as num_messages FROM Messages 
-                WHERE parent_id IS NULL AND ChatId = ?
+        with self.writer(commit) as cursor:
+            chat = models.IChat(title=title, leaf_node_id=None, active_depth=0, roots=0, active_root_id=None)
+            cursor.execute("""--sql
+                INSERT INTO Chats (
+                    title
+                ) VALUES (?)
             """, (
-                chat_id,
+               chat['title'],
             ))
-            parent_childs = self.cursor.fetchone()['num_messages']
-
-            # siblings increasing and inactive all childs
-            
-            self.cursor.execute("""--sql
-                UPDATE Messages 
-                SET is_active = FALSE, siblings=?
-                WHERE parent_id IS NULL AND ChatId = ?
+            assert cursor.lastrowid is not None, "Something went wrong..."
+            return cursor.lastrowid
+    def update_chat_title(self, chat_id: int, title: str, commit: bool = True, expected: Optional[str] = None) -> bool:
+        with self.writer(commit) as cursor:
+            # with `expected`, only over that title (a generated title never replaces one set meanwhile)
+            cursor.execute("""--sql
+                UPDATE Chats
+                SET title = ?
+                WHERE ChatId = ? AND (? IS NULL OR title = ?)
             """, (
-                parent_childs+1, chat_id
+               title, chat_id, expected, expected
             ))
-            
-            level = 1
-            position = parent_childs + 1
-            siblings = parent_childs + 1
-
-        else:
-            self.cursor.execute("""--sql
-                SELECT 
-                    MessageId, ChatId, content, message_by, message_model, message_rating, 
-                    level, parent_id, siblings, position, childs, is_active, Timestamp
-                FROM Messages WHERE MessageId = ? AND ChatId = ?
-                LIMIT 1
-            """, (
-                parent_message_id, chat_id
-            ))
-            parent: Optional[models.IFetchMessage] = self.cursor.fetchone()
+            return cursor.rowcount == 1
+    
+    def new_message(self, chat_id: int, content: str, message_by: Literal['USER', 'SYSTEM', 'AI'], parent_message_id: Optional[int] = None,
+                    message_model: Literal[None, 'GPT4', 'LLAMA3'] = None, commit: bool = True) -> int:
+        with self.writer(commit) as cursor:
+            # the new message is the last of its siblings and the visible one: a counter and a pointer on the parent,
+            # the siblings rows are not touched except the one it hides
+            if parent_message_id is None:
+                cursor.execute("""--sql
+                    UPDATE Chats 
+                    SET roots = roots + 1
+                    WHERE ChatId = ?
+                    RETURNING roots AS childs, active_root_id AS active_child_id, 0 AS level
+                """, (
+                    chat_id,
+                ))
+            else:
+                cursor.execute("""--sql
+                    UPDATE Messages 
+                    SET childs = childs + 1
+                    WHERE MessageId = ? AND ChatId = ?
+                    RETURNING childs, active_child_id, level
+                """, (
+                    parent_message_id, chat_id
+                ))
+            parent = cursor.fetchone()
             assert parent is not None, "Wrong id"
-            parent_childs = parent['childs']
-            parent_level = parent['level']
-            
-            self.cursor.execute("""--sql
-                UPDATE Messages 
-                SET childs=?
-                WHERE MessageId = ? AND ChatId = ?
+        
+            level = parent['level'] + 1
+            position = parent['childs']
+            siblings = parent['childs']
+
+            message = models.IMessage(
+                ChatId=chat_id,
+                content=content,
+                message_by=message_by,
+                message_model=message_model,
+                message_rating=None,
+                level=level,
+                parent_id=parent_message_id,
+                siblings=siblings,
+                position=position,
+                childs=0,
+                is_active=True,
+                active_child_id=None
+            )
+        
+            cursor.execute("""--sql
+                INSERT INTO Messages (
+                    ChatId, content, message_by, message_model, message_rating, level, parent_id, siblings, position, childs, is_active
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
-                parent_childs + 1, parent_message_id, chat_id
+               message['ChatId'], message['content'], message['message_by'], message['message_model'], message['message_rating'],
+               message['level'], message['parent_id'], message['siblings'], message['position'], message['childs'], message['is_active']
             ))
-            
-            # siblings increasing and inactive all childs
-            
-            self.cursor.execute("""--sql
-                UPDATE Messages 
-                SET is_active = FALSE, siblings=?
-                WHERE parent_id = ? AND ChatId = ?
+
+            new_message_id = cursor.lastrowid
+            assert new_message_id is not None, "Something went wrong..."
+            self.set_active_child(chat_id, parent_message_id, parent['active_child_id'], new_message_id, activate=False)
+
+            if parent_message_id is None or self.get_active_depth(chat_id, parent_message_id) is not None:
+                # the new message is the active child of a message on the visible branch: it ends the branch
+                cursor.execute("""--sql
+                    DELETE FROM ChatActivePath WHERE ChatId = ? AND depth >= ?
+                """, (chat_id, level))
+                cursor.execute("""--sql
+                    INSERT INTO ChatActivePath (ChatId, depth, MessageId) VALUES (?, ?, ?)
+                """, (chat_id, level, new_message_id))
+
+            cursor.execute("""--sql
+                UPDATE Chats
+                SET leaf_node_id = ?, active_depth = ?
+                WHERE ChatId = ?
             """, (
-                parent_childs+1, parent_message_id, chat_id
+                new_message_id, message['level'], message['ChatId']
             ))
-            
-            level = parent_level + 1
-            position = parent_childs + 1
-            siblings = parent_childs + 1
-
-        message = models.IMessage(
-            ChatId=chat_id,
-            content=content,
-            message_by=message_by,
-            message_model=message_model,
-            message_rating=None,
-            level=level,
-            parent_id=parent_message_id,
-            siblings=siblings,
-            position=position,
-            childs=0,
-            is_active=True
-        )
-        
-        self.cursor.execute("""--sql
-            INSERT INTO Messages (
-                ChatId, content, message_by, message_model, message_rating, level, parent_id, siblings, position, childs, is_active
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-           message['ChatId'], message['content'], message['message_by'], message['message_model'], message['message_rating'],
-           message['level'], message['parent_id'], message['siblings'], message['position'], message['childs'], message['is_active']
-        ))
-
-        new_message_id = self.cursor.lastrowid
-
-        self.cursor.execute("""--sql
-            UPDATE Chats
-            SET leaf_node_id = ?, active_depth = ?
-            WHERE ChatId = ?
-        """, (
-            new_message_id, message['level'], message['ChatId']
-        ))
-
-        if commit: self.conn.commit()
-        assert new_message_id is not None, "Something went wrong..."
-        return new_message_id
+
+            return new_message_id
+
+    def update_message_content(self, chat_id: int, message_id: int, content: str, commit: bool = True) -> None:
+        with self.writer(commit) as cursor:
+            # checkpoints of a streamed answer, nothing else of the tree changes
+            cursor.execute("""--sql
+                UPDATE Messages SET content = ? WHERE MessageId = ? AND ChatId = ?
+            """, (content, message_id, chat_id))
+            assert cursor.rowcount == 1, "Wrong id"
     
     def next_message(self, chat_id: int, message_id: int, return_type: Literal[None, 'next_message_id', 'next_message_leaf_id'] = 'next_message_leaf_id', 
                      commit: bool = True) -> Optional[int]:
-        self.cursor.execute("""--sql
-            SELECT 
-                MessageId, ChatId, content, message_by, message_model, message_rating, 
-                level, parent_id, siblings, position, childs, is_active, Timestamp
-            FROM Messages WHERE MessageId = ? AND ChatId = ?
-            LIMIT 1
-        """, (
-            message_id, chat_id
-        ))
-        message: Optional[models.IFetchMessage] = self.cursor.fetchone()
-        assert message is not None, "message not found by given ids"
-        if message['position'] == message['siblings']: 
-            raise IndexError("already at last chat")
-        
-        if message['parent_id'] is None:
-            self.cursor.execute("""--sql
-                UPDATE Messages 
-                SET is_active = (position=?)
-                WHERE level = 1 AND parent_id IS NULL
-            """, (
-                message['position'] + 1,
-            ))
-        else:
-            self.cursor.execute("""--sql
-                UPDATE Messages 
-                SET is_active = (position=?)
-                WHERE level = ? AND parent_id = ?
-            """, (
-                message['position'] + 1, message['level'], message['parent_id']
-            ))
-        new_leaf_node_id = self.get_current_leaf_node_id(chat_id=chat_id, message_id=message['parent_id'], use_get_chat_info=False)
-        self.cursor.execute("""--sql
-            UPDATE Chats 
-            SET leaf_node_id = ?
-            WHERE ChatId = ?
-        """, (
-            new_leaf_node_id, chat_id
-        ))
-
-        if commit: self.conn.commit()
+        with self.writer(commit) as cursor:
+            message = self.get_chat_message(chat_id=chat_id, message_id=message_id)
+            new_leaf_node_id, next_message_id = self.switch_sibling(chat_id=chat_id, message=message, step=1)
+
         
-        if return_type == 'next_message_leaf_id':
-            return new_leaf_node_id
+            if return_type == 'next_message_leaf_id':
+                return new_leaf_node_id
         
-        if return_type == 'next_message_id':
-            return self.get_current_active_child_id(chat_id=chat_id, message_id=message['parent_id'])
+            if return_type == 'next_message_id':
+                return next_message_id
         
     def prev_message(self, chat_id: int, message_id: int, return_type: Literal[None, 'prev_message_id', 'prev_message_leaf_id'] = 'prev_message_leaf_id', 
                      commit: bool = True) -> Optional[int]:
-        self.cursor.execute("""--sql
-            SELECT 
-                MessageId, ChatId, content, message_by, message_model, message_rating, 
-                level, parent_id, siblings, position, childs, is_active, Timestamp
-            FROM Messages WHERE MessageId = ? AND ChatId = ?
-            LIMIT 1
-        """, (
-            message_id, chat_id
-        ))
-        message: Optional[models.IFetchMessage] = self.cursor.fetchone()
-        assert message is not None, "message not found by given ids"
-        if message['position'] == 1: 
-            raise IndexError("already at first chat")
+        with self.writer(commit) as cursor:
+            message = self.get_chat_message(chat_id=chat_id, message_id=message_id)
+            new_leaf_node_id, prev_message_id = self.switch_sibling(chat_id=chat_id, message=message, step=-1)
+
         
-        if message['parent_id'] is None:
-            self.cursor.execute("""--sql
-                UPDATE Messages 
-                SET is_active = (position=?)
-                WHERE level = 1 AND parent_id IS NULL
-            """, (
-                message['position'] - 1,
-            ))
-        else:
-            self.cursor.execute("""--sql
-                UPDATE Messages 
-                SET is_active = (position=?)
-                WHERE level = ? AND parent_id = ?
+            if return_type == 'prev_message_leaf_id':
+                return new_leaf_node_id
+        
+            if return_type == 'prev_message_id':
+                return prev_message_id
+
+    def get_children_counter(self, chat_id: int, message_id: Optional[int]) -> Tuple[int, Optional[int]]:
+        """Number of childs of the message (of first messages of the chat if None) and the visible one."""
+        with self.reader() as cursor:
+            if message_id is None:
+                cursor.execute("""--sql
+                    SELECT roots AS childs, active_root_id AS active_child_id FROM Chats WHERE ChatId = ?
+                """, (
+                    chat_id,
+                ))
+            else:
+                cursor.execute("""--sql
+                    SELECT childs, active_child_id FROM Messages WHERE MessageId = ? AND ChatId = ?
+                """, (
+                    message_id, chat_id
+                ))
+            row = cursor.fetchone()
+            assert row is not None, "message not found by given ids"
+            return row['childs'], row['active_child_id']
+
+    def get_children_contents(self, chat_id: int, message_id: int) -> List[str]:
+        """Content of every child of the message (the answers of a question), by position."""
+        with self.reader() as cursor:
+            cursor.execute("""--sql
+                SELECT content FROM Messages WHERE ChatId = ? AND parent_id = ? ORDER BY position
             """, (
-                message['position'] - 1, message['level'], message['parent_id']
+                chat_id, message_id
             ))
+            return [row['content'] for row in cursor.fetchall()]
 
-        new_leaf_node_id = self.get_current_leaf_node_id(chat_id=chat_id, message_id=message['parent_id'], use_get_chat_info=False)
-        self.cursor.execute("""--sql
-            UPDATE Chats 
-            SET leaf_node_id = ?
-            WHERE ChatId = ?
-        """, (
-            new_leaf_node_id, message['ChatId']
-        ))
+    def set_active_child(self, chat_id: int, parent_id: Optional[int], old_id: Optional[int], new_id: int, activate: bool = True) -> None:
+        """Moves the parent's pointer (the chat's for first messages) and the is_active flags: at most 3 row writes."""
+        with self.writer(commit=False) as cursor:
+            if old_id is not None and old_id != new_id:
+                cursor.execute("""--sql
+                    UPDATE Messages SET is_active = FALSE WHERE MessageId = ?
+                """, (old_id, ))
+            if activate:
+                cursor.execute("""--sql
+                    UPDATE Messages SET is_active = TRUE WHERE MessageId = ?
+                """, (new_id, ))
+            if parent_id is None:
+                cursor.execute("""--sql
+                    UPDATE Chats SET active_root_id = ? WHERE ChatId = ?
+                """, (new_id, chat_id))
+            else:
+                cursor.execute("""--sql
+                    UPDATE Messages SET active_child_id = ? WHERE MessageId = ?
+                """, (new_id, parent_id))
 
-        if commit: self.conn.commit()
-        
-        if return_type == 'prev_message_leaf_id':
-            return new_leaf_node_id
-        
-        if return_type == 'prev_message_id':
-            return self.get_current_active_child_id(chat_id=chat_id, message_id=message['parent_id'])
-        
-    def get_current_active_child_id(self, chat_id: int, message_id: Optional[int]) -> int: 
-        if message_id is None:
-            self.cursor.execute("""--sql
-                SELECT 
-                    MessageId, ChatId, content, message_by, message_model, message_rating, 
-                    level, parent_id, siblings, position, childs, is_active, Timestamp
-                FROM Messages WHERE parent_id IS NULL AND is_active AND ChatId = ?
-                LIMIT 1
+    def switch_sibling(self, chat_id: int, message: models.IFetchMessage, step: int) -> Tuple[int, int]:
+        """Makes the sibling `step` positions away from `message` the visible one, returns the new leaf and the sibling."""
+        with self.writer(commit=False) as cursor:
+            siblings, active_id = self.get_children_counter(chat_id, message['parent_id'])
+            position = message['position'] + step
+            if position > siblings: raise IndexError("already at last chat")
+            if position < 1: raise IndexError("already at first chat")
+            cursor.execute("""--sql
+                SELECT MessageId FROM Messages WHERE ChatId = ? AND parent_id IS ? AND position = ?
             """, (
-                chat_id,
+                chat_id, message['parent_id'], position
             ))
-        else:
-            self.cursor.execute("""--sql
-                SELECT 
-                    MessageId, ChatId, content, message_by, message_model, message_rating, 
-                    level, parent_id, siblings, position, childs, is_active, Timestamp
-                FROM Messages WHERE parent_id = ? AND is_active AND ChatId = ?
-                LIMIT 1
+            sibling_id = cursor.fetchone()['MessageId']
+            self.set_active_child(chat_id, message['parent_id'], active_id, sibling_id)
+            return self.switch_active_path(chat_id=chat_id, parent_id=message['parent_id'], message_id=sibling_id), sibling_id
+
+    def get_active_depth(self, chat_id: int, message_id: int) -> Optional[int]:
+        """Depth of the message on the chat's visible branch, None if it is not on it."""
+        with self.reader() as cursor:
+            cursor.execute("""--sql
+                SELECT p.depth FROM Messages AS m
+                INNER JOIN ChatActivePath AS p ON p.ChatId = m.ChatId AND p.depth = m.level AND p.MessageId = m.MessageId
+                WHERE m.MessageId = ? AND m.ChatId = ?
             """, (
                 message_id, chat_id
             ))
-        child_message: Optional[models.IFetchMessage] = self.cursor.fetchone()
-        assert child_message is not None, "something went wrong, no child at all"
-        return child_message['MessageId']
+            row = cursor.fetchone()
+            return row['depth'] if row else None
 
-    def get_current_leaf_node_id(self, chat_id: int, message_id: Optional[int] = None, use_get_chat_info: bool = True) -> int: 
-        if message_id is None:
-            if use_get_chat_info:
-                leaf_node_id = self.get_chat_info(chat_id)['leaf_node_id']
-            else:
-                self.cursor.execute("""--sql                    
-                WITH RECURSIVE active_path(MessageId, parent_id, level, is_active) As (
-                    -- Base case: start from the given root node.
-                    SELECT m.MessageId, m.parent_id, m.level, m.is_active
-                    FROM Messages as m
-                    WHERE m.ChatId=? AND m.parent_id IS NULL AND m.is_active
+    def switch_active_path(self, chat_id: int, parent_id: Optional[int], message_id: int) -> int:
+        """
+        After `message_id` became the active child of `parent_id`: rewrites the visible branch below the
+        parent (the message and its active descendants, by their pointers) and the chat's leaf, returns the leaf.
+        """
+        with self.writer(commit=False) as cursor:
+            if parent_id is not None and self.get_active_depth(chat_id, parent_id) is None:
+                # a branch that is not visible: only the chat's leaf moves, as before the path was stored
+                new_leaf_node_id = self.get_current_leaf_node_id(chat_id=chat_id, message_id=parent_id, use_get_chat_info=False)
+                cursor.execute("""--sql
+                    UPDATE Chats SET leaf_node_id = ? WHERE ChatId = ?
+                """, (
+                    new_leaf_node_id, chat_id
+                ))
+                return new_leaf_node_id
+            cursor.execute("""--sql
+                DELETE FROM ChatActivePath WHERE ChatId = ? AND depth >= (SELECT level FROM Messages WHERE MessageId = ?)
+            """, (chat_id, message_id))
+            cursor.execute("""--sql
+                INSERT INTO ChatActivePath (ChatId, depth, MessageId)
+                WITH RECURSIVE active_path(MessageId, level, active_child_id) AS (
+                    SELECT m.MessageId, m.level, m.active_child_id FROM Messages AS m
+                    WHERE m.MessageId = ?
                     UNION ALL
-                    -- Recursive case: join on the parent.
-                    SELECT m.MessageId, m.parent_id, m.level, m.is_active
-                    FROM Messages as m
-                    INNER JOIN active_path a ON a.MessageId = m.parent_id and m.is_active
+                    SELECT m.MessageId, m.level, m.active_child_id FROM Messages AS m
+                    INNER JOIN active_path AS a ON m.MessageId = a.active_child_id
                 )
-                SELECT * FROM active_path
+                SELECT ?, level, MessageId FROM active_path
             """, (
-                chat_id, 
+                message_id, chat_id
             ))
-            items: list = self.cursor.fetchall()
-            assert len(items) != 0, "This is already a leaf node"
-            item = items[-1]
-            leaf_node_id = item['MessageId']
-        else:
-            self.cursor.execute("""--sql                    
-                WITH RECURSIVE active_path(MessageId, parent_id, level, is_active) As (
-                    -- Base case: start from the given root node.
-                    SELECT m.MessageId, m.parent_id, m.level, m.is_active
-                    FROM Messages as m
-                    WHERE m.ChatId=? AND m.MessageId = ?
-                    UNION ALL
-                    -- Recursive case: join on the parent.
-                    SELECT m.MessageId, m.parent_id, m.level, m.is_active
-                    FROM Messages as m
-                    INNER JOIN active_path a ON a.MessageId = m.parent_id and m.is_active
+            cursor.execute("""--sql
+                UPDATE Chats SET (leaf_node_id, active_depth) = (
+                    SELECT MessageId, depth FROM ChatActivePath WHERE ChatId = ? ORDER BY depth DESC LIMIT 1
                 )
-                SELECT * FROM active_path
+                WHERE ChatId = ?
+                RETURNING leaf_node_id
             """, (
-                chat_id, message_id
+                chat_id, chat_id
             ))
-            items: list = self.cursor.fetchall()
-            assert len(items) != 0, "This is already a leaf node"
-            item = items[-1]
-            leaf_node_id = item['MessageId']
-        return leaf_node_id
+            return cursor.fetchone()['leaf_node_id']
+
+    def get_active_path(self, chat_id: int, min_depth: int, max_depth: int, reverse: bool = False) -> List[GetMessages]:
+        """
+        Messages of the visible branch between the depths (inclusive) in one range read of ChatActivePath,
+        `depth` counts from 1 in the returned order (from the leaf side if `reverse`).
+        """
+        with self.reader() as cursor:
+            cursor.execute(f"""--sql
+                SELECT {MESSAGE_COLUMNS}, {"? - p.depth" if reverse else "p.depth - ?"} + 1 AS depth
+                FROM ChatActivePath AS p
+                INNER JOIN Messages AS m ON m.MessageId = p.MessageId
+                WHERE p.ChatId = ? AND p.depth BETWEEN ? AND ?
+                ORDER BY p.depth {"DESC" if reverse else "ASC"}
+            """, (
+                max_depth if reverse else min_depth, chat_id, min_depth, max_depth
+            ))
+            return cursor.fetchall()
+
+    def get_current_active_child_id(self, chat_id: int, message_id: Optional[int]) -> int: 
+        _, active_child_id = self.get_children_counter(chat_id, message_id)
+        assert active_child_id is not None, "something went wrong, no child at all"
+        return active_child_id
+
+    def get_active_message_id(self, chat_id: int, depth: int) -> Optional[int]:
+        with self.reader() as cursor:
+            cursor.execute("""--sql
+                SELECT MessageId FROM ChatActivePath WHERE ChatId = ? AND depth = ?
+            """, (
+                chat_id, depth
+            ))
+            row = cursor.fetchone()
+            return row['MessageId'] if row else None
+
+    def get_last_active_message_id(self, chat_id: int) -> Optional[int]:
+        with self.reader() as cursor:
+            cursor.execute("""--sql
+                SELECT MessageId FROM ChatActivePath WHERE ChatId = ? ORDER BY depth DESC LIMIT 1
+            """, (
+                chat_id, 
+            ))
+            row = cursor.fetchone()
+            return row['MessageId'] if row else None
+
+    def get_current_leaf_node_id(self, chat_id: int, message_id: Optional[int] = None, use_get_chat_info: bool = True) -> int: 
+        with self.reader() as cursor:
+            if message_id is None:
+                if use_get_chat_info:
+                    leaf_node_id = self.get_chat_info(chat_id)['leaf_node_id']
+                else:
+                    leaf_node_id = self.get_last_active_message_id(chat_id)
+                    assert leaf_node_id is not None, "This is already a leaf node"
+            elif self.get_active_depth(chat_id, message_id) is not None:
+                leaf_node_id = self.get_last_active_message_id(chat_id)
+            else:
+                cursor.execute("""--sql                    
+                    WITH RECURSIVE active_path(MessageId, parent_id, level, is_active) As (
+                        -- Base case: start from the given root node.
+                        SELECT m.MessageId, m.parent_id, m.level, m.is_active
+                        FROM Messages as m
+                        WHERE m.ChatId=? AND m.MessageId = ?
+                        UNION ALL
+                        -- Recursive case: join on the parent.
+                        SELECT m.MessageId, m.parent_id, m.level, m.is_active
+                        FROM Messages as m
+                        INNER JOIN active_path a ON a.MessageId = m.parent_id and m.is_active
+                    )
+                    SELECT * FROM active_path
+                """, (
+                    chat_id, message_id
+                ))
+                items: list = cursor.fetchall()
+                assert len(items) != 0, "This is already a leaf node"
+                item = items[-1]
+                leaf_node_id = item['MessageId']
+            return leaf_node_id
     
     def get_chats_above(self, chat_id: int, message_id: int, max_result: int = 50) -> List[GetMessages]:
-        self.cursor.execute("""--sql                    
-            WITH RECURSIVE active_path(MessageId, ChatId, content, message_by, message_model, message_rating, 
-                            level, parent_id, siblings, position, childs, is_active, Timestamp, depth) As (
-                -- Base case: start from the given root node.
-                SELECT m.MessageId, m.ChatId, m.content, m.message_by, m.message_model, m.message_rating, m.level, m.parent_id, m.siblings, m.position, m.childs, m.is_active, m.Timestamp, 1 as depth
-                FROM Messages as m
-                WHERE m.ChatId=? AND m.MessageId = ?
-                UNION ALL
-                -- Recursive case: join on the parent.
-                SELECT m.MessageId, m.ChatId, m.content, m.message_by, m.message_model, m.message_rating, m.level, m.parent_id, m.siblings, m.position, m.childs, m.is_active, m.Timestamp, a.depth + 1 as depth
-                FROM Messages as m
-                INNER JOIN active_path AS a ON m.ChatId = a.ChatId and m.MessageId = a.parent_id and m.is_active and depth != ?
-            )
-            SELECT * FROM active_path
-        """, (
-            chat_id, message_id, max_result
-        ))
-        
-        items: list = self.cursor.fetchall()
-        return items
-        
-    def get_chats_down(self, chat_id: int, message_id: Optional[int], max_result: int = 50) -> List[GetMessages]:
-        if message_id is None:
-            self.cursor.execute("""--sql                    
+        with self.reader() as cursor:
+            depth = self.get_active_depth(chat_id, message_id)
+            if depth is not None:
+                return self.get_active_path(chat_id, min_depth=depth - max_result + 1, max_depth=depth, reverse=True)
+            cursor.execute("""--sql                    
                 WITH RECURSIVE active_path(MessageId, ChatId, content, message_by, message_model, message_rating, 
                                 level, parent_id, siblings, position, childs, is_active, Timestamp, depth) As (
                     -- Base case: start from the given root node.
                     SELECT m.MessageId, m.ChatId, m.content, m.message_by, m.message_model, m.message_rating, m.level, m.parent_id, m.siblings, m.position, m.childs, m.is_active, m.Timestamp, 1 as depth
                     FROM Messages as m
-                    WHERE m.ChatId=? AND m.parent_id IS NULL AND m.is_active
+                    WHERE m.ChatId=? AND m.MessageId = ?
                     UNION ALL
                     -- Recursive case: join on the parent.
                     SELECT m.MessageId, m.ChatId, m.content, m.message_by, m.message_model, m.message_rating, m.level, m.parent_id, m.siblings, m.position, m.childs, m.is_active, m.Timestamp, a.depth + 1 as depth
                     FROM Messages as m
-                    INNER JOIN active_path a ON m.ChatId = a.ChatId and a.MessageId = m.parent_id and m.is_active and depth != ?
+                    INNER JOIN active_path AS a ON m.ChatId = a.ChatId and m.MessageId = a.parent_id and m.is_active and depth != ?
                 )
                 SELECT * FROM active_path
             """, (
-                chat_id, max_result
+                chat_id, message_id, max_result
             ))
-        else:
-            self.cursor.execute("""--sql                    
+        
+            items: list = cursor.fetchall()
+            return items
+        
+    def get_chats_down(self, chat_id: int, message_id: Optional[int], max_result: int = 50) -> List[GetMessages]:
+        with self.reader() as cursor:
+            depth = 1 if message_id is None else self.get_active_depth(chat_id, message_id)
+            if depth is not None:
+                return self.get_active_path(chat_id, min_depth=depth, max_depth=depth + max_result - 1)
+            cursor.execute("""--sql                    
                 WITH RECURSIVE active_path(MessageId, ChatId, content, message_by, message_model, message_rating, 
                                 level, parent_id, siblings, position, childs, is_active, Timestamp, depth) As (
                     -- Base case: start from the given root node.
@@ -379,90 +480,223 @@ class DataBase:
                 chat_id, message_id, max_result
             ))
 
-        items: list = self.cursor.fetchall()
-        return items
+            items: list = cursor.fetchall()
+            return items
     
+    def get_nearest_summary(self, chat_id: int, max_depth: int) -> Optional[models.IFetchChatSummary]:
+        """The deepest summary of the visible branch at or above `max_depth`."""
+        with self.reader() as cursor:
+            cursor.execute("""--sql
+                SELECT s.MessageId, s.ChatId, s.depth, s.summary, s.tokens, s.Timestamp
+                FROM ChatActivePath AS p
+                INNER JOIN ChatSummaries AS s ON s.MessageId = p.MessageId
+                WHERE p.ChatId = ? AND p.depth <= ?
+                ORDER BY p.depth DESC
+                LIMIT 1
+            """, (
+                chat_id, max_depth
+            ))
+            return cursor.fetchone()
+
+    def save_summary(self, summary: models.IChatSummary, commit: bool = True) -> None:
+        with self.writer(commit) as cursor:
+            cursor.execute("""--sql
+                INSERT OR REPLACE INTO ChatSummaries (MessageId, ChatId, depth, summary, tokens) VALUES (?, ?, ?, ?, ?)
+            """, (
+                summary['MessageId'], summary['ChatId'], summary['depth'], summary['summary'], summary['tokens']
+            ))
+
+    def enqueue_task(self, task: models.IChatTask, now: float, commit: bool = True) -> int:
+        with self.writer(commit) as cursor:
+            cursor.execute("""--sql
+                INSERT INTO ChatTasks (ChatId, Kind, Payload, NextAttempt, EnqueuedAt) VALUES (?, ?, ?, ?, ?)
+            """, (task['ChatId'], task['Kind'], task['Payload'], now, now))
+            task_id = cursor.lastrowid
+            assert task_id is not None, "Something went wrong..."
+            return task_id
+
+    def claim_tasks(self, now: float, limit: int, lease: float, chat_id: Optional[int] = None,
+                    kind: Optional[models.ChatTaskKind] = None) -> List[models.IFetchChatTask]:
+        """Marks up to limit ready tasks (and abandoned running ones) as running, oldest first."""
+        with self.writer() as cursor:
+            cursor.execute("""--sql
+                UPDATE ChatTasks
+                SET Status = 'running', StartedAt = ?, Attempts = Attempts + 1
+                WHERE TaskId IN (
+                    SELECT TaskId FROM ChatTasks
+                    WHERE ((Status = 'pending' AND NextAttempt <= ?) OR (Status = 'running' AND StartedAt <= ?))
+                        AND (? IS NULL OR ChatId = ?) AND (? IS NULL OR Kind = ?)
+                    ORDER BY TaskId
+                    LIMIT ?
+                )
+                RETURNING *
+            """, (now, now, now - lease, chat_id, chat_id, kind, kind, limit))
+            tasks = [models.IFetchChatTask(**row) for row in cursor.fetchall()]
+            return sorted(tasks, key=lambda task: task['TaskId'])
+
+    def complete_task(self, task_id: int, now: float, commit: bool = True) -> None:
+        with self.writer(commit) as cursor:
+            cursor.execute("""--sql
+                UPDATE ChatTasks SET Status = 'done', LastError = NULL, FinishedAt = ? WHERE TaskId = ?
+            """, (now, task_id))
+
+    def fail_task(self, task: models.IFetchChatTask, error: str, now: float, max_attempts: int, backoff: float,
+                  commit: bool = True) -> models.ChatTaskStatus:
+        """Reschedules the task `backoff` sec later, or dead-letters it. Returns the new status."""
+        with self.writer(commit) as cursor:
+            status: models.ChatTaskStatus = 'dead' if task['Attempts'] >= max_attempts else 'pending'
+            cursor.execute("""--sql
+                UPDATE ChatTasks SET Status = ?, LastError = ?, NextAttempt = ?, FinishedAt = ? WHERE TaskId = ?
+            """, (status, error, now + backoff, now if status == 'dead' else None, task['TaskId']))
+            return status
+
+    def release_tasks(self, commit: bool = True) -> int:
+        """Running tasks of a previous process are pending again (claimed without waiting for the lease)."""
+        with self.writer(commit) as cursor:
+            cursor.execute("""--sql
+                UPDATE ChatTasks SET Status = 'pending' WHERE Status = 'running'
+            """)
+            released = cursor.rowcount
+            return released
+
+    def get_unfinished_tasks(self, kind: models.ChatTaskKind) -> Dict[int, int]:
+        """ChatId -> pending / running tasks of the kind."""
+        with self.reader() as cursor:
+            cursor.execute("""--sql
+                SELECT ChatId, COUNT(*) AS count FROM ChatTasks WHERE Kind = ? AND Status IN ('pending', 'running') GROUP BY ChatId
+            """, (kind, ))
+            return {row['ChatId']: row['count'] for row in cursor.fetchall()}
+
+    def get_task_counts(self) -> Dict[str, int]:
+        with self.reader() as cursor:
+            cursor.execute("""--sql
+                SELECT Status, COUNT(*) AS count FROM ChatTasks GROUP BY Status
+            """)
+            return {row['Status']: row['count'] for row in cursor.fetchall()}
+
     def get_chat_info(self, chat_id: int) -> models.IFetchChat:
-        self.cursor.execute("""--sql
-            SELECT ChatId, title, leaf_node_id, active_depth, Timestamp FROM Chats 
-            WHERE ChatId = ?
-        """, (
-            chat_id, 
-        ))
-        chat: models.IFetchChat = self.cursor.fetchone()
-        assert chat is not None, "Chat_id is Wrong, or maybe something went wrong"
-        return chat
+        with self.reader() as cursor:
+            cursor.execute("""--sql
+                SELECT ChatId, title, leaf_node_id, active_depth, roots, active_root_id, Timestamp FROM Chats 
+                WHERE ChatId = ?
+            """, (
+                chat_id, 
+            ))
+            chat: models.IFetchChat = cursor.fetchone()
+            assert chat is not None, "Chat_id is Wrong, or maybe something went wrong"
+            return chat
     
     def delete_chat_info(self, chat_id: int, commit: bool = True):
-        self.cursor.execute("""--sql
-            DELETE FROM Messages WHERE ChatId = ?
-        """, (
-            chat_id, 
-        ))
-        self.cursor.execute("""--sql
-            DELETE FROM Chats WHERE ChatId = ?
-        """, (
-            chat_id, 
-        ))
+        with self.writer(commit) as cursor:
+            cursor.execute("""--sql
+                DELETE FROM ChatActivePath WHERE ChatId = ?
+            """, (
+                chat_id, 
+            ))
+            cursor.execute("""--sql
+                DELETE FROM ChatSummaries WHERE ChatId = ?
+            """, (
+                chat_id, 
+            ))
+            cursor.execute("""--sql
+                DELETE FROM ChatTasks WHERE ChatId = ?
+            """, (
+                chat_id, 
+            ))
+            cursor.execute("""--sql
+                DELETE FROM Messages WHERE ChatId = ?
+            """, (
+                chat_id, 
+            ))
+            cursor.execute("""--sql
+                DELETE FROM Chats WHERE ChatId = ?
+            """, (
+                chat_id, 
+            ))
         
-        if commit: self.conn.commit()
     
     def get_chat_messages(self, chat_id: int) -> List[models.IFetchMessage]:
-        self.cursor.execute("""--sql
-            SELECT MessageId, ChatId, content, message_by, message_model, message_rating, level, parent_id, siblings, position, childs, is_active, Timestamp
-            FROM Messages
-            WHERE ChatId = ?
-            ORDER BY level ASC, position ASC
-        """, (
-            chat_id, 
-        ))
-        messages = self.cursor.fetchall()
-        return messages
+        with self.reader() as cursor:
+            cursor.execute("""--sql
+                SELECT MessageId, ChatId, content, message_by, message_model, message_rating, level, parent_id, siblings, position, childs, is_active, active_child_id, Timestamp
+                FROM Messages
+                WHERE ChatId = ?
+                ORDER BY level ASC, position ASC
+            """, (
+                chat_id, 
+            ))
+            messages = cursor.fetchall()
+            return messages
     
     def get_chat_message(self, chat_id: int, message_id: int) -> models.IFetchMessage:
-        self.cursor.execute("""--sql
-            SELECT 
-                MessageId, ChatId, content, message_by, message_model, message_rating, 
-                level, parent_id, siblings, position, childs, is_active, Timestamp
-            FROM Messages WHERE MessageId = ? AND ChatId = ?
-            LIMIT 1
-        """, (
-            message_id, chat_id
-        ))
-        message: Optional[models.IFetchMessage] = self.cursor.fetchone()
-        assert message is not None, "message not found by given ids"
-        return message
+        with self.reader() as cursor:
+            cursor.execute("""--sql
+                SELECT 
+                    MessageId, ChatId, content, message_by, message_model, message_rating, 
+                    level, parent_id, siblings, position, childs, is_active, active_child_id, Timestamp
+                FROM Messages WHERE MessageId = ? AND ChatId = ?
+                LIMIT 1
+            """, (
+                message_id, chat_id
+            ))
+            message: Optional[models.IFetchMessage] = cursor.fetchone()
+            assert message is not None, "message not found by given ids"
+            return message
     
-    def get_lazy_chat_messages(self, chat_id: int) -> List[models.IFetchMessage]:
-        self.cursor.execute("""--sql                    
-            WITH RECURSIVE active_path(MessageId, ChatId, content, message_by, message_model, message_rating, 
-                            level, parent_id, siblings, position, childs, is_active, Timestamp, depth) As (
-                -- Base case: start from the given root node.
-                SELECT m.MessageId, m.ChatId, m.content, m.message_by, m.message_model, m.message_rating, m.level, m.parent_id, m.siblings, m.position, m.childs, m.is_active, m.Timestamp, 1 as depth
-                FROM Messages as m
-                WHERE m.ChatId=? AND m.parent_id IS NULL AND m.is_active
+    def get_lazy_chat_messages(self, chat_id: int, min_depth: int = 1, max_depth: Optional[int] = None) -> List[models.IFetchMessage]:
+        """
+        The visible branch with the siblings of each of its messages (for the branch pickers),
+        only the messages between the depths (inclusive) if given.
+        """
+        with self.reader() as cursor:
+            cursor.execute(f"""--sql
+                SELECT {MESSAGE_COLUMNS}
+                FROM Messages AS m
+                WHERE m.ChatId = ? AND m.parent_id IS NULL AND ? <= 1
+                    AND EXISTS (SELECT 1 FROM ChatActivePath WHERE ChatId = ? AND depth = 1)
                 UNION ALL
-                -- Recursive case: join on the parent.
-                SELECT m.MessageId, m.ChatId, m.content, m.message_by, m.message_model, m.message_rating, m.level, m.parent_id, m.siblings, m.position, m.childs, m.is_active, m.Timestamp, a.depth + 1 as depth
-                FROM Messages as m
-                INNER JOIN active_path a ON m.ChatId = a.ChatId and a.MessageId = m.parent_id and m.is_active
-            )
-                            
-            SELECT m.MessageId, m.ChatId, m.content, m.message_by, m.message_model, m.message_rating, m.level, m.parent_id, m.siblings, m.position, m.childs, m.is_active, m.Timestamp
-            FROM Messages as m
-            INNER JOIN active_path a ON m.ChatId = ? and ((m.parent_id IS NULL AND a.parent_id IS NULL) OR (a.parent_id = m.parent_id))
-            ORDER BY m.level ASC, m.position ASC
-        """, (
-            chat_id,chat_id
-        ))
-        messages = self.cursor.fetchall()
-        return messages
+                SELECT {MESSAGE_COLUMNS}
+                FROM ChatActivePath AS p
+                INNER JOIN ChatActivePath AS c ON c.ChatId = p.ChatId AND c.depth = p.depth + 1
+                INNER JOIN Messages AS m ON m.ChatId = p.ChatId AND m.parent_id = p.MessageId
+                WHERE p.ChatId = ? AND p.depth >= ? - 1 {"AND p.depth < ?" if max_depth is not None else ""}
+                ORDER BY level ASC, position ASC
+            """, (
+                chat_id, min_depth, chat_id, chat_id, min_depth, *((max_depth, ) if max_depth is not None else ())
+            ))
+            messages = cursor.fetchall()
+            return messages
     
     def get_all_chats(self) -> List[models.IFetchChat]:
-        self.cursor.execute("""--sql                    
-            SELECT ChatId, title, leaf_node_id, active_depth, Timestamp
-            FROM Chats
-            ORDER BY Timestamp DESC
-        """, ())
-        chats = self.cursor.fetchall()
-        return chats
\ No newline at end of file
+        with self.reader() as cursor:
+            cursor.execute("""--sql                    
+                SELECT ChatId, title, leaf_node_id, active_depth, roots, active_root_id, Timestamp
+                FROM Chats
+                ORDER BY Timestamp DESC
+            """, ())
+            chats = cursor.fetchall()
+            return chats
+
+    def search_history(self, query: str, limit: int, kinds: Tuple[search.SearchKind, ...] = ('message', 'chat'), chat_id: Optional[int] = None,
+                       role: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None) -> List[search.SearchHit]:
+        """Best `limit` messages and chat titles for the FTS5 `query` (see db.search.match_query), best first."""
+        hits: List[search.SearchHit] = []
+        with self.reader() as cursor:
+            if 'message' in kinds:
+                hits += search.search_messages(cursor, query, limit, chat_id=chat_id, role=role, since=since, until=until)
+            if 'chat' in kinds and role is None: # a title has no author
+                hits += search.search_chats(cursor, query, limit, chat_id=chat_id, since=since, until=until)
+        return sorted(hits, key=lambda hit: hit['score'])[:limit]
+
+    def rebuild_search_index(self) -> None:
+        with self.writer() as cursor:
+            for name in ('Chats', 'Messages'): search.rebuild_search_index(cursor, name)
+
+    def index_pending(self, batch: int = search.BATCH) -> int:
+        """One batch of the rows not indexed yet (what SearchIndexer does for a database file)."""
+        with self.writer() as cursor:
+            return sum(search.index_pending(cursor, name, batch) for name in ('Chats', 'Messages'))
+
+    def get_search_status(self) -> List[search.SearchIndexStatus]:
+        with self.reader() as cursor:
+            return search.index_status(cursor, ('Chats', 'Messages'))
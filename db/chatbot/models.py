@@ -2,7 +2,12 @@ from typing import TypedDict, Optional, Literal
 from sqlite3 import Cursor
 from datetime import datetime, time
 
-    
+def add_column(cursor: Cursor, table: str, column: str, definition: str) -> bool:
+    """Adds the column to a table created by an older version, returns whether it was missing."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if any(row[1] == column for row in cursor.fetchall()): return False
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
 
 #####################################################################################
 #                                         CHAT                                      #
@@ -12,6 +17,8 @@ class IChat(TypedDict):
     title: str
     leaf_node_id: Optional[int] # None
     active_depth: int # 0
+    roots: int # 0, first messages (their alternatives included)
+    active_root_id: Optional[int] # None, the visible one of them
 
 class IFetchChat(IChat):
     ChatId: int
@@ -24,10 +31,15 @@ def create_chat(cursor: Cursor):
         title TEXT NOT NULL,
         leaf_node_id INTEGER DEFAULT NULL,
         active_depth INTEGER DEFAULT 0,
+        roots INTEGER DEFAULT 0,
+        active_root_id INTEGER DEFAULT NULL,
         Timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (leaf_node_id) REFERENCES Messages (MessageId)
+        FOREIGN KEY (leaf_node_id) REFERENCES Messages (MessageId),
+        FOREIGN KEY (active_root_id) REFERENCES Messages (MessageId)
     )
     """)
+    add_column(cursor, 'Chats', 'roots', 'INTEGER DEFAULT 0')
+    add_column(cursor, 'Chats', 'active_root_id', 'INTEGER DEFAULT NULL REFERENCES Messages (MessageId)')
     
 
 #####################################################################################
@@ -43,10 +55,11 @@ class IMessage(TypedDict):
     
     level: int
     parent_id: Optional[int]
-    siblings: int # 0
+    siblings: int # 0, alternatives when the message was written (the live count is the parent's childs, or Chats.roots)
     position: int # 0
     childs: int # 0
     is_active: bool # true
+    active_child_id: Optional[int] # None, the visible one of the childs
         
 class IFetchMessage(IMessage):
     MessageId: int
@@ -68,9 +81,133 @@ def create_message(cursor: Cursor):
         position INTEGER DEFAULT 0,
         childs INTEGER DEFAULT 0,
         is_active Boolean DEFAULT TRUE,
+        active_child_id INTEGER DEFAULT NULL,
         Timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (ChatId) REFERENCES Chats (ChatId),
-        FOREIGN KEY (parent_id) REFERENCES Messages (MessageId)
+        FOREIGN KEY (parent_id) REFERENCES Messages (MessageId),
+        FOREIGN KEY (active_child_id) REFERENCES Messages (MessageId)
     )
     """)
-    
\ No newline at end of file
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_parent ON Messages (ChatId, parent_id, position)")
+    if add_column(cursor, 'Messages', 'active_child_id', 'INTEGER DEFAULT NULL REFERENCES Messages (MessageId)'):
+        # the counters and pointers of an older database, from the is_active flags
+        cursor.execute("""--sql
+        UPDATE Messages AS m SET
+            childs = (SELECT COUNT(*) FROM Messages AS c WHERE c.ChatId = m.ChatId AND c.parent_id = m.MessageId),
+            active_child_id = (SELECT c.MessageId FROM Messages AS c WHERE c.ChatId = m.ChatId AND c.parent_id = m.MessageId AND c.is_active)
+        """)
+        cursor.execute("""--sql
+        UPDATE Chats AS chat SET
+            roots = (SELECT COUNT(*) FROM Messages AS m WHERE m.ChatId = chat.ChatId AND m.parent_id IS NULL),
+            active_root_id = (SELECT m.MessageId FROM Messages AS m WHERE m.ChatId = chat.ChatId AND m.parent_id IS NULL AND m.is_active)
+        """)
+
+
+#####################################################################################
+#                                   CHAT ACTIVE PATH                                #
+#####################################################################################
+
+class IChatActivePath(TypedDict):
+    ChatId: int
+    depth: int # level of the message, 1 for the root
+    MessageId: int
+
+def create_chat_active_path(cursor: Cursor):
+    """The visible branch of every chat (root -> leaf_node_id), kept in step with Messages.is_active."""
+    cursor.execute("""--sql
+    CREATE TABLE IF NOT EXISTS ChatActivePath (
+        ChatId INTEGER NOT NULL,
+        depth INTEGER NOT NULL,
+        MessageId INTEGER NOT NULL,
+        PRIMARY KEY (ChatId, depth),
+        FOREIGN KEY (ChatId) REFERENCES Chats (ChatId),
+        FOREIGN KEY (MessageId) REFERENCES Messages (MessageId)
+    ) WITHOUT ROWID
+    """)
+    # chats of databases created before the table
+    cursor.execute("""--sql
+    INSERT OR IGNORE INTO ChatActivePath (ChatId, depth, MessageId)
+    WITH RECURSIVE active_path(ChatId, MessageId, level) AS (
+        SELECT m.ChatId, m.MessageId, m.level FROM Messages AS m
+        WHERE m.parent_id IS NULL AND m.is_active AND m.ChatId NOT IN (SELECT ChatId FROM ChatActivePath)
+        UNION ALL
+        SELECT m.ChatId, m.MessageId, m.level FROM Messages AS m
+        INNER JOIN active_path AS a ON m.ChatId = a.ChatId AND m.parent_id = a.MessageId AND m.is_active
+    )
+    SELECT ChatId, level, MessageId FROM active_path
+    """)
+
+
+#####################################################################################
+#                                   CHAT SUMMARY                                    #
+#####################################################################################
+
+class IChatSummary(TypedDict):
+    MessageId: int  # the summary covers the branch from the first message down to this one
+    ChatId: int
+    depth: int
+    summary: str
+    tokens: int
+
+class IFetchChatSummary(IChatSummary):
+    Timestamp: datetime
+
+def create_chat_summary(cursor: Cursor):
+    """Rolling summaries of the history dropped from the model context (ml/context_builder.py)."""
+    cursor.execute("""--sql
+    CREATE TABLE IF NOT EXISTS ChatSummaries (
+        MessageId INTEGER PRIMARY KEY,
+        ChatId INTEGER NOT NULL,
+        depth INTEGER NOT NULL,
+        summary TEXT NOT NULL,
+        tokens INTEGER NOT NULL,
+        Timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (MessageId) REFERENCES Messages (MessageId),
+        FOREIGN KEY (ChatId) REFERENCES Chats (ChatId)
+    )
+    """)
+
+
+#####################################################################################
+#                                   CHAT TASK                                       #
+#####################################################################################
+
+ChatTaskKind = Literal['answer', 'title']
+ChatTaskStatus = Literal['pending', 'running', 'done', 'dead']
+
+class IChatTask(TypedDict):
+    ChatId: int
+    Kind: ChatTaskKind
+    Payload: str # json, see api/chatbot/tasks.py
+
+class IFetchChatTask(IChatTask):
+    TaskId: int
+    Status: ChatTaskStatus
+    Attempts: int
+    NextAttempt: float # unix time, pending tasks are not claimed before it
+    LastError: Optional[str]
+    EnqueuedAt: float
+    StartedAt: Optional[float]
+    FinishedAt: Optional[float]
+
+def create_chat_task(cursor: Cursor):
+    """Work done after a chat response closed (api/chatbot/tasks.py), a task is done in the transaction applying it."""
+    cursor.execute("""--sql
+    CREATE TABLE IF NOT EXISTS ChatTasks (
+        TaskId INTEGER PRIMARY KEY AUTOINCREMENT,
+        ChatId INTEGER NOT NULL,
+        Kind TEXT NOT NULL,
+        Payload TEXT NOT NULL,
+        Status TEXT NOT NULL DEFAULT 'pending',
+        Attempts INTEGER NOT NULL DEFAULT 0,
+        NextAttempt REAL NOT NULL,
+        LastError TEXT,
+        EnqueuedAt REAL NOT NULL,
+        StartedAt REAL,
+        FinishedAt REAL,
+        FOREIGN KEY (ChatId) REFERENCES Chats (ChatId)
+    )
+    """)
+    cursor.execute("""--sql
+    CREATE INDEX IF NOT EXISTS idx_chat_tasks_status ON ChatTasks (Status, NextAttempt)
+    """)
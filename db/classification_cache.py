@@ -0,0 +1,214 @@
+import re
+import sqlite3
+import time
+from threading import Lock
+from typing import TypedDict, Optional, List, Dict, Mapping, Any, Iterable, Union
+from .models import IFetchClassificationCacheEntry, IClassificationCacheEntry, ClassificationKind, ClassificationSource
+
+#####################################################################################
+#                                   Constants                                       #
+#####################################################################################
+
+TTL: float = 60*60*24*90        # sec, model answers are asked again after it, user choices never expire
+PRIORITY: Dict[ClassificationSource, int] = {'user': 3, 'import': 2, 'llm': 1, 'local': 0} # lower never overwrites higher
+
+# Public suffixes with more than one label, enough for the sites people actually visit
+# (a full Public Suffix List is not worth a dependency here): `mail.google.co.uk` -> `google.co.uk`
+MULTI_LABEL_SUFFIXES = frozenset({
+    'co.uk', 'org.uk', 'ac.uk', 'gov.uk', 'me.uk', 'ltd.uk', 'plc.uk', 'net.uk',
+    'com.au', 'net.au', 'org.au', 'edu.au', 'gov.au', 'co.nz', 'org.nz', 'ac.nz',
+    'co.in', 'net.in', 'org.in', 'ac.in', 'gov.in', 'edu.in', 'co.jp', 'ne.jp', 'or.jp', 'ac.jp', 'go.jp',
+    'co.kr', 'or.kr', 'ac.kr', 'com.br', 'net.br', 'org.br', 'gov.br', 'com.cn', 'net.cn', 'org.cn', 'edu.cn', 'gov.cn',
+    'com.mx', 'com.ar', 'com.tr', 'com.tw', 'com.hk', 'com.sg', 'com.my', 'com.ph', 'com.pk', 'com.ng', 'com.eg',
+    'co.za', 'co.id', 'co.il', 'co.th', 'com.vn', 'com.ua', 'com.pl', 'com.ru',
+    'github.io', 'gitlab.io', 'blogspot.com', 'herokuapp.com', 'vercel.app', 'netlify.app', 'pages.dev',
+    'web.app', 'firebaseapp.com', 'appspot.com', 'azurewebsites.net', 'cloudfront.net', 'workers.dev',
+    'readthedocs.io', 'substack.com', 'wordpress.com', 'tumblr.com', 'notion.site', 'streamlit.app', 'hf.space',
+})
+IP_PATTERN = re.compile(r"^\d{1,3}(\.\d{1,3}){3}$")
+DOTTED_VERSION = re.compile(r"[\s_\-]*v?\d+(?:[._]\d+)+[a-z]?\b")          # 1.2.3, v10_0, 2023.2
+TRAILING_VERSION = re.compile(r"[\s_\-]+(?:v|version\s*)?\d+[a-z]?$")     # 'Studio 2022', 'app-5', 'tool v2'
+NON_WORD = re.compile(r"[^a-z0-9+#]+")
+
+#####################################################################################
+#                                   Types                                           #
+#####################################################################################
+
+class ClassificationCacheStats(TypedDict):
+    entries: int
+    expired: int
+    by_source: Dict[str, int]
+    hits_total: int     # persisted per entry, over the lifetime of the database
+    hits: int           # lookups of this process
+    misses: int
+    expired_hits: int   # lookups that matched an expired entry (counted as misses too)
+
+_counters = {'hits': 0, 'misses': 0, 'expired_hits': 0}
+_counters_lock = Lock()
+
+def _count(name: str) -> None:
+    with _counters_lock: _counters[name] += 1
+
+#####################################################################################
+#                                   Keys                                            #
+#####################################################################################
+
+def normalize_host(baseURL: str) -> str:
+    host = baseURL.strip().lower().rstrip('.')
+    if host.startswith('[') or host.count(':') > 1: return host # ipv6
+    return host.split(':', 1)[0].removeprefix('www.')
+
+def registrable_domain(host: str) -> str:
+    """eTLD+1 of a normalized host: `docs.google.com` -> `google.com`, `a.b.github.io` -> `b.github.io`."""
+    if IP_PATTERN.match(host) or '.' not in host: return host
+    labels = host.split('.')
+    size = 3 if '.'.join(labels[-2:]) in MULTI_LABEL_SUFFIXES else 2
+    return '.'.join(labels[-size:])
+
+def url_keys(baseURL: str) -> List[str]:
+    """Most specific first: the host override, then its registrable domain."""
+    host = normalize_host(baseURL)
+    domain = registrable_domain(host)
+    return [f"url:{host}"] if domain == host else [f"url:{host}", f"url:{domain}"]
+
+def strip_version(value: Optional[str]) -> str:
+    if not value or value == 'None': return ''
+    value = value.lower().strip().removesuffix('.exe')
+    value = TRAILING_VERSION.sub('', DOTTED_VERSION.sub('', value))
+    return NON_WORD.sub(' ', value).strip()
+
+def app_key(app: Union[Mapping[str, Any], sqlite3.Row]) -> str:
+    """Identity of an app without its install path or version: `app:<product>|<exe>`."""
+    fields = dict(app)
+    return f"app:{strip_version(fields.get('ProductName'))}|{strip_version(fields.get('ExeFileName'))}"
+
+#####################################################################################
+#                                   Cache                                           #
+#####################################################################################
+
+def lookup(cursor: sqlite3.Cursor, keys: List[str], now: Optional[float] = None) -> Optional[IFetchClassificationCacheEntry]:
+    """First live entry in keys order (hit counted on it), None on a miss."""
+    now = time.time() if now is None else now
+    cursor.execute(f"""--sql
+    SELECT * FROM ClassificationCache WHERE CacheKey IN ({', '.join('?' for _ in keys)})
+    """, keys)
+    entries = {row['CacheKey']: IFetchClassificationCacheEntry(**row) for row in cursor.fetchall()}
+    expired = False
+    for key in keys:
+        entry = entries.get(key)
+        if entry is None: continue
+        if entry['ExpiresAt'] is not None and entry['ExpiresAt'] <= now:
+            expired = True
+            continue
+        cursor.execute("""--sql
+        UPDATE ClassificationCache SET Hits = Hits + 1, LastHitAt = ? WHERE CacheKey = ?
+        """, (now, key))
+        _count('hits')
+        return entry
+    _count('misses')
+    if expired: _count('expired_hits')
+    return None
+
+def lookup_app(cursor: sqlite3.Cursor, app: Union[Mapping[str, Any], sqlite3.Row], now: Optional[float] = None) -> Optional[IFetchClassificationCacheEntry]:
+    return lookup(cursor, [app_key(app)], now=now)
+
+def lookup_url(cursor: sqlite3.Cursor, baseURL: str, now: Optional[float] = None) -> Optional[IFetchClassificationCacheEntry]:
+    return lookup(cursor, url_keys(baseURL), now=now)
+
+def store(cursor: sqlite3.Cursor, key: str, category: str, source: ClassificationSource,
+          now: Optional[float] = None, ttl: Optional[float] = TTL) -> bool:
+    """Upserts the entry unless a live entry of a higher priority source exists, returns whether it was written."""
+    now = time.time() if now is None else now
+    expires_at = None if source == 'user' or ttl is None else now + ttl
+    priority_case = ' '.join(f"WHEN '{name}' THEN {value}" for name, value in PRIORITY.items())
+    cursor.execute(f"""--sql
+    INSERT INTO ClassificationCache (CacheKey, Category, Source, CreatedAt, ExpiresAt) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (CacheKey) DO UPDATE SET
+        Category = excluded.Category, Source = excluded.Source, CreatedAt = excluded.CreatedAt, ExpiresAt = excluded.ExpiresAt
+    WHERE (CASE excluded.Source {priority_case} END) >= (CASE ClassificationCache.Source {priority_case} END)
+        OR (ClassificationCache.ExpiresAt IS NOT NULL AND ClassificationCache.ExpiresAt <= ?)
+    """, (key, category, source, now, expires_at, now))
+    return cursor.rowcount == 1
+
+def store_app(cursor: sqlite3.Cursor, app: Union[Mapping[str, Any], sqlite3.Row], category: str, source: ClassificationSource,
+              now: Optional[float] = None) -> bool:
+    return store(cursor, app_key(app), category, source, now=now)
+
+def store_url(cursor: sqlite3.Cursor, baseURL: str, category: str, source: ClassificationSource,
+              now: Optional[float] = None) -> bool:
+    """
+    A model answer is stored for the whole registrable domain unless the domain already maps to
+    another category, then only for the host (an override). A user choice always targets the host.
+    """
+    keys = url_keys(baseURL)
+    if source == 'user' or len(keys) == 1: return store(cursor, keys[0], category, source, now=now)
+    now = time.time() if now is None else now
+    cursor.execute("""--sql
+    SELECT Category FROM ClassificationCache WHERE CacheKey = ? AND (ExpiresAt IS NULL OR ExpiresAt > ?)
+    """, (keys[1], now))
+    domain = cursor.fetchone()
+    if domain is None: return store(cursor, keys[1], category, source, now=now)
+    if domain['Category'] == category: return False # already covered by the domain entry
+    return store(cursor, keys[0], category, source, now=now)
+
+def apply(cursor: sqlite3.Cursor, kind: ClassificationKind, key: str, now: Optional[float] = None) -> Optional[str]:
+    """Sets the cached category on an uncategorized app / baseURL, returns it (None on a miss)."""
+    if kind == 'app':
+        cursor.execute("SELECT * FROM Apps WHERE AppId = ? AND Category IS NULL", (key, ))
+        row = cursor.fetchone()
+        entry = lookup_app(cursor, row, now=now) if row is not None else None
+    else:
+        entry = lookup_url(cursor, key, now=now)
+    if entry is None: return None
+    cursor.execute("INSERT OR IGNORE INTO Categories (Category, BlockId) VALUES (?, NULL)", (entry['Category'], ))
+    if kind == 'app':
+        cursor.execute("UPDATE Apps SET Category = ? WHERE AppId = ? AND Category IS NULL", (entry['Category'], key))
+    else:
+        cursor.execute("UPDATE BaseURLs SET Category = ? WHERE baseURL = ? AND Category IS NULL", (entry['Category'], key))
+    return entry['Category']
+
+def purge_expired(cursor: sqlite3.Cursor, now: Optional[float] = None) -> int:
+    now = time.time() if now is None else now
+    cursor.execute("DELETE FROM ClassificationCache WHERE ExpiresAt IS NOT NULL AND ExpiresAt <= ?", (now, ))
+    return cursor.rowcount
+
+def export_entries(cursor: sqlite3.Cursor, now: Optional[float] = None) -> List[IClassificationCacheEntry]:
+    """Live entries to share with another database (local model guesses are not shared)."""
+    now = time.time() if now is None else now
+    cursor.execute("""--sql
+    SELECT CacheKey, Category, Source, ExpiresAt FROM ClassificationCache
+    WHERE Source != 'local' AND (ExpiresAt IS NULL OR ExpiresAt > ?)
+    ORDER BY CacheKey
+    """, (now, ))
+    return [IClassificationCacheEntry(**row) for row in cursor.fetchall()]
+
+def import_entries(cursor: sqlite3.Cursor, entries: Iterable[Mapping[str, Any]], now: Optional[float] = None,
+                   ttl: Optional[float] = TTL) -> int:
+    """Stores foreign entries as 'import' (never over this database's own user choices), returns how many were written."""
+    now = time.time() if now is None else now
+    written = 0
+    for entry in entries:
+        key, category = entry.get('CacheKey'), entry.get('Category')
+        if not isinstance(key, str) or not key.startswith(('app:', 'url:')) or not isinstance(category, str) or not category: continue
+        written += store(cursor, key, category, 'import', now=now, ttl=ttl)
+    return written
+
+def stats(cursor: sqlite3.Cursor, now: Optional[float] = None) -> ClassificationCacheStats:
+    now = time.time() if now is None else now
+    cursor.execute("""--sql
+    SELECT
+        Source, COUNT(*) AS count, SUM(Hits) AS hits,
+        SUM(CASE WHEN ExpiresAt IS NOT NULL AND ExpiresAt <= ? THEN 1 ELSE 0 END) AS expired
+    FROM ClassificationCache GROUP BY Source
+    """, (now, ))
+    rows = cursor.fetchall()
+    with _counters_lock: counters = dict(_counters)
+    return ClassificationCacheStats(
+        entries=sum(row['count'] for row in rows),
+        expired=sum(row['expired'] for row in rows),
+        by_source={row['Source']: row['count'] for row in rows},
+        hits_total=sum(row['hits'] or 0 for row in rows),
+        hits=counters['hits'],
+        misses=counters['misses'],
+        expired_hits=counters['expired_hits']
+    )
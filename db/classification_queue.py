@@ -0,0 +1,211 @@
+import sqlite3
+import time
+from datetime import datetime
+from typing import TypedDict, Optional, List, Dict, Tuple
+from .models import IFetchClassificationJob, ClassificationKind
+
+#####################################################################################
+#                                   Constants                                       #
+#####################################################################################
+
+MAX_ATTEMPTS: int = 5           # a job failing this many times is dead-lettered
+BACKOFF_BASE: float = 10.0      # sec, doubled after every failed attempt
+BACKOFF_MAX: float = 60*30
+LEASE: float = 60*5             # a running job older than this was abandoned (crash), it is claimed again
+LATENCY_WINDOW: int = 100       # latest done jobs used for the latency metrics
+MIN_USAGE: float = 60.0         # sec of activity after which an app / site is worth a model call right away
+MAX_DEFER: float = 60*60*24     # sec a job below MIN_USAGE waits at most
+OFFPEAK_HOURS: Tuple[int, int] = (2, 5) # local hours [start, end) during which deferred jobs are drained in batches
+
+# Accumulated activity (sec) of an app / baseURL, `{key}` is the column or parameter holding the AppId / baseURL
+APP_USAGE = "(SELECT COALESCE(SUM(a.Duration), 0) FROM ActivityEntries AS a WHERE a.AppId = {key})"
+URL_USAGE = """(SELECT COALESCE(SUM(a.Duration), 0) FROM URLs AS u
+    JOIN ActivityEntries AS a ON a.URL = u.URL WHERE u.baseURL = {key})"""
+
+#####################################################################################
+#                                   Types                                           #
+#####################################################################################
+
+class ClassificationQueueMetrics(TypedDict):
+    depth: int                          # pending jobs
+    ready: int                          # pending jobs whose NextAttempt has passed
+    running: int
+    done: int
+    dead: int
+    oldest_pending_age: Optional[float] # sec
+    latency_avg: Optional[float]        # sec from enqueue to result, over the latest LATENCY_WINDOW done jobs
+    latency_p95: Optional[float]
+    attempts_avg: Optional[float]
+    deferred: int                       # pending jobs held back by the usage priority
+
+#####################################################################################
+#                                   Priority                                        #
+#####################################################################################
+
+def usage_sql(kind_column: str = 'Kind', key_column: str = 'Key') -> str:
+    return f"(CASE {kind_column} WHEN 'app' THEN {APP_USAGE.format(key=key_column)} ELSE {URL_USAGE.format(key=key_column)} END)"
+
+class UsagePriority:
+    """
+    Spends model calls / fetches on what is actually used: a key is ready once it has
+    `min_usage` sec of activity (most used first), once it waited `max_defer`, or
+    during the off-peak hours, when the one-off visits left over are drained in batches.
+    """
+    def __init__(self, min_usage: float = MIN_USAGE, max_defer: float = MAX_DEFER,
+                 offpeak_hours: Optional[Tuple[int, int]] = OFFPEAK_HOURS):
+        self.min_usage = min_usage
+        self.max_defer = max_defer
+        self.offpeak_hours = offpeak_hours
+
+    def is_offpeak(self, now: float) -> bool:
+        if self.offpeak_hours is None: return False
+        start, end = self.offpeak_hours
+        hour = datetime.fromtimestamp(now).hour
+        return start <= hour < end if start <= end else (hour >= start or hour < end)
+
+    def deferred_before(self, now: float) -> float:
+        """Keys first seen before it are ready whatever their usage."""
+        return now if self.is_offpeak(now) else now - self.max_defer
+
+#####################################################################################
+#                                   Queue                                           #
+#####################################################################################
+
+def enqueue(cursor: sqlite3.Cursor, kind: ClassificationKind, key: str, now: Optional[float] = None) -> bool:
+    """Returns False if the key already has a job."""
+    now = time.time() if now is None else now
+    cursor.execute("""--sql
+    INSERT OR IGNORE INTO ClassificationQueue (Kind, Key, NextAttempt, EnqueuedAt) VALUES (?, ?, ?, ?)
+    """, (kind, key, now, now))
+    return cursor.rowcount == 1
+
+def enqueue_app(cursor: sqlite3.Cursor, app_id: str, now: Optional[float] = None) -> bool:
+    """Enqueues the app only if it has no Category yet."""
+    now = time.time() if now is None else now
+    cursor.execute("""--sql
+    INSERT OR IGNORE INTO ClassificationQueue (Kind, Key, NextAttempt, EnqueuedAt)
+    SELECT 'app', AppId, ?, ? FROM Apps WHERE AppId = ? AND Category IS NULL
+    """, (now, now, app_id))
+    return cursor.rowcount == 1
+
+def enqueue_baseurl(cursor: sqlite3.Cursor, baseURL: str, now: Optional[float] = None) -> bool:
+    """Enqueues the baseURL only if it has no Category yet."""
+    now = time.time() if now is None else now
+    cursor.execute("""--sql
+    INSERT OR IGNORE INTO ClassificationQueue (Kind, Key, NextAttempt, EnqueuedAt)
+    SELECT 'url', baseURL, ?, ? FROM BaseURLs WHERE baseURL = ? AND Category IS NULL
+    """, (now, now, baseURL))
+    return cursor.rowcount == 1
+
+def claim(cursor: sqlite3.Cursor, limit: int, now: Optional[float] = None, lease: float = LEASE,
+          priority: Optional[UsagePriority] = None) -> List[IFetchClassificationJob]:
+    """
+    Marks up to limit ready jobs (and abandoned running ones) as running and returns them.
+    With a priority, the most used keys come first and jobs it defers are left pending.
+    """
+    now = time.time() if now is None else now
+    min_usage, deferred_before = (priority.min_usage, priority.deferred_before(now)) if priority else (0.0, now)
+    cursor.execute(f"""--sql
+    UPDATE ClassificationQueue
+    SET Status = 'running', StartedAt = ?, Attempts = Attempts + 1
+    WHERE JobId IN (
+        SELECT JobId FROM (
+            SELECT JobId, Status, NextAttempt, EnqueuedAt, {usage_sql()} AS Usage FROM ClassificationQueue
+            WHERE (Status = 'pending' AND NextAttempt <= ?) OR (Status = 'running' AND StartedAt <= ?)
+        )
+        WHERE Status = 'running' OR Usage >= ? OR EnqueuedAt <= ?
+        ORDER BY Usage DESC, NextAttempt
+        LIMIT ?
+    )
+    RETURNING *
+    """, (now, now, now - lease, min_usage, deferred_before, limit))
+    return [IFetchClassificationJob(**row) for row in cursor.fetchall()]
+
+def complete(cursor: sqlite3.Cursor, job: IFetchClassificationJob, category: str, now: Optional[float] = None) -> None:
+    """Applies the category (never over a Category set in the meantime) and marks the job done."""
+    now = time.time() if now is None else now
+    cursor.execute("""--sql
+    INSERT OR IGNORE INTO Categories (Category, BlockId) VALUES (?, NULL)
+    """, (category, ))
+    if job['Kind'] == 'app':
+        cursor.execute("""--sql
+        UPDATE Apps SET Category = ? WHERE AppId = ? AND Category IS NULL
+        """, (category, job['Key']))
+    else:
+        cursor.execute("""--sql
+        UPDATE BaseURLs SET Category = ? WHERE baseURL = ? AND Category IS NULL
+        """, (category, job['Key']))
+    cursor.execute("""--sql
+    UPDATE ClassificationQueue SET Status = 'done', Result = ?, LastError = NULL, FinishedAt = ? WHERE JobId = ?
+    """, (category, now, job['JobId']))
+
+def fail(cursor: sqlite3.Cursor, job: IFetchClassificationJob, error: str, now: Optional[float] = None,
+         max_attempts: int = MAX_ATTEMPTS, backoff_base: float = BACKOFF_BASE, backoff_max: float = BACKOFF_MAX) -> str:
+    """Reschedules the job with exponential backoff, or dead-letters it. Returns the new status."""
+    now = time.time() if now is None else now
+    if job['Attempts'] >= max_attempts:
+        cursor.execute("""--sql
+        UPDATE ClassificationQueue SET Status = 'dead', LastError = ?, FinishedAt = ? WHERE JobId = ?
+        """, (error, now, job['JobId']))
+        return 'dead'
+    delay = min(backoff_max, backoff_base * 2 ** (job['Attempts'] - 1))
+    cursor.execute("""--sql
+    UPDATE ClassificationQueue SET Status = 'pending', LastError = ?, NextAttempt = ?, StartedAt = NULL WHERE JobId = ?
+    """, (error, now + delay, job['JobId']))
+    return 'pending'
+
+def retry_dead(cursor: sqlite3.Cursor, job_id: Optional[int] = None, now: Optional[float] = None) -> int:
+    """Moves dead-lettered jobs (all, or only job_id) back to pending with a fresh attempt budget."""
+    now = time.time() if now is None else now
+    cursor.execute(f"""--sql
+    UPDATE ClassificationQueue
+    SET Status = 'pending', Attempts = 0, NextAttempt = ?, StartedAt = NULL, FinishedAt = NULL
+    WHERE Status = 'dead' {"AND JobId = ?" if job_id is not None else ""}
+    """, (now, job_id) if job_id is not None else (now, ))
+    return cursor.rowcount
+
+def dead_letters(cursor: sqlite3.Cursor, limit: int = 100) -> List[IFetchClassificationJob]:
+    cursor.execute("""--sql
+    SELECT * FROM ClassificationQueue WHERE Status = 'dead' ORDER BY FinishedAt DESC LIMIT ?
+    """, (limit, ))
+    return [IFetchClassificationJob(**row) for row in cursor.fetchall()]
+
+def metrics(cursor: sqlite3.Cursor, now: Optional[float] = None, priority: Optional[UsagePriority] = None) -> ClassificationQueueMetrics:
+    now = time.time() if now is None else now
+    cursor.execute("""--sql
+    SELECT Status, COUNT(*) AS count FROM ClassificationQueue GROUP BY Status
+    """)
+    counts: Dict[str, int] = {row['Status']: row['count'] for row in cursor.fetchall()}
+    cursor.execute("""--sql
+    SELECT
+        MIN(EnqueuedAt) AS oldest,
+        SUM(CASE WHEN NextAttempt <= ? THEN 1 ELSE 0 END) AS ready
+    FROM ClassificationQueue WHERE Status = 'pending'
+    """, (now, ))
+    row = cursor.fetchone()
+    oldest, ready = row['oldest'], row['ready'] or 0
+    cursor.execute("""--sql
+    SELECT FinishedAt - EnqueuedAt AS latency, Attempts FROM ClassificationQueue
+    WHERE Status = 'done' ORDER BY FinishedAt DESC LIMIT ?
+    """, (LATENCY_WINDOW, ))
+    rows = cursor.fetchall()
+    latencies = sorted(row['latency'] for row in rows)
+    deferred = 0
+    if priority is not None:
+        cursor.execute(f"""--sql
+        SELECT COUNT(*) AS count FROM ClassificationQueue
+        WHERE Status = 'pending' AND EnqueuedAt > ? AND {usage_sql()} < ?
+        """, (priority.deferred_before(now), priority.min_usage))
+        deferred = cursor.fetchone()['count']
+    return ClassificationQueueMetrics(
+        depth=counts.get('pending', 0),
+        ready=ready,
+        running=counts.get('running', 0),
+        done=counts.get('done', 0),
+        dead=counts.get('dead', 0),
+        oldest_pending_age=now - oldest if oldest is not None else None,
+        latency_avg=sum(latencies) / len(latencies) if latencies else None,
+        latency_p95=latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+        attempts_avg=sum(row['Attempts'] for row in rows) / len(rows) if rows else None,
+        deferred=deferred
+    )
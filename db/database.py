@@ -1,10 +1,11 @@
 import sqlite3
-from typing import Optional, Union
-from .models import IActivityEntry, IApp, IBaseUrl, IUrl
+import time
+from typing import Optional, Union, List
+from .models import IActivityEntry, IApp, IBaseUrl, IUrl, IResourceSample, RESOURCE_TIERS, RESOURCE_RETENTION
 from .models import IFetchActivityEntry, IFetchApp, IFetchBaseUrl, IFetchUrl
 from . import models
-from .helpers import get_baseurl, logger, get_url_info
-from ml import langchain_classification
+from .helpers import get_baseurl, logger
+from . import classification_queue, classification_cache, search
 from contextlib import contextmanager
 
 class NullCursor:
@@ -14,9 +15,9 @@ class NullCursor:
         raise RuntimeError(f"Cursor is None, Please Run inside with database.cursor_context() as cursor: ...")
     
 class DataBase:
-    def __init__(self, db_path: str, check_create_table: bool = True, check_same_thread: bool = False):
-        # Connect to SQLite database
-        self.conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+    def __init__(self, db_path: str, check_create_table: bool = True, check_same_thread: bool = False, uri: bool = False):
+        # Connect to SQLite database (db_path is a `file:` URI with uri=True, e.g. `?mode=ro`)
+        self.conn = sqlite3.connect(db_path, check_same_thread=check_same_thread, uri=uri)
         self.conn.row_factory = sqlite3.Row # Set row_factory to sqlite3.Row so that results are returned as dictionaries
         self.cursor: Union[sqlite3.Cursor, NullCursor] = NullCursor()
         with self.cursor_context() as cursor:
@@ -42,8 +43,15 @@ class DataBase:
         models.create_category(self.cursor)
         models.create_app(self.cursor)
         models.create_base_url(self.cursor)
+        models.create_url_fetch_state(self.cursor)
         models.create_url(self.cursor)
         models.create_activity(self.cursor)
+        models.create_resource_sample(self.cursor)
+        models.create_activity_rollup(self.cursor)
+        models.create_classification_queue(self.cursor)
+        models.create_classification_cache(self.cursor)
+        models.create_reclassification(self.cursor)
+        models.create_title_classification(self.cursor)
         
         models.create_goal(self.cursor)
         models.create_session(self.cursor)
@@ -53,6 +61,8 @@ class DataBase:
         models.create_note(self.cursor)
         models.create_notetag(self.cursor)
         models.create_notetagassignees(self.cursor)
+        search.create_search_index(self.cursor, 'Notes')
+        models.create_data_versions(self.cursor)
         
         models.create_block_in_goal(self.cursor)
         models.create_block_in_session(self.cursor)
@@ -61,54 +71,27 @@ class DataBase:
         self.conn.commit()
     
     def insert_baseurl(self, baseurl: IBaseUrl, commit: bool = True) -> None:
-        # Check if URL exists and whether it's fetched or not
         self.cursor.execute("""--sql
-        SELECT 
-            baseURL, Title, Description, is_fetched, icon_url, Timestamp
-        FROM BaseURLs WHERE baseURL = ?
-        LIMIT 1
+        SELECT baseURL, is_fetched FROM BaseURLs WHERE baseURL = ? LIMIT 1
         """, (
             baseurl['baseURL'],
         ))
-        existing_url: IFetchBaseUrl = self.cursor.fetchone()
-        
-        title: Optional[str] = None
-        desc: Optional[str] = None
-        favicon: Optional[str] = None
-        # feching info
-        if not existing_url or (existing_url and not existing_url['is_fetched']):
-            try:
-                urlinfo = get_url_info(url=baseurl['baseURL'])
-                title = urlinfo['title']
-                desc = urlinfo['description']
-                favicon = urlinfo['favicon_url']
-            except Exception as e:
-                logger.error(f"Error while Feching url info for {baseurl['baseURL']} ERROR: {e}")
-                
+        existing_url: Optional[sqlite3.Row] = self.cursor.fetchone()
         if existing_url is None:
+            # Title / Description / icon are fetched in the background (db/metadata_fetcher.py),
+            # which queues the classification once the metadata is there
             self.cursor.execute("""--sql
-            INSERT INTO BaseURLs (
-                baseURL, Title, Description, is_fetched, icon_url
-            ) VALUES (?, ?, ?, ?, ?)
+            INSERT INTO BaseURLs (baseURL, is_fetched) VALUES (?, FALSE)
             """, (
-               baseurl['baseURL'], title, desc, True, favicon
+               baseurl['baseURL'],
             ))
-        elif existing_url and not existing_url['is_fetched']:
-            self.cursor.execute("""--sql
-            REPLACE INTO BaseURLs (
-                baseURL, Title, Description, is_fetched, icon_url
-            ) VALUES (?, ?, ?, ?, ?)
-            """, (
-               baseurl['baseURL'], title, desc, True, favicon
-            ))
-            if commit: self.conn.commit()
-        try:
-            new_url_class = langchain_classification.clssify_new_url(self.cursor, self.conn, 
-                                                                     baseURL=baseurl['baseURL'], Title=baseurl['Title'], Description=baseurl['Description'], 
-                                                                     commit=False)
-            logger.info(msg=f"Url Classification report: {new_url_class} <= {baseurl['baseURL']}")
-        except Exception as e:
-            logger.error(msg=f"Url Classification error: {e} <= {baseurl['baseURL']}")
+            if category := classification_cache.apply(self.cursor, 'url', baseurl['baseURL']):
+                logger.info(msg=f"Url Classification cache hit: {category} <= {baseurl['baseURL']}")
+        elif existing_url['is_fetched']:
+            # classified later by the worker pool (ml/classification_worker.py), Category stays NULL until then
+            if classification_queue.enqueue_baseurl(self.cursor, baseURL=baseurl['baseURL']):
+                logger.info(msg=f"Url Classification queued <= {baseurl['baseURL']}")
+        if commit: self.conn.commit()
     
     def insert_url(self, url: IUrl, commit: bool = True) -> None:
         baseurl = get_baseurl(url['URL'])
@@ -145,13 +128,12 @@ class DataBase:
             app.get('InternalName'), app.get('LegalCopyright'), app.get('LegalTrademarks'), app.get('OriginalFilename'), 
             app.get('Comments'), app.get('PrivateBuild'), app.get('SpecialBuild')
         ))
-        try:
-            new_app_class = langchain_classification.classify_new_app(self.cursor, self.conn, 
-                                                                  app, 
-                                                                  commit=False)
-            logger.info(msg=f"App Classification report: {new_app_class} <= {app['AppId']}")
-        except Exception as e:
-            logger.error(msg=f"App Classification error: {e} <= {app['AppId']}")
+        # cached category of the same app (any version / install path), otherwise
+        # classified later by the worker pool (ml/classification_worker.py), Category stays NULL until then
+        if self.cursor.rowcount == 1 and (category := classification_cache.apply(self.cursor, 'app', app['AppId'])):
+            logger.info(msg=f"App Classification cache hit: {category} <= {app['AppId']}")
+        elif classification_queue.enqueue_app(self.cursor, app_id=app['AppId']):
+            logger.info(msg=f"App Classification queued <= {app['AppId']}")
         if commit: self.conn.commit()
         
     def insert_activity(self, activity: IActivityEntry, commit: bool = True) -> int:
@@ -188,4 +170,69 @@ class DataBase:
             activity=activity, EntryId=EntryId, commit=commit
         )
         return EntryId
-        
+
+    def insert_resource_samples(self, samples: List[IResourceSample], commit: bool = True) -> None:
+        """Accumulates samples into the finest tier (RESOURCE_TIERS[0])."""
+        resolution = RESOURCE_TIERS[0]
+        self.cursor.executemany("""--sql
+        INSERT INTO ResourceSamples (
+            AppId, Resolution, BucketStart, CpuTime, RssSum, RssMax, ReadBytes, WriteBytes, Samples
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (AppId, Resolution, BucketStart) DO UPDATE SET
+            CpuTime = CpuTime + excluded.CpuTime,
+            RssSum = RssSum + excluded.RssSum,
+            RssMax = MAX(RssMax, excluded.RssMax),
+            ReadBytes = ReadBytes + excluded.ReadBytes,
+            WriteBytes = WriteBytes + excluded.WriteBytes,
+            Samples = Samples + excluded.Samples
+        """, [(
+            sample['AppId'], resolution, sample['BucketStart'] - sample['BucketStart'] % resolution,
+            sample['CpuTime'], sample['RssSum'], sample['RssMax'],
+            sample['ReadBytes'], sample['WriteBytes'], sample['Samples']
+        ) for sample in samples])
+        if commit: self.conn.commit()
+
+    def downsample_resource_samples(self, now: Optional[float] = None, commit: bool = True) -> int:
+        """
+        Rolls buckets older than RESOURCE_RETENTION[tier] up into the next tier (1 min -> 1 hour -> 1 day),
+        returns the number of rolled up rows.
+        """
+        now = time.time() if now is None else now
+        rolled = 0
+        for fine, coarse in zip(RESOURCE_TIERS, RESOURCE_TIERS[1:]):
+            cutoff = int(now) - RESOURCE_RETENTION[fine]
+            self.cursor.execute("""--sql
+            INSERT INTO ResourceSamples (
+                AppId, Resolution, BucketStart, CpuTime, RssSum, RssMax, ReadBytes, WriteBytes, Samples
+            )
+            SELECT
+                AppId, ?, BucketStart - BucketStart % ?,
+                SUM(CpuTime), SUM(RssSum), MAX(RssMax), SUM(ReadBytes), SUM(WriteBytes), SUM(Samples)
+            FROM ResourceSamples
+            WHERE Resolution = ? AND BucketStart + ? <= ?
+            GROUP BY AppId, BucketStart - BucketStart % ?
+            ON CONFLICT (AppId, Resolution, BucketStart) DO UPDATE SET
+                CpuTime = CpuTime + excluded.CpuTime,
+                RssSum = RssSum + excluded.RssSum,
+                RssMax = MAX(RssMax, excluded.RssMax),
+                ReadBytes = ReadBytes + excluded.ReadBytes,
+                WriteBytes = WriteBytes + excluded.WriteBytes,
+                Samples = Samples + excluded.Samples
+            """, (coarse, coarse, fine, fine, cutoff, coarse))
+            self.cursor.execute("""--sql
+            DELETE FROM ResourceSamples WHERE Resolution = ? AND BucketStart + ? <= ?
+            """, (fine, fine, cutoff))
+            rolled += self.cursor.rowcount
+        if commit: self.conn.commit()
+        return rolled
+
+    def search_notes(self, query: str, limit: int, since: Optional[str] = None, until: Optional[str] = None) -> List[search.SearchHit]:
+        """Best `limit` notes for the FTS5 `query` (see db.search.match_query), best first."""
+        return search.search_notes(self.cursor, query, limit, since=since, until=until)
+
+    def rebuild_search_index(self, commit: bool = True) -> None:
+        search.rebuild_search_index(self.cursor, 'Notes')
+        if commit: self.conn.commit()
+
+    def get_search_status(self) -> List[search.SearchIndexStatus]:
+        return search.index_status(self.cursor, ('Notes', ))
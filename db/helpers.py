@@ -3,10 +3,14 @@
 import os
 import shutil
 import logging
+import threading
+from collections import OrderedDict
 from .constants import loglevel
-from typing import TypedDict, Optional, List, Literal, Dict, NewType
+from typing import TypedDict, Optional, List, Literal, Dict, NewType, Generic, TypeVar, Hashable, Any
 import requests
-from bs4 import BeautifulSoup
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
 
 def encode_weekdays(weekdays: List[Literal['sunday', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday']]):
     # mapping of weekdays to their binary positions (0 to 6)
@@ -54,6 +58,7 @@ def get_url_info(url: str) -> UrlInfo:
     # TODO: use playwright's firefox.launch(headless=True) as some site render everything through js :-( ;for example chat.openai.com
     # as url is a baseurl we have to add back protocol...
     # Notice: it may raises error if url is not valid (url is any random str)
+    from bs4 import BeautifulSoup # only this legacy path parses whole pages, keep it off the import of db
     if not url.startswith('https://') or url.startswith('http://'):
         url = f'https://{url}'
     try:
@@ -107,6 +112,81 @@ def get_url_info(url: str) -> UrlInfo:
         favicon_url=favicon_url
     )
 
+class CacheStats(TypedDict):
+    size: int
+    maxsize: int
+    hits: int
+    misses: int
+    evictions: int
+    hit_rate: float
+
+_MISSING: Any = object()
+
+class LRUCache(Generic[K, V]):
+    """
+    A small thread-safe least-recently-used cache with hit/miss/eviction counters.
+    """
+    def __init__(self, maxsize: int = 128):
+        assert maxsize > 0, "maxsize must be positive integer"
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[K, V]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        """
+        Returns the cached value for key (marking it as recently used) or default.
+        """
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: K, value: V) -> None:
+        """
+        Stores value under key, evicting the least recently used entry if the cache is full.
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __contains__(self, key: K) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> CacheStats:
+        total = self.hits + self.misses
+        return CacheStats(
+            size=len(self._data),
+            maxsize=self.maxsize,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            hit_rate=self.hits / total if total else 0.0
+        )
+
 class Path(str):
     """
     A class that extends the functionality of a string to handle file system paths.
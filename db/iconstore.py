@@ -0,0 +1,152 @@
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+from typing import TypedDict, Optional, List, Dict, Iterable, Tuple
+from .helpers import Path, logger
+
+#####################################################################################
+#                                   IconBlob                                        #
+#####################################################################################
+
+class IIconBlob(TypedDict):
+    Hash: str # Primary Key, sha256 of Data
+    Data: bytes
+    Size: int
+class IFetchIconBlob(IIconBlob):
+    Timestamp: datetime
+
+def create_icon_blob(cursor: sqlite3.Cursor):
+    cursor.execute("""--sql
+    CREATE TABLE IF NOT EXISTS IconBlobs (
+        Hash TEXT PRIMARY KEY,
+        Data BLOB NOT NULL,
+        Size INTEGER NOT NULL,
+        Timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID
+    """)
+
+#####################################################################################
+#                                   IconName                                        #
+#####################################################################################
+
+class IIconName(TypedDict):
+    Name: str # Primary Key, `<base64 AppId>.png` or `<base64 AppId>.<size>.png`
+    Hash: str # Foreign Key
+class IFetchIconName(IIconName):
+    Timestamp: datetime
+
+def create_icon_name(cursor: sqlite3.Cursor):
+    cursor.execute("""--sql
+    CREATE TABLE IF NOT EXISTS IconNames (
+        Name TEXT PRIMARY KEY,
+        Hash TEXT NOT NULL,
+        Timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (Hash) REFERENCES IconBlobs (Hash)
+    ) WITHOUT ROWID
+    """)
+
+#####################################################################################
+#                                   IconStore                                       #
+#####################################################################################
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+class IconStore:
+    """
+    Content addressed icon pack: every distinct png is stored once in IconBlobs
+    (keyed by its sha256) and IconNames maps the file names the api serves to it.
+    Used from the tracker (writer) and the api (reader), so the database runs in WAL mode.
+    """
+    def __init__(self, db_path: str, check_same_thread: bool = False):
+        self.conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            create_icon_blob(cursor)
+            create_icon_name(cursor)
+            self.conn.commit()
+            cursor.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def put(self, name: str, data: bytes, commit: bool = True) -> Tuple[str, bool]:
+        """
+        Stores data under name, returns (hash, is_new_blob).
+        """
+        digest = content_hash(data)
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute("""--sql
+            INSERT OR IGNORE INTO IconBlobs (Hash, Data, Size) VALUES (?, ?, ?)
+            """, (digest, data, len(data)))
+            is_new = cursor.rowcount == 1
+            cursor.execute("""--sql
+            INSERT OR REPLACE INTO IconNames (Name, Hash) VALUES (?, ?)
+            """, (name, digest))
+            if commit: self.conn.commit()
+            cursor.close()
+        return digest, is_new
+
+    def commit(self) -> None:
+        with self.lock:
+            self.conn.commit()
+
+    def get_hash(self, name: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT Hash FROM IconNames WHERE Name = ?", (name,)).fetchone()
+        return row['Hash'] if row else None
+
+    def get_hashes(self, names: Iterable[str]) -> Dict[str, str]:
+        names = list(dict.fromkeys(names))
+        result: Dict[str, str] = {}
+        with self.lock:
+            for i in range(0, len(names), 500): # stay below SQLITE_MAX_VARIABLE_NUMBER
+                chunk = names[i:i+500]
+                rows = self.conn.execute(f"""--sql
+                SELECT Name, Hash FROM IconNames WHERE Name IN ({', '.join('?' for _ in chunk)})
+                """, chunk).fetchall()
+                result.update((row['Name'], row['Hash']) for row in rows)
+        return result
+
+    def get_blob(self, digest: str) -> Optional[bytes]:
+        with self.lock:
+            row = self.conn.execute("SELECT Data FROM IconBlobs WHERE Hash = ?", (digest,)).fetchone()
+        return row['Data'] if row else None
+
+    def get_blobs(self, digests: Iterable[str]) -> Dict[str, bytes]:
+        digests = list(dict.fromkeys(digests))
+        result: Dict[str, bytes] = {}
+        with self.lock:
+            for i in range(0, len(digests), 500):
+                chunk = digests[i:i+500]
+                rows = self.conn.execute(f"""--sql
+                SELECT Hash, Data FROM IconBlobs WHERE Hash IN ({', '.join('?' for _ in chunk)})
+                """, chunk).fetchall()
+                result.update((row['Hash'], row['Data']) for row in rows)
+        return result
+
+    def names(self) -> List[str]:
+        with self.lock:
+            return [row['Name'] for row in self.conn.execute("SELECT Name FROM IconNames").fetchall()]
+
+    def import_directory(self, icon_dir: Path) -> int:
+        """
+        Packs the legacy one-file-per-icon directory into the store (files already packed are skipped).
+        """
+        if not icon_dir.exists(): return 0
+        known = set(self.names())
+        imported = 0
+        for name in icon_dir.listdir():
+            if not name.endswith('.png') or name in known: continue
+            path = icon_dir.joinpath(name)
+            if not path.is_file(): continue
+            self.put(name, path.read_bytes(), commit=False)
+            imported += 1
+        self.commit()
+        if imported: logger.info(f"Imported {imported} icons from {icon_dir} into the icon store")
+        return imported
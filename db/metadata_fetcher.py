@@ -0,0 +1,288 @@
+import asyncio
+import codecs
+import sqlite3
+import time
+from html.parser import HTMLParser
+from threading import Thread, Event
+from typing import TypedDict, Optional, List, Dict, Tuple, Callable
+from urllib.parse import urljoin, urlsplit
+import httpx
+
+from .database import DataBase
+from .helpers import logger, UrlInfo
+from . import classification_queue
+from .classification_cache import registrable_domain, normalize_host
+
+#####################################################################################
+#                                   Constants                                       #
+#####################################################################################
+
+TIMEOUT = httpx.Timeout(5.0, connect=3.0)   # per network operation
+DEADLINE: float = 10.0                      # sec for a whole fetch, redirects and both schemes included
+MAX_BYTES: int = 256 * 1024                 # never read more of a page than this
+MAX_CONNECTIONS: int = 32
+CONCURRENCY: int = 16                       # fetches in flight
+PER_HOST: int = 2                           # fetches in flight per registrable domain
+BATCH_SIZE: int = 64
+RETRY_BASE: float = 60*5                    # sec, doubled after every failed fetch
+RETRY_MAX: float = 60*60*24*7
+USER_AGENT = "Mozilla/5.0 (compatible; Efficia/0.1; +https://github.com/thefcraft/Efficia)"
+
+#####################################################################################
+#                                   Types                                           #
+#####################################################################################
+
+class FetchError(Exception): ...
+
+class MetadataFetcherStats(TypedDict):
+    fetched: int
+    failed: int
+    pending: int        # not fetched yet and due
+    deferred: int       # due but held back by the usage priority
+    backing_off: int    # negative cache: failed recently, not fetched again before NextFetch
+    latency_avg: Optional[float] # sec per successful fetch
+
+FetchResult = Tuple[str, Optional[UrlInfo], Optional[str]] # baseURL, metadata, error
+
+#####################################################################################
+#                                   HeadParser                                      #
+#####################################################################################
+
+class HeadParser(HTMLParser):
+    """Incremental parser of the <head> only: title, description and icon, `done` once the body starts."""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.done = False
+        self.in_title = False
+        self.title_parts: List[str] = []
+        self.meta: Dict[str, str] = {}
+        self.icon: Optional[str] = None
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if self.done: return
+        attributes = {name.lower(): value or '' for name, value in attrs}
+        if tag == 'body': self.done = True
+        elif tag == 'title': self.in_title = True
+        elif tag == 'meta':
+            name = (attributes.get('name') or attributes.get('property') or '').lower()
+            if name and 'content' in attributes: self.meta.setdefault(name, attributes['content'])
+        elif tag == 'link' and self.icon is None and 'icon' in attributes.get('rel', '').lower().split() and attributes.get('href'):
+            self.icon = attributes['href']
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == 'title': self.in_title = False
+        elif tag == 'head': self.done = True
+
+    def handle_data(self, data: str) -> None:
+        if self.in_title and not self.done: self.title_parts.append(data)
+
+    def result(self, url: str) -> UrlInfo:
+        title = ' '.join(''.join(self.title_parts).split()) or self.meta.get('og:title') or self.meta.get('twitter:title')
+        description = self.meta.get('description') or self.meta.get('og:description') or self.meta.get('twitter:description')
+        origin = '{0.scheme}://{0.netloc}'.format(urlsplit(url))
+        return UrlInfo(
+            title=title or None,
+            description=description or None,
+            favicon_url=urljoin(url, self.icon) if self.icon else f"{origin}/favicon.ico"
+        )
+
+async def fetch_metadata(client: httpx.AsyncClient, baseURL: str, max_bytes: int = MAX_BYTES,
+                         schemes: Tuple[str, ...] = ('https', 'http')) -> UrlInfo:
+    """Streams the page until </head> (or max_bytes), https first and http if the connection fails."""
+    error: Optional[Exception] = None
+    for scheme in schemes:
+        try:
+            async with client.stream('GET', f"{scheme}://{baseURL}") as response:
+                if response.status_code >= 400: raise FetchError(f"HTTP {response.status_code}")
+                content_type = response.headers.get('content-type', 'text/html')
+                if 'html' not in content_type: raise FetchError(f"not html ({content_type})")
+                parser = HeadParser()
+                decoder = codecs.getincrementaldecoder(response.charset_encoding or 'utf-8')(errors='replace')
+                size = 0
+                async for chunk in response.aiter_bytes():
+                    chunk = chunk[:max_bytes - size]
+                    size += len(chunk)
+                    parser.feed(decoder.decode(chunk))
+                    if parser.done or size >= max_bytes: break
+                return parser.result(str(response.url))
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e: # includes ssl errors
+            error = e
+    assert error is not None
+    raise error
+
+#####################################################################################
+#                                   MetadataFetcher                                 #
+#####################################################################################
+
+class MetadataFetcher:
+    """
+    Fetches Title / Description / icon of new BaseURLs off the insert path, on an asyncio loop
+    in its own thread: one pooled httpx client, bounded global and per host concurrency, strict
+    timeouts and a response size cap. Failures go to the UrlFetchState negative cache and are
+    retried with exponential backoff. Every attempt queues the classification of the baseURL.
+    With a `priority`, the most used sites are fetched first and one-off visits are deferred.
+    """
+    def __init__(self, db_path: str, concurrency: int = CONCURRENCY, per_host: int = PER_HOST, batch_size: int = BATCH_SIZE,
+                 timeout: httpx.Timeout = TIMEOUT, deadline: float = DEADLINE, max_bytes: int = MAX_BYTES,
+                 retry_base: float = RETRY_BASE, retry_max: float = RETRY_MAX, poll_interval: float = 30.0,
+                 on_fetched: Optional[Callable[[], None]] = None, schemes: Tuple[str, ...] = ('https', 'http'),
+                 priority: Optional[classification_queue.UsagePriority] = None):
+        self.db_path = db_path
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_bytes = max_bytes
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.poll_interval = poll_interval
+        self.on_fetched = on_fetched
+        self.schemes = schemes
+        self.priority = priority
+
+        self.wakeup = Event()
+        self.stop_event = Event()
+        self.thread: Optional[Thread] = None
+        self.database: Optional[DataBase] = None
+        self.fetched, self.failed, self.fetch_time = 0, 0, 0.0
+
+    def notify(self) -> None:
+        self.wakeup.set()
+
+    def make_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS // 2),
+            follow_redirects=True,
+            headers={'User-Agent': USER_AGENT, 'Accept': 'text/html,application/xhtml+xml'}
+        )
+
+    def priority_args(self, now: float) -> Tuple[float, float]:
+        """min usage and first-seen cutoff of the ready baseURLs."""
+        if self.priority is None: return 0.0, now
+        return self.priority.min_usage, self.priority.deferred_before(now)
+
+    def due(self, cursor: sqlite3.Cursor, now: float) -> List[str]:
+        cursor.execute(f"""--sql
+        SELECT baseURL FROM (
+            SELECT b.baseURL, s.NextFetch, (julianday(b.Timestamp) - 2440587.5) * 86400.0 AS FirstSeen,
+                {classification_queue.URL_USAGE.format(key='b.baseURL')} AS Usage
+            FROM BaseURLs AS b
+            LEFT JOIN UrlFetchState AS s ON s.baseURL = b.baseURL
+            WHERE NOT b.is_fetched AND (s.NextFetch IS NULL OR s.NextFetch <= ?)
+        )
+        WHERE Usage >= ? OR FirstSeen <= ?
+        ORDER BY Usage DESC, NextFetch IS NOT NULL, NextFetch
+        LIMIT ?
+        """, (now, *self.priority_args(now), self.batch_size))
+        return [row['baseURL'] for row in cursor.fetchall()]
+
+    async def fetch_all(self, client: httpx.AsyncClient, baseURLs: List[str]) -> List[FetchResult]:
+        limit = asyncio.Semaphore(self.concurrency)
+        hosts: Dict[str, asyncio.Semaphore] = {}
+        async def fetch(baseURL: str) -> FetchResult:
+            host = hosts.setdefault(registrable_domain(normalize_host(baseURL)), asyncio.Semaphore(self.per_host))
+            async with host, limit: # a slot of `limit` is only held by a fetch its host lets through
+                start = time.perf_counter()
+                try:
+                    info = await asyncio.wait_for(fetch_metadata(client, baseURL, max_bytes=self.max_bytes, schemes=self.schemes), self.deadline)
+                except Exception as e:
+                    return baseURL, None, (f"{type(e).__name__}: {e}" if str(e) else type(e).__name__)
+                self.fetch_time += time.perf_counter() - start
+                return baseURL, info, None
+        return await asyncio.gather(*(fetch(baseURL) for baseURL in baseURLs))
+
+    def apply(self, cursor: sqlite3.Cursor, results: List[FetchResult], now: float) -> None:
+        for baseURL, info, error in results:
+            if info is not None:
+                cursor.execute("""--sql
+                UPDATE BaseURLs SET Title = ?, Description = ?, icon_url = ?, is_fetched = TRUE WHERE baseURL = ?
+                """, (info['title'], info['description'], info['favicon_url'], baseURL))
+                cursor.execute("DELETE FROM UrlFetchState WHERE baseURL = ?", (baseURL, ))
+                self.fetched += 1
+            else:
+                cursor.execute("SELECT Attempts FROM UrlFetchState WHERE baseURL = ?", (baseURL, ))
+                row = cursor.fetchone()
+                attempts = (row['Attempts'] if row else 0) + 1
+                cursor.execute("""--sql
+                INSERT OR REPLACE INTO UrlFetchState (baseURL, Attempts, NextFetch, LastError, LastAttempt) VALUES (?, ?, ?, ?, ?)
+                """, (baseURL, attempts, now + min(self.retry_max, self.retry_base * 2 ** (attempts - 1)), error, now))
+                self.failed += 1
+                logger.error(msg=f"Metadata fetch failed ({attempts}): {error} <= {baseURL}")
+            # classify with whatever is known now, a later successful fetch does not reclassify
+            classification_queue.enqueue_baseurl(cursor, baseURL=baseURL, now=now)
+
+    async def run_once(self, client: httpx.AsyncClient, now: Optional[float] = None) -> int:
+        """Fetches one batch of due baseURLs, returns how many were attempted."""
+        assert self.database is not None, "call open() first"
+        now = time.time() if now is None else now
+        with self.database.cursor_context() as cursor:
+            baseURLs = self.due(cursor, now)
+        if not baseURLs: return 0
+        results = await self.fetch_all(client, baseURLs)
+        with self.database.cursor_context() as cursor:
+            self.apply(cursor, results, now)
+            self.database.commit()
+        if self.on_fetched is not None: self.on_fetched()
+        return len(baseURLs)
+
+    def stats(self, cursor: sqlite3.Cursor, now: Optional[float] = None) -> MetadataFetcherStats:
+        now = time.time() if now is None else now
+        min_usage, deferred_before = self.priority_args(now)
+        cursor.execute(f"""--sql
+        SELECT
+            SUM(CASE WHEN s.NextFetch IS NULL OR s.NextFetch <= ? THEN 1 ELSE 0 END) AS pending,
+            SUM(CASE WHEN s.NextFetch > ? THEN 1 ELSE 0 END) AS backing_off,
+            SUM(CASE WHEN (s.NextFetch IS NULL OR s.NextFetch <= ?)
+                AND (julianday(b.Timestamp) - 2440587.5) * 86400.0 > ?
+                AND {classification_queue.URL_USAGE.format(key='b.baseURL')} < ? THEN 1 ELSE 0 END) AS deferred
+        FROM BaseURLs AS b LEFT JOIN UrlFetchState AS s ON s.baseURL = b.baseURL
+        WHERE NOT b.is_fetched
+        """, (now, now, now, deferred_before, min_usage))
+        row = cursor.fetchone()
+        return MetadataFetcherStats(
+            fetched=self.fetched,
+            failed=self.failed,
+            pending=row['pending'] or 0,
+            backing_off=row['backing_off'] or 0,
+            deferred=row['deferred'] or 0,
+            latency_avg=self.fetch_time / self.fetched if self.fetched else None
+        )
+
+    def open(self) -> None:
+        if self.database is None:
+            self.database = DataBase(db_path=self.db_path, check_create_table=False, check_same_thread=False)
+
+    def close(self) -> None:
+        if self.database is not None: self.database.close()
+        self.database = None
+
+    async def _main(self) -> None:
+        async with self.make_client() as client:
+            while not self.stop_event.is_set():
+                try:
+                    if await self.run_once(client): continue # keep draining
+                except Exception as e:
+                    logger.error(msg=f"Metadata fetcher error: {e}")
+                await asyncio.to_thread(self.wakeup.wait, self.poll_interval)
+                self.wakeup.clear()
+
+    def _run(self) -> None:
+        self.open()
+        try:
+            asyncio.run(self._main())
+        finally:
+            self.close()
+
+    def start(self) -> None:
+        if self.thread is not None and self.thread.is_alive(): return
+        self.stop_event.clear()
+        self.thread = Thread(target=self._run, name="MetadataFetcher", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread is not None: self.thread.join()
+        self.thread = None
@@ -1,4 +1,4 @@
-from typing import TypedDict, Optional
+from typing import TypedDict, Optional, Literal
 from sqlite3 import Cursor
 from datetime import datetime, time
 
@@ -136,9 +136,111 @@ def create_activity(cursor: Cursor):
         FOREIGN KEY (URL) REFERENCES URLs (URL)
     )
     """)
+    # usage per app / url, ranks the classification queue and the metadata fetches (db/classification_queue.py)
+    cursor.execute("""--sql
+    CREATE INDEX IF NOT EXISTS idx_activity_entries_app ON ActivityEntries (AppId)
+    """)
+    cursor.execute("""--sql
+    CREATE INDEX IF NOT EXISTS idx_activity_entries_url ON ActivityEntries (URL)
+    """)
+    cursor.execute("""--sql
+    CREATE INDEX IF NOT EXISTS idx_activity_entries_endtime ON ActivityEntries (EndTime)
+    """)
     
     
     
+#####################################################################################
+#                              ResourceSample                                       #
+#####################################################################################
+
+RESOURCE_TIERS = (60, 60*60, 60*60*24)   # 1 min -> 1 hour -> 1 day buckets
+RESOURCE_RETENTION = {                   # age (sec) after which a bucket is rolled up into the next tier
+    60: 60*60*24,
+    60*60: 60*60*24*30,
+}
+
+class IResourceSample(TypedDict):
+    AppId: str # Foreign Key
+    BucketStart: int # unix time (sec), multiple of Resolution
+    CpuTime: float # cpu seconds (user + system) consumed by the app during the bucket
+    RssSum: int # sum of the sampled rss (bytes), RssSum / Samples is the average
+    RssMax: int
+    ReadBytes: int
+    WriteBytes: int
+    Samples: int
+class IFetchResourceSample(IResourceSample):
+    Resolution: int # one of RESOURCE_TIERS
+
+def create_resource_sample(cursor: Cursor):
+    # Each sample lives in exactly one tier, so totals over a range are a plain SUM across tiers
+    cursor.execute("""--sql
+    CREATE TABLE IF NOT EXISTS ResourceSamples (
+        AppId TEXT NOT NULL,
+        Resolution INTEGER NOT NULL,
+        BucketStart INTEGER NOT NULL,
+        CpuTime REAL NOT NULL DEFAULT 0,
+        RssSum INTEGER NOT NULL DEFAULT 0,
+        RssMax INTEGER NOT NULL DEFAULT 0,
+        ReadBytes INTEGER NOT NULL DEFAULT 0,
+        WriteBytes INTEGER NOT NULL DEFAULT 0,
+        Samples INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (AppId, Resolution, BucketStart) -- no FOREIGN KEY: every process is sampled, not only the tracked apps
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("""--sql
+    CREATE INDEX IF NOT EXISTS idx_resource_samples_bucket ON ResourceSamples (Resolution, BucketStart)
+    """)
+
+#####################################################################################
+#                              ActivityRollup                                       #
+#####################################################################################
+
+class IActivityRollup(TypedDict):
+    Day: str # YYYY-MM-DD (utc, like EndTime)
+    AppId: str
+    baseURL: str # '' for entries without a URL
+    Duration: float # sec, every entry
+    ActiveDuration: float # sec, entries with IsActive
+    Entries: int
+
+def create_activity_rollup(cursor: Cursor):
+    # ActivityEntries summed per day, app and site, for the days that are over (db/activity_rollup.py)
+    cursor.execute("""--sql
+    CREATE TABLE IF NOT EXISTS ActivityRollups (
+        Day TEXT NOT NULL,
+        AppId TEXT NOT NULL,
+        baseURL TEXT NOT NULL DEFAULT '',
+        Duration REAL NOT NULL DEFAULT 0,
+        ActiveDuration REAL NOT NULL DEFAULT 0,
+        Entries INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (Day, AppId, baseURL)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("""--sql
+    CREATE INDEX IF NOT EXISTS idx_activity_rollups_baseurl ON ActivityRollups (baseURL, Day)
+    """)
+
+VERSIONED_TABLES = ('ActivityEntries', 'Todos')
+
+def create_data_versions(cursor: Cursor):
+    # Bumped by every write of the table, a cached result of a read of it is valid while its version is
+    cursor.execute("""--sql
+    CREATE TABLE IF NOT EXISTS DataVersions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    """)
+    for table in VERSIONED_TABLES:
+        cursor.execute("INSERT OR IGNORE INTO DataVersions (name) VALUES (?)", (table, ))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f"""--sql
+            CREATE TRIGGER IF NOT EXISTS {table}Version{event.title()} AFTER {event} ON {table} BEGIN
+                UPDATE DataVersions SET version = version + 1 WHERE name = '{table}';
+            END
+            """)
+
+    
+    
 #####################################################################################
 #                                   Url                                             #
 #####################################################################################
@@ -158,7 +260,10 @@ def create_url(cursor: Cursor):
         Timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (baseURL) REFERENCES BaseURLs (baseURL)
     )
-    """)    
+    """)
+    cursor.execute("""--sql
+    CREATE INDEX IF NOT EXISTS idx_urls_baseurl ON URLs (baseURL)
+    """)
     
     
     
@@ -194,6 +299,225 @@ def create_base_url(cursor: Cursor):
     )
     """)    
 
+class IUrlFetchState(TypedDict):
+    baseURL: str # Primary Key
+    Attempts: int # consecutive failed fetches
+    NextFetch: float # unix time, not fetched again before it (negative cache)
+    LastError: Optional[str]
+    LastAttempt: float
+
+def create_url_fetch_state(cursor: Cursor):
+    # Failed metadata fetches of BaseURLs (db/metadata_fetcher.py), removed once a fetch succeeds
+    cursor.execute("""--sql
+    CREATE TABLE IF NOT EXISTS UrlFetchState (
+        baseURL TEXT PRIMARY KEY,
+        Attempts INTEGER NOT NULL DEFAULT 0,
+        NextFetch REAL NOT NULL,
+        LastError TEXT,
+        LastAttempt REAL NOT NULL,
+        FOREIGN KEY (baseURL) REFERENCES BaseURLs (baseURL)
+    ) WITHOUT ROWID
+    """)
+
+
+#####################################################################################
+#                           ClassificationQueue                                     #
+#####################################################################################
+
+ClassificationKind = Literal['app', 'url']
+ClassificationStatus = Literal['pending', 'running', 'done', 'dead']
+
+class IClassificationJob(TypedDict):
+    Kind: ClassificationKind
+    Key: str # AppId or baseURL
+class IFetchClassificationJob(IClassificationJob):
+    JobId: int # Primary Key
+    Status: ClassificationStatus
+    Attempts: int
+    NextAttempt: float # unix time, pending jobs are not claimed before it
+    LastError: Optional[str]
+    Result: Optional[str] # Category
+    EnqueuedAt: float
+    StartedAt: Optional[float]
+    FinishedAt: Optional[float]
+
+def create_classification_queue(cursor: Cursor):
+    # Persistent work queue of the classification worker pool (ml/classification_worker.py)
+    cursor.execute("""--sql
+    CREATE TABLE IF NOT EXISTS ClassificationQueue (
+        JobId INTEGER PRIMARY KEY AUTOINCREMENT,
+        Kind TEXT NOT NULL,
+        Key TEXT NOT NULL,
+        Status TEXT NOT NULL DEFAULT 'pending',
+        Attempts INTEGER NOT NULL DEFAULT 0,
+        NextAttempt REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+        LastError TEXT,
+        Result TEXT,
+        EnqueuedAt REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+        StartedAt REAL,
+        FinishedAt REAL,
+        UNIQUE (Kind, Key)
+    )
+    """)
+    cursor.execute("""--sql
+    CREATE INDEX IF NOT EXISTS idx_classification_queue_status ON ClassificationQueue (Status, NextAttempt)
+    """)
+
+
+#####################################################################################
+#                           ClassificationCache                                     #
+#####################################################################################
+
+ClassificationSource = Literal['user', 'llm', 'local', 'import']
+
+class IClassificationCacheEntry(TypedDict):
+    CacheKey: str # 'url:<host or registrable domain>' or 'app:<product>|<exe>' (see db/classification_cache.py)
+    Category: str
+    Source: ClassificationSource
+    ExpiresAt: Optional[float] # unix time, NULL never expires
+class IFetchClassificationCacheEntry(IClassificationCacheEntry):
+    Hits: int
+    CreatedAt: float
+    LastHitAt: Optional[float]
+
+def create_classification_cache(cursor: Cursor):
+    # Category per normalized key, shared by every app / baseURL mapping to it and exportable to other databases
+    cursor.execute("""--sql
+    CREATE TABLE IF NOT EXISTS ClassificationCache (
+        CacheKey TEXT PRIMARY KEY,
+        Category TEXT NOT NULL,
+        Source TEXT NOT NULL,
+        Hits INTEGER NOT NULL DEFAULT 0,
+        CreatedAt REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+        LastHitAt REAL,
+        ExpiresAt REAL
+    ) WITHOUT ROWID
+    """)
+
+
+#####################################################################################
+#                           Reclassification                                        #
+#####################################################################################
+
+ReclassificationScope = Literal['all', 'uncategorized', 'category']
+ReclassificationStatus = Literal['running', 'done', 'cancelled', 'failed', 'applied']
+
+class IReclassificationRun(TypedDict):
+    Scope: ReclassificationScope
+    Category: Optional[str] # selected category when Scope = 'category'
+    Kinds: str # 'app', 'url' or 'app,url'
+    DryRun: bool
+    IncludeManual: bool # also reclassify items whose category was chosen by the user
+class IFetchReclassificationRun(IReclassificationRun):
+    RunId: int # Primary Key
+    Status: ReclassificationStatus
+    Total: int
+    Processed: int
+    Changed: int
+    Failed: int
+    Error: Optional[str]
+    CreatedAt: float
+    FinishedAt: Optional[float]
+
+class IReclassificationChange(TypedDict):
+    RunId: int
+    Kind: ClassificationKind
+    Key: str # AppId or baseURL
+    OldCategory: Optional[str]
+    NewCategory: str
+    Applied: bool
+
+def create_reclassification(cursor: Cursor):
+    # Bulk reclassification runs (ml/reclassification.py) and the category changes they found
+    cursor.execute("""--sql
+    CREATE TABLE IF NOT EXISTS ReclassificationRuns (
+        RunId INTEGER PRIMARY KEY AUTOINCREMENT,
+        Scope TEXT NOT NULL,
+        Category TEXT,
+        Kinds TEXT NOT NULL,
+        DryRun BOOLEAN NOT NULL,
+        IncludeManual BOOLEAN NOT NULL DEFAULT FALSE,
+        Status TEXT NOT NULL DEFAULT 'running',
+        Total INTEGER NOT NULL DEFAULT 0,
+        Processed INTEGER NOT NULL DEFAULT 0,
+        Changed INTEGER NOT NULL DEFAULT 0,
+        Failed INTEGER NOT NULL DEFAULT 0,
+        Error TEXT,
+        CreatedAt REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+        FinishedAt REAL
+    )
+    """)
+    cursor.execute("""--sql
+    CREATE TABLE IF NOT EXISTS ReclassificationChanges (
+        RunId INTEGER NOT NULL,
+        Kind TEXT NOT NULL,
+        Key TEXT NOT NULL,
+        OldCategory TEXT,
+        NewCategory TEXT NOT NULL,
+        Applied BOOLEAN NOT NULL DEFAULT FALSE,
+        PRIMARY KEY (RunId, Kind, Key),
+        FOREIGN KEY (RunId) REFERENCES ReclassificationRuns (RunId) ON DELETE CASCADE
+    ) WITHOUT ROWID
+    """)
+
+
+#####################################################################################
+#                           TitleClassification                                     #
+#####################################################################################
+
+TitleSource = Literal['user', 'llm', 'keyword', 'local', 'pending'] # pending: ambiguous, waiting for the LLM
+
+class IActivityTitleCategory(TypedDict):
+    EntryId: int # Primary Key, Foreign Key
+    TitleKey: str # scope (registrable domain) | normalized title
+    Category: Optional[str] # NULL while pending
+    Source: TitleSource
+    Confidence: Optional[float]
+
+class ITitleCacheEntry(TypedDict):
+    TitleKey: str # Primary Key
+    Category: str
+    Source: TitleSource
+class IFetchTitleCacheEntry(ITitleCacheEntry):
+    Confidence: Optional[float]
+    Hits: int
+    CreatedAt: float
+
+def create_title_classification(cursor: Cursor):
+    # Category of a browser tab title, per ActivityEntry (ml/title_classifier.py)
+    cursor.execute("""--sql
+    CREATE TABLE IF NOT EXISTS ActivityTitleCategories (
+        EntryId INTEGER PRIMARY KEY,
+        TitleKey TEXT NOT NULL,
+        Category TEXT,
+        Source TEXT NOT NULL,
+        Confidence REAL,
+        FOREIGN KEY (EntryId) REFERENCES ActivityEntries (EntryId),
+        FOREIGN KEY (Category) REFERENCES Categories (Category)
+    )
+    """)
+    cursor.execute("""--sql
+    CREATE INDEX IF NOT EXISTS idx_activity_title_categories_key ON ActivityTitleCategories (TitleKey)
+    """)
+    cursor.execute("""--sql
+    CREATE TABLE IF NOT EXISTS TitleCache (
+        TitleKey TEXT PRIMARY KEY,
+        Category TEXT NOT NULL,
+        Source TEXT NOT NULL,
+        Confidence REAL,
+        Hits INTEGER NOT NULL DEFAULT 0,
+        CreatedAt REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("""--sql
+    CREATE TABLE IF NOT EXISTS TitleAttempts (
+        TitleKey TEXT PRIMARY KEY,
+        Attempts INTEGER NOT NULL,
+        NextAttempt REAL, -- NULL: given up, the entries of the title keep the category of their site / app
+        LastError TEXT
+    ) WITHOUT ROWID
+    """)
+
 
 #####################################################################################
 #                               Goal                                                #
@@ -271,6 +595,7 @@ def create_todo(cursor: Cursor):
         FOREIGN KEY (GoalId) REFERENCES Goals (GoalId)
     )
     """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_todos_due ON Todos (completed, duedate)") # open todos by due date
     
 
 #####################################################################################
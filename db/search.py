@@ -0,0 +1,326 @@
+"""
+Full-text search (SQLite FTS5) over chat messages and titles (chatbot database) and notes (main
+database). Every index is an external content table kept in sync by triggers, so the text is
+stored once. Rows that existed before their index are indexed in batches (`index_pending`, run
+by `SearchIndexer`), and a rebuild only clears the index and marks every row pending again:
+neither ever blocks the database for a whole table.
+"""
+import re
+import sqlite3
+from threading import Event, Thread
+from typing import TypedDict, NamedTuple, Optional, List, Dict, Tuple, Literal, Iterable
+from .helpers import logger
+
+#####################################################################################
+#                                   Constants                                       #
+#####################################################################################
+
+BATCH: int = 2000               # rows indexed per transaction of a backfill / rebuild
+PAUSE: float = 0.05             # sec between two batches, writes of the app go in between
+SNIPPET_TOKENS: int = 16        # tokens around the match in a snippet
+CANDIDATES: int = 5000          # newest matches ranked by a search (all of them unless a word is in most rows)
+MARK: Tuple[str, str] = ('<mark>', '</mark>')
+ELLIPSIS: str = '…'
+TOKENIZE: str = "unicode61 remove_diacritics 2"
+PREFIX: str = "2 3"             # prefix indexes: `ab*`, `abc*` are index lookups, longer ones scan a term range
+
+#####################################################################################
+#                                   Types                                           #
+#####################################################################################
+
+class SearchIndex(NamedTuple):
+    table: str
+    rowid: str
+    columns: Tuple[str, ...]
+
+    @property
+    def fts(self) -> str:
+        return f"{self.table}Search"
+
+INDEXES: Dict[str, SearchIndex] = {
+    'Messages': SearchIndex('Messages', 'MessageId', ('content', )),   # chatbot database
+    'Chats': SearchIndex('Chats', 'ChatId', ('title', )),               # chatbot database
+    'Notes': SearchIndex('Notes', 'note_id', ('title', 'content')),     # main database
+}
+
+SearchKind = Literal['message', 'chat', 'note']
+
+class SearchHit(TypedDict):
+    kind: SearchKind
+    id: int                     # MessageId, ChatId or note_id
+    chat_id: Optional[int]
+    title: str                  # of the chat (messages, chats) or the note, highlighted for chats and notes
+    snippet: str                # matched text with the matches in MARK
+    role: Optional[str]         # message_by of a message
+    timestamp: str
+    score: float                # bm25, lower is better (comparable between kinds only roughly)
+
+class SearchIndexStatus(TypedDict):
+    name: str
+    pending: int                # rows not indexed yet (upper bound, deleted rows included)
+
+#####################################################################################
+#                                   Index                                           #
+#####################################################################################
+
+def create_search_state(cursor: sqlite3.Cursor) -> None:
+    # rows next_rowid..end_rowid existed before the index (or its rebuild) and are not indexed yet
+    cursor.execute("""--sql
+    CREATE TABLE IF NOT EXISTS SearchIndexState (
+        name TEXT PRIMARY KEY,
+        next_rowid INTEGER NOT NULL,
+        end_rowid INTEGER NOT NULL
+    )
+    """)
+
+def create_search_index(cursor: sqlite3.Cursor, name: str) -> None:
+    """The FTS table and its triggers; the rows there before the table are left to `index_pending`."""
+    index = INDEXES[name]
+    create_search_state(cursor)
+    columns = ', '.join(index.columns)
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (index.fts, ))
+    if cursor.fetchone() is None:
+        cursor.execute(f"""--sql
+        CREATE VIRTUAL TABLE {index.fts} USING fts5(
+            {columns}, content='{index.table}', content_rowid='{index.rowid}', tokenize='{TOKENIZE}', prefix='{PREFIX}'
+        )
+        """)
+        mark_pending(cursor, name)
+    # a row still pending is not in the index: it is neither removed from it nor added by an update
+    indexed = f"""NOT EXISTS (
+            SELECT 1 FROM SearchIndexState WHERE name = '{name}' AND old.{index.rowid} BETWEEN next_rowid AND end_rowid
+        )"""
+    old = ', '.join(f"old.{column}" for column in index.columns)
+    new = ', '.join(f"new.{column}" for column in index.columns)
+    cursor.execute(f"""--sql
+    CREATE TRIGGER IF NOT EXISTS {index.fts}Insert AFTER INSERT ON {index.table} BEGIN
+        INSERT INTO {index.fts} (rowid, {columns}) VALUES (new.{index.rowid}, {new});
+    END
+    """)
+    cursor.execute(f"""--sql
+    CREATE TRIGGER IF NOT EXISTS {index.fts}Delete AFTER DELETE ON {index.table} BEGIN
+        INSERT INTO {index.fts} ({index.fts}, rowid, {columns}) SELECT 'delete', old.{index.rowid}, {old} WHERE {indexed};
+    END
+    """)
+    cursor.execute(f"""--sql
+    CREATE TRIGGER IF NOT EXISTS {index.fts}Update AFTER UPDATE OF {columns} ON {index.table} BEGIN
+        INSERT INTO {index.fts} ({index.fts}, rowid, {columns}) SELECT 'delete', old.{index.rowid}, {old} WHERE {indexed};
+        INSERT INTO {index.fts} (rowid, {columns}) SELECT new.{index.rowid}, {new} WHERE {indexed};
+    END
+    """)
+
+def mark_pending(cursor: sqlite3.Cursor, name: str) -> None:
+    index = INDEXES[name]
+    cursor.execute(f"SELECT COALESCE(MAX({index.rowid}), 0) AS end_rowid FROM {index.table}")
+    cursor.execute("""--sql
+        INSERT INTO SearchIndexState (name, next_rowid, end_rowid) VALUES (?, 1, ?)
+        ON CONFLICT (name) DO UPDATE SET next_rowid = 1, end_rowid = excluded.end_rowid
+    """, (name, cursor.fetchone()['end_rowid']))
+
+def rebuild_search_index(cursor: sqlite3.Cursor, name: str) -> None:
+    """Empties the index and marks every row pending: the rebuild itself is the batched backfill."""
+    index = INDEXES[name]
+    cursor.execute(f"INSERT INTO {index.fts} ({index.fts}) VALUES ('delete-all')")
+    mark_pending(cursor, name)
+
+def index_pending(cursor: sqlite3.Cursor, name: str, batch: int = BATCH) -> int:
+    """
+    Indexes the next `batch` pending rowids (commit after it), returns how many rows were indexed:
+    0 only once nothing is pending, the batch starts at the next existing row (deleted rows leave gaps).
+    """
+    index = INDEXES[name]
+    cursor.execute("SELECT next_rowid, end_rowid FROM SearchIndexState WHERE name = ?", (name, ))
+    state = cursor.fetchone()
+    if state is None or state['next_rowid'] > state['end_rowid']: return 0
+    cursor.execute(f"SELECT MIN({index.rowid}) AS first FROM {index.table} WHERE {index.rowid} BETWEEN ? AND ?",
+                   (state['next_rowid'], state['end_rowid']))
+    first = cursor.fetchone()['first']
+    if first is None:
+        cursor.execute("UPDATE SearchIndexState SET next_rowid = ? WHERE name = ?", (state['end_rowid'] + 1, name))
+        return 0
+    last = min(state['end_rowid'], first + batch - 1)
+    columns = ', '.join(index.columns)
+    cursor.execute(f"""--sql
+        INSERT INTO {index.fts} (rowid, {columns})
+        SELECT {index.rowid}, {columns} FROM {index.table} WHERE {index.rowid} BETWEEN ? AND ?
+    """, (first, last))
+    indexed = cursor.rowcount
+    cursor.execute("UPDATE SearchIndexState SET next_rowid = ? WHERE name = ?", (last + 1, name))
+    return indexed
+
+def index_status(cursor: sqlite3.Cursor, names: Iterable[str]) -> List[SearchIndexStatus]:
+    cursor.execute("SELECT name, MAX(0, end_rowid - next_rowid + 1) AS pending FROM SearchIndexState")
+    pending = {row['name']: row['pending'] for row in cursor.fetchall()}
+    return [SearchIndexStatus(name=name, pending=pending.get(name, 0)) for name in names]
+
+#####################################################################################
+#                                   Queries                                         #
+#####################################################################################
+
+TERM = re.compile(r'"[^"]*"?|[^\s"]+')
+WORD = re.compile(r"\w")
+
+def match_query(text: str, prefix_last: bool = True) -> Optional[str]:
+    """
+    FTS5 query of what the user typed: every word must match, "quoted phrases" as a phrase, `word*`
+    as a prefix and the last word too (search as you type). Operators are not passed through, so no
+    input is a syntax error. None when there is no word to search.
+    """
+    terms: List[str] = []
+    open_word = False
+    for match in TERM.finditer(text):
+        term = match.group()
+        if term.startswith('"'):
+            phrase = term.strip('"')
+            if WORD.search(phrase): terms.append(f'"{phrase}"')
+            open_word = False
+            continue
+        word = term.rstrip('*')
+        if not WORD.search(word): continue
+        terms.append(f'"{word}"' + ('*' if term.endswith('*') else ''))
+        open_word = not term.endswith('*')
+    if not terms: return None
+    if prefix_last and open_word: terms[-1] += '*'
+    return ' '.join(terms)
+
+# FTS5 scores every match of `ORDER BY rank`: a word in most rows costs a scan of the whole index.
+# The matches come newest first (rowid order, no scoring) and only the newest CANDIDATES are ranked;
+# the snippets are made for the `limit` best only.
+
+def search_messages(cursor: sqlite3.Cursor, query: str, limit: int, chat_id: Optional[int] = None,
+                    role: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None) -> List[SearchHit]:
+    """Best `limit` messages for the FTS5 `query` (see match_query), in a chat / by a role / from `since` until `until`."""
+    cursor.execute("""--sql
+        WITH candidates AS (
+            SELECT s.rowid AS id, bm25(MessagesSearch) AS score
+            FROM MessagesSearch s
+            JOIN Messages m ON m.MessageId = s.rowid
+            WHERE MessagesSearch MATCH ?5
+                AND (?6 IS NULL OR m.ChatId = ?6) AND (?7 IS NULL OR m.message_by = ?7)
+                AND (?8 IS NULL OR m.Timestamp >= ?8) AND (?9 IS NULL OR m.Timestamp < ?9)
+            ORDER BY s.rowid DESC
+            LIMIT ?11
+        ), best AS (
+            SELECT id, score FROM candidates ORDER BY score LIMIT ?10
+        )
+        SELECT m.MessageId AS id, m.ChatId AS chat_id, c.title, m.message_by AS role, m.Timestamp AS timestamp,
+            snippet(MessagesSearch, 0, ?1, ?2, ?3, ?4) AS snippet, best.score
+        FROM best
+        JOIN MessagesSearch s ON s.rowid = best.id
+        JOIN Messages m ON m.MessageId = best.id
+        JOIN Chats c ON c.ChatId = m.ChatId
+        WHERE MessagesSearch MATCH ?5
+        ORDER BY best.score
+    """, (*MARK, ELLIPSIS, SNIPPET_TOKENS, query, chat_id, role, since, until, limit, CANDIDATES))
+    return [SearchHit(kind='message', **row) for row in map(dict, cursor.fetchall())]
+
+def search_chats(cursor: sqlite3.Cursor, query: str, limit: int, chat_id: Optional[int] = None,
+                 since: Optional[str] = None, until: Optional[str] = None) -> List[SearchHit]:
+    cursor.execute("""--sql
+        WITH candidates AS (
+            SELECT s.rowid AS id, bm25(ChatsSearch) AS score
+            FROM ChatsSearch s
+            JOIN Chats c ON c.ChatId = s.rowid
+            WHERE ChatsSearch MATCH ?3
+                AND (?4 IS NULL OR c.ChatId = ?4) AND (?5 IS NULL OR c.Timestamp >= ?5) AND (?6 IS NULL OR c.Timestamp < ?6)
+            ORDER BY s.rowid DESC
+            LIMIT ?8
+        ), best AS (
+            SELECT id, score FROM candidates ORDER BY score LIMIT ?7
+        )
+        SELECT c.ChatId AS id, c.ChatId AS chat_id, highlight(ChatsSearch, 0, ?1, ?2) AS title,
+            highlight(ChatsSearch, 0, ?1, ?2) AS snippet, NULL AS role, c.Timestamp AS timestamp, best.score
+        FROM best
+        JOIN ChatsSearch s ON s.rowid = best.id
+        JOIN Chats c ON c.ChatId = best.id
+        WHERE ChatsSearch MATCH ?3
+        ORDER BY best.score
+    """, (*MARK, query, chat_id, since, until, limit, CANDIDATES))
+    return [SearchHit(kind='chat', **row) for row in map(dict, cursor.fetchall())]
+
+def search_notes(cursor: sqlite3.Cursor, query: str, limit: int, since: Optional[str] = None,
+                 until: Optional[str] = None) -> List[SearchHit]:
+    cursor.execute("""--sql
+        WITH candidates AS (
+            SELECT s.rowid AS id, bm25(NotesSearch) AS score
+            FROM NotesSearch s
+            JOIN Notes n ON n.note_id = s.rowid
+            WHERE NotesSearch MATCH ?5 AND (?6 IS NULL OR n.Timestamp >= ?6) AND (?7 IS NULL OR n.Timestamp < ?7)
+            ORDER BY s.rowid DESC
+            LIMIT ?9
+        ), best AS (
+            SELECT id, score FROM candidates ORDER BY score LIMIT ?8
+        )
+        SELECT n.note_id AS id, NULL AS chat_id, highlight(NotesSearch, 0, ?1, ?2) AS title,
+            snippet(NotesSearch, 1, ?1, ?2, ?3, ?4) AS snippet, NULL AS role, n.Timestamp AS timestamp, best.score
+        FROM best
+        JOIN NotesSearch s ON s.rowid = best.id
+        JOIN Notes n ON n.note_id = best.id
+        WHERE NotesSearch MATCH ?5
+        ORDER BY best.score
+    """, (*MARK, ELLIPSIS, SNIPPET_TOKENS, query, since, until, limit, CANDIDATES))
+    return [SearchHit(kind='note', **row) for row in map(dict, cursor.fetchall())]
+
+#####################################################################################
+#                                   Indexer                                         #
+#####################################################################################
+
+class SearchIndexer:
+    """
+    Indexes the pending rows of every database in its own thread, one short transaction per batch,
+    then waits for a `notify` (after a rebuild). Each database is `path -> index names`.
+    """
+    def __init__(self, databases: Dict[str, Tuple[str, ...]], batch: int = BATCH, pause: float = PAUSE):
+        self.databases = databases
+        self.batch = batch
+        self.pause = pause
+        self.wakeup = Event()
+        self.stop_event = Event()
+        self.thread: Optional[Thread] = None
+        self.indexed = 0
+
+    def notify(self) -> None:
+        self.wakeup.set()
+
+    def run_once(self) -> int:
+        """One batch of every index with pending rows, returns the rows indexed."""
+        indexed = 0
+        for path, names in self.databases.items():
+            conn = sqlite3.connect(path, timeout=30.0)
+            conn.row_factory = sqlite3.Row
+            try:
+                if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'SearchIndexState'").fetchone() is None:
+                    continue # tables not created yet, `notify` after
+                for name in names:
+                    cursor = conn.cursor()
+                    indexed += index_pending(cursor, name, self.batch)
+                    conn.commit()
+            finally:
+                conn.close()
+        self.indexed += indexed
+        return indexed
+
+    def _run(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                if self.run_once():
+                    self.stop_event.wait(self.pause)
+                    continue
+            except sqlite3.Error as e:
+                logger.error(msg=f"Search indexer: {e}")
+                self.stop_event.wait(5.0)
+                continue
+            self.wakeup.wait()
+            self.wakeup.clear()
+
+    def start(self) -> None:
+        if self.thread is not None and self.thread.is_alive(): return
+        self.stop_event.clear()
+        self.thread = Thread(target=self._run, name="SearchIndexer", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread is not None: self.thread.join()
+        self.thread = None
@@ -21,8 +21,7 @@ import {
 import { ScrollArea } from '@/components/ui/scroll-area';
 import { Badge } from '@/components/ui/badge';
 import { getCurrentDate, formatDate, formatDateWithOffset } from '@/lib/utils';
-import api, {GetActivity} from '@/lib/api';
-import { API_BASE_URL } from '@/lib/constants';
+import api, {GetActivity, fetchIcons} from '@/lib/api';
 import { useBackend } from '@/hooks/use-backend';
 
 // Define activity entry type
@@ -80,11 +79,12 @@ export function ActivityHistory() {
       if (data.length === 0) {
         setHasMore(false);  // No more data
       } else {
+        const icons = await fetchIcons(data.map((item: GetActivity) => item.app.ICON), 32); // one request per page, not per row
         setFilteredActivities(prevActivities => [...prevActivities, ...data.map((item: GetActivity) => ({
           id: `${item.activity.EntryId}`,
           appName: item.app.FileDescription || item.app.ExeDirName,
           exeName: item.app.ExeFileName,
-          exeIcon: `${API_BASE_URL}/static/icons/${item.app.ICON}`, // Add exeIcon if needed
+          exeIcon: icons[item.app.ICON],
           // exeIcon: item.activity.URL_ICON!==null?`${API_BASE_URL}/static/icons_url/${item.activity.URL_ICON}`:`${API_BASE_URL}/static/icons/${item.app.ICON}`, // Add exeIcon if needed
           windowTitle: item.activity.Title,
           url: item.activity.URL || undefined,
@@ -42,7 +42,10 @@ import { TooltipIconButton } from "@/components/assistant-ui/tooltip-icon-button
 import { useParams } from 'react-router-dom';
 import { API_BASE_URL } from "@/lib/constants";
 
-export const Thread: FC = () => {
+const TOP_THRESHOLD = 200; // px from the top of the viewport at which older messages are loaded
+
+// onReachTop: the user scrolled up to the oldest loaded message (chats load by pages)
+export const Thread: FC<{ onReachTop?: (viewport: HTMLDivElement) => void }> = ({ onReachTop }) => {
   // const {isAtBottom, scrollToBottom, onScrollToBottom} = useThreadViewport()
   // const {
   //   append, cancelRun, composer, getModelContext, 
@@ -59,7 +62,10 @@ export const Thread: FC = () => {
         ["--thread-max-width" as string]: "52rem",
       }}
     >
-      <ThreadPrimitive.Viewport className="flex h-full flex-col items-center overflow-y-auto scroll-smooth bg-inherit px-4 pt-8">
+      <ThreadPrimitive.Viewport
+        className="flex h-full flex-col items-center overflow-y-auto scroll-smooth bg-inherit px-4 pt-8"
+        onScroll={(e) => { if (onReachTop && e.currentTarget.scrollTop < TOP_THRESHOLD) onReachTop(e.currentTarget); }}
+      >
         <ThreadWelcome />
 
         <ThreadPrimitive.Messages
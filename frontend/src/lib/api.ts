@@ -56,6 +56,66 @@ export interface GetAppResponse{
     hour_18: number; hour_19: number; hour_20: number; hour_21: number; hour_22: number; hour_23: number;
 }
 
+// #####################################################################################
+// #                                   Icons                                           #
+// #####################################################################################
+
+export interface IconBatchResponse{
+    icons: Record<string, { hash: string; data: string }> // data: data:image/png;base64,...
+    missing: string[]
+}
+
+const ICON_BATCH_SIZE = 50; // names per request, keeps the query string short
+
+export const iconUrl = (name: string, size?: number) =>
+    `${API_BASE_URL}/static/icons/${name}${size !== undefined ? `?size=${size}` : ''}`;
+
+// icons of a whole list in a few requests (GET /static/icons/batch) instead of one per row,
+// name -> data uri, the url of the single icon for names the batch does not have
+export async function fetchIcons(names: string[], size?: number): Promise<Record<string, string>> {
+    const unique = [...new Set(names.filter(Boolean))];
+    const icons: Record<string, string> = {};
+    const batches = [];
+    for (let i = 0; i < unique.length; i += ICON_BATCH_SIZE) batches.push(unique.slice(i, i + ICON_BATCH_SIZE));
+    await Promise.all(batches.map(async (batch) => {
+        const params = new URLSearchParams();
+        batch.forEach(name => params.append('names', name));
+        if (size !== undefined) params.append('size', `${size}`);
+        try {
+            const res = await api.get<IconBatchResponse>(`/static/icons/batch?${params}`);
+            batch.forEach(name => { icons[name] = res.data.icons[name]?.data ?? iconUrl(name, size); });
+        } catch (e) {
+            console.error('Error fetching icons:', e);
+            batch.forEach(name => { icons[name] = iconUrl(name, size); });
+        }
+    }));
+    return icons;
+}
+
+// #####################################################################################
+// #                                   Chatbot                                         #
+// #####################################################################################
+
+export interface ChatMessageEntry{
+    message: any // a ThreadMessage of assistant-ui, as `runtime.thread.import` takes it
+    parentId: string | null
+}
+
+export interface ChatPageResponse{
+    headId: string | null
+    messages: ChatMessageEntry[] // oldest first, with the siblings of each message of the visible branch
+    cursor: string | null // of the next (older) page
+    hasMore: boolean
+}
+
+// the newest page of the visible branch, then the older ones by `cursor` (409 once the branch changed)
+export async function fetchChatPage(chatId: string, cursor?: string | null): Promise<ChatPageResponse> {
+    const params = new URLSearchParams();
+    if (cursor) params.append('cursor', cursor);
+    const res = await api.get<ChatPageResponse>(`/chatbot/chat/${chatId}/messages?${params}`);
+    return res.data;
+}
+
 // #####################################################################################
 // #                                   BaseUrl                                         #
 // #####################################################################################
@@ -9,8 +9,7 @@ import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from '@
 import { Search, Filter, ArrowUpDown, ExternalLink, Check, Ban, Loader2 } from 'lucide-react';
 import { Link } from 'react-router-dom';
 import { toast } from "@/hooks/use-toast";
-import api, { AppResponse, Category as ApiCategory, SimpleSuccessResponse } from '@/lib/api';
-import { API_BASE_URL } from '@/lib/constants';
+import api, { AppResponse, Category as ApiCategory, SimpleSuccessResponse, fetchIcons } from '@/lib/api';
 import { base64UrlEncode } from '@/lib/utils';
 import { Skeleton } from '@/components/ui/skeleton'; // For loading state
 
@@ -54,6 +53,7 @@ const Apps = () => {
         api.get<AppResponse[]>('/apps'),
         api.get<ApiCategory[]>('/categories') // Fetch categories
       ]);
+      const icons = await fetchIcons(appsRes.data.map(item => item.ICON), 32); // rendered at h-8 w-8
 
       setApps(appsRes.data.map((item: AppResponse) => ({
         id: base64UrlEncode(item.AppId),
@@ -62,7 +62,7 @@ const Apps = () => {
         exeFileName: item.ExeFileName,
         exeDirName: item.ExeDirName,
         isBrowser: item.IsBrowser,
-        icon: `${API_BASE_URL}/static/icons/${item.ICON}`,
+        icon: icons[item.ICON],
         companyName: item.CompanyName,
         productName: item.ProductName,
         fileVersion: item.FileVersion,
@@ -9,9 +9,26 @@ import {
   SimpleTextAttachmentAdapter,
 } from "@assistant-ui/react";
  
-import { useEffect, useState } from 'react'
+import { useEffect, useRef, useState } from 'react'
 import { useParams } from "react-router-dom";
+import axios from 'axios';
 import { SideNavigation } from "@/components/layout/chatbot/SideNavigation";
+import { fetchChatPage, ChatMessageEntry } from "@/lib/api";
+
+// the parents of the oldest loaded messages are on the next (older) page: they are imported as roots
+// until it is loaded, `detached` keeps their real parent meanwhile
+const detach = (messages: ChatMessageEntry[], detached: Map<string, string>): ChatMessageEntry[] => {
+  const ids = new Set(messages.map(entry => entry.message.id));
+  return messages.map(entry => {
+    const parentId = entry.parentId ?? detached.get(entry.message.id) ?? null;
+    if (parentId === null || ids.has(parentId)) {
+      detached.delete(entry.message.id);
+      return { ...entry, parentId };
+    }
+    detached.set(entry.message.id, parentId);
+    return { ...entry, parentId: null };
+  });
+};
  
 export default function ChatBotChat() {
   const { chatId } = useParams();
@@ -37,25 +54,51 @@ export default function ChatBotChat() {
   });
   
 
-  useEffect(() => {
-    fetch(`http://127.0.0.1:8000/api/chatbot/chat/${chatId}`)
-    .then(async (res) => {
-      if(!res.ok) {
-        const error = await res.json();
-        throw error
-      }
-      return res.json()
-    })
-    .then((data) => {
+  const cursor = useRef<string | null>(null); // of the next older page, null once the first message is loaded
+  const loadingOlder = useRef(false);
+  const detached = useRef(new Map<string, string>());
+
+  // the newest page of the visible branch, older pages are loaded on scroll (loadOlder)
+  const loadNewest = () => fetchChatPage(chatId!)
+    .then((page) => {
+      detached.current.clear();
+      cursor.current = page.cursor;
+      runtime.thread.import({ headId: page.headId, messages: detach(page.messages, detached.current) });
       setLoading(false);
-      console.log(data);
-      runtime.thread.import(data);
-    })
+    });
+
+  useEffect(() => {
+    setLoading(true);
+    loadNewest()
     .catch((e) => {
-      setError(e['detail'] || e);
+      setError(e.response?.data?.detail || e.message || e);
     })
   }, [chatId])
 
+  const loadOlder = async (viewport: HTMLDivElement) => {
+    if (cursor.current === null || loadingOlder.current) return;
+    loadingOlder.current = true;
+    const height = viewport.scrollHeight;
+    try {
+      const page = await fetchChatPage(chatId!, cursor.current);
+      const current = runtime.thread.export(); // with the messages streamed since the chat was opened
+      const known = new Set(current.messages.map(entry => entry.message.id)); // a branch switch imports the whole branch
+      const older = page.messages.filter(entry => !known.has(entry.message.id));
+      cursor.current = page.cursor;
+      runtime.thread.import({
+        headId: current.headId,
+        messages: detach([...older, ...current.messages as ChatMessageEntry[]], detached.current)
+      });
+      // keep the message the user was reading in place
+      requestAnimationFrame(() => viewport.scrollTo({ top: viewport.scrollTop + viewport.scrollHeight - height, behavior: 'instant' }));
+    } catch (e) {
+      if (axios.isAxiosError(e) && e.response?.status === 409) await loadNewest().catch(console.error); // the visible branch changed
+      else console.error("Error loading older messages:", e);
+    } finally {
+      loadingOlder.current = false;
+    }
+  };
+
   if (error) {
     return <>ERROR: {error}</>
   }
@@ -64,7 +107,7 @@ export default function ChatBotChat() {
     <AssistantRuntimeProvider runtime={runtime}>
       <main className="h-dvh flex">
         <SideNavigation />
-        {!loading && <Thread />}
+        {!loading && <Thread onReachTop={loadOlder} />}
       </main>
     </AssistantRuntimeProvider>
   </>
@@ -0,0 +1,203 @@
+from db.helpers import logger
+from db.models import IApp
+from typing import TypedDict, Optional, List, Dict, Literal, Tuple, Any
+from .providers import Provider, get_provider
+import json
+import time
+
+#####################################################################################
+#                                   Constants                                       #
+#####################################################################################
+
+TOKEN_BUDGET: int = 4000        # estimated prompt tokens per request (system prompt + items)
+MAX_ITEMS: int = 50             # items per request, keeps the json answer short enough
+COMPLETION_TOKENS_PER_ITEM: int = 16
+MAX_FIELD_LENGTH: int = 200     # metadata strings are truncated to this many chars
+MAX_CATEGORY_LENGTH: int = 64
+
+APP_FIELDS = (
+    'ExeFileName', 'ExeDirName', 'CompanyName', 'ProductName', 'FileDescription',
+    'InternalName', 'OriginalFilename', 'Comments'
+)
+
+SYSTEM_PROMPT = """You classify apps, websites and browser tab titles of a productivity tracker into categories.
+Existing categories: [{categories}]
+Use an existing category whenever one fits, otherwise create a short new one.
+Each line of the user message is one item as json with an "id".
+Respond only with json: {{"results": [{{"id": "<id>", "category": "<category>"}}, ...]}} with one entry per item."""
+
+#####################################################################################
+#                                   Types                                           #
+#####################################################################################
+
+ItemKind = Literal['app', 'url', 'title']
+
+class BatchItem(TypedDict):
+    key: str # AppId or baseURL, what the caller gets the category back for
+    kind: ItemKind
+    data: Dict[str, Any] # metadata sent to the model
+
+class BatchStats(TypedDict):
+    items: int
+    classified: int
+    failed: int
+    prompt_tokens: Optional[int] # as reported by the api (None if not reported)
+    completion_tokens: Optional[int]
+    estimated_prompt_tokens: int
+    latency: float # sec
+    error: Optional[str]
+
+class BatchResult(TypedDict):
+    categories: Dict[str, str]  # key -> category
+    failed: Dict[str, str]      # key -> reason
+    batches: List[BatchStats]
+
+#####################################################################################
+#                                   Helpers                                         #
+#####################################################################################
+
+def estimate_tokens(text: str) -> int:
+    """~4 chars per token, good enough to pack requests below the budget."""
+    return len(text) // 4 + 1
+
+def truncate(value: Any) -> Any:
+    if isinstance(value, str) and len(value) > MAX_FIELD_LENGTH: return value[:MAX_FIELD_LENGTH]
+    return value
+
+def app_item(app: IApp) -> BatchItem:
+    data = {field: truncate(app.get(field)) for field in APP_FIELDS if app.get(field) not in (None, '', 'None')}
+    return BatchItem(key=app['AppId'], kind='app', data=data)
+
+def url_item(baseURL: str, Title: Optional[str] = None, Description: Optional[str] = None) -> BatchItem:
+    data = {'url': baseURL, 'title': truncate(Title), 'description': truncate(Description)}
+    return BatchItem(key=baseURL, kind='url', data={k: v for k, v in data.items() if v})
+
+def title_item(key: str, title: str, site: Optional[str] = None) -> BatchItem:
+    """A browser tab title, `site` (its domain) tells e.g. a lecture from a music video on the same site apart."""
+    data = {'title': truncate(title), 'site': site}
+    return BatchItem(key=key, kind='title', data={k: v for k, v in data.items() if v})
+
+def item_line(item_id: str, item: BatchItem) -> str:
+    return json.dumps({'id': item_id, 'kind': item['kind'], **item['data']}, ensure_ascii=False, separators=(',', ':'))
+
+def chunk_items(items: List[BatchItem], categories: List[str], token_budget: int = TOKEN_BUDGET,
+                max_items: int = MAX_ITEMS) -> List[List[BatchItem]]:
+    """Greedy packing in order, an item larger than the budget still gets its own request."""
+    base = estimate_tokens(SYSTEM_PROMPT.format(categories=' | '.join(categories)))
+    chunks: List[List[BatchItem]] = []
+    current: List[BatchItem] = []
+    used = base
+    for item in items:
+        cost = estimate_tokens(item_line(str(len(current)), item)) + 1
+        if current and (used + cost > token_budget or len(current) >= max_items):
+            chunks.append(current)
+            current, used = [], base
+        current.append(item)
+        used += cost
+    if current: chunks.append(current)
+    return chunks
+
+def parse_results(content: str, ids: Dict[str, BatchItem]) -> Dict[str, str]:
+    """id -> category for every well formed entry with a known id, the rest is ignored."""
+    payload = json.loads(content)
+    results = payload.get('results') if isinstance(payload, dict) else payload
+    if not isinstance(results, list): raise ValueError("response has no `results` list")
+    categories: Dict[str, str] = {}
+    for entry in results:
+        if not isinstance(entry, dict): continue
+        item_id, category = str(entry.get('id')), entry.get('category')
+        if item_id not in ids or not isinstance(category, str) or not category.strip(): continue
+        categories[item_id] = category.strip()[:MAX_CATEGORY_LENGTH]
+    return categories
+
+#####################################################################################
+#                                   BatchClassifier                                 #
+#####################################################################################
+
+class BatchClassifier:
+    """
+    Classifies many apps / baseURLs per chat completion request: the category list is
+    sent once per request, items are packed by an estimated token budget and referred
+    to by short ids. Items missing from an answer are retried once in a follow-up request.
+    Requests go through `provider` (the configured one by default), or through `client` if given.
+    """
+    def __init__(self, client: Optional[Any] = None, model: Optional[str] = None, token_budget: int = TOKEN_BUDGET,
+                 max_items: int = MAX_ITEMS, retry_missing: bool = True, provider: Optional[Provider] = None):
+        self._client = client
+        self._provider = provider
+        self._model = model
+        self.token_budget = token_budget
+        self.max_items = max_items
+        self.retry_missing = retry_missing
+
+    @property
+    def provider(self) -> Provider:
+        return self._provider or get_provider()
+
+    @property
+    def client(self):
+        return self._client or self.provider.client
+
+    @property
+    def model(self) -> str:
+        return self._model or self.provider.model
+
+    def build_messages(self, ids: Dict[str, BatchItem], categories: List[str]) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT.format(categories=' | '.join(categories))},
+            {"role": "user", "content": '\n'.join(item_line(item_id, item) for item_id, item in ids.items())}
+        ]
+
+    def classify_chunk(self, items: List[BatchItem], categories: List[str]) -> Tuple[Dict[str, str], BatchStats]:
+        """key -> category for one request, never raises (errors are reported in the stats)."""
+        ids = {str(i): item for i, item in enumerate(items)}
+        messages = self.build_messages(ids, categories)
+        stats = BatchStats(
+            items=len(items), classified=0, failed=len(items), prompt_tokens=None, completion_tokens=None,
+            estimated_prompt_tokens=sum(estimate_tokens(message['content']) for message in messages),
+            latency=0.0, error=None
+        )
+        start = time.perf_counter()
+        try:
+            with self.provider.limit():
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    response_format={"type": "json_object"},
+                    temperature=0,
+                    max_tokens=COMPLETION_TOKENS_PER_ITEM * len(items) + 64
+                )
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                stats['prompt_tokens'] = usage.prompt_tokens
+                stats['completion_tokens'] = usage.completion_tokens
+            by_id = parse_results(response.choices[0].message.content or '', ids)
+        except Exception as e:
+            stats['latency'] = time.perf_counter() - start
+            stats['error'] = f"{type(e).__name__}: {e}"
+            logger.error(f"Batch classification of {len(items)} items failed: {stats['error']}")
+            return {}, stats
+        stats['latency'] = time.perf_counter() - start
+        stats['classified'] = len(by_id)
+        stats['failed'] = len(items) - len(by_id)
+        return {ids[item_id]['key']: category for item_id, category in by_id.items()}, stats
+
+    def classify(self, items: List[BatchItem], categories: List[str]) -> BatchResult:
+        result = BatchResult(categories={}, failed={}, batches=[])
+        pending = list({item['key']: item for item in items}.values()) # dedup by key
+        for _ in range(2 if self.retry_missing else 1):
+            missing: List[BatchItem] = []
+            for chunk in chunk_items(pending, categories, token_budget=self.token_budget, max_items=self.max_items):
+                classified, stats = self.classify_chunk(chunk, categories)
+                result['batches'].append(stats)
+                result['categories'].update(classified)
+                for item in chunk:
+                    if item['key'] in classified: continue
+                    missing.append(item)
+                    result['failed'][item['key']] = stats['error'] or "missing from the model answer"
+            if not missing or len(missing) == len(pending):
+                break # nothing to retry, or nothing worked at all (api down, let the caller back off)
+            pending = missing
+        for key in result['categories']: result['failed'].pop(key, None)
+        logger.info(f"Batch classification: {len(result['categories'])}/{len(items)} items in {len(result['batches'])} requests")
+        return result
@@ -0,0 +1,346 @@
+"""
+Tools the chatbot calls to answer from the tracked data (OpenAI tool calling): the top apps of a
+period, the time on a site, a usage trend, the todos due. Each tool is one read of the precomputed
+data (db/activity_rollup.py: daily rollups and the EndTime index, the due date index of Todos), and
+its result is cached by (tool, arguments, data version), so the same question asked again while the
+tracker has not written anything it reads is answered from memory.
+"""
+import asyncio
+import json
+import sqlite3
+import time
+from contextlib import aclosing
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from threading import Lock
+from typing import TypedDict, Optional, List, Dict, Any, Tuple, AsyncIterator, TYPE_CHECKING
+
+from db import DataBase, activity_rollup
+from db.helpers import LRUCache, logger
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletionChunk
+    from .providers import Provider
+
+#####################################################################################
+#                                   Constants                                       #
+#####################################################################################
+
+MAX_ROUNDS: int = 3             # model turns that may call tools before it has to answer
+CACHE_SIZE: int = 512           # tool results
+REFRESH_INTERVAL: float = 300.0 # sec between two rollups of the days that are over
+MAX_PERIOD_DAYS: int = 366
+PERIODS = ('today', 'yesterday', 'last_7_days', 'last_30_days', 'this_week', 'last_week', 'this_month', 'last_month')
+SYSTEM_PROMPT = (
+    "You can look up the user's tracked computer activity and todos with the tools. Today is {today} (UTC). "
+    "When a question is about their usage, time or todos, call a tool and answer with the numbers it returns; "
+    "never guess numbers. Durations are in minutes."
+)
+
+PERIOD_PARAMETERS: Dict[str, Any] = {
+    'period': {'type': 'string', 'enum': list(PERIODS), 'description': "Period to look at, last_7_days by default"},
+    'start_date': {'type': 'string', 'description': "First day YYYY-MM-DD, instead of period"},
+    'end_date': {'type': 'string', 'description': "Last day YYYY-MM-DD (inclusive), today by default"},
+}
+TOOLS: List[Dict[str, Any]] = [
+    {'type': 'function', 'function': {
+        'name': 'top_apps', 'description': "Apps the user spent the most active time in during a period",
+        'parameters': {'type': 'object', 'properties': {
+            **PERIOD_PARAMETERS, 'limit': {'type': 'integer', 'description': "Number of apps, 5 by default"}
+        }}
+    }},
+    {'type': 'function', 'function': {
+        'name': 'time_on_site', 'description': "Time the user spent on a website (domain and its subdomains) during a period",
+        'parameters': {'type': 'object', 'properties': {
+            'domain': {'type': 'string', 'description': "e.g. youtube.com"}, **PERIOD_PARAMETERS
+        }, 'required': ['domain']}
+    }},
+    {'type': 'function', 'function': {
+        'name': 'usage_trend', 'description': "Active time per day or week of a period compared to the period before it, "
+                                              "of everything or of one app or website",
+        'parameters': {'type': 'object', 'properties': {
+            **PERIOD_PARAMETERS,
+            'bucket': {'type': 'string', 'enum': ['day', 'week'], 'description': "day by default"},
+            'app': {'type': 'string', 'description': "App name to restrict to"},
+            'domain': {'type': 'string', 'description': "Website to restrict to"},
+        }}
+    }},
+    {'type': 'function', 'function': {
+        'name': 'todos_due', 'description': "Open todos due in the next days, overdue ones included",
+        'parameters': {'type': 'object', 'properties': {
+            'days': {'type': 'integer', 'description': "Due within this many days from today, 7 by default"},
+            'include_overdue': {'type': 'boolean', 'description': "true by default"},
+        }}
+    }},
+]
+TOOL_NAMES = frozenset(tool['function']['name'] for tool in TOOLS)
+
+#####################################################################################
+#                                   Types                                           #
+#####################################################################################
+
+class ToolCall(TypedDict):
+    name: str
+    arguments: Dict[str, Any]
+    cached: bool
+    latency: float              # sec, the read of the database (or of the cache)
+    error: Optional[str]
+
+class ActivityToolStats(TypedDict):
+    calls: int
+    cached: int
+    errors: int
+    latency_avg: Optional[float] # sec per uncached call
+    cache_entries: int
+    rollup_days: int
+    rolled_until: Optional[str]
+
+#####################################################################################
+#                                   Periods                                         #
+#####################################################################################
+
+def today() -> date:
+    return datetime.now(timezone.utc).date() # ActivityEntries are in utc
+
+def resolve_period(args: Dict[str, Any], now: Optional[date] = None) -> Tuple[str, str]:
+    """First and last day (inclusive, YYYY-MM-DD) of the period the tool arguments ask for."""
+    now = now or today()
+    if args.get('start_date'):
+        start = date.fromisoformat(str(args['start_date']))
+        end = date.fromisoformat(str(args['end_date'])) if args.get('end_date') else now
+    else:
+        period = args.get('period') or 'last_7_days'
+        if period not in PERIODS: raise ValueError(f"unknown period {period!r}, expected one of {list(PERIODS)}")
+        monday, first = now - timedelta(days=now.weekday()), now.replace(day=1)
+        start, end = {
+            'today': (now, now),
+            'yesterday': (now - timedelta(days=1), now - timedelta(days=1)),
+            'last_7_days': (now - timedelta(days=6), now),
+            'last_30_days': (now - timedelta(days=29), now),
+            'this_week': (monday, now),
+            'last_week': (monday - timedelta(days=7), monday - timedelta(days=1)),
+            'this_month': (first, now),
+            'last_month': ((first - timedelta(days=1)).replace(day=1), first - timedelta(days=1)),
+        }[period]
+    if end < start: raise ValueError("end_date is before start_date")
+    if (end - start).days >= MAX_PERIOD_DAYS: raise ValueError(f"periods are at most {MAX_PERIOD_DAYS} days")
+    return start.isoformat(), end.isoformat()
+
+def minutes(seconds: float) -> float:
+    return round((seconds or 0) / 60, 1)
+
+def database_uri(db_path: str, mode: str) -> str:
+    """`file:` URI of the database opened in `mode` ('ro' or 'rw'), neither creates a missing file."""
+    return f"{Path(db_path).resolve().as_uri()}?mode={mode}"
+
+#####################################################################################
+#                                   ActivityTools                                   #
+#####################################################################################
+
+class ActivityTools:
+    """
+    The tools over the main database, thread safe (one read-only connection, calls run one at a time:
+    each is a few indexed reads). The connection is opened on the first call, the api starts before the
+    tracker creates the database: until it exists (with its tables) a call returns an error result.
+    The days that are over are rolled up every REFRESH_INTERVAL, on a short-lived connection of its own.
+    """
+    def __init__(self, db_path: str, cache_size: int = CACHE_SIZE, refresh_interval: float = REFRESH_INTERVAL):
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        self.cache: LRUCache[Tuple[str, str, Tuple], Dict[str, Any]] = LRUCache(maxsize=cache_size)
+        self.database: Optional[DataBase] = None
+        self.refreshed: Optional[float] = None # time.monotonic() of the last rollup
+        self.lock = Lock()
+        self.calls = self.cached = self.errors = 0
+        self.latency = 0.0
+
+    def close(self) -> None:
+        with self.lock:
+            if self.database is not None: self.database.close()
+            self.database = None
+
+    def _rollup(self) -> None:
+        database = DataBase(db_path=database_uri(self.db_path, 'rw'), check_create_table=False, uri=True)
+        try:
+            with database.cursor_context() as cursor:
+                if activity_rollup.refresh(cursor): database.commit()
+        finally:
+            database.close() # rolls back a failed refresh
+
+    def _cursor(self):
+        if self.refreshed is None or time.monotonic() - self.refreshed >= self.refresh_interval:
+            try:
+                self._rollup()
+            except sqlite3.Error as e: # the reads stay exact, the entries of the days not rolled up are read instead
+                logger.warning(msg=f"chat tools: rollup failed: {e}")
+            self.refreshed = time.monotonic()
+        if self.database is None:
+            self.database = DataBase(db_path=database_uri(self.db_path, 'ro'), check_create_table=False,
+                                     check_same_thread=False, uri=True)
+        return self.database.cursor_context()
+
+    def refresh(self) -> None:
+        """Rolls up the days that are over now (otherwise done on the first call after REFRESH_INTERVAL)."""
+        with self.lock:
+            self._rollup()
+            self.refreshed = time.monotonic()
+
+    def call(self, name: str, arguments: Dict[str, Any]) -> Tuple[Dict[str, Any], ToolCall]:
+        """Result of the tool `name` ({'error': ...} for a bad call, the model reads it), and the record of the call."""
+        start = time.perf_counter()
+        cached, error = False, None
+        with self.lock:
+            self.calls += 1
+            try:
+                if name not in TOOL_NAMES: raise ValueError(f"unknown tool {name!r}")
+                with self._cursor() as cursor:
+                    args, version = self._arguments(cursor, name, arguments)
+                    key = (name, json.dumps(args, sort_keys=True), version)
+                    result = self.cache.get(key)
+                    if result is not None:
+                        cached = True
+                        self.cached += 1
+                    else:
+                        result = getattr(self, f"_{name}")(cursor, **args)
+                        self.cache.put(key, result)
+            except (ValueError, TypeError, KeyError, sqlite3.Error) as e: # sqlite3: no database (tables) yet
+                error, result = str(e), {'error': str(e)}
+                self.errors += 1
+            latency = time.perf_counter() - start
+            if not cached: self.latency += latency
+        if error is not None: logger.warning(msg=f"chat tool {name}({arguments}): {error}")
+        return result, ToolCall(name=name, arguments=arguments, cached=cached, latency=latency, error=error)
+
+    def _arguments(self, cursor, name: str, arguments: Dict[str, Any]) -> Tuple[Dict[str, Any], Tuple]:
+        """Normalized arguments of a call (periods as dates) and the version of the data it reads."""
+        if name == 'todos_due':
+            days = int(arguments.get('days') or 7)
+            if not 0 <= days <= MAX_PERIOD_DAYS: raise ValueError(f"days must be in 0..{MAX_PERIOD_DAYS}")
+            until = (today() + timedelta(days=days)).isoformat()
+            args = {'until': until, 'include_overdue': bool(arguments.get('include_overdue', True))}
+            return args, (activity_rollup.table_version(cursor, 'Todos'), today().isoformat())
+        start, end = resolve_period(arguments)
+        args: Dict[str, Any] = {'start': start, 'end': end}
+        if name == 'top_apps': args['limit'] = max(1, min(int(arguments.get('limit') or 5), 50))
+        if name == 'time_on_site':
+            if not str(arguments.get('domain') or '').strip(): raise ValueError("domain is required")
+            args['domain'] = str(arguments['domain']).strip()
+        if name == 'usage_trend':
+            args['bucket'] = 'week' if arguments.get('bucket') == 'week' else 'day'
+            args['app'] = str(arguments['app']).strip() if arguments.get('app') else None
+            args['domain'] = str(arguments['domain']).strip() if arguments.get('domain') else None
+        # the app and site tables only grow, the names they resolve to are read with the activity
+        return args, activity_rollup.version(cursor, end)
+
+    def _top_apps(self, cursor, start: str, end: str, limit: int) -> Dict[str, Any]:
+        apps = activity_rollup.top_apps(cursor, start, end, limit=limit)
+        return {'start_date': start, 'end_date': end, 'apps': [
+            {'app': app['name'], 'active_minutes': minutes(app['ActiveDuration']), 'tracked_minutes': minutes(app['Duration'])}
+            for app in apps
+        ]}
+
+    def _time_on_site(self, cursor, start: str, end: str, domain: str) -> Dict[str, Any]:
+        baseURLs = activity_rollup.site_baseurls(cursor, domain)
+        days = activity_rollup.trend(cursor, start, end, baseURLs=baseURLs) if baseURLs else []
+        return {
+            'domain': domain, 'start_date': start, 'end_date': end, 'sites': baseURLs,
+            'active_minutes': minutes(sum(day['ActiveDuration'] for day in days)),
+            'tracked_minutes': minutes(sum(day['Duration'] for day in days)),
+            'by_day': {day['period']: minutes(day['ActiveDuration']) for day in days if day['ActiveDuration']},
+        }
+
+    def _usage_trend(self, cursor, start: str, end: str, bucket: str, app: Optional[str], domain: Optional[str]) -> Dict[str, Any]:
+        app_ids = [match['AppId'] for match in activity_rollup.find_apps(cursor, app)] if app else None
+        baseURLs = activity_rollup.site_baseurls(cursor, domain) if domain else None
+        length = (date.fromisoformat(end) - date.fromisoformat(start)).days + 1
+        previous_start = (date.fromisoformat(start) - timedelta(days=length)).isoformat()
+        days = activity_rollup.trend(cursor, previous_start, end, app_ids=app_ids, baseURLs=baseURLs)
+        previous = sum(day['ActiveDuration'] for day in days[:length])
+        current = days[length:]
+        series = current if bucket == 'day' else activity_rollup.trend(cursor, start, end, 'week', app_ids=app_ids, baseURLs=baseURLs)
+        total = sum(day['ActiveDuration'] for day in current)
+        return {
+            'start_date': start, 'end_date': end, 'app': app, 'domain': domain, 'bucket': bucket,
+            'active_minutes': minutes(total),
+            'previous_period_active_minutes': minutes(previous),
+            'change_percent': round((total - previous) / previous * 100, 1) if previous else None,
+            'series': [{bucket: day['period'], 'active_minutes': minutes(day['ActiveDuration'])} for day in series],
+        }
+
+    def _todos_due(self, cursor, until: str, include_overdue: bool) -> Dict[str, Any]:
+        todos = activity_rollup.todos_due(cursor, until, overdue=include_overdue)
+        return {'due_until': until, 'todos': [
+            {'title': todo['title'], 'due': todo['duedate'], 'overdue': bool(todo['overdue'])} for todo in todos
+        ]}
+
+    def stats(self) -> ActivityToolStats:
+        with self.lock:
+            rollup = {'days': 0, 'rolled_until': None}
+            if self.database is not None:
+                try:
+                    with self.database.cursor_context() as cursor: rollup = activity_rollup.status(cursor)
+                except sqlite3.Error:
+                    pass
+            uncached = self.calls - self.cached - self.errors
+            return ActivityToolStats(
+                calls=self.calls,
+                cached=self.cached,
+                errors=self.errors,
+                latency_avg=self.latency / uncached if uncached > 0 else None,
+                cache_entries=len(self.cache),
+                rollup_days=rollup['days'],
+                rolled_until=rollup['rolled_until']
+            )
+
+#####################################################################################
+#                                   ToolChat                                        #
+#####################################################################################
+
+def system_message() -> Dict[str, str]:
+    return {'role': 'system', 'content': SYSTEM_PROMPT.format(today=today().isoformat())}
+
+class ToolChat:
+    """
+    One streamed answer with the tools: the model's turns that call tools are not shown, their calls
+    run (off the event loop) and the next turn is streamed; the chunks of the turn that answers are
+    yielded as they come. `calls` holds the tool calls once the stream ended.
+    """
+    def __init__(self, provider: 'Provider', tools: ActivityTools, messages: List[Dict[str, Any]], max_rounds: int = MAX_ROUNDS):
+        self.provider = provider
+        self.tools = tools
+        self.messages = [system_message(), *messages]
+        self.max_rounds = max_rounds
+        self.calls: List[ToolCall] = []
+
+    async def astream(self) -> AsyncIterator['ChatCompletionChunk']:
+        for round in range(self.max_rounds + 1):
+            calls: Dict[int, Dict[str, Any]] = {}
+            options = {'tools': TOOLS} if round < self.max_rounds else {} # the last turn has to answer
+            async with aclosing(self.provider.astream(self.messages, **options)) as chunks:
+                async for chunk in chunks:
+                    delta = chunk.choices[0].delta if chunk.choices else None
+                    if delta is not None and delta.tool_calls:
+                        for part in delta.tool_calls:
+                            call = calls.setdefault(part.index, {'id': '', 'name': '', 'arguments': ''})
+                            if part.id: call['id'] = part.id
+                            if part.function is not None:
+                                call['name'] += part.function.name or ''
+                                call['arguments'] += part.function.arguments or ''
+                        continue
+                    yield chunk
+            if not calls: return
+            ordered = [calls[index] for index in sorted(calls)]
+            self.messages.append({'role': 'assistant', 'content': None, 'tool_calls': [
+                {'id': call['id'], 'type': 'function', 'function': {'name': call['name'], 'arguments': call['arguments']}}
+                for call in ordered
+            ]})
+            for call in ordered:
+                try: arguments = json.loads(call['arguments'] or '{}')
+                except ValueError: arguments = None
+                if isinstance(arguments, dict):
+                    result, record = await asyncio.to_thread(self.tools.call, call['name'], arguments)
+                else:
+                    result = {'error': "arguments are not a json object"}
+                    record = ToolCall(name=call['name'], arguments={}, cached=False, latency=0.0, error=result['error'])
+                self.calls.append(record)
+                self.messages.append({'role': 'tool', 'tool_call_id': call['id'], 'content': json.dumps(result)})
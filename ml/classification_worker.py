@@ -0,0 +1,313 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from threading import Thread, Event
+import sqlite3
+import time
+from typing import Optional, List, Dict, Protocol, Tuple, Union, Deque, TypedDict
+
+from db import DataBase, logger
+from db import classification_queue, classification_cache
+from db.models import IFetchApp, IFetchBaseUrl, IFetchClassificationJob, ClassificationSource
+from .batch_classification import BatchClassifier, BatchItem, BatchStats, app_item, url_item
+from .embedding_classifier import EmbeddingClassifier
+
+#####################################################################################
+#                                   Classifier                                      #
+#####################################################################################
+
+class IClassifier(Protocol):
+    def classify_app(self, app: IFetchApp, categories: List[str]) -> str: ...
+    def classify_url(self, baseurl: IFetchBaseUrl, categories: List[str]) -> str: ...
+
+class LangchainClassifier:
+    """The configured LLM provider (ml/providers.py) through ml.langchain_classification (imported on first use)."""
+    def classify_app(self, app: IFetchApp, categories: List[str]) -> str:
+        from . import langchain_classification
+        return langchain_classification.predict_app_category(app, categories)
+    def classify_url(self, baseurl: IFetchBaseUrl, categories: List[str]) -> str:
+        from . import langchain_classification
+        return langchain_classification.predict_url_category(
+            baseurl['baseURL'], Title=baseurl['Title'], Description=baseurl['Description'], categories=categories
+        )
+
+JobResult = Tuple[IFetchClassificationJob, Optional[str], Optional[str]] # job, category, error
+
+class BatchStatsSummary(TypedDict):
+    requests: int
+    items: int
+    failed: int
+    latency_avg: Optional[float] # sec per request
+    prompt_tokens: int
+    completion_tokens: int
+
+class LocalStats(TypedDict):
+    documents: int
+    categories: int
+    min_confidence: float
+    predicted: int      # jobs answered by the local model
+    deferred: int       # low confidence jobs sent to the LLM
+    latency_avg: Optional[float] # sec per prediction
+
+#####################################################################################
+#                           ClassificationWorkerPool                                #
+#####################################################################################
+
+class ClassificationWorkerPool:
+    """
+    Drains the persistent ClassificationQueue (db/classification_queue.py).
+    A single dispatcher thread owns the database connection: it claims a batch,
+    classifies it without holding a cursor or transaction during the LLM round trips
+    and applies the whole batch in one transaction.
+    The ClassificationCache (db/classification_cache.py) is consulted before any model and
+    stores every answer. With a `local` EmbeddingClassifier, jobs it is confident about
+    never reach the LLM, and every LLM answer is learned by it. With a `priority`, the most
+    used apps / sites are classified first and one-off visits are deferred (UsagePriority).
+        - IClassifier: one call per job, run concurrently on `workers` threads.
+        - BatchClassifier: the whole claimed batch in as few requests as the token budget allows.
+    """
+    def __init__(self, db_path: str, classifier: Union[IClassifier, BatchClassifier], workers: int = 4, batch_size: int = 16,
+                 poll_interval: float = 5.0, max_attempts: int = classification_queue.MAX_ATTEMPTS,
+                 backoff_base: float = classification_queue.BACKOFF_BASE, local: Optional[EmbeddingClassifier] = None,
+                 priority: Optional[classification_queue.UsagePriority] = None):
+        self.db_path = db_path
+        self.classifier = classifier
+        self.local = local
+        self.priority = priority
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+
+        self.wakeup = Event()
+        self.stop_event = Event()
+        self.dispatcher: Optional[Thread] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.database: Optional[DataBase] = None
+        self.trained = local is None
+        self.recent_batches: Deque[BatchStats] = deque(maxlen=100)
+        self.local_predicted, self.local_deferred, self.local_latency = 0, 0, 0.0
+
+    def notify(self) -> None:
+        """Wakes the dispatcher up, called after something was enqueued."""
+        self.wakeup.set()
+
+    def load_payloads(self, jobs: List[IFetchClassificationJob]) -> Tuple[Dict[str, IFetchApp], Dict[str, IFetchBaseUrl], List[str]]:
+        assert self.database is not None
+        with self.database.cursor_context() as cursor:
+            app_ids = [job['Key'] for job in jobs if job['Kind'] == 'app']
+            base_urls = [job['Key'] for job in jobs if job['Kind'] == 'url']
+            apps: Dict[str, IFetchApp] = {}
+            if app_ids:
+                cursor.execute(f"""--sql
+                SELECT * FROM Apps WHERE AppId IN ({', '.join('?' for _ in app_ids)})
+                """, app_ids)
+                apps = {row['AppId']: IFetchApp(**row) for row in cursor.fetchall()}
+            urls: Dict[str, IFetchBaseUrl] = {}
+            if base_urls:
+                cursor.execute(f"""--sql
+                SELECT * FROM BaseURLs WHERE baseURL IN ({', '.join('?' for _ in base_urls)})
+                """, base_urls)
+                urls = {row['baseURL']: IFetchBaseUrl(**row) for row in cursor.fetchall()}
+            cursor.execute("SELECT Category FROM Categories")
+            categories = [row['Category'] for row in cursor.fetchall()]
+        return apps, urls, categories
+
+    def resolve(self, jobs: List[IFetchClassificationJob], apps: Dict[str, IFetchApp],
+                urls: Dict[str, IFetchBaseUrl]) -> Tuple[List[JobResult], List[IFetchClassificationJob]]:
+        """Results known without any model (Category set in the meantime, row deleted) and the jobs left."""
+        results: List[JobResult] = []
+        pending: List[IFetchClassificationJob] = []
+        for job in jobs:
+            row = apps.get(job['Key']) if job['Kind'] == 'app' else urls.get(job['Key'])
+            if row is None:
+                results.append((job, None, f"LookupError: {'App' if job['Kind'] == 'app' else 'BaseURL'} {job['Key']} does not exist"))
+            elif row['Category']:
+                results.append((job, row['Category'], None))
+            else:
+                pending.append(job)
+        return results, pending
+
+    def lookup_cache(self, jobs: List[IFetchClassificationJob], apps: Dict[str, IFetchApp],
+                     now: Optional[float] = None) -> Tuple[List[JobResult], List[IFetchClassificationJob]]:
+        assert self.database is not None
+        results: List[JobResult] = []
+        missed: List[IFetchClassificationJob] = []
+        with self.database.cursor_context() as cursor:
+            for job in jobs:
+                if job['Kind'] == 'app':
+                    entry = classification_cache.lookup_app(cursor, apps[job['Key']], now=now)
+                else:
+                    entry = classification_cache.lookup_url(cursor, job['Key'], now=now)
+                if entry is None: missed.append(job)
+                else: results.append((job, entry['Category'], None))
+            self.database.commit()
+        return results, missed
+
+    def store_cache(self, cursor: sqlite3.Cursor, results: List[JobResult], apps: Dict[str, IFetchApp],
+                    source: ClassificationSource, now: Optional[float] = None) -> None:
+        for job, category, _ in results:
+            if not category: continue
+            if job['Kind'] == 'app': classification_cache.store_app(cursor, apps[job['Key']], category, source, now=now)
+            else: classification_cache.store_url(cursor, job['Key'], category, source, now=now)
+
+    def job_item(self, job: IFetchClassificationJob, apps: Dict[str, IFetchApp], urls: Dict[str, IFetchBaseUrl]) -> BatchItem:
+        if job['Kind'] == 'app': return app_item(apps[job['Key']])
+        baseurl = urls[job['Key']]
+        return url_item(baseurl['baseURL'], Title=baseurl['Title'], Description=baseurl['Description'])
+
+    def classify_local(self, jobs: List[IFetchClassificationJob], apps: Dict[str, IFetchApp],
+                       urls: Dict[str, IFetchBaseUrl]) -> Tuple[List[JobResult], List[IFetchClassificationJob]]:
+        assert self.local is not None
+        results: List[JobResult] = []
+        deferred: List[IFetchClassificationJob] = []
+        start = time.perf_counter()
+        for job in jobs:
+            prediction = self.local.predict(self.job_item(job, apps, urls))
+            if self.local.confident(prediction):
+                results.append((job, prediction['category'], None))
+            else:
+                deferred.append(job)
+        self.local_latency += time.perf_counter() - start
+        self.local_predicted += len(results)
+        self.local_deferred += len(deferred)
+        return results, deferred
+
+    def classify(self, job: IFetchClassificationJob, apps: Dict[str, IFetchApp], urls: Dict[str, IFetchBaseUrl],
+                 categories: List[str]) -> str:
+        assert not isinstance(self.classifier, BatchClassifier)
+        if job['Kind'] == 'app': return self.classifier.classify_app(apps[job['Key']], categories)
+        return self.classifier.classify_url(urls[job['Key']], categories)
+
+    def classify_each(self, jobs: List[IFetchClassificationJob], apps: Dict[str, IFetchApp], urls: Dict[str, IFetchBaseUrl],
+                      categories: List[str]) -> List[JobResult]:
+        assert self.executor is not None
+        futures = [self.executor.submit(self.classify, job, apps, urls, categories) for job in jobs]
+        results: List[JobResult] = []
+        for job, future in zip(jobs, futures):
+            try:
+                results.append((job, future.result(), None))
+            except Exception as e:
+                results.append((job, None, f"{type(e).__name__}: {e}"))
+        return results
+
+    def classify_batch(self, jobs: List[IFetchClassificationJob], apps: Dict[str, IFetchApp], urls: Dict[str, IFetchBaseUrl],
+                       categories: List[str]) -> List[JobResult]:
+        assert isinstance(self.classifier, BatchClassifier)
+        items: List[BatchItem] = []
+        for job in jobs:
+            item = self.job_item(job, apps, urls)
+            item['key'] = str(job['JobId'])
+            items.append(item)
+        batch = self.classifier.classify(items, categories)
+        self.recent_batches.extend(batch['batches'])
+        by_key = {str(job['JobId']): job for job in jobs}
+        results: List[JobResult] = [(by_key[key], category, None) for key, category in batch['categories'].items()]
+        results.extend((by_key[key], None, reason) for key, reason in batch['failed'].items())
+        return results
+
+    def batch_stats(self) -> BatchStatsSummary:
+        batches = list(self.recent_batches)
+        return BatchStatsSummary(
+            requests=len(batches),
+            items=sum(stats['items'] for stats in batches),
+            failed=sum(stats['failed'] for stats in batches),
+            latency_avg=sum(stats['latency'] for stats in batches) / len(batches) if batches else None,
+            prompt_tokens=sum(stats['prompt_tokens'] or stats['estimated_prompt_tokens'] for stats in batches),
+            completion_tokens=sum(stats['completion_tokens'] or 0 for stats in batches)
+        )
+
+    def local_stats(self) -> Optional[LocalStats]:
+        if self.local is None: return None
+        predictions = self.local_predicted + self.local_deferred
+        return LocalStats(
+            **self.local.stats(),
+            predicted=self.local_predicted,
+            deferred=self.local_deferred,
+            latency_avg=self.local_latency / predictions if predictions else None
+        )
+
+    def run_once(self, now: Optional[float] = None) -> int:
+        """Claims, classifies and applies one batch, returns the number of claimed jobs."""
+        assert self.database is not None and self.executor is not None, "call open() first"
+        with self.database.cursor_context() as cursor:
+            jobs = classification_queue.claim(cursor, limit=self.batch_size, now=now, priority=self.priority)
+            self.database.commit()
+        if not jobs: return 0
+
+        apps, urls, categories = self.load_payloads(jobs)
+        results, pending = self.resolve(jobs, apps, urls)
+        if pending:
+            cached_results, pending = self.lookup_cache(pending, apps, now=now)
+            results.extend(cached_results)
+        local_results: List[JobResult] = []
+        if pending and self.local is not None:
+            local_results, pending = self.classify_local(pending, apps, urls)
+            results.extend(local_results)
+        model_results: List[JobResult] = []
+        if pending and isinstance(self.classifier, BatchClassifier):
+            model_results = self.classify_batch(pending, apps, urls, categories)
+        elif pending:
+            model_results = self.classify_each(pending, apps, urls, categories)
+        results.extend(model_results)
+
+        with self.database.cursor_context() as cursor: # one transaction for the whole batch
+            for job, category, error in results:
+                if category:
+                    classification_queue.complete(cursor, job, category, now=now)
+                    logger.info(msg=f"{job['Kind'].capitalize()} Classification report: {category} <= {job['Key']}")
+                else:
+                    status = classification_queue.fail(
+                        cursor, job, error or "empty category", now=now,
+                        max_attempts=self.max_attempts, backoff_base=self.backoff_base
+                    )
+                    logger.error(msg=f"{job['Kind'].capitalize()} Classification error ({status}): {error} <= {job['Key']}")
+            self.store_cache(cursor, local_results, apps, 'local', now=now)
+            self.store_cache(cursor, model_results, apps, 'llm', now=now)
+            self.database.commit()
+        if self.local is not None: # the LLM answers become training data
+            for job, category, _ in model_results:
+                if category: self.local.learn(self.job_item(job, apps, urls), category)
+        return len(jobs)
+
+    def open(self) -> None:
+        """Raises sqlite3.Error while the schema does not exist yet (fresh database): called again on the next poll."""
+        if self.database is None:
+            self.database = DataBase(db_path=self.db_path, check_create_table=False, check_same_thread=False)
+        if not self.trained:
+            assert self.local is not None
+            with self.database.cursor_context() as cursor:
+                logger.info(msg=f"Local classifier trained on {self.local.fit(cursor)} items")
+            self.trained = True
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="Classifier")
+
+    def close(self) -> None:
+        if self.executor is not None: self.executor.shutdown(wait=True)
+        if self.database is not None: self.database.close()
+        self.executor, self.database = None, None
+
+    def _run(self) -> None:
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    self.open()
+                    if self.run_once(): continue # keep draining
+                except Exception as e:
+                    logger.error(msg=f"Classification worker error: {e}")
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+        finally:
+            self.close()
+
+    def start(self) -> None:
+        if self.dispatcher is not None and self.dispatcher.is_alive(): return
+        self.stop_event.clear()
+        self.dispatcher = Thread(target=self._run, name="ClassificationDispatcher", daemon=True)
+        self.dispatcher.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.dispatcher is not None: self.dispatcher.join()
+        self.dispatcher = None
@@ -0,0 +1,198 @@
+import math
+import re
+import time
+from typing import TypedDict, Optional, List, Dict, Callable, Awaitable, Tuple
+
+from db.chatbot import DataBase, GetMessages
+from db.chatbot.models import IChatSummary
+from db.helpers import LRUCache, logger
+
+#####################################################################################
+#                                   Constants                                       #
+#####################################################################################
+
+CONTEXT_BUDGET: int = 6000      # prompt tokens of the history (summary included)
+SUMMARY_TOKENS: int = 400       # kept free for the summary once history is dropped
+SUMMARY_STEP: int = 8           # at most this many messages dropped ahead of need, so a summary serves the next turns
+SUMMARY_SLACK: float = 0.25     # ... as long as they are at most this part of the budget
+SUMMARY_INPUT_BUDGET: int = 6000 # tokens of messages per summarization request
+MESSAGE_OVERHEAD: int = 4       # role and separators per chat message
+PAGE: int = 64                  # messages read per range read of the visible branch
+
+# Pre-tokenizer of the BPE tokenizers (cl100k, llama 3): words with their leading space, 1-3 digit
+# numbers, punctuation runs, newlines. Common words are one token, longer ones one per WORD_CHARS.
+PIECE = re.compile(r"""'(?:s|t|re|ve|m|ll|d)| ?[^\W\d_]+| ?\d{1,3}| ?(?:[^\s\w]|_)+|\s+""", re.IGNORECASE)
+WORD_CHARS: int = 6             # letters per token past the first of a long word
+NON_ASCII = re.compile(r"[^\x00-\x7f]")
+
+#####################################################################################
+#                                   Types                                           #
+#####################################################################################
+
+Summarizer = Callable[[Optional[str], List[Dict[str, str]]], Awaitable[str]]
+
+class ContextStats(TypedDict):
+    messages: int           # kept verbatim
+    dropped: int            # replaced by the summary
+    tokens: int             # of the whole history (summary included)
+    summary_tokens: int
+    summarized: int         # summarization requests of this build
+    build_time: float       # sec
+
+class Context(TypedDict):
+    messages: List[Dict[str, str]] # oldest first, the summary as a system message
+    stats: ContextStats
+
+#####################################################################################
+#                                   Tokens                                          #
+#####################################################################################
+
+def count_tokens(text: str) -> int:
+    """Local estimate of the tokens of `text` (no tokenizer download), close to cl100k / llama 3 on english text and code."""
+    tokens = 0
+    for piece in PIECE.findall(text):
+        stripped = piece.strip()
+        if not stripped:
+            if '\n' in piece: tokens += 1 # a newline run is one token, spaces merge into the next word
+            continue
+        if stripped[0].isalpha(): tokens += 1 + max(0, len(stripped) - WORD_CHARS) // WORD_CHARS
+        elif stripped[0].isdigit(): tokens += 1
+        else: tokens += math.ceil(len(stripped) / 2)
+        tokens += len(NON_ASCII.findall(stripped)) // 2
+    return tokens
+
+message_tokens: LRUCache[int, int] = LRUCache(maxsize=8192) # MessageId -> tokens, streamed answers are evicted on each checkpoint
+
+def count_message_tokens(message: GetMessages) -> int:
+    tokens = message_tokens.get(message['MessageId'])
+    if tokens is None:
+        tokens = count_tokens(message['content']) + MESSAGE_OVERHEAD
+        message_tokens.put(message['MessageId'], tokens)
+    return tokens
+
+def chat_message(message: GetMessages) -> Dict[str, str]:
+    return {"role": "user" if message['message_by'] == 'USER' else "assistant", "content": message['content']}
+
+#####################################################################################
+#                                   Summaries                                       #
+#####################################################################################
+
+SUMMARY_PROMPT = """Summarize the conversation below for the assistant that continues it.
+Keep facts, decisions, names, numbers, code identifiers and open questions; drop greetings and filler.
+Answer with the summary only, at most {max_words} words."""
+
+async def summarize_with_provider(previous: Optional[str], messages: List[Dict[str, str]]) -> str:
+    from .providers import get_provider
+    transcript = '\n'.join(f"{message['role']}: {message['content']}" for message in messages)
+    if previous: transcript = f"Summary of the conversation before:\n{previous}\n\nConversation:\n{transcript}"
+    response = await get_provider().acreate([
+        {"role": "system", "content": SUMMARY_PROMPT.format(max_words=SUMMARY_TOKENS * 3 // 4)},
+        {"role": "user", "content": transcript},
+    ], max_tokens=SUMMARY_TOKENS)
+    return (response.choices[0].message.content or '').strip()
+
+#####################################################################################
+#                                   ContextBuilder                                  #
+#####################################################################################
+
+class ContextBuilder:
+    """
+    History of a chat message for the model, newest first until `budget` tokens: whatever does
+    not fit is replaced by a rolling summary. Summaries are stored per message (ChatSummaries),
+    a summary of the branch down to a message never changes, so one is reused by every later
+    turn of the branch and extended from the nearest one above when the window moves on.
+    A new summary drops a few more messages than needed (`summary_step`, `summary_slack`), so it
+    serves the next turns too instead of one summarization request per turn.
+    """
+    def __init__(self, database: DataBase, budget: int = CONTEXT_BUDGET, summary_tokens: int = SUMMARY_TOKENS,
+                 summary_step: int = SUMMARY_STEP, summary_slack: float = SUMMARY_SLACK,
+                 summary_input_budget: int = SUMMARY_INPUT_BUDGET, summarizer: Optional[Summarizer] = None):
+        self.database = database
+        self.budget = budget
+        self.summary_tokens = summary_tokens
+        self.summary_step = summary_step
+        self.summary_slack = summary_slack
+        self.summary_input_budget = summary_input_budget
+        self.summarizer: Summarizer = summarizer or summarize_with_provider
+
+    def newest_first(self, chat_id: int, head_id: int, budget: int) -> List[GetMessages]:
+        """Messages from the head up while they fit the budget (the head always does)."""
+        kept: List[GetMessages] = []
+        tokens, depth = 0, None
+        while True:
+            page = (self.database.get_chats_above(chat_id, head_id, max_result=PAGE) if depth is None
+                    else self.database.get_active_path(chat_id, min_depth=depth - PAGE, max_depth=depth - 1, reverse=True))
+            for message in page:
+                cost = count_message_tokens(message)
+                if kept and tokens + cost > budget: return kept
+                kept.append(message)
+                tokens += cost
+            if len(page) < PAGE or page[-1]['level'] == 1: return kept
+            if self.database.get_active_depth(chat_id, head_id) is None: return kept # older pages are range reads of the visible branch
+            depth = page[-1]['level']
+
+    async def summary_until(self, chat_id: int, depth: int) -> Tuple[Optional[IChatSummary], int]:
+        """
+        Summary of the visible branch from the first message down to `depth`, extending the nearest
+        stored one, and the summarization requests it took.
+        """
+        nearest = self.database.get_nearest_summary(chat_id, max_depth=depth)
+        if nearest is not None and nearest['depth'] == depth: return nearest, 0
+        summary: Optional[IChatSummary] = nearest
+        requests = 0
+        pending = self.database.get_active_path(chat_id, min_depth=nearest['depth'] + 1 if nearest is not None else 1, max_depth=depth)
+        while pending:
+            # one request per `summary_input_budget` tokens, each result is stored (a later build starts from it)
+            tokens, size = 0, 0
+            for message in pending:
+                tokens += count_message_tokens(message)
+                if size and tokens > self.summary_input_budget: break
+                size += 1
+            chunk, pending = pending[:size], pending[size:]
+            text = await self.summarizer(summary['summary'] if summary else None, [chat_message(message) for message in chunk])
+            summary = IChatSummary(MessageId=chunk[-1]['MessageId'], ChatId=chat_id, depth=chunk[-1]['level'], summary=text, tokens=count_tokens(text))
+            self.database.save_summary(summary, commit=True)
+            requests += 1
+        return summary, requests
+
+    def summary_depth(self, chat_id: int, kept: List[GetMessages], budget: int) -> int:
+        """Where the summary should end for the messages that fit (newest first): a stored one if it covers enough."""
+        needed = kept[-1]['level'] - 1
+        stored = self.database.get_nearest_summary(chat_id, max_depth=kept[0]['level'] - 1)
+        if stored is not None and stored['depth'] >= needed: return stored['depth']
+        depth, slack = needed, 0
+        for message in kept[:0:-1][:self.summary_step]: # oldest first, never the head
+            slack += count_message_tokens(message)
+            if slack > budget * self.summary_slack: break
+            depth = message['level']
+        return depth
+
+    async def build(self, chat_id: int, head_id: int, reserve: int = 0) -> Context:
+        """History down to `head_id` (included) in `budget - reserve` tokens, e.g. reserve the new user message."""
+        start, summarized = time.perf_counter(), 0
+        budget = max(0, self.budget - reserve)
+        kept = self.newest_first(chat_id, head_id, budget)
+        dropped = kept[-1]['level'] - 1
+        summary: Optional[IChatSummary] = None
+        if dropped > 0 and self.database.get_active_depth(chat_id, head_id) is not None:
+            kept = self.newest_first(chat_id, head_id, max(0, budget - self.summary_tokens))
+            dropped = self.summary_depth(chat_id, kept, budget)
+            kept = [message for message in kept if message['level'] > dropped]
+            try:
+                summary, summarized = await self.summary_until(chat_id, dropped)
+            except Exception as e:
+                logger.error(msg=f"Chat summary failed, sending the history without it: {e}")
+        messages = [chat_message(message) for message in reversed(kept)]
+        if summary is not None:
+            messages.insert(0, {"role": "system", "content": f"Summary of the earlier conversation:\n{summary['summary']}"})
+        return Context(
+            messages=messages,
+            stats=ContextStats(
+                messages=len(kept),
+                dropped=dropped,
+                tokens=sum(count_message_tokens(message) for message in kept) + (summary['tokens'] + MESSAGE_OVERHEAD if summary else 0),
+                summary_tokens=summary['tokens'] if summary else 0,
+                summarized=summarized,
+                build_time=time.perf_counter() - start
+            )
+        )
@@ -0,0 +1,190 @@
+from db.models import IFetchApp, IFetchBaseUrl
+from .batch_classification import BatchItem, ItemKind, app_item, url_item
+from threading import Lock
+from typing import TypedDict, Optional, List, Dict, Tuple
+import numpy as np
+import sqlite3
+import zlib
+import re
+
+#####################################################################################
+#                                   Constants                                       #
+#####################################################################################
+
+N_FEATURES: int = 2**16             # hashed n-gram buckets (power of 2)
+NGRAM_RANGE: Tuple[int, int] = (3, 5)
+MIN_CONFIDENCE: float = 0.1         # margin between the best and 2nd best category, below it the LLM decides
+MIN_SIMILARITY: float = 0.3         # similarity to the best category, below it nothing learned is close enough
+MIN_DOCUMENTS: int = 2              # documents a category needs before the model answers with it...
+MIN_CATEGORIES: int = 2             # ... and categories that have them (with one, the margin is the raw similarity)
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+#####################################################################################
+#                                   Types                                           #
+#####################################################################################
+
+class Prediction(TypedDict):
+    category: Optional[str]
+    similarity: float   # cosine similarity to the category centroid
+    confidence: float   # similarity margin over the 2nd best category
+
+class EmbeddingStats(TypedDict):
+    documents: int
+    categories: int
+    min_confidence: float
+
+SparseVector = Tuple[np.ndarray, np.ndarray] # bucket indices, values
+
+#####################################################################################
+#                                   Features                                        #
+#####################################################################################
+
+def item_text(item: BatchItem) -> str:
+    """Lower cased alphanumeric tokens of every metadata field (names, description, domain, title)."""
+    return ' '.join(TOKEN_PATTERN.findall(' '.join(str(value) for value in item['data'].values()).lower()))
+
+def hashed_ngrams(text: str, n_features: int = N_FEATURES, ngram_range: Tuple[int, int] = NGRAM_RANGE) -> SparseVector:
+    """L2 normalized, sublinear tf of the character n-grams inside word boundaries."""
+    buckets: List[int] = []
+    for word in text.split():
+        padded = f" {word} "
+        for n in range(ngram_range[0], ngram_range[1] + 1):
+            if len(padded) < n: break
+            buckets.extend(zlib.crc32(padded[i:i + n].encode()) & (n_features - 1) for i in range(len(padded) - n + 1))
+    if not buckets: return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    indices, counts = np.unique(np.array(buckets, dtype=np.int64), return_counts=True)
+    values = (1 + np.log(counts)).astype(np.float32)
+    return indices, values / np.linalg.norm(values)
+
+def row_item(kind: ItemKind, row: sqlite3.Row) -> BatchItem:
+    if kind == 'app': return app_item(IFetchApp(**row))
+    return url_item(row['baseURL'], Title=row['Title'], Description=row['Description'])
+
+#####################################################################################
+#                               EmbeddingClassifier                                 #
+#####################################################################################
+
+class EmbeddingClassifier:
+    """
+    Offline nearest-centroid classifier over hashed character n-gram TF-IDF vectors,
+    trained on the apps / baseURLs that already have a Category.
+    Each category keeps the sum of its documents' tf vectors and the document
+    frequencies are counted as they come, so (re)labelling one row is O(its n-grams);
+    the idf weighted centroids are rebuilt lazily on the next prediction.
+    """
+    def __init__(self, n_features: int = N_FEATURES, min_confidence: float = MIN_CONFIDENCE, min_similarity: float = MIN_SIMILARITY,
+                 min_documents: int = MIN_DOCUMENTS, min_categories: int = MIN_CATEGORIES):
+        assert n_features & (n_features - 1) == 0, "n_features must be a power of 2"
+        self.n_features = n_features
+        self.min_confidence = min_confidence
+        self.min_similarity = min_similarity
+        self.min_documents = min_documents
+        self.min_categories = min_categories
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.sums: Dict[str, np.ndarray] = {}
+        self.counts: Dict[str, int] = {}
+        self.df = np.zeros(self.n_features, dtype=np.int32)
+        self.labels: Dict[Tuple[ItemKind, str], Tuple[str, SparseVector]] = {}
+        self.categories: List[str] = []
+        self.centroids: Optional[np.ndarray] = None # (categories, n_features), rows L2 normalized
+        self.idf: Optional[np.ndarray] = None
+
+    def vectorize(self, item: BatchItem) -> SparseVector:
+        return hashed_ngrams(item_text(item), n_features=self.n_features)
+
+    def _update(self, category: str, vector: SparseVector, sign: int) -> None:
+        indices, values = vector
+        if category not in self.sums: self.sums[category], self.counts[category] = np.zeros(self.n_features, dtype=np.float32), 0
+        self.sums[category][indices] += sign * values
+        self.counts[category] += sign
+        self.df[indices] += sign
+        if self.counts[category] == 0: del self.sums[category], self.counts[category]
+        self.centroids = None
+
+    def learn(self, item: BatchItem, category: str) -> None:
+        """Adds the item (or moves it to category if it was learned before)."""
+        vector = self.vectorize(item)
+        with self.lock:
+            self._forget(item['kind'], item['key'])
+            self._update(category, vector, +1)
+            self.labels[(item['kind'], item['key'])] = (category, vector)
+
+    def _forget(self, kind: ItemKind, key: str) -> bool:
+        label = self.labels.pop((kind, key), None)
+        if label is None: return False
+        self._update(label[0], label[1], -1)
+        return True
+
+    def forget(self, kind: ItemKind, key: str) -> bool:
+        with self.lock:
+            return self._forget(kind, key)
+
+    def fit(self, cursor: sqlite3.Cursor) -> int:
+        """Trains from scratch on every categorized app and baseURL, returns the number of documents."""
+        cursor.execute("SELECT * FROM Apps WHERE Category IS NOT NULL")
+        rows: List[Tuple[BatchItem, str]] = [(row_item('app', row), row['Category']) for row in cursor.fetchall()]
+        cursor.execute("SELECT * FROM BaseURLs WHERE Category IS NOT NULL")
+        rows.extend((row_item('url', row), row['Category']) for row in cursor.fetchall())
+        vectors = [(item, category, self.vectorize(item)) for item, category in rows]
+        with self.lock:
+            self.reset()
+            for item, category, vector in vectors:
+                self._update(category, vector, +1)
+                self.labels[(item['kind'], item['key'])] = (category, vector)
+        return len(vectors)
+
+    def sync(self, cursor: sqlite3.Cursor, kind: ItemKind, key: str) -> None:
+        """Relearns one app / baseURL from its row, called after its Category was edited."""
+        if kind == 'app':
+            cursor.execute("SELECT * FROM Apps WHERE AppId = ?", (key, ))
+        else:
+            cursor.execute("SELECT * FROM BaseURLs WHERE baseURL = ?", (key, ))
+        row = cursor.fetchone()
+        if row is None or row['Category'] is None:
+            self.forget(kind, key)
+        else:
+            self.learn(row_item(kind, row), row['Category'])
+
+    def _build(self) -> None:
+        n_docs = len(self.labels)
+        self.idf = (np.log((1 + n_docs) / (1 + self.df)) + 1).astype(np.float32)
+        self.categories = list(self.sums)
+        if not self.categories:
+            self.centroids = np.zeros((0, self.n_features), dtype=np.float32)
+            return
+        centroids = np.stack([self.sums[category] for category in self.categories]) * self.idf
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        self.centroids = centroids / np.where(norms == 0, 1, norms)
+
+    def predict(self, item: BatchItem) -> Prediction:
+        indices, values = self.vectorize(item)
+        with self.lock:
+            if self.centroids is None: self._build()
+            assert self.centroids is not None and self.idf is not None
+            if not self.categories or len(indices) == 0: return Prediction(category=None, similarity=0.0, confidence=0.0)
+            weighted = values * self.idf[indices]
+            similarities = self.centroids[:, indices] @ (weighted / np.linalg.norm(weighted))
+            categories = self.categories
+        order = np.argsort(similarities)[::-1]
+        best = float(similarities[order[0]])
+        second = float(similarities[order[1]]) if len(order) > 1 else 0.0
+        return Prediction(category=categories[order[0]], similarity=best, confidence=best - second)
+
+    def confident(self, prediction: Prediction) -> bool:
+        """
+        Whether the prediction can be used without the LLM: close to its category, ahead of the 2nd best,
+        and the model knows enough (cold start: the first labels learned would be applied to anything similar).
+        """
+        category = prediction['category']
+        if category is None or prediction['similarity'] < self.min_similarity or prediction['confidence'] < self.min_confidence:
+            return False
+        with self.lock:
+            if self.counts.get(category, 0) < self.min_documents: return False
+            return sum(count >= self.min_documents for count in self.counts.values()) >= self.min_categories
+
+    def stats(self) -> EmbeddingStats:
+        with self.lock:
+            return EmbeddingStats(documents=len(self.labels), categories=len(self.sums), min_confidence=self.min_confidence)
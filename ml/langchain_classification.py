@@ -7,17 +7,11 @@ import json
 import os
 import time
 from typing import Optional, List, Literal, Dict
-from pydantic.v1 import BaseModel, Field
-from langchain_groq import ChatGroq
+from .providers import get_provider
 
 # database = get_database()
 
 
-model = ChatGroq(
-    api_key=os.environ["GROQ_API_KEY"],
-    model="llama-3.3-70b-versatile"
-)
-
 def filter_app_info(app_info: Dict, removed_keys: List[str]) -> dict:
     return {k: v for k, v in app_info.items() if k not in removed_keys}
 
@@ -35,40 +29,27 @@ def add_new_category(cursor: sqlite3.Cursor, conn: sqlite3.Connection, category:
 
     if commit: conn.commit()
 
-def classify_new_app(cursor: sqlite3.Cursor, conn: sqlite3.Connection, iApp: IApp, commit: bool = True) -> str:
-    cursor.execute("""--sql
-        SELECT Category FROM Apps WHERE AppId = ?
-        """, (iApp['AppId'], )
-    )
-    exists = cursor.fetchone()
-    if exists and exists['Category']:
-        return exists['Category']
-
-    categories: List[str] = get_current_category(cursor=cursor)
-    class Category(BaseModel):
-        """Category Model to classify the App."""
-        Category: str = Field(description=f"Classify the App in the following list [{' | '.join(categories)}], you can create a new category also if no sutable category founds.")
-    
-    structured_llm = model.with_structured_output(Category, method="json_mode")
+def predict_app_category(iApp: IApp, categories: List[str]) -> str:
+    """LLM round trip only, no database access (used by the classification worker pool)."""
     app_info = {
             "AppId": iApp['AppId'],
             "ExeFileName": iApp['ExeFileName'],
             "ExeDirName": iApp['ExeDirName'],
             "IsBrowser": iApp['IsBrowser'],
-            "CompanyName": iApp['CompanyName'],
-            "ProductName": iApp['ProductName'],
-            "FileVersion": iApp['FileVersion'],
-            "ProductVersion": iApp['ProductVersion'],
-            "FileDescription": iApp['FileDescription'],
-            "InternalName": iApp['InternalName'],
-            "LegalCopyright": iApp['LegalCopyright'],
-            "LegalTrademarks": iApp['LegalTrademarks'],
-            "OriginalFilename": iApp['OriginalFilename'],
-            "Comments": iApp['Comments'],
-            "PrivateBuild": iApp['PrivateBuild'],
-            "SpecialBuild": iApp['SpecialBuild']
+            "CompanyName": iApp.get('CompanyName'),
+            "ProductName": iApp.get('ProductName'),
+            "FileVersion": iApp.get('FileVersion'),
+            "ProductVersion": iApp.get('ProductVersion'),
+            "FileDescription": iApp.get('FileDescription'),
+            "InternalName": iApp.get('InternalName'),
+            "LegalCopyright": iApp.get('LegalCopyright'),
+            "LegalTrademarks": iApp.get('LegalTrademarks'),
+            "OriginalFilename": iApp.get('OriginalFilename'),
+            "Comments": iApp.get('Comments'),
+            "PrivateBuild": iApp.get('PrivateBuild'),
+            "SpecialBuild": iApp.get('SpecialBuild')
     }
-    response: Category = structured_llm.invoke(
+    response = get_provider().complete_json(
         f"""
         Based on the following metadata extracted from an app, classify it into one of the following categories: [{' | '.join(categories)}]. 
         If none of the existing categories fit, feel free to create a new one. do not provide any brief explanation of why you chose this category. Here's the app's metadata:
@@ -83,36 +64,35 @@ def classify_new_app(cursor: sqlite3.Cursor, conn: sqlite3.Connection, iApp: IAp
         }}
         """,
     )
-    logger.debug(f"App Classification GROQ: {response}")
-    if response.Category not in categories:
-        add_new_category(cursor, conn, response.Category, commit=False)
-    
-    cursor.execute("""--sql
-        UPDATE Apps 
-        SET Category = ?
-        WHERE AppId = ?
-        """, (response.Category, iApp['AppId'])
-    )
-    if commit: conn.commit()
-    return response.Category
+    logger.debug(f"App Classification LLM: {response}")
+    return str(response['Category'])
 
-def clssify_new_url(cursor: sqlite3.Cursor, conn: sqlite3.Connection, baseURL: str, Title: Optional[str] = None, Description: Optional[str] = None, commit: bool = True) -> str:
+def classify_new_app(cursor: sqlite3.Cursor, conn: sqlite3.Connection, iApp: IApp, commit: bool = True) -> str:
     cursor.execute("""--sql
-        SELECT Category FROM baseUrls WHERE baseURL = ?
-        """, (baseURL, )
+        SELECT Category FROM Apps WHERE AppId = ?
+        """, (iApp['AppId'], )
     )
     exists = cursor.fetchone()
     if exists and exists['Category']:
         return exists['Category']
 
     categories: List[str] = get_current_category(cursor=cursor)
-    class Category(BaseModel):
-        """Category Model to classify the URL."""
-        Category: str = Field(description=f"Classify the URL in one of the following categories [{' | '.join(categories)}]. If none fits, feel free to create a new category and explain why.")
-
-    structured_llm = model.with_structured_output(Category, method="json_mode")
+    category = predict_app_category(iApp, categories)
+    if category not in categories:
+        add_new_category(cursor, conn, category, commit=False)
     
-    response: Category = structured_llm.invoke(
+    cursor.execute("""--sql
+        UPDATE Apps 
+        SET Category = ?
+        WHERE AppId = ?
+        """, (category, iApp['AppId'])
+    )
+    if commit: conn.commit()
+    return category
+
+def predict_url_category(baseURL: str, Title: Optional[str], Description: Optional[str], categories: List[str]) -> str:
+    """LLM round trip only, no database access (used by the classification worker pool)."""
+    response = get_provider().complete_json(
         f"""
         Based on the following metadata extracted from a URL, classify it into one of the following categories: [{' | '.join(categories)}]. 
         If none of the existing categories fit, feel free to create a new one. do not provide any brief explanation of why you chose this category.
@@ -131,15 +111,28 @@ def clssify_new_url(cursor: sqlite3.Cursor, conn: sqlite3.Connection, baseURL: s
         }}
         """,
     )
-    logger.debug(f"Url Classification GROQ: {response}")
-    if response.Category not in categories:
-        add_new_category(cursor, conn, response.Category, commit=False)
+    logger.debug(f"Url Classification LLM: {response}")
+    return str(response['Category'])
+
+def clssify_new_url(cursor: sqlite3.Cursor, conn: sqlite3.Connection, baseURL: str, Title: Optional[str] = None, Description: Optional[str] = None, commit: bool = True) -> str:
+    cursor.execute("""--sql
+        SELECT Category FROM baseUrls WHERE baseURL = ?
+        """, (baseURL, )
+    )
+    exists = cursor.fetchone()
+    if exists and exists['Category']:
+        return exists['Category']
+
+    categories: List[str] = get_current_category(cursor=cursor)
+    category = predict_url_category(baseURL, Title, Description, categories)
+    if category not in categories:
+        add_new_category(cursor, conn, category, commit=False)
     
     cursor.execute("""--sql
         UPDATE baseUrls 
         SET Category = ?
         WHERE baseURL = ?
-        """, (response.Category, baseURL)
+        """, (category, baseURL)
     )
     if commit: conn.commit()
-    return response.Category
\ No newline at end of file
+    return category
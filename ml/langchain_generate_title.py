@@ -1,25 +1,9 @@
-from pydantic.v1 import BaseModel, Field
-from langchain_groq import ChatGroq
-from langchain.prompts import PromptTemplate
-from langchain.chains.llm import LLMChain
-import os
+from .providers import get_provider
 
-model = ChatGroq(
-    api_key=os.environ["GROQ_API_KEY"],
-    model="llama-3.3-70b-versatile"
-)
-
-class TitleResponse(BaseModel):
-    title: str = Field(..., description="A short, concise and catchy title for the user query")
-
-
-# Initialize the LLMChain with the model and the prompt template
-structured_llm = model.with_structured_output(TitleResponse, method="json_mode")
-
-# Function to generate the title using LangChain
+# Function to generate the title through the configured provider (ml/providers.py)
 async def generate_title(user_query: str) -> str:
     # Get the title from the model
-    response: TitleResponse = await structured_llm.ainvoke(
+    response = await get_provider().acomplete_json(
         f"""
         Generate a short, concise and catchy title for the following query:
         {user_query}
@@ -30,4 +14,4 @@ async def generate_title(user_query: str) -> str:
         }}
         """
     )
-    return response.title
+    return str(response['title'])
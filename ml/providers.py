@@ -0,0 +1,203 @@
+import asyncio
+import json
+import os
+import time
+from contextlib import contextmanager, asynccontextmanager
+from threading import Lock, BoundedSemaphore
+from typing import TypedDict, Optional, List, Dict, Any, Iterator, AsyncIterator, Tuple, TYPE_CHECKING
+from weakref import WeakKeyDictionary
+import httpx
+
+from db.helpers import logger
+
+if TYPE_CHECKING:
+    from openai import OpenAI, AsyncOpenAI
+    from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+#####################################################################################
+#                                   Constants                                       #
+#####################################################################################
+
+PROVIDER_ENV = "EFFICIA_LLM_PROVIDER"       # name of the provider every LLM path uses, 'groq' by default
+STANDIN_URL_ENV = "EFFICIA_STANDIN_URL"     # base url of the local stand-in server (ml/standin_server.py)
+DEFAULT_PROVIDER = 'groq'
+
+#####################################################################################
+#                                   Types                                           #
+#####################################################################################
+
+class ProviderConfig(TypedDict):
+    base_url: str
+    api_key_env: Optional[str] # environment variable holding the key, None if no key is needed
+    model: str
+    max_concurrency: int    # requests in flight, also the size of the connection pool
+    timeout: float          # sec per network operation
+    connect_timeout: float
+    max_retries: int
+
+class ProviderStats(TypedDict):
+    name: str
+    model: str
+    requests: int
+    errors: int
+    in_flight: int
+    max_in_flight: int
+    latency_avg: Optional[float] # sec per request, whole stream included
+
+PROVIDERS: Dict[str, ProviderConfig] = {
+    'groq': ProviderConfig(
+        base_url="https://api.groq.com/openai/v1", api_key_env="GROQ_API_KEY", model="llama-3.3-70b-versatile",
+        max_concurrency=8, timeout=60.0, connect_timeout=5.0, max_retries=2
+    ),
+    'local': ProviderConfig(
+        base_url=os.environ.get(STANDIN_URL_ENV, "http://127.0.0.1:8765/v1"), api_key_env=None, model="standin",
+        max_concurrency=64, timeout=30.0, connect_timeout=2.0, max_retries=0
+    ),
+}
+
+#####################################################################################
+#                                   Provider                                        #
+#####################################################################################
+
+class Provider:
+    """
+    One OpenAI compatible chat completion endpoint shared by every LLM path (classification,
+    chat titles, the chatbot): pooled http clients built on first use (the openai package is
+    imported then, not at import time), a concurrency limit and timeouts per provider.
+    The sync client is shared by all threads, async clients are kept per event loop.
+    """
+    def __init__(self, name: str, config: ProviderConfig):
+        self.name = name
+        self.config = config
+        self.model = config['model']
+        self._client: Optional['OpenAI'] = None
+        self._async: 'WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[AsyncOpenAI, asyncio.Semaphore]]' = WeakKeyDictionary()
+        self._semaphore = BoundedSemaphore(config['max_concurrency'])
+        self._lock = Lock()
+        self.requests, self.errors, self.in_flight, self.max_in_flight, self.latency = 0, 0, 0, 0, 0.0
+
+    def client_options(self) -> Dict[str, Any]:
+        api_key_env = self.config['api_key_env']
+        return dict(
+            base_url=self.config['base_url'],
+            api_key=os.environ.get(api_key_env) if api_key_env else self.name,
+            timeout=httpx.Timeout(self.config['timeout'], connect=self.config['connect_timeout']),
+            max_retries=self.config['max_retries']
+        )
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=self.config['max_concurrency'], max_keepalive_connections=self.config['max_concurrency'])
+
+    @property
+    def client(self) -> 'OpenAI':
+        with self._lock:
+            if self._client is None:
+                from openai import OpenAI
+                self._client = OpenAI(**self.client_options(), http_client=httpx.Client(limits=self.limits()))
+            return self._client
+
+    def async_client(self) -> Tuple['AsyncOpenAI', asyncio.Semaphore]:
+        """Client and concurrency limit of the running event loop (connections can not move between loops)."""
+        loop = asyncio.get_running_loop()
+        if loop not in self._async:
+            from openai import AsyncOpenAI
+            client = AsyncOpenAI(**self.client_options(), http_client=httpx.AsyncClient(limits=self.limits()))
+            self._async[loop] = (client, asyncio.Semaphore(self.config['max_concurrency']))
+        return self._async[loop]
+
+    def _started(self) -> float:
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return time.perf_counter()
+
+    def _finished(self, start: float, failed: bool) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self.latency += time.perf_counter() - start
+            if failed: self.errors += 1
+
+    @contextmanager
+    def limit(self) -> Iterator[None]:
+        """Holds one of the provider's request slots (blocking), for callers using `client` directly."""
+        with self._semaphore:
+            start, failed = self._started(), True
+            try:
+                yield
+                failed = False
+            finally:
+                self._finished(start, failed)
+
+    @asynccontextmanager
+    async def alimit(self) -> AsyncIterator['AsyncOpenAI']:
+        client, semaphore = self.async_client()
+        async with semaphore:
+            start, failed = self._started(), True
+            try:
+                yield client
+                failed = False
+            finally:
+                self._finished(start, failed)
+
+    def create(self, messages: List[Dict[str, str]], **kwargs) -> 'ChatCompletion':
+        with self.limit():
+            return self.client.chat.completions.create(model=self.model, messages=messages, **kwargs) # type: ignore
+
+    async def acreate(self, messages: List[Dict[str, str]], **kwargs) -> 'ChatCompletion':
+        async with self.alimit() as client:
+            return await client.chat.completions.create(model=self.model, messages=messages, **kwargs) # type: ignore
+
+    async def astream(self, messages: List[Dict[str, str]], **kwargs) -> AsyncIterator['ChatCompletionChunk']:
+        """Chunks of a streamed completion, the request slot is held until the stream ends (or is closed early)."""
+        async with self.alimit() as client:
+            stream = await client.chat.completions.create(model=self.model, messages=messages, stream=True, **kwargs) # type: ignore
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.close() # a consumer that stops early cancels the upstream request
+
+    def complete_json(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        response = self.create([{"role": "user", "content": prompt}], response_format={"type": "json_object"}, **kwargs)
+        return json.loads(response.choices[0].message.content or '{}')
+
+    async def acomplete_json(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        response = await self.acreate([{"role": "user", "content": prompt}], response_format={"type": "json_object"}, **kwargs)
+        return json.loads(response.choices[0].message.content or '{}')
+
+    def stats(self) -> ProviderStats:
+        with self._lock:
+            return ProviderStats(
+                name=self.name,
+                model=self.model,
+                requests=self.requests,
+                errors=self.errors,
+                in_flight=self.in_flight,
+                max_in_flight=self.max_in_flight,
+                latency_avg=self.latency / (self.requests - self.in_flight) if self.requests > self.in_flight else None
+            )
+
+#####################################################################################
+#                                   Registry                                        #
+#####################################################################################
+
+_providers: Dict[str, Provider] = {}
+_providers_lock = Lock()
+_override: Optional[Provider] = None
+
+def get_provider(name: Optional[str] = None) -> Provider:
+    """The provider every LLM path should use: `name`, else $EFFICIA_LLM_PROVIDER, else groq."""
+    if name is None and _override is not None: return _override
+    name = name or os.environ.get(PROVIDER_ENV, DEFAULT_PROVIDER)
+    with _providers_lock:
+        if name not in _providers:
+            if name not in PROVIDERS: raise KeyError(f"Unknown LLM provider {name!r}, expected one of {sorted(PROVIDERS)}")
+            _providers[name] = Provider(name, PROVIDERS[name])
+            logger.info(msg=f"LLM provider: {name} ({PROVIDERS[name]['model']} @ {PROVIDERS[name]['base_url']})")
+        return _providers[name]
+
+def set_provider(provider: Optional[Provider]) -> None:
+    """Makes `provider` the default (None restores the configured one), e.g. a stand-in for load tests."""
+    global _override
+    _override = provider
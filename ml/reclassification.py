@@ -0,0 +1,233 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Thread, Event
+from typing import TypedDict, Optional, List, Dict, Tuple, Union, Callable, Any
+import sqlite3
+import time
+
+from db import DataBase, logger
+from db import classification_cache
+from db.models import (
+    IFetchApp, IFetchBaseUrl, ClassificationKind, IReclassificationRun, IFetchReclassificationRun, IReclassificationChange
+)
+from .batch_classification import BatchClassifier, BatchItem, app_item, url_item
+from .classification_worker import IClassifier
+
+#####################################################################################
+#                                   Constants                                       #
+#####################################################################################
+
+WORKERS: int = 4
+CHUNK_SIZE: int = 32    # items per classifier call (BatchClassifier) and per write transaction
+
+#####################################################################################
+#                                   Types                                           #
+#####################################################################################
+
+class Selected(TypedDict):
+    """One app / baseURL picked for reclassification."""
+    kind: ClassificationKind
+    key: str # AppId or baseURL
+    old: Optional[str] # Category when selected
+    row: Union[IFetchApp, IFetchBaseUrl]
+
+ChunkResult = Tuple[List[Selected], Dict[Tuple[ClassificationKind, str], str], int] # chunk, new categories, failed
+
+#####################################################################################
+#                                   Runs                                            #
+#####################################################################################
+
+def selected_item(selected: Selected) -> BatchItem:
+    if selected['kind'] == 'app': item = app_item(selected['row']) # type: ignore
+    else: item = url_item(selected['key'], Title=selected['row']['Title'], Description=selected['row']['Description'])
+    item['key'] = f"{selected['kind']}:{selected['key']}" # unique across kinds
+    return item
+
+def create_run(cursor: sqlite3.Cursor, run: IReclassificationRun) -> int:
+    cursor.execute("""--sql
+    INSERT INTO ReclassificationRuns (Scope, Category, Kinds, DryRun, IncludeManual) VALUES (?, ?, ?, ?, ?)
+    """, (run['Scope'], run['Category'], run['Kinds'], run['DryRun'], run['IncludeManual']))
+    assert cursor.lastrowid is not None
+    return cursor.lastrowid
+
+def get_run(cursor: sqlite3.Cursor, run_id: int) -> Optional[IFetchReclassificationRun]:
+    cursor.execute("SELECT * FROM ReclassificationRuns WHERE RunId = ?", (run_id, ))
+    row = cursor.fetchone()
+    return IFetchReclassificationRun(**row) if row is not None else None
+
+def get_changes(cursor: sqlite3.Cursor, run_id: int, limit: int = 100, offset: int = 0) -> List[IReclassificationChange]:
+    cursor.execute("""--sql
+    SELECT * FROM ReclassificationChanges WHERE RunId = ? ORDER BY Kind, Key LIMIT ? OFFSET ?
+    """, (run_id, limit, offset))
+    return [IReclassificationChange(**row) for row in cursor.fetchall()]
+
+def select_items(cursor: sqlite3.Cursor, run: IReclassificationRun) -> List[Selected]:
+    """Apps / baseURLs in the run's scope, without manual choices unless IncludeManual."""
+    condition, params = {
+        'all': ("1", ()),
+        'uncategorized': ("Category IS NULL", ()),
+        'category': ("Category = ?", (run['Category'], ))
+    }[run['Scope']]
+    manual: set = set()
+    if not run['IncludeManual']:
+        cursor.execute("SELECT CacheKey FROM ClassificationCache WHERE Source = 'user'")
+        manual = {row['CacheKey'] for row in cursor.fetchall()}
+    selected: List[Selected] = []
+    kinds = run['Kinds'].split(',')
+    if 'app' in kinds:
+        cursor.execute(f"SELECT * FROM Apps WHERE {condition} ORDER BY AppId", params)
+        for row in cursor.fetchall():
+            if classification_cache.app_key(row) in manual: continue
+            selected.append(Selected(kind='app', key=row['AppId'], old=row['Category'], row=IFetchApp(**row)))
+    if 'url' in kinds:
+        cursor.execute(f"SELECT * FROM BaseURLs WHERE {condition} ORDER BY baseURL", params)
+        for row in cursor.fetchall():
+            if classification_cache.url_keys(row['baseURL'])[0] in manual: continue
+            selected.append(Selected(kind='url', key=row['baseURL'], old=row['Category'], row=IFetchBaseUrl(**row)))
+    return selected
+
+def set_category(cursor: sqlite3.Cursor, kind: ClassificationKind, key: str, old: Optional[str], new: str) -> bool:
+    """Compare and set, so an edit made while the run was going on is never overwritten."""
+    cursor.execute("INSERT OR IGNORE INTO Categories (Category, BlockId) VALUES (?, NULL)", (new, ))
+    if kind == 'app':
+        cursor.execute("UPDATE Apps SET Category = ? WHERE AppId = ? AND Category IS ?", (new, key, old))
+    else:
+        cursor.execute("UPDATE BaseURLs SET Category = ? WHERE baseURL = ? AND Category IS ?", (new, key, old))
+    if cursor.rowcount != 1: return False
+    if kind == 'app':
+        cursor.execute("SELECT * FROM Apps WHERE AppId = ?", (key, ))
+        classification_cache.store_app(cursor, cursor.fetchone(), new, 'llm')
+    else:
+        classification_cache.store_url(cursor, key, new, 'llm')
+    return True
+
+def apply_changes(database: DataBase, run_id: int, chunk_size: int = CHUNK_SIZE) -> int:
+    """Writes the changes of a dry run, one transaction per chunk, returns how many were applied."""
+    applied = 0
+    last: Tuple[str, str] = ('', '')
+    while True:
+        with database.cursor_context() as cursor:
+            cursor.execute("""--sql
+            SELECT * FROM ReclassificationChanges
+            WHERE RunId = ? AND NOT Applied AND (Kind, Key) > (?, ?)
+            ORDER BY Kind, Key LIMIT ?
+            """, (run_id, *last, chunk_size))
+            changes = [IReclassificationChange(**row) for row in cursor.fetchall()]
+            if not changes: break
+            for change in changes:
+                if not set_category(cursor, change['Kind'], change['Key'], change['OldCategory'], change['NewCategory']): continue
+                cursor.execute("""--sql
+                UPDATE ReclassificationChanges SET Applied = TRUE WHERE RunId = ? AND Kind = ? AND Key = ?
+                """, (run_id, change['Kind'], change['Key']))
+                applied += 1
+            database.commit()
+        last = (changes[-1]['Kind'], changes[-1]['Key'])
+    with database.cursor_context() as cursor:
+        cursor.execute("UPDATE ReclassificationRuns SET Status = 'applied' WHERE RunId = ?", (run_id, ))
+        database.commit()
+    return applied
+
+#####################################################################################
+#                               ReclassificationJob                                 #
+#####################################################################################
+
+class ReclassificationJob:
+    """
+    Reclassifies the selection of a ReclassificationRuns row on a background thread:
+    chunks are classified on a bounded thread pool and every finished chunk is written
+    in its own transaction together with the run's progress, so progress is visible
+    (and a cancel takes effect) between chunks. A dry run only records the changes.
+    """
+    def __init__(self, db_path: str, classifier: Union[IClassifier, BatchClassifier], run_id: int,
+                 workers: int = WORKERS, chunk_size: int = CHUNK_SIZE,
+                 on_done: Optional[Callable[[sqlite3.Cursor], Any]] = None):
+        self.db_path = db_path
+        self.classifier = classifier
+        self.run_id = run_id
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.on_done = on_done
+        self.cancel_event = Event()
+        self.thread: Optional[Thread] = None
+
+    def classify_chunk(self, chunk: List[Selected], categories: List[str]) -> ChunkResult:
+        results: Dict[Tuple[ClassificationKind, str], str] = {}
+        if self.cancel_event.is_set(): return chunk, results, 0
+        if isinstance(self.classifier, BatchClassifier):
+            batch = self.classifier.classify([selected_item(selected) for selected in chunk], categories)
+            for key, category in batch['categories'].items():
+                kind, _, name = key.partition(':')
+                results[(kind, name)] = category # type: ignore
+        else:
+            for selected in chunk:
+                try:
+                    if selected['kind'] == 'app': category = self.classifier.classify_app(selected['row'], categories) # type: ignore
+                    else: category = self.classifier.classify_url(selected['row'], categories) # type: ignore
+                except Exception as e:
+                    logger.error(msg=f"Reclassification error: {e} <= {selected['key']}")
+                    continue
+                if category: results[(selected['kind'], selected['key'])] = category
+        return chunk, results, len(chunk) - len(results)
+
+    def write_chunk(self, cursor: sqlite3.Cursor, run: IFetchReclassificationRun, result: ChunkResult) -> None:
+        chunk, categories, failed = result
+        changed = 0
+        for selected in chunk:
+            new = categories.get((selected['kind'], selected['key']))
+            if not new or new == selected['old']: continue
+            if not run['DryRun'] and not set_category(cursor, selected['kind'], selected['key'], selected['old'], new): continue
+            cursor.execute("""--sql
+            INSERT OR REPLACE INTO ReclassificationChanges (RunId, Kind, Key, OldCategory, NewCategory, Applied)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """, (self.run_id, selected['kind'], selected['key'], selected['old'], new, not run['DryRun']))
+            changed += 1
+        cursor.execute("""--sql
+        UPDATE ReclassificationRuns SET Processed = Processed + ?, Changed = Changed + ?, Failed = Failed + ? WHERE RunId = ?
+        """, (len(chunk), changed, failed, self.run_id))
+
+    def run(self) -> None:
+        database = DataBase(db_path=self.db_path, check_create_table=False, check_same_thread=False)
+        status, error = 'done', None
+        try:
+            with database.cursor_context() as cursor:
+                run = get_run(cursor, self.run_id)
+                assert run is not None, f"ReclassificationRun {self.run_id} does not exist"
+                selected = select_items(cursor, run)
+                cursor.execute("SELECT Category FROM Categories")
+                categories = [row['Category'] for row in cursor.fetchall()]
+                cursor.execute("UPDATE ReclassificationRuns SET Total = ? WHERE RunId = ?", (len(selected), self.run_id))
+                database.commit()
+            chunks = [selected[i:i + self.chunk_size] for i in range(0, len(selected), self.chunk_size)]
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="Reclassifier") as executor:
+                futures = [executor.submit(self.classify_chunk, chunk, categories) for chunk in chunks]
+                for future in as_completed(futures):
+                    if self.cancel_event.is_set():
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        break
+                    with database.cursor_context() as cursor:
+                        self.write_chunk(cursor, run, future.result())
+                        database.commit()
+            if self.cancel_event.is_set(): status = 'cancelled'
+        except Exception as e:
+            status, error = 'failed', f"{type(e).__name__}: {e}"
+            logger.error(msg=f"Reclassification run {self.run_id} failed: {error}")
+        finally:
+            with database.cursor_context() as cursor:
+                cursor.execute("""--sql
+                UPDATE ReclassificationRuns SET Status = ?, Error = ?, FinishedAt = ? WHERE RunId = ?
+                """, (status, error, time.time(), self.run_id))
+                database.commit()
+                if self.on_done is not None: self.on_done(cursor)
+            database.close()
+
+    def start(self) -> None:
+        self.thread = Thread(target=self.run, name=f"Reclassification-{self.run_id}", daemon=True)
+        self.thread.start()
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        if self.thread is not None: self.thread.join(timeout)
+
+    def is_alive(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
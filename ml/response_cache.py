@@ -0,0 +1,201 @@
+"""
+Chat completions already answered, in front of the provider: the same formatted message list to the
+same model (a repeated question, in a new chat too) is answered from memory and replayed as a token
+stream, so the chat UI gets the frames it gets from the model. Opt in ($EFFICIA_CHAT_CACHE_NEAR=1),
+a last user turn that is a near duplicate of a cached one (same history before it) is answered too.
+"""
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import TypedDict, NamedTuple, Optional, List, Dict, Any, Iterable, AsyncIterator, Callable, Literal
+import numpy as np
+
+from .embedding_classifier import hashed_ngrams, SparseVector, TOKEN_PATTERN
+from .context_builder import PIECE
+
+#####################################################################################
+#                                   Constants                                       #
+#####################################################################################
+
+NEAR_DUPLICATES_ENV = "EFFICIA_CHAT_CACHE_NEAR" # '1': answer near duplicate questions from the cache too
+MAX_ENTRIES: int = 1024
+MAX_BYTES: int = 16 * 2**20     # of cached answers (utf-8)
+MAX_ENTRY_BYTES: int = 256 * 2**10 # longer answers are not cached
+NEAR_SIMILARITY: float = 0.9    # cosine similarity of the char n-grams of two last user turns to be near duplicates
+REPLAY_PIECES: int = 64         # pieces replayed between two yields to the event loop
+
+#####################################################################################
+#                                   Types                                           #
+#####################################################################################
+
+class CacheKey(NamedTuple):
+    exact: str                  # hash of model, parameters and every message
+    context: str                # hash of model, parameters and the messages before the last user turn
+    vector: Optional[SparseVector] # of the last user turn, None without near duplicates
+
+class CachedResponse(TypedDict):
+    text: str
+    match: Literal['exact', 'near']
+    similarity: float
+
+class ResponseCacheStats(TypedDict):
+    entries: int
+    bytes: int
+    max_entries: int
+    max_bytes: int
+    near_duplicates: bool
+    hits: int
+    near_hits: int
+    misses: int
+    skipped: int        # cached answer already shown under the question (a regenerate), asked the model
+    stored: int
+    evictions: int
+    hit_rate: Optional[float]
+
+class Entry(NamedTuple):
+    key: CacheKey
+    text: str
+    size: int
+
+#####################################################################################
+#                                   Keys                                            #
+#####################################################################################
+
+def digest(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':')).encode()).hexdigest()
+
+def turn_vector(text: str) -> SparseVector:
+    return hashed_ngrams(' '.join(TOKEN_PATTERN.findall(text.lower())))
+
+def similarity(a: SparseVector, b: SparseVector) -> float:
+    """Cosine similarity of two L2 normalized sparse vectors."""
+    _, ia, ib = np.intersect1d(a[0], b[0], assume_unique=True, return_indices=True)
+    return float(np.dot(a[1][ia], b[1][ib]))
+
+def pieces(text: str) -> List[str]:
+    """`text` cut like the model streams it (roughly one token each)."""
+    return PIECE.findall(text) or [text]
+
+#####################################################################################
+#                                   ResponseCache                                   #
+#####################################################################################
+
+class ResponseCache:
+    """
+    LRU of complete answers by CacheKey, bounded by entries and bytes. Only answers the model finished
+    are stored (`record`), not a stream cut by an error or a disconnected client. Near duplicates are
+    looked up among the entries with the same context hash only, so a lookup compares a few vectors.
+    """
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES, near_duplicates: Optional[bool] = None,
+                 near_similarity: float = NEAR_SIMILARITY):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.near_duplicates = os.environ.get(NEAR_DUPLICATES_ENV) == '1' if near_duplicates is None else near_duplicates
+        self.near_similarity = near_similarity
+        self.lock = Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries: "OrderedDict[str, Entry]" = OrderedDict()
+            self.contexts: Dict[str, Dict[str, SparseVector]] = {} # context hash -> exact hash -> vector
+            self.bytes = 0
+            self.hits = self.near_hits = self.misses = self.skipped = self.stored = self.evictions = 0
+
+    def key(self, messages: List[Dict[str, str]], model: str, params: Optional[Dict[str, Any]] = None) -> CacheKey:
+        params = params or {}
+        last = len(messages) - 1
+        while last >= 0 and messages[last]['role'] != 'user': last -= 1
+        context = digest({'model': model, 'params': params, 'messages': messages[:max(last, 0)], 'tail': messages[last + 1:]})
+        return CacheKey(
+            exact=digest({'model': model, 'params': params, 'messages': messages}),
+            context=context,
+            vector=turn_vector(messages[last]['content']) if self.near_duplicates and last >= 0 else None
+        )
+
+    def get(self, key: CacheKey, exclude: Iterable[str] = ()) -> Optional[CachedResponse]:
+        """The cached answer for `key` (an exact match first), none of `exclude` (answers the user already has)."""
+        exclude = set(exclude)
+        with self.lock:
+            entry = self.entries.get(key.exact)
+            if entry is not None and entry.text not in exclude:
+                self.entries.move_to_end(key.exact)
+                self.hits += 1
+                return CachedResponse(text=entry.text, match='exact', similarity=1.0)
+            best, best_similarity = None, self.near_similarity
+            if key.vector is not None:
+                for exact, vector in self.contexts.get(key.context, {}).items():
+                    if exact == key.exact or self.entries[exact].text in exclude: continue
+                    if (value := similarity(key.vector, vector)) >= best_similarity: best, best_similarity = exact, value
+            if best is not None:
+                self.entries.move_to_end(best)
+                self.near_hits += 1
+                return CachedResponse(text=self.entries[best].text, match='near', similarity=best_similarity)
+            if entry is not None: self.skipped += 1
+            else: self.misses += 1
+            return None
+
+    def put(self, key: CacheKey, text: str) -> bool:
+        size = len(text.encode())
+        if not text or size > min(MAX_ENTRY_BYTES, self.max_bytes): return False
+        with self.lock:
+            self._remove(key.exact)
+            self.entries[key.exact] = Entry(key, text, size)
+            self.bytes += size
+            if key.vector is not None: self.contexts.setdefault(key.context, {})[key.exact] = key.vector
+            self.stored += 1
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+        return True
+
+    def _remove(self, exact: str) -> None:
+        entry = self.entries.pop(exact, None)
+        if entry is None: return
+        self.bytes -= entry.size
+        vectors = self.contexts.get(entry.key.context)
+        if vectors is not None:
+            vectors.pop(exact, None)
+            if not vectors: del self.contexts[entry.key.context]
+
+    async def record(self, key: CacheKey, texts: AsyncIterator[str], cacheable: Optional[Callable[[], bool]] = None) -> AsyncIterator[str]:
+        """
+        Passes the texts of a model's stream through, stores the answer once the stream ended (not if it
+        was closed early) if `cacheable()` then (an answer grounded in tool results is not: the data moves on).
+        """
+        parts: List[str] = []
+        try:
+            async for text in texts:
+                parts.append(text)
+                yield text
+        finally:
+            aclose = getattr(texts, 'aclose', None)
+            if aclose is not None: await aclose()
+        if cacheable is None or cacheable(): self.put(key, ''.join(parts))
+
+    async def replay(self, cached: CachedResponse) -> AsyncIterator[str]:
+        """The cached answer as a token stream (the frames of ChatStream are the same as the model's)."""
+        for i, piece in enumerate(pieces(cached['text'])):
+            if i and i % REPLAY_PIECES == 0: await asyncio.sleep(0)
+            yield piece
+
+    def stats(self) -> ResponseCacheStats:
+        with self.lock:
+            lookups = self.hits + self.near_hits + self.misses + self.skipped
+            return ResponseCacheStats(
+                entries=len(self.entries),
+                bytes=self.bytes,
+                max_entries=self.max_entries,
+                max_bytes=self.max_bytes,
+                near_duplicates=self.near_duplicates,
+                hits=self.hits,
+                near_hits=self.near_hits,
+                misses=self.misses,
+                skipped=self.skipped,
+                stored=self.stored,
+                evictions=self.evictions,
+                hit_rate=(self.hits + self.near_hits) / lookups if lookups else None
+            )
@@ -0,0 +1,207 @@
+"""
+Deterministic local stand-in for an OpenAI compatible chat completion api, so every LLM
+path (classification, chat titles, the chatbot) can be run and load tested offline.
+
+    python -m ml.standin_server [--port 8765] [--tokens-per-second 50] [--latency 0.2]
+    EFFICIA_LLM_PROVIDER=local python run_api.py
+
+Answers depend on the request only: json mode requests get the json the caller's prompt
+asks for (batch classification results, {"Category": ...} or {"title": ...}), a request
+with tools whose last user turn names one (`top_apps` <- "my top apps") a call of it, and
+anything else a short text reply (after tool results: a reply citing them). Streams are
+sent token by token at `tokens_per_second`.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+from typing import List, Dict, Any, Optional
+from zlib import crc32
+import argparse
+import json
+import re
+import time
+
+FALLBACK_CATEGORY = 'Other'
+REQUEST_QUEUE_SIZE = 1024 # listen backlog: load tests open every stream at once, the default 5 refuses the rest
+CATEGORIES_PATTERN = re.compile(r"categor(?:y|ies)[^\[]*\[([^\]]*)\]", re.IGNORECASE)
+TOKEN_PATTERN = re.compile(r"\s*\S+")
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+DOMAIN_PATTERN = re.compile(r"\b[a-z0-9-]+(?:\.[a-z0-9-]+)*\.[a-z]{2,}\b")
+
+def pick_category(text: str, categories: List[str]) -> str:
+    return categories[crc32(text.encode()) % len(categories)] if categories else FALLBACK_CATEGORY
+
+def prompt_categories(text: str) -> List[str]:
+    match = CATEGORIES_PATTERN.search(text)
+    if match is None: return []
+    return [category.strip() for category in match.group(1).split('|') if category.strip()]
+
+def reply(body: Dict[str, Any]) -> str:
+    messages: List[Dict[str, Any]] = body.get('messages') or []
+    text = '\n'.join(str(message.get('content') or '') for message in messages)
+    last = str(messages[-1].get('content') or '') if messages else ''
+    if messages and messages[-1].get('role') == 'tool': # ml/chat_tools.py, the answer cites the result
+        return f"From your tracked data: {' '.join(last.split()[:96])}"
+    if (body.get('response_format') or {}).get('type') != 'json_object':
+        return f"This is the stand-in model answering: {' '.join(last.split()[:48])}"
+    categories = prompt_categories(text)
+    if '"results"' in text: # ml/batch_classification.py, one json item per line of the user message
+        results = []
+        for line in last.splitlines():
+            try: item = json.loads(line)
+            except ValueError: continue
+            if isinstance(item, dict) and 'id' in item: results.append({'id': item['id'], 'category': pick_category(line, categories)})
+        return json.dumps({'results': results})
+    if '"title"' in text: # ml/langchain_generate_title.py
+        query = last.split('following query:', 1)[-1].split('Respond in', 1)[0]
+        return json.dumps({'title': ' '.join(query.split()[:6]) or 'New chat'})
+    return json.dumps({'Category': pick_category(last, categories)}) # ml/langchain_classification.py
+
+def tool_call(body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    The function call a model would make for the last user turn: the tool with the most words of its
+    name (3+ letters) in the turn, its arguments picked from the turn (an enum value it names, a domain).
+    None if no tool matches or the turn was answered by tools already.
+    """
+    messages: List[Dict[str, Any]] = body.get('messages') or []
+    if not body.get('tools') or not messages or messages[-1].get('role') != 'user': return None
+    last = str(messages[-1].get('content') or '').lower()
+    words = set(WORD_PATTERN.findall(last))
+    words |= {word[:-1] for word in words if word.endswith('s')}
+    best, best_score = None, 0
+    for tool in body['tools']:
+        function = tool.get('function') or {}
+        score = sum(word in words for word in (function.get('name') or '').split('_') if len(word) >= 3)
+        if score > best_score: best, best_score = function, score
+    if best is None: return None
+    arguments: Dict[str, Any] = {}
+    domain = DOMAIN_PATTERN.search(last)
+    for name, schema in ((best.get('parameters') or {}).get('properties') or {}).items():
+        if 'enum' in schema:
+            value = next((value for value in schema['enum'] if ' '.join(str(value).split('_')) in last), None)
+            if value is not None: arguments[name] = value
+        elif name == 'domain' and domain is not None: arguments[name] = domain.group(0)
+    return {'name': best['name'], 'arguments': json.dumps(arguments)}
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+class StandInHTTPServer(ThreadingHTTPServer):
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+class StandInServer:
+    """Threaded http server on `port` (0 picks a free one), `base_url` is what a client should use."""
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, tokens_per_second: float = 50.0, latency: float = 0.0):
+        self.tokens_per_second = tokens_per_second
+        self.latency = latency # sec before the first byte
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = Lock()
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # keep-alive, the clients pool their connections
+            def log_message(self, *args): pass
+            def do_GET(self):
+                if self.path.rstrip('/').endswith('/models'): server.send_json(self, {'object': 'list', 'data': [{'id': 'standin', 'object': 'model'}]})
+                else: server.send_json(self, {'error': {'message': 'not found'}}, status=404)
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    server.send_json(self, {'error': {'message': 'not found'}}, status=404)
+                    return
+                with server.lock:
+                    server.requests += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    time.sleep(server.latency)
+                    server.complete(self, body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass # the client went away
+                finally:
+                    with server.lock: server.in_flight -= 1
+        self.httpd = StandInHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread: Optional[Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def send_json(self, handler: BaseHTTPRequestHandler, payload: Dict[str, Any], status: int = 200) -> None:
+        data = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def complete(self, handler: BaseHTTPRequestHandler, body: Dict[str, Any]) -> None:
+        call = tool_call(body)
+        content = '' if call is not None else reply(body)
+        completion_id = f"chatcmpl-standin{self.requests}"
+        model = body.get('model') or 'standin'
+        prompt_tokens = sum(estimate_tokens(str(message.get('content') or '')) for message in body.get('messages') or [])
+        tokens = TOKEN_PATTERN.findall(content)
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens), 'total_tokens': prompt_tokens + len(tokens)}
+        delay = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+        tool_calls = [{'index': 0, 'id': f"call_standin{self.requests}", 'type': 'function', 'function': call}] if call is not None else None
+        finish_reason = 'tool_calls' if call is not None else 'stop'
+        if not body.get('stream'):
+            time.sleep(delay * len(tokens))
+            message: Dict[str, Any] = {'role': 'assistant', 'content': content or None}
+            if tool_calls is not None: message['tool_calls'] = [{key: value for key, value in tool.items() if key != 'index'} for tool in tool_calls]
+            self.send_json(handler, {
+                'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'finish_reason': finish_reason, 'message': message}],
+                'usage': usage
+            })
+            return
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.end_headers()
+        def send(data: str) -> None:
+            event = f"data: {data}\n\n".encode()
+            handler.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+            handler.wfile.flush()
+        def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+            return json.dumps({
+                'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+            })
+        send(chunk({'role': 'assistant', 'content': ''}))
+        if call is not None: # the name first, the arguments in two parts, like the hosted models
+            time.sleep(delay)
+            send(chunk({'tool_calls': [{**tool_calls[0], 'function': {'name': call['name'], 'arguments': ''}}]})) # type: ignore
+            middle = len(call['arguments']) // 2
+            for part in (call['arguments'][:middle], call['arguments'][middle:]):
+                send(chunk({'tool_calls': [{'index': 0, 'function': {'arguments': part}}]}))
+        for token in tokens:
+            time.sleep(delay)
+            send(chunk({'content': token}))
+        send(chunk({}, finish_reason=finish_reason))
+        send('[DONE]')
+        handler.wfile.write(b"0\r\n\r\n")
+
+    def start(self) -> "StandInServer":
+        self.thread = Thread(target=self.httpd.serve_forever, name="StandInServer", daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--tokens-per-second', type=float, default=50.0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+    server = StandInServer(args.host, args.port, tokens_per_second=args.tokens_per_second, latency=args.latency)
+    print(f"Stand-in model at {server.base_url} (EFFICIA_LLM_PROVIDER=local)")
+    try: server.httpd.serve_forever()
+    except KeyboardInterrupt: server.close()
@@ -0,0 +1,353 @@
+import re
+import time
+import sqlite3
+from threading import Thread, Event, Lock
+from typing import TypedDict, Optional, List, Dict, Tuple
+
+from db import DataBase, logger
+from db.classification_cache import normalize_host, registrable_domain
+from db.classification_queue import MAX_ATTEMPTS, BACKOFF_BASE, BACKOFF_MAX
+from db.models import TitleSource
+from .batch_classification import BatchClassifier, BatchResult, title_item
+from .embedding_classifier import EmbeddingClassifier
+
+#####################################################################################
+#                                   Constants                                       #
+#####################################################################################
+
+BATCH_SIZE: int = 500           # new entries per streaming pass
+LLM_BATCH: int = 64             # ambiguous titles per LLM call
+MIN_CONFIDENCE: float = 0.15    # margin of the local model, below it the title is ambiguous
+MIN_SIMILARITY: float = 0.35    # similarity of the local model's best category (the site's tokens are in every title of it)
+PRIORITY: Dict[TitleSource, int] = {'user': 3, 'llm': 2, 'keyword': 1, 'local': 0, 'pending': -1} # lower never overwrites higher
+
+SITE_SUFFIX = re.compile(r"\s+[-|–—·•:]\s+[^-|–—·•:]{1,40}$")    # ' - YouTube', ' | GitHub', ' — Wikipedia'
+COUNTER = re.compile(r"^\s*[(\[]\d+\+?[)\]]\s*")                # '(3) Inbox'
+NUMBER = re.compile(r"\d+")
+
+# Seeds of the keyword tier, used for the user's categories of the same name (a category's own name counts too)
+KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    'education': ('lecture', 'course', 'tutorial', 'lesson', 'exam', 'homework', 'assignment', 'university', 'khan academy', 'coursera', 'explained'),
+    'entertainment': ('trailer', 'official video', 'music video', 'official audio', 'lyrics', 'funny', 'meme', 'episode', 'gameplay', 'highlights', 'reaction'),
+    'development': ('github', 'stack overflow', 'pull request', 'documentation', 'api reference', 'traceback', 'exception', 'pypi', 'npm'),
+    'communication': ('inbox', 'meeting', 'messages', 'chat'),
+    'news': ('breaking', 'live updates', 'headlines'),
+    'shopping': ('cart', 'checkout', 'order'),
+}
+
+#####################################################################################
+#                                   Types                                           #
+#####################################################################################
+
+class TitleResult(TypedDict):
+    category: Optional[str] # None while pending
+    source: TitleSource
+    confidence: Optional[float]
+
+class TitleClassifierStats(TypedDict):
+    processed: int      # entries classified by this process
+    cached: int         # answered by the TitleCache
+    keyword: int
+    local: int
+    llm: int            # titles answered by the LLM
+    pending: int        # entries waiting for the LLM
+    dead: int           # titles the LLM was asked about MAX_ATTEMPTS times without an answer, left to their site / app
+    llm_requests: int
+    documents: int      # titles the local model learned
+
+class CategorySplit(TypedDict):
+    Category: Optional[str]
+    Duration: float         # sec
+    TitleDuration: float    # part of Duration categorized by the tab title (the rest by its site or app)
+
+#####################################################################################
+#                                   Keys                                            #
+#####################################################################################
+
+def normalize_title(title: str) -> str:
+    """Without the unread counter, the trailing site names and the numbers: '(3) Lecture 12 - YouTube' -> 'lecture #'."""
+    value = COUNTER.sub('', title.strip())
+    for _ in range(2):
+        stripped = SITE_SUFFIX.sub('', value)
+        if not stripped: break
+        value = stripped
+    return ' '.join(NUMBER.sub('#', value.lower()).split())
+
+def title_key(title: str, baseURL: str) -> str:
+    """Same title on the same site (any subdomain) -> same key: `<registrable domain>|<normalized title>`."""
+    return f"{registrable_domain(normalize_host(baseURL))}|{normalize_title(title)}"
+
+def match_keywords(normalized: str, categories: List[str]) -> Optional[str]:
+    """The only category whose keywords occur in the title, None if none or several do."""
+    matches = set()
+    for category in categories:
+        keywords = KEYWORDS.get(category.lower(), ()) + (category.lower(), )
+        if any(re.search(rf"\b{re.escape(keyword)}\b", normalized) for keyword in keywords): matches.add(category)
+    return matches.pop() if len(matches) == 1 else None
+
+#####################################################################################
+#                                   Cache                                           #
+#####################################################################################
+
+def lookup(cursor: sqlite3.Cursor, keys: List[str]) -> Dict[str, TitleResult]:
+    results: Dict[str, TitleResult] = {}
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        cursor.execute(f"""--sql
+        UPDATE TitleCache SET Hits = Hits + 1 WHERE TitleKey IN ({', '.join('?' for _ in chunk)})
+        RETURNING TitleKey, Category, Source, Confidence
+        """, chunk)
+        results.update({
+            row['TitleKey']: TitleResult(category=row['Category'], source=row['Source'], confidence=row['Confidence'])
+            for row in cursor.fetchall()
+        })
+    return results
+
+def store(cursor: sqlite3.Cursor, key: str, category: str, source: TitleSource, confidence: Optional[float] = None) -> bool:
+    """Upserts unless a higher priority source answered already, returns whether it was written."""
+    priority_case = ' '.join(f"WHEN '{name}' THEN {value}" for name, value in PRIORITY.items())
+    cursor.execute(f"""--sql
+    INSERT INTO TitleCache (TitleKey, Category, Source, Confidence) VALUES (?, ?, ?, ?)
+    ON CONFLICT (TitleKey) DO UPDATE SET Category = excluded.Category, Source = excluded.Source, Confidence = excluded.Confidence
+    WHERE (CASE excluded.Source {priority_case} END) >= (CASE TitleCache.Source {priority_case} END)
+    """, (key, category, source, confidence))
+    return cursor.rowcount == 1
+
+def category_split(cursor: sqlite3.Cursor, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                   active_only: bool = True) -> List[CategorySplit]:
+    """
+    Time per category between the dates (YYYY-MM-DD, inclusive): an entry counts for the category
+    of its tab title if it has one, else of its baseURL, else of its app.
+    """
+    conditions, params = [], []
+    if start_date:
+        conditions.append("e.EndTime >= ?")
+        params.append(start_date)
+    if end_date:
+        conditions.append("e.EndTime < date(?, '+1 day')")
+        params.append(end_date)
+    if active_only: conditions.append("e.IsActive")
+    cursor.execute(f"""--sql
+    SELECT
+        COALESCE(t.Category, b.Category, a.Category) AS Category,
+        SUM(e.Duration) AS Duration,
+        SUM(CASE WHEN t.Category IS NOT NULL THEN e.Duration ELSE 0 END) AS TitleDuration
+    FROM ActivityEntries AS e
+    LEFT JOIN ActivityTitleCategories AS t ON t.EntryId = e.EntryId
+    LEFT JOIN URLs AS u ON u.URL = e.URL
+    LEFT JOIN BaseURLs AS b ON b.baseURL = u.baseURL
+    LEFT JOIN Apps AS a ON a.AppId = e.AppId
+    {"WHERE " + " AND ".join(conditions) if conditions else ""}
+    GROUP BY 1
+    ORDER BY Duration DESC
+    """, params)
+    return [CategorySplit(**row) for row in cursor.fetchall()]
+
+#####################################################################################
+#                                   TitleClassifier                                 #
+#####################################################################################
+
+class TitleClassifier:
+    """
+    Categorizes the title of every new browser ActivityEntry, in streaming passes over the
+    entries past a watermark, cheapest tier first:
+        1. TitleCache by title_key (normalized title on its registrable domain)
+        2. keywords of the user's categories (KEYWORDS), when exactly one matches
+        3. a local EmbeddingClassifier trained on the LLM / user answered titles, once it learned a few titles
+           of several categories (EmbeddingClassifier.confident)
+        4. the LLM (BatchClassifier), only for the ambiguous rest, batched and deduplicated by key
+    Every answer lands in ActivityTitleCategories (per entry) and in the TitleCache. A title the LLM
+    leaves unanswered is asked again with exponential backoff (TitleAttempts), and given up after
+    `max_attempts` like a dead-lettered ClassificationQueue job.
+    """
+    def __init__(self, db_path: str, classifier: Optional[BatchClassifier] = None, local: Optional[EmbeddingClassifier] = None,
+                 batch_size: int = BATCH_SIZE, llm_batch: int = LLM_BATCH, poll_interval: float = 30.0,
+                 max_attempts: int = MAX_ATTEMPTS, backoff_base: float = BACKOFF_BASE):
+        self.db_path = db_path
+        self.classifier = classifier
+        self.local = local if local is not None else EmbeddingClassifier(min_confidence=MIN_CONFIDENCE, min_similarity=MIN_SIMILARITY)
+        self.batch_size = batch_size
+        self.llm_batch = llm_batch
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+
+        self.watermark = 0 # last EntryId seen
+        self.loaded = False # watermark and local model read from the database
+        self.counters = {'processed': 0, 'cached': 0, 'keyword': 0, 'local': 0, 'llm': 0, 'llm_requests': 0}
+        self.counters_lock = Lock()
+        self.wakeup = Event()
+        self.stop_event = Event()
+        self.thread: Optional[Thread] = None
+        self.database: Optional[DataBase] = None
+
+    def notify(self) -> None:
+        self.wakeup.set()
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self.counters_lock: self.counters[name] += value
+
+    def fit(self, cursor: sqlite3.Cursor) -> int:
+        """Trains the local model on every title the LLM or the user answered."""
+        cursor.execute("SELECT TitleKey, Category FROM TitleCache WHERE Source IN ('user', 'llm')")
+        rows = cursor.fetchall()
+        self.local.reset()
+        for row in rows:
+            site, _, title = row['TitleKey'].partition('|')
+            self.local.learn(title_item(row['TitleKey'], title, site), row['Category'])
+        return len(rows)
+
+    def classify_titles(self, cursor: sqlite3.Cursor, titles: Dict[str, Tuple[str, str]], categories: List[str]) -> Dict[str, TitleResult]:
+        """key -> result of tiers 1-3 for {key: (title, baseURL)}, ambiguous keys stay 'pending'."""
+        results = lookup(cursor, list(titles))
+        self.count('cached', len(results))
+        for key in titles:
+            if key in results: continue
+            site, _, normalized = key.partition('|')
+            if category := match_keywords(normalized, categories):
+                results[key] = TitleResult(category=category, source='keyword', confidence=1.0)
+            elif self.local.confident(prediction := self.local.predict(title_item(key, normalized, site))):
+                results[key] = TitleResult(category=prediction['category'], source='local', confidence=prediction['confidence'])
+            else:
+                results[key] = TitleResult(category=None, source='pending', confidence=None)
+                continue
+            self.count(results[key]['source'])
+            store(cursor, key, results[key]['category'], results[key]['source'], results[key]['confidence']) # type: ignore
+        return results
+
+    def process_new(self) -> int:
+        """One streaming pass over the entries past the watermark, returns how many were seen."""
+        assert self.database is not None
+        with self.database.cursor_context() as cursor:
+            cursor.execute("""--sql
+            SELECT e.EntryId, e.Title, u.baseURL FROM ActivityEntries AS e
+            JOIN URLs AS u ON u.URL = e.URL
+            WHERE e.EntryId > ? AND u.baseURL IS NOT NULL
+            ORDER BY e.EntryId LIMIT ?
+            """, (self.watermark, self.batch_size))
+            rows = cursor.fetchall()
+            if not rows: return 0
+            cursor.execute("SELECT Category FROM Categories")
+            categories = [row['Category'] for row in cursor.fetchall()]
+            keys = {row['EntryId']: title_key(row['Title'], row['baseURL']) for row in rows}
+            titles = {keys[row['EntryId']]: (row['Title'], row['baseURL']) for row in rows}
+            results = self.classify_titles(cursor, titles, categories)
+            cursor.executemany("""--sql
+            INSERT OR REPLACE INTO ActivityTitleCategories (EntryId, TitleKey, Category, Source, Confidence) VALUES (?, ?, ?, ?, ?)
+            """, [(entry_id, key, results[key]['category'], results[key]['source'], results[key]['confidence']) for entry_id, key in keys.items()])
+            self.database.commit()
+        self.watermark = rows[-1]['EntryId']
+        self.count('processed', len(rows))
+        return len(rows)
+
+    def resolve_pending(self, now: Optional[float] = None) -> int:
+        """Asks the LLM about one batch of ambiguous titles (without holding a cursor), returns how many it answered."""
+        assert self.database is not None
+        if self.classifier is None: return 0
+        now = time.time() if now is None else now
+        with self.database.cursor_context() as cursor:
+            cursor.execute("""--sql
+            SELECT t.TitleKey, MAX(e.Title) AS Title, COALESCE(MAX(a.Attempts), 0) AS Attempts FROM ActivityTitleCategories AS t
+            JOIN ActivityEntries AS e ON e.EntryId = t.EntryId
+            LEFT JOIN TitleAttempts AS a ON a.TitleKey = t.TitleKey
+            WHERE t.Source = 'pending' AND (a.TitleKey IS NULL OR a.NextAttempt <= ?)
+            GROUP BY t.TitleKey LIMIT ?
+            """, (now, self.llm_batch))
+            pending = {row['TitleKey']: (row['Title'], row['Attempts']) for row in cursor.fetchall()}
+            cursor.execute("SELECT Category FROM Categories")
+            categories = [row['Category'] for row in cursor.fetchall()]
+        if not pending: return 0
+        items = [title_item(key, title, key.partition('|')[0]) for key, (title, _) in pending.items()]
+        try:
+            batch = self.classifier.classify(items, categories)
+        except Exception as e:
+            batch = BatchResult(categories={}, failed={key: f"{type(e).__name__}: {e}" for key in pending}, batches=[])
+        self.count('llm_requests', len(batch['batches']))
+        answered = 0
+        with self.database.cursor_context() as cursor:
+            for key, (_, attempts) in pending.items():
+                category = batch['categories'].get(key)
+                if category is not None and self.apply(cursor, key, category, 'llm'):
+                    answered += 1
+                else:
+                    self.retry(cursor, key, attempts + 1, batch['failed'].get(key, 'not applied' if category else 'not answered'), now)
+            self.database.commit()
+        self.count('llm', answered)
+        return answered
+
+    def retry(self, cursor: sqlite3.Cursor, key: str, attempts: int, error: str, now: float) -> None:
+        """Schedules the next LLM attempt of a title with exponential backoff, NextAttempt NULL once given up."""
+        next_attempt = None if attempts >= self.max_attempts else now + min(BACKOFF_MAX, self.backoff_base * 2 ** (attempts - 1))
+        cursor.execute("""--sql
+        INSERT INTO TitleAttempts (TitleKey, Attempts, NextAttempt, LastError) VALUES (?, ?, ?, ?)
+        ON CONFLICT (TitleKey) DO UPDATE SET Attempts = excluded.Attempts, NextAttempt = excluded.NextAttempt, LastError = excluded.LastError
+        """, (key, attempts, next_attempt, error))
+
+    def apply(self, cursor: sqlite3.Cursor, key: str, category: str, source: TitleSource) -> int:
+        """Caches the answer and sets it on every entry of the key it may overwrite, returns how many entries changed."""
+        if not store(cursor, key, category, source): return 0
+        cursor.execute("DELETE FROM TitleAttempts WHERE TitleKey = ?", (key, ))
+        cursor.execute("INSERT OR IGNORE INTO Categories (Category, BlockId) VALUES (?, NULL)", (category, ))
+        overwritable = [name for name, value in PRIORITY.items() if value <= PRIORITY[source]]
+        cursor.execute(f"""--sql
+        UPDATE ActivityTitleCategories SET Category = ?, Source = ?, Confidence = NULL
+        WHERE TitleKey = ? AND Source IN ({', '.join('?' for _ in overwritable)})
+        """, (category, source, key, *overwritable))
+        site, _, normalized = key.partition('|')
+        self.local.learn(title_item(key, normalized, site), category)
+        return cursor.rowcount
+
+    def set_category(self, cursor: sqlite3.Cursor, key: str, category: str) -> int:
+        """Manual choice for a title, wins over every model answer."""
+        return self.apply(cursor, key, category, 'user')
+
+    def run_once(self) -> int:
+        return self.process_new() + self.resolve_pending()
+
+    def stats(self, cursor: sqlite3.Cursor) -> TitleClassifierStats:
+        cursor.execute("SELECT COUNT(*) AS count FROM ActivityTitleCategories WHERE Source = 'pending'")
+        pending = cursor.fetchone()['count']
+        cursor.execute("SELECT COUNT(*) AS count FROM TitleAttempts WHERE NextAttempt IS NULL")
+        dead = cursor.fetchone()['count']
+        with self.counters_lock: counters = dict(self.counters)
+        return TitleClassifierStats(**counters, pending=pending, dead=dead, documents=self.local.stats()['documents']) # type: ignore
+
+    def open(self) -> None:
+        """Raises sqlite3.Error while the schema does not exist yet (upgraded database): called again on the next poll."""
+        if self.database is None:
+            self.database = DataBase(db_path=self.db_path, check_create_table=False, check_same_thread=False)
+        if not self.loaded:
+            with self.database.cursor_context() as cursor:
+                cursor.execute("SELECT COALESCE(MAX(EntryId), 0) AS watermark FROM ActivityTitleCategories")
+                self.watermark = cursor.fetchone()['watermark']
+                logger.info(msg=f"Title classifier trained on {self.fit(cursor)} titles")
+            self.loaded = True
+
+    def close(self) -> None:
+        if self.database is not None: self.database.close()
+        self.database, self.loaded = None, False
+
+    def _run(self) -> None:
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    self.open()
+                    if self.run_once(): continue # keep draining
+                except Exception as e:
+                    logger.error(msg=f"Title classifier error: {e}")
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+        finally:
+            self.close()
+
+    def start(self) -> None:
+        if self.thread is not None and self.thread.is_alive(): return
+        self.stop_event.clear()
+        self.thread = Thread(target=self._run, name="TitleClassifier", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread is not None: self.thread.join()
+        self.thread = None
@@ -0,0 +1,71 @@
+"""
+Prompt size and build time of the chat history: the last 15 messages the chat api sent before,
+against the token budgeted ContextBuilder (ml/context_builder.py) with rolling summaries.
+
+Replays a chat of `messages` messages of mixed length (one-liners to long code answers) turn
+by turn in a temporary database, building the history of every turn. Summaries come from a
+local stand-in summarizer (no model calls), its requests are counted.
+
+    python -m scripts.benchmark_chat_context [--messages 400] [--budget 6000]
+"""
+from db.chatbot import DataBase
+from ml.context_builder import ContextBuilder, count_tokens, MESSAGE_OVERHEAD
+from typing import List, Dict, Optional
+import statistics
+import argparse
+import tempfile
+import asyncio
+import random
+import time
+import os
+
+WORDS = "the model returns a list of apps sorted by usage and the classifier keeps its cache warm between runs".split()
+
+def make_content(rng: random.Random, i: int) -> str:
+    kind = rng.random()
+    if kind < 0.4: return ' '.join(rng.choices(WORDS, k=rng.randint(3, 15)))              # short turn
+    if kind < 0.8: return ' '.join(rng.choices(WORDS, k=rng.randint(80, 300)))            # explanation
+    return '\n'.join(f"    value_{j} = compute(item_{j}, limit={j * 3})  # step {j}" for j in range(rng.randint(40, 200))) # code
+
+async def stand_in_summarizer(previous: Optional[str], messages: List[Dict[str, str]]) -> str:
+    return ((previous or '') + ' ' + ' '.join(message['content'][:40] for message in messages))[-1200:]
+
+def tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(count_tokens(message['content']) + MESSAGE_OVERHEAD for message in messages)
+
+def run_script(messages: int = 400, budget: int = 6000, seed: int = 0):
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database = DataBase(db_path=os.path.join(tmpdir, 'database.db'))
+        builder = ContextBuilder(database, budget=budget, summarizer=stand_in_summarizer)
+        chat_id = database.new_chat(title='benchmark', commit=False)
+        leaf: Optional[int] = None
+        before: List[int] = []
+        after: List[int] = []
+        build_times: List[float] = []
+        summarized = 0
+        for i in range(messages):
+            leaf = database.new_message(chat_id, content=make_content(rng, i), message_by='USER' if i % 2 == 0 else 'AI', parent_message_id=leaf, commit=False)
+            if i % 2: continue # a request per user turn
+            last_15 = [{'role': '', 'content': message['content']} for message in database.get_chats_above(chat_id, leaf, max_result=15)]
+            before.append(tokens(last_15))
+            start = time.perf_counter()
+            context = asyncio.run(builder.build(chat_id, leaf))
+            build_times.append(time.perf_counter() - start)
+            after.append(context['stats']['tokens'])
+            summarized += context['stats']['summarized']
+        database.close()
+    print(f"{len(before)} requests over a chat of {messages} messages, budget {budget} tokens")
+    print(f"last 15 messages : prompt p50 {statistics.median(before):7.0f}  max {max(before):7.0f} tokens, "
+          f"{sum(value > budget for value in before)} requests over the budget")
+    print(f"context builder  : prompt p50 {statistics.median(after):7.0f}  max {max(after):7.0f} tokens, "
+          f"{sum(value > budget for value in after)} requests over the budget")
+    print(f"build time       : p50 {statistics.median(build_times) * 1000:.2f} ms  max {max(build_times) * 1000:.2f} ms, "
+          f"{summarized} summarization requests ({summarized / len(before):.2f} per request)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=400)
+    parser.add_argument('--budget', type=int, default=6000)
+    args = parser.parse_args()
+    run_script(messages=args.messages, budget=args.budget)
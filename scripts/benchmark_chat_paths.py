@@ -0,0 +1,122 @@
+"""
+Loading the visible branch of a chat tree: the recursive queries over Messages.is_active the
+chat api used before, against range reads of the materialized ChatActivePath.
+
+Builds a chat of `messages` messages with `branches` edits (each a new branch off one of the
+last 10 messages of the visible branch) in a temporary database and times the reads of every
+/chat/{id}, /generate and /branch_picker call, and a branch switch.
+
+    python -m scripts.benchmark_chat_paths [--messages 1000] [--branches 50] [--runs 200]
+"""
+from db.chatbot import DataBase
+from typing import Callable
+import argparse
+import tempfile
+import random
+import time
+import os
+
+LEGACY_CHATS_DOWN = """--sql
+    WITH RECURSIVE active_path(MessageId, ChatId, content, level, parent_id, depth) As (
+        SELECT m.MessageId, m.ChatId, m.content, m.level, m.parent_id, 1 as depth
+        FROM Messages as m
+        WHERE m.ChatId=? AND m.parent_id IS NULL AND m.is_active
+        UNION ALL
+        SELECT m.MessageId, m.ChatId, m.content, m.level, m.parent_id, a.depth + 1 as depth
+        FROM Messages as m
+        INNER JOIN active_path a ON m.ChatId = a.ChatId and a.MessageId = m.parent_id and m.is_active and depth != ?
+    )
+    SELECT * FROM active_path
+"""
+LEGACY_CHATS_ABOVE = """--sql
+    WITH RECURSIVE active_path(MessageId, ChatId, content, level, parent_id, depth) As (
+        SELECT m.MessageId, m.ChatId, m.content, m.level, m.parent_id, 1 as depth
+        FROM Messages as m
+        WHERE m.ChatId=? AND m.MessageId = ?
+        UNION ALL
+        SELECT m.MessageId, m.ChatId, m.content, m.level, m.parent_id, a.depth + 1 as depth
+        FROM Messages as m
+        INNER JOIN active_path AS a ON m.ChatId = a.ChatId and m.MessageId = a.parent_id and m.is_active and depth != ?
+    )
+    SELECT * FROM active_path
+"""
+LEGACY_LAZY_MESSAGES = """--sql
+    WITH RECURSIVE active_path(MessageId, ChatId, parent_id) As (
+        SELECT m.MessageId, m.ChatId, m.parent_id
+        FROM Messages as m
+        WHERE m.ChatId=? AND m.parent_id IS NULL AND m.is_active
+        UNION ALL
+        SELECT m.MessageId, m.ChatId, m.parent_id
+        FROM Messages as m
+        INNER JOIN active_path a ON m.ChatId = a.ChatId and a.MessageId = m.parent_id and m.is_active
+    )
+    SELECT m.MessageId, m.content, m.level, m.position
+    FROM Messages as m
+    INNER JOIN active_path a ON m.ChatId = ? and ((m.parent_id IS NULL AND a.parent_id IS NULL) OR (a.parent_id = m.parent_id))
+    ORDER BY m.level ASC, m.position ASC
+"""
+
+def build_chat(database: DataBase, messages: int, branches: int, seed: int = 0) -> int:
+    rng = random.Random(seed)
+    with database.transaction():
+        chat_id = database.new_chat(title='benchmark')
+        leaf = database.new_message(chat_id, content='question 0', message_by='USER')
+        edits = set(rng.sample(range(1, messages), branches))
+        for i in range(1, messages):
+            if i in edits:
+                path = database.get_chats_down(chat_id, None, max_result=messages)
+                parent = rng.choice(path[-11:-1])['MessageId'] if len(path) > 1 else None
+                leaf = database.new_message(chat_id, content=f"edit {i}", message_by='USER', parent_message_id=parent)
+            else:
+                leaf = database.new_message(chat_id, content=f"message {i} " + 'lorem ipsum ' * 20,
+                                            message_by='AI' if i % 2 else 'USER', parent_message_id=leaf)
+    return chat_id
+
+def timeit(function: Callable[[], object], runs: int) -> float:
+    """ms per call"""
+    start = time.perf_counter()
+    for _ in range(runs): function()
+    return (time.perf_counter() - start) / runs * 1000
+
+def run_script(messages: int = 1000, branches: int = 50, runs: int = 200):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database = DataBase(db_path=os.path.join(tmpdir, 'database.db'))
+        chat_id = build_chat(database, messages, branches)
+        path = database.get_chats_down(chat_id, None, max_result=messages)
+        leaf = path[-1]['MessageId']
+        cursor = database.conn.cursor()
+        def legacy(query: str, *params) -> Callable[[], object]:
+            return lambda: cursor.execute(query, params).fetchall()
+        cases = [
+            ('chat/{id} (branch + siblings)', legacy(LEGACY_LAZY_MESSAGES, chat_id, chat_id),
+                lambda: database.get_lazy_chat_messages(chat_id)),
+            ('branch_picker (whole branch)', legacy(LEGACY_CHATS_DOWN, chat_id, messages),
+                lambda: database.get_chats_down(chat_id, None, max_result=messages)),
+            ('generate (15 above the leaf)', legacy(LEGACY_CHATS_ABOVE, chat_id, leaf, 15),
+                lambda: database.get_chats_above(chat_id, leaf, max_result=15)),
+        ]
+        print(f"chat of {messages} messages, {branches} branches, visible branch of {len(path)} messages")
+        for name, before, after in cases:
+            assert len(before()) == len(after()), name # type: ignore
+            before_ms, after_ms = timeit(before, runs), timeit(after, runs)
+            print(f"{name:32}: {before_ms:8.3f} ms -> {after_ms:8.3f} ms ({before_ms / after_ms:.1f}x)")
+        first_page = (lambda: database.get_lazy_chat_messages(chat_id, min_depth=len(path) - 29, max_depth=len(path)))
+        print(f"{'chat/{id}/messages first page':32}: {timeit(first_page, runs):8.3f} ms (30 newest of the branch)")
+
+        # a switch rewrites the path below the switched message
+        switchable = next(m for m in path if m['position'] > 1) # the newest branch is the visible one
+        message_id = switchable['MessageId']
+        start = time.perf_counter()
+        for i in range(runs):
+            if i % 2 == 0: message_id = database.prev_message(chat_id, message_id, return_type='prev_message_id', commit=False)
+            else: message_id = database.next_message(chat_id, message_id, return_type='next_message_id', commit=False)
+        print(f"{'branch switch at depth ' + str(switchable['level']):32}: {(time.perf_counter() - start) / runs * 1000:8.3f} ms")
+        database.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--branches', type=int, default=50)
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+    run_script(messages=args.messages, branches=args.branches, runs=args.runs)
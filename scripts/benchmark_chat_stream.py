@@ -0,0 +1,109 @@
+"""
+Streamed chat answers: one write per token with hand escaped JSON (the previous /chatbot/generate
+loop) against ChatStream (api/chatbot/streaming.py), which coalesces tokens into frames and
+checkpoints the partial answer to an in-memory chat database. Then the time from the last token
+to the end of the response of a new chat: answer and title written in the response, or handed to
+the chat tasks (api/chatbot/tasks.py) and written after it, a title request taking --title-latency.
+
+    python -m scripts.benchmark_chat_stream [--tokens 4000] [--tokens-per-second 400] [--title-latency 0.8]
+"""
+from db.chatbot import DataBase
+from api.chatbot.streaming import ChatStream, AnswerWriter
+from api.chatbot.tasks import ChatTaskWorker, heuristic_title
+from tempfile import TemporaryDirectory
+import os
+from typing import AsyncIterator, List, Tuple
+import argparse
+import asyncio
+import random
+import socket
+import time
+
+WORDS = ['the', 'function', 'returns', '"value"', 'of', 'x\n', '    if', 'self.cache', 'is', 'None:', 'ünïcode', '\t']
+
+def make_tokens(count: int) -> List[str]:
+    rng = random.Random(0)
+    return [(' ' if i else '') + rng.choice(WORDS) for i in range(count)]
+
+async def upstream(tokens: List[str], tokens_per_second: float) -> AsyncIterator[str]:
+    for token in tokens:
+        if tokens_per_second: await asyncio.sleep(1 / tokens_per_second)
+        yield token
+
+async def per_token(texts: AsyncIterator[str]) -> AsyncIterator[str]:
+    aiResponse = ""
+    async for content in texts:
+        aiResponse += content
+        d = content.replace("\\", "\\\\").replace("\n", "\\n").replace("\t", "\\t").replace("\"", "\\\"")
+        yield f'0: "{d}"\n'
+
+async def consume(parts: AsyncIterator[str]) -> Tuple[int, int, float]:
+    """Writes, bytes and cpu time of the response, each part written to a socket like the ASGI server does."""
+    client, server = socket.socketpair()
+    reader, client_writer = await asyncio.open_connection(sock=client)
+    server_reader, writer = await asyncio.open_connection(sock=server)
+    async def drain_client():
+        while await reader.read(65536): pass
+    receiving = asyncio.ensure_future(drain_client())
+    writes = size = 0
+    start = time.process_time()
+    async for part in parts:
+        data = part.encode()
+        writer.write(data)
+        await writer.drain()
+        writes += 1
+        size += len(data)
+    cpu = time.process_time() - start
+    writer.close()
+    await receiving
+    client_writer.close()
+    return writes, size, cpu
+
+async def close_time(database: DataBase, answer: List[str], title_latency: float, background: bool) -> float:
+    """Sec from the last text frame to the end of the response."""
+    async def generate_title(query: str) -> str:
+        await asyncio.sleep(title_latency)
+        return 'A generated title'
+    worker = ChatTaskWorker(database, title_generator=generate_title)
+    chat_id = database.new_chat(title=heuristic_title('question'), commit=False)
+    writer = AnswerWriter(database, chat_id, user_content='question')
+    stream = ChatStream(upstream(answer, 0.0), writer, finish=worker.submit_answer if background else None)
+    if background: worker.submit_title(chat_id, query='question', heuristic=heuristic_title('question'))
+    last = 0.0
+    async for part in stream.response():
+        if part.startswith('0:'): last = time.perf_counter()
+    if not background:
+        database.update_chat_title(chat_id, await generate_title('question'))
+    closed = time.perf_counter() - last
+    await worker.run_once() # after the response
+    return closed
+
+def run_script(tokens: int = 4000, tokens_per_second: float = 400.0, title_latency: float = 0.8):
+    answer = make_tokens(tokens)
+    for rate in (0.0, tokens_per_second):
+        label = 'burst' if not rate else f"{rate:.0f} tok/s"
+        writes, size, cpu = asyncio.run(consume(per_token(upstream(answer, rate))))
+        print(f"{label:>11} per token   : {writes:5d} writes {size / 1024:7.1f} KiB cpu {cpu * 1000:7.1f} ms, saved at the end only")
+        database = DataBase(db_path=':memory:')
+        chat_id = database.new_chat(title='bench')
+        stream = ChatStream(upstream(answer, rate), AnswerWriter(database, chat_id, user_content='question'))
+        writes, size, cpu = asyncio.run(consume(stream.frames()))
+        print(f"{label:>11} ChatStream  : {writes:5d} writes {size / 1024:7.1f} KiB cpu {cpu * 1000:7.1f} ms, "
+              f"{stream.stats['checkpoints']} checkpoints")
+        database.close()
+
+    with TemporaryDirectory() as directory:
+        database = DataBase(db_path=os.path.join(directory, 'chatbot.db'))
+        for background in (False, True):
+            closes = [asyncio.run(close_time(database, answer[:200], title_latency, background)) for _ in range(5)]
+            label = 'chat tasks' if background else 'in response'
+            print(f"new chat, {label:<11}: response closed {sorted(closes)[2] * 1000:7.1f} ms after the last token (median of 5)")
+        database.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokens', type=int, default=4000)
+    parser.add_argument('--tokens-per-second', type=float, default=400.0)
+    parser.add_argument('--title-latency', type=float, default=0.8)
+    args = parser.parse_args()
+    run_script(tokens=args.tokens, tokens_per_second=args.tokens_per_second, title_latency=args.title_latency)
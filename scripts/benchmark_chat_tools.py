@@ -0,0 +1,122 @@
+"""
+The chatbot's tools over the tracked data (ml/chat_tools.py) on `days` days of `per_day` activity
+entries in a temporary database: the scan of the entries against the daily rollups plus the index
+read of the recent days (db/activity_rollup.py), a tool call with and without its cached result,
+then whole answers (model turn, tool call, model turn) against the local stand-in model.
+
+    python -m scripts.benchmark_chat_tools [--days 365] [--per-day 2000] [--runs 20] [--latency 0.05]
+"""
+from db import DataBase, activity_rollup
+from ml.chat_tools import ActivityTools, ToolChat, today
+from ml.providers import Provider, ProviderConfig
+from ml.standin_server import StandInServer
+from datetime import timedelta
+from typing import Callable, List
+import argparse
+import asyncio
+import logging
+import tempfile
+import random
+import time
+import os
+
+SITES = ['www.youtube.com', 'm.youtube.com', 'github.com', 'docs.python.org', 'mail.google.com', 'news.ycombinator.com']
+
+# what the tools would do without the rollups: group every entry of the period
+SCAN_TOP_APPS = """--sql
+    SELECT e.AppId, SUM(CASE WHEN e.IsActive THEN e.Duration ELSE 0 END) AS ActiveDuration, SUM(e.Duration) AS Duration
+    FROM ActivityEntries AS e
+    WHERE e.EndTime >= ? AND e.EndTime < date(?, '+1 day')
+    GROUP BY e.AppId ORDER BY ActiveDuration DESC LIMIT 5
+"""
+
+def build_activity(database: DataBase, days: int, per_day: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    apps = [f"C:\\Program Files\\App{i} | app{i}.exe" for i in range(40)]
+    cursor = database.conn.cursor()
+    cursor.executemany("INSERT INTO Apps (AppId, ExeFileName, ExeDirName, IsBrowser, ProductName) VALUES (?, ?, ?, ?, ?)",
+                       [(app, f"app{i}.exe", 'C:\\Program Files', i == 0, f"App {i}") for i, app in enumerate(apps)])
+    cursor.executemany("INSERT INTO BaseURLs (baseURL, is_fetched) VALUES (?, FALSE)", [(site, ) for site in SITES])
+    cursor.executemany("INSERT INTO URLs (URL, baseURL) VALUES (?, ?)", [(f"https://{site}/{i}", site) for site in SITES for i in range(20)])
+    for offset in range(days, -1, -1):
+        day = (today() - timedelta(days=offset)).isoformat()
+        rows = []
+        for i in range(per_day):
+            app = apps[min(int(rng.paretovariate(1.2)) - 1, len(apps) - 1)]
+            url = f"https://{rng.choice(SITES)}/{rng.randrange(20)}" if app == apps[0] else None
+            rows.append((app, 'title', url, rng.random() < 0.8, 0.0, rng.uniform(1, 60), f"{day} {i * 86399 // per_day // 3600:02}:{i % 60:02}:00"))
+        cursor.executemany("""--sql
+        INSERT INTO ActivityEntries (AppId, Title, URL, IsActive, IdleDuration, Duration, EndTime) VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+    database.commit()
+
+def timeit(function: Callable[[], object], runs: int) -> float:
+    """ms per call"""
+    start = time.perf_counter()
+    for _ in range(runs): function()
+    return (time.perf_counter() - start) / runs * 1000
+
+async def answer(provider: Provider, tools: ActivityTools, question: str) -> List[float]:
+    """sec to the first text, to the end of the answer, in tools"""
+    chat = ToolChat(provider, tools, [{'role': 'user', 'content': question}])
+    start, first = time.perf_counter(), None
+    async for chunk in chat.astream():
+        if first is None and chunk.choices and chunk.choices[0].delta.content: first = time.perf_counter() - start
+    return [first or 0.0, time.perf_counter() - start, sum(call['latency'] for call in chat.calls)]
+
+def run_script(days: int = 365, per_day: int = 2000, runs: int = 20, latency: float = 0.05, tokens_per_second: float = 200.0):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, 'database.db')
+        database = DataBase(db_path=db_path)
+        start = time.perf_counter()
+        build_activity(database, days, per_day)
+        print(f"{days * per_day} entries over {days} days, written in {time.perf_counter() - start:.1f} sec")
+        cursor = database.conn.cursor()
+        start = time.perf_counter()
+        rows = activity_rollup.refresh(cursor)
+        database.commit()
+        print(f"rollup: {rows} rows in {time.perf_counter() - start:.2f} sec (once, then a day at a time)")
+
+        for period in (7, 30, 90, 365):
+            first, last = (today() - timedelta(days=period - 1)).isoformat(), today().isoformat()
+            scan_ms = timeit(lambda: cursor.execute(SCAN_TOP_APPS, (first, last)).fetchall(), runs)
+            rollup_ms = timeit(lambda: activity_rollup.top_apps(cursor, first, last), runs)
+            print(f"top apps, {period:3} days: scan {scan_ms:8.3f} ms -> rollups {rollup_ms:8.3f} ms ({scan_ms / rollup_ms:.1f}x)")
+
+        tools = ActivityTools(db_path=db_path)
+        tools.refresh()
+        for name, arguments in (('top_apps', {'period': 'last_30_days'}), ('time_on_site', {'domain': 'youtube.com', 'period': 'last_30_days'}),
+                                ('usage_trend', {'period': 'last_30_days', 'bucket': 'week'}), ('todos_due', {'days': 7})):
+            tools.cache.clear()
+            cold_ms = timeit(lambda: (tools.cache.clear(), tools.call(name, arguments)), runs)
+            warm_ms = timeit(lambda: tools.call(name, arguments), runs)
+            print(f"{name:13}: {cold_ms:7.3f} ms, cached {warm_ms:7.3f} ms")
+
+        server = StandInServer(tokens_per_second=tokens_per_second, latency=latency).start()
+        provider = Provider('local', ProviderConfig(
+            base_url=server.base_url, api_key_env=None, model='standin', max_concurrency=8, timeout=30.0, connect_timeout=2.0, max_retries=0
+        ))
+        logging.getLogger('httpx').setLevel(logging.WARNING) # a line per request
+        async def main():
+            await provider.acreate([{'role': 'user', 'content': 'warm up'}]) # the client and its connection
+            for question in ("What were my top apps in the last 30 days?", "How much time on youtube.com this week?", "Hello"):
+                tools.cache.clear()
+                cold = await answer(provider, tools, question)
+                warm = [sum(values) / runs for values in zip(*[await answer(provider, tools, question) for _ in range(runs)])]
+                print(f"{question[:40]:40}: first text {cold[0] * 1000:6.1f} ms, answer {cold[1] * 1000:6.1f} ms (tools {cold[2] * 1000:5.2f} ms) "
+                      f"| cached tools: {warm[0] * 1000:6.1f} ms, {warm[1] * 1000:6.1f} ms (tools {warm[2] * 1000:5.2f} ms)")
+        asyncio.run(main())
+        print(f"stand-in: {latency * 1000:.0f} ms to the first byte, {tokens_per_second:.0f} tokens/sec, {server.requests - 1} requests")
+        server.close()
+        tools.close()
+        database.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--per-day', type=int, default=2000)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--tokens-per-second', type=float, default=200.0)
+    args = parser.parse_args()
+    run_script(days=args.days, per_day=args.per_day, runs=args.runs, latency=args.latency, tokens_per_second=args.tokens_per_second)
@@ -0,0 +1,93 @@
+"""
+Startup import cost of the api and tracker entry points, from `python -X importtime`.
+
+Every entry point is imported in a fresh interpreter `runs` times (the median is
+reported), followed by its heaviest imports and the LLM libraries it loaded.
+The tracker must never load an LLM library, the exit code is 1 if it does.
+
+    python -m scripts.benchmark_import_time [--runs 5] [--top 10]
+"""
+from typing import TypedDict, List, Dict, Tuple
+import statistics
+import subprocess
+import argparse
+import sys
+import os
+
+ENTRY_POINTS: Dict[str, str] = {
+    'tracker': 'services.background_service',
+    'db': 'db',
+    'classification': 'ml.classification_worker',
+    'api': 'api',
+}
+TRACKER_ENTRY_POINTS = ('tracker', 'db')
+LLM_MODULES = ('langchain', 'langchain_core', 'langchain_groq', 'groq', 'openai')
+
+class ImportTime(TypedDict):
+    module: str
+    depth: int          # nesting level in the import tree
+    self_us: int
+    cumulative_us: int
+
+def parse_importtime(stderr: str) -> List[ImportTime]:
+    """`import time: <self> | <cumulative> | <indented name>` lines of `-X importtime`."""
+    rows: List[ImportTime] = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line: continue
+        self_us, cumulative_us, name = line.removeprefix('import time:').split('|', 2)
+        module = name.strip()
+        rows.append(ImportTime(
+            module=module,
+            depth=(len(name) - len(name.lstrip()) - 1) // 2,
+            self_us=int(self_us),
+            cumulative_us=int(cumulative_us)
+        ))
+    return rows
+
+def measure(module: str) -> List[ImportTime]:
+    env = dict(os.environ)
+    env.pop('GROQ_API_KEY', None) # importing must not need it
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    if process.returncode != 0: raise RuntimeError(f"import {module} failed:\n{process.stderr[-2000:]}")
+    return parse_importtime(process.stderr)
+
+def summarize(rows: List[ImportTime], module: str, top: int) -> Tuple[int, List[ImportTime], List[str]]:
+    """Total cumulative us of the module, its heaviest imports and the LLM packages it loaded."""
+    # children are printed before their parent: the subtree is the run of deeper rows right above the entry point
+    root = max(i for i, row in enumerate(rows) if row['module'] == module and row['depth'] == 0)
+    start = root
+    while start > 0 and rows[start - 1]['depth'] > 0: start -= 1
+    subtree = [row for row in rows[start:root] if not module.startswith(row['module'])] # without the entry's own packages
+    shallowest = min((row['depth'] for row in subtree), default=0)
+    heaviest = sorted(
+        (ImportTime(**{**row, 'depth': row['depth'] - shallowest}) for row in subtree if row['depth'] <= shallowest + 1),
+        key=lambda row: row['cumulative_us'], reverse=True
+    )[:top]
+    llm = sorted({row['module'].split('.')[0] for row in rows if row['module'].split('.')[0] in LLM_MODULES})
+    return rows[root]['cumulative_us'], heaviest, llm
+
+def run_script(runs: int = 5, top: int = 10) -> int:
+    failed = False
+    for name, module in ENTRY_POINTS.items():
+        totals: List[int] = []
+        for _ in range(runs):
+            total, heaviest, llm = summarize(measure(module), module, top)
+            totals.append(total)
+        print(f"{name} (import {module}): median {statistics.median(totals) / 1000:7.1f} ms over {runs} runs")
+        for row in heaviest:
+            print(f"    {row['cumulative_us'] / 1000:7.1f} ms  {'  ' * row['depth']}{row['module']}")
+        print(f"    llm libraries: {', '.join(llm) or 'none'}")
+        if llm and name in TRACKER_ENTRY_POINTS:
+            print(f"    ERROR: the {name} must not import llm libraries")
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+    sys.exit(run_script(runs=args.runs, top=args.top))
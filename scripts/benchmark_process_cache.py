@@ -0,0 +1,77 @@
+"""
+Per-tick cost of resolving the foreground process metadata with and without the
+cross-tick ProcessMetadataCache.
+
+Runs on any platform: psutil is used for the process lookups and the win32
+version info reads are replaced by a provider that costs what services/fileinfo.py
+FileInfo does: the translation is read when it is loaded, each string on its
+first access only (@cached), so a tick without the cache reads the executable
+3 times (translation, CompanyName and ProductName for the AppId).
+
+    python -m scripts.benchmark_process_cache
+"""
+from services.process_cache import ProcessMetadataCache, get_app_id, default_exe_path_provider
+from services.utils import cached
+import psutil
+import time
+import os
+
+TICKS = 2000
+reads = 0 # GetFileVersionInfo calls simulated
+
+def read_version_info(exe_full_path: str) -> bytes:
+    """One GetFileVersionInfo call: opens and parses the executable."""
+    global reads
+    reads += 1
+    with open(exe_full_path, 'rb') as f:
+        return f.read(4096)
+
+class SimulatedFileInfo:
+    def __init__(self, exe_full_path: str):
+        self.exe_full_path = exe_full_path
+        self.exe_lang_and_code_page = read_version_info(exe_full_path) # \\VarFileInfo\\Translation, like load_fileinfo
+    @property
+    @cached
+    def CompanyName(self) -> str:
+        read_version_info(self.exe_full_path)
+        return 'Benchmark Corp'
+    @property
+    @cached
+    def ProductName(self) -> str:
+        read_version_info(self.exe_full_path)
+        return os.path.basename(self.exe_full_path)
+
+def uncached_tick(pid: int) -> str:
+    process = psutil.Process(pid)
+    exe_file_name = process.name()
+    exe_full_path = default_exe_path_provider(process)
+    fileinfo = SimulatedFileInfo(exe_full_path)
+    return get_app_id(fileinfo, exe_dir_name=os.path.basename(os.path.dirname(exe_full_path)), exe_file_name=exe_file_name)
+
+def cached_tick(cache: ProcessMetadataCache, pid: int) -> str:
+    process = psutil.Process(pid)
+    return cache.get_metadata(cache.get_exe_full_path(process), exe_file_name=process.name()).app_id
+
+def run_script(ticks: int = TICKS):
+    pid = os.getpid()
+
+    global reads
+    reads, start = 0, time.perf_counter()
+    for _ in range(ticks): before_app_id = uncached_tick(pid)
+    before = (time.perf_counter() - start) / ticks
+    before_reads, reads = reads / ticks, 0
+
+    cache = ProcessMetadataCache(fileinfo_provider=SimulatedFileInfo)
+    start = time.perf_counter()
+    for _ in range(ticks): after_app_id = cached_tick(cache, pid)
+    after = (time.perf_counter() - start) / ticks
+    after_reads = reads / ticks
+
+    assert before_app_id == after_app_id
+    print(f"ticks: {ticks}")
+    print(f"before (no cache): {before * 1e6:9.1f} us/tick  ({before_reads:.2f} version info reads/tick)")
+    print(f"after  (cached)  : {after * 1e6:9.1f} us/tick  ({after_reads:.4f} version info reads/tick, {before / after:.1f}x)")
+    print(f"cache stats      : {cache.stats()}")
+
+if __name__ == "__main__":
+    run_script()
@@ -0,0 +1,87 @@
+"""
+Full-text search over the chat history (db/search.py): the LIKE scan it replaces against the FTS5
+index, on `messages` messages over `chats` chats in a temporary database, then a rebuild (backfill
+batch by batch) of that index.
+
+    python -m scripts.benchmark_search [--messages 100000] [--chats 1000] [--runs 50]
+"""
+from db.chatbot import DataBase
+from db import search
+from typing import Callable
+from itertools import accumulate
+import argparse
+import tempfile
+import random
+import time
+import os
+
+WORDS = ("python sqlite index query cache thread async stream token model prompt branch summary chart "
+         "budget travel paris museum recipe garden workout invoice meeting deadline report").split()
+VOCABULARY = 20_000 # filler words w0 (most common), w1, ..., Zipf distributed like the words of real text
+
+LEGACY_SEARCH = """--sql
+    SELECT m.MessageId, m.ChatId, m.content FROM Messages m
+    WHERE m.content LIKE ? ORDER BY m.Timestamp DESC LIMIT ?
+"""
+
+def build_history(database: DataBase, messages: int, chats: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" for i in range(VOCABULARY)]
+    for i, word in enumerate(WORDS): vocabulary.insert(100 * (i + 1), word) # ranks 100, 200, ...
+    cum_weights = list(accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+    per_chat = max(1, messages // chats)
+    with database.transaction():
+        for c in range(chats):
+            chat_id = database.new_chat(title=' '.join(rng.sample(WORDS, 3)))
+            leaf = None
+            for i in range(per_chat):
+                content = ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=40)) + f" message{c}x{i}"
+                leaf = database.new_message(chat_id, content=content, message_by='AI' if i % 2 else 'USER', parent_message_id=leaf)
+
+def timeit(function: Callable[[], object], runs: int) -> float:
+    """ms per call"""
+    start = time.perf_counter()
+    for _ in range(runs): function()
+    return (time.perf_counter() - start) / runs * 1000
+
+def run_script(messages: int = 100_000, chats: int = 1000, runs: int = 50):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database = DataBase(db_path=os.path.join(tmpdir, 'database.db'))
+        start = time.perf_counter()
+        build_history(database, messages, chats)
+        print(f"{messages} messages in {chats} chats, written (and indexed by the triggers) in {time.perf_counter() - start:.1f} sec")
+        cursor = database.conn.cursor()
+        cases = [
+            ('one word', 'museum', '%museum%'),
+            ('prefix (typing)', 'muse', '%muse%'),
+            ('two words', 'paris recipe', '%paris%recipe%'),
+            ('phrase', '"sqlite index"', '%sqlite index%'),
+            ('one message', 'message7x3', '%message7x3%'),
+            ('most common', 'w0', '% w0 %'),
+        ]
+        for name, text, like in cases:
+            query = search.match_query(text)
+            matches = cursor.execute("SELECT COUNT(*) FROM MessagesSearch WHERE MessagesSearch MATCH ?", (query, )).fetchone()[0]
+            before_ms = timeit(lambda: cursor.execute(LEGACY_SEARCH, (like, 20)).fetchall(), runs)
+            after_ms = timeit(lambda: database.search_history(query, 20), runs)
+            print(f"{name:16} ({matches:6} hits): LIKE {before_ms:8.3f} ms -> FTS5 {after_ms:8.3f} ms ({before_ms / after_ms:.1f}x)")
+        role_ms = timeit(lambda: database.search_history(search.match_query('museum'), 20, role='AI', since='2000-01-01'), runs)
+        print(f"{'filtered':29}: FTS5 {role_ms:8.3f} ms (role, date)")
+
+        database.rebuild_search_index()
+        start, batches, longest = time.perf_counter(), 0, 0.0
+        while True:
+            batch_start = time.perf_counter()
+            if not database.index_pending(): break
+            batches += 1
+            longest = max(longest, time.perf_counter() - batch_start)
+        print(f"rebuild: {time.perf_counter() - start:.1f} sec in {batches} batches of {search.BATCH}, longest write {longest * 1000:.1f} ms")
+        database.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=100_000)
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=50)
+    args = parser.parse_args()
+    run_script(messages=args.messages, chats=args.chats, runs=args.runs)
@@ -0,0 +1,125 @@
+"""
+Cross-validates the local embedding classifier (ml/embedding_classifier.py) on the
+categorized apps / baseURLs of a database and reports, per confidence threshold,
+how many items it answers itself (coverage), how often those answers are right
+and how many would still go to the LLM, plus training and prediction latency.
+
+    python -m scripts.eval_embedding_classifier [--db instance/database.db] [--folds 5]
+    python -m scripts.eval_embedding_classifier --synthetic   # built-in labelled sample
+"""
+from db import modulepath
+from ml.batch_classification import BatchItem, app_item, url_item
+from ml.embedding_classifier import EmbeddingClassifier, Prediction, row_item, MIN_SIMILARITY
+from db.models import IApp
+from typing import List, Tuple, Optional
+import argparse
+import random
+import sqlite3
+import time
+
+Sample = Tuple[BatchItem, str] # item, category
+
+THRESHOLDS = (0.0, 0.05, 0.1, 0.2, 0.3)
+
+SYNTHETIC = {
+    'Development': (
+        ['code.exe', 'pycharm64.exe', 'devenv.exe', 'git-bash.exe', 'WindowsTerminal.exe', 'idea64.exe', 'sublime_text.exe', 'postman.exe'],
+        ['github.com', 'stackoverflow.com', 'gitlab.com', 'docs.python.org', 'developer.mozilla.org', 'pypi.org', 'npmjs.com', 'readthedocs.io'],
+        ['code editor', 'integrated development environment', 'git repository', 'programming', 'api client', 'terminal']
+    ),
+    'Entertainment': (
+        ['vlc.exe', 'spotify.exe', 'steam.exe', 'netflix.exe', 'EpicGamesLauncher.exe', 'wmplayer.exe', 'discord.exe', 'obs64.exe'],
+        ['youtube.com', 'netflix.com', 'twitch.tv', 'primevideo.com', 'open.spotify.com', 'hotstar.com', 'crunchyroll.com', 'store.steampowered.com'],
+        ['watch videos', 'music streaming', 'games', 'movies and tv shows', 'live streams', 'media player']
+    ),
+    'Communication': (
+        ['slack.exe', 'teams.exe', 'zoom.exe', 'outlook.exe', 'thunderbird.exe', 'telegram.exe', 'whatsapp.exe', 'skype.exe'],
+        ['mail.google.com', 'web.whatsapp.com', 'outlook.live.com', 'slack.com', 'teams.microsoft.com', 'zoom.us', 'meet.google.com', 'web.telegram.org'],
+        ['email', 'chat with your team', 'video meetings', 'messaging', 'calls', 'inbox']
+    ),
+    'Productivity': (
+        ['winword.exe', 'excel.exe', 'powerpnt.exe', 'notion.exe', 'obsidian.exe', 'onenote.exe', 'acrord32.exe', 'todoist.exe'],
+        ['docs.google.com', 'notion.so', 'trello.com', 'calendar.google.com', 'office.com', 'drive.google.com', 'todoist.com', 'asana.com'],
+        ['documents and spreadsheets', 'notes', 'task management', 'calendar', 'word processor', 'presentations']
+    ),
+    'Social Media': (
+        [],
+        ['twitter.com', 'x.com', 'facebook.com', 'instagram.com', 'reddit.com', 'linkedin.com', 'pinterest.com', 'tumblr.com'],
+        ['social network', 'posts from friends', 'share photos', 'news feed', 'follow people', 'communities']
+    ),
+}
+
+def synthetic_samples(seed: int = 0) -> List[Sample]:
+    rng = random.Random(seed)
+    samples: List[Sample] = []
+    for category, (exes, domains, phrases) in SYNTHETIC.items():
+        for exe in exes:
+            name = exe.rsplit('.', 1)[0]
+            app = IApp(
+                AppId=f"C:\\Program Files\\{name} | {exe}", ExeFileName=exe, ExeDirName=f"C:\\Program Files\\{name}",
+                IsBrowser=False, FileDescription=f"{name} {rng.choice(phrases)}", ProductName=name
+            )
+            samples.append((app_item(app), category))
+        for domain in domains:
+            samples.append((url_item(domain, Title=f"{domain.split('.')[-2].title()} - {rng.choice(phrases)}",
+                                     Description=' '.join(rng.sample(phrases, 2))), category))
+    return samples
+
+def database_samples(db_path: str) -> List[Sample]:
+    connection = sqlite3.connect(db_path)
+    connection.row_factory = sqlite3.Row
+    cursor = connection.cursor()
+    cursor.execute("SELECT * FROM Apps WHERE Category IS NOT NULL")
+    samples: List[Sample] = [(row_item('app', row), row['Category']) for row in cursor.fetchall()]
+    cursor.execute("SELECT * FROM BaseURLs WHERE Category IS NOT NULL")
+    samples.extend((row_item('url', row), row['Category']) for row in cursor.fetchall())
+    connection.close()
+    return samples
+
+def cross_validate(samples: List[Sample], folds: int = 5, seed: int = 0) -> Tuple[List[Tuple[Prediction, str]], float, List[float]]:
+    """(prediction, truth) for every sample when held out, mean fit time, prediction latencies."""
+    order = list(range(len(samples)))
+    random.Random(seed).shuffle(order)
+    results: List[Tuple[Prediction, str]] = []
+    fit_times: List[float] = []
+    latencies: List[float] = []
+    for fold in range(folds):
+        held_out = set(order[fold::folds])
+        model = EmbeddingClassifier()
+        start = time.perf_counter()
+        for i, (item, category) in enumerate(samples):
+            if i not in held_out: model.learn(item, category)
+        model.predict(samples[0][0]) # builds the centroids
+        fit_times.append(time.perf_counter() - start)
+        for i in sorted(held_out):
+            start = time.perf_counter()
+            prediction = model.predict(samples[i][0])
+            latencies.append(time.perf_counter() - start)
+            results.append((prediction, samples[i][1]))
+    return results, sum(fit_times) / len(fit_times), latencies
+
+def run_script(db_path: Optional[str] = None, synthetic: bool = False, folds: int = 5):
+    samples = synthetic_samples() if synthetic else database_samples(db_path or str(modulepath.joinpath('..', 'instance', 'database.db')))
+    categories = {category for _, category in samples}
+    if len(samples) < folds or len(categories) < 2:
+        print(f"Need at least {folds} categorized items in 2 categories, got {len(samples)} in {len(categories)}")
+        return
+    results, fit_time, latencies = cross_validate(samples, folds=folds)
+    latencies.sort()
+    print(f"{len(samples)} items, {len(categories)} categories, {folds}-fold cross validation")
+    print(f"fit {fit_time*1000:.1f} ms, predict p50 {latencies[len(latencies)//2]*1e6:.0f} us, "
+          f"p95 {latencies[int(len(latencies)*0.95)]*1e6:.0f} us")
+    print(f"{'min_confidence':>15} {'coverage':>9} {'accuracy':>9} {'to LLM':>7}  (similarity >= {MIN_SIMILARITY})")
+    for threshold in THRESHOLDS:
+        answered = [(prediction, truth) for prediction, truth in results if prediction['confidence'] >= threshold and prediction['similarity'] >= MIN_SIMILARITY]
+        correct = sum(prediction['category'] == truth for prediction, truth in answered)
+        accuracy = f"{correct / len(answered):9.1%}" if answered else f"{'-':>9}"
+        print(f"{threshold:>15.2f} {len(answered) / len(results):9.1%} {accuracy} {len(results) - len(answered):7d}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default=None)
+    parser.add_argument('--synthetic', action='store_true')
+    parser.add_argument('--folds', type=int, default=5)
+    args = parser.parse_args()
+    run_script(db_path=args.db, synthetic=args.synthetic, folds=args.folds)
@@ -0,0 +1,174 @@
+"""
+Load test of the chatbot store (db/chatbot/database.py) under concurrent chat streams against the
+local stand-in server (ml/standin_server.py): every stream answers a new user message of one of a few
+chats (streams of a chat add sibling answers under the same message), checkpoints its partial answer
+while streaming and hands the final one to the task worker, while threads switch branches and read the
+same chats. Afterwards the message trees are checked: positions, child counts, visible pointers and
+flags, the stored visible branch and every answer against the streamed text.
+
+    python -m scripts.load_test_chatbot [--streams 50] [--chats 10] [--tokens-per-second 200] [--latency 0.05]
+"""
+from api.chatbot.streaming import AnswerWriter, ChatStream, StreamStats, delta_texts
+from api.chatbot.tasks import ChatTaskWorker, heuristic_title
+from db.chatbot import DataBase
+from ml import providers
+from ml.providers import Provider, ProviderConfig
+from ml.standin_server import StandInServer
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Optional
+import statistics
+import argparse
+import asyncio
+import threading
+import tempfile
+import random
+import time
+import os
+
+def check_tree(database: DataBase, chat_id: int) -> List[str]:
+    """What is wrong with the message tree of the chat (nothing for a consistent one)."""
+    errors: List[str] = []
+    messages = database.get_chat_messages(chat_id)
+    children: Dict[Optional[int], List[dict]] = {None: []}
+    for message in messages:
+        children.setdefault(message['parent_id'], []).append(message)
+        children.setdefault(message['MessageId'], [])
+    for parent, childs in children.items():
+        count, active = database.get_children_counter(chat_id, parent)
+        if count != len(childs): errors.append(f"{parent}: childs {count}, has {len(childs)}")
+        if sorted(m['position'] for m in childs) != list(range(1, len(childs) + 1)):
+            errors.append(f"{parent}: positions {sorted(m['position'] for m in childs)}")
+        flagged = [m['MessageId'] for m in childs if m['is_active']]
+        if childs and flagged != [active]: errors.append(f"{parent}: visible {active}, flagged {flagged}")
+        levels = {m['level'] for m in childs}
+        if parent is not None and levels - {next(m['level'] for m in messages if m['MessageId'] == parent) + 1}:
+            errors.append(f"{parent}: child levels {levels}")
+    path: List[int] = []
+    parent = None
+    while True: # the visible branch from the pointers
+        _, active = database.get_children_counter(chat_id, parent)
+        if active is None: break
+        path.append(active)
+        parent = active
+    stored = [m['MessageId'] for m in database.get_chats_down(chat_id, None, max_result=len(messages) + 1)]
+    if stored != path: errors.append(f"visible branch {stored}, pointers {path}")
+    info = database.get_chat_info(chat_id)
+    if path and (info['leaf_node_id'], info['active_depth']) != (path[-1], len(path)):
+        errors.append(f"leaf {info['leaf_node_id']} depth {info['active_depth']}, pointers {path[-1]} {len(path)}")
+    return errors
+
+def make_chats(database: DataBase, chats: int) -> List[Tuple[int, int]]:
+    """Chats of a question and its answer: (ChatId, the answer) the streams reply under."""
+    made = []
+    for i in range(chats):
+        with database.transaction():
+            chat_id = database.new_chat(title=heuristic_title(f"question {i}"))
+            question = database.new_message(chat_id, content=f"question {i}", message_by='USER')
+            made.append((chat_id, database.new_message(chat_id, content=f"answer {i}", message_by='AI', parent_message_id=question)))
+    return made
+
+async def run_streams(database: DataBase, worker: ChatTaskWorker, chats: List[Tuple[int, int]], streams: int,
+                      checkpoint_interval: float) -> Tuple[List[float], Dict[int, str], float, List[str]]:
+    """Time to first frame of every stream, text of every stored answer, wall time and what went wrong per stream."""
+    provider = providers.get_provider()
+    async def stream(i: int) -> Tuple[float, Optional[int], str, StreamStats]:
+        chat_id, parent_id = chats[i % len(chats)]
+        content = f"follow up {i} " + 'lorem ipsum ' * 20
+        start, first = time.perf_counter(), None
+        writer = AnswerWriter(database, chat_id, user_content=content, parent_id=parent_id)
+        answer = ChatStream(delta_texts(provider.astream([{'role': 'user', 'content': content}])), writer,
+                            checkpoint_interval=checkpoint_interval, finish=worker.submit_answer)
+        async for _ in answer.response():
+            if first is None: first = time.perf_counter() - start
+        worker.notify()
+        return first or 0.0, writer.message_id, answer.text, answer.stats
+    start = time.perf_counter()
+    results = await asyncio.gather(*(stream(i) for i in range(streams)))
+    elapsed = time.perf_counter() - start
+    errors = [f"stream {i}: {stats['error'] or 'nothing stored'} after {stats['tokens']} tokens"
+              for i, (_, message_id, _, stats) in enumerate(results) if stats['error'] or message_id is None]
+    answers = {message_id: text for _, message_id, text, _ in results if message_id is not None}
+    return [first for first, *_ in results], answers, elapsed, errors
+
+def switch_and_read(database: DataBase, chats: List[Tuple[int, int]], stop: threading.Event, seed: int) -> int:
+    """Branch switches and reads of the chats from a thread until `stop`, returns the operations."""
+    rng, operations = random.Random(seed), 0
+    while not stop.is_set():
+        chat_id, parent_id = rng.choice(chats)
+        path = database.get_chats_down(chat_id, None, max_result=100)
+        if len(path) > 3:
+            try:
+                if rng.random() < 0.5: database.next_message(chat_id, path[2]['MessageId'])
+                else: database.prev_message(chat_id, path[2]['MessageId'])
+            except IndexError: pass
+        database.get_lazy_chat_messages(chat_id)
+        operations += 1
+        time.sleep(0.001)
+    return operations
+
+async def run_load(database: DataBase, chats: List[Tuple[int, int]], streams: int, threads: int,
+                   checkpoint_interval: float) -> Tuple[List[float], Dict[int, str], float, List[str], int, ChatTaskWorker]:
+    """The streams with `threads` threads switching branches meanwhile, then the handed over answers are written."""
+    worker = ChatTaskWorker(database, poll=0.5)
+    worker.start()
+    loop, stop = asyncio.get_running_loop(), threading.Event()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        switchers = [loop.run_in_executor(executor, switch_and_read, database, chats, stop, seed) for seed in range(threads)]
+        try:
+            firsts, answers, elapsed, failed = await run_streams(database, worker, chats, streams, checkpoint_interval)
+        finally:
+            stop.set()
+            operations = sum(await asyncio.gather(*switchers))
+    await worker.run_once()
+    await worker.stop()
+    return firsts, answers, elapsed, failed, operations, worker
+
+def percentile(values: List[float], q: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(q * len(values)))]
+
+def run_script(streams: int = 50, chats: int = 10, threads: int = 4, tokens_per_second: float = 200.0,
+               latency: float = 0.05, checkpoint_interval: float = 0.1):
+    server = StandInServer(tokens_per_second=tokens_per_second, latency=latency).start()
+    provider = Provider('local', ProviderConfig(
+        base_url=server.base_url, api_key_env=None, model='standin',
+        max_concurrency=streams, timeout=60.0, connect_timeout=2.0, max_retries=0
+    ))
+    providers.set_provider(provider)
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            database = DataBase(db_path=os.path.join(tmpdir, 'database.db'))
+            made = make_chats(database, chats)
+            firsts, answers, elapsed, failed, operations, worker = asyncio.run(run_load(database, made, streams, threads, checkpoint_interval))
+            stats = worker.stats()
+            print(f"chat streams : {streams} over {chats} chats in {elapsed:.2f}s, {operations} branch switches / reads "
+                  f"from {threads} threads, "
+                  f"first frame p50 {statistics.median(firsts) * 1000:.0f} ms p95 {percentile(firsts, 0.95) * 1000:.0f} ms")
+            print(f"chat tasks   : {stats}")
+            print(f"stream errors: {len(failed)}")
+            for error in failed[:20]: print(f"  {error}")
+            errors = [f"chat {chat_id}: {error}" for chat_id, _ in made for error in check_tree(database, chat_id)]
+            for chat_id, _ in made:
+                for message in database.get_chat_messages(chat_id):
+                    if message['MessageId'] in answers and message['content'] != answers.pop(message['MessageId']):
+                        errors.append(f"chat {chat_id}: answer {message['MessageId']} differs from the streamed text")
+            errors += [f"answer {message_id} not stored" for message_id in answers]
+            if stats['pending'] or stats['running'] or stats['dead']: errors.append(f"tasks left: {stats}")
+            database.close()
+        print(f"tree integrity: {'ok' if not errors else f'{len(errors)} errors'}")
+        for error in errors[:20]: print(f"  {error}")
+        if errors or failed: raise SystemExit(1)
+    finally:
+        providers.set_provider(None)
+        server.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--streams', type=int, default=50)
+    parser.add_argument('--chats', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--checkpoint-interval', type=float, default=0.1)
+    args = parser.parse_args()
+    run_script(streams=args.streams, chats=args.chats, threads=args.threads, tokens_per_second=args.tokens_per_second,
+               latency=args.latency, checkpoint_interval=args.checkpoint_interval)
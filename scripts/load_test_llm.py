@@ -0,0 +1,81 @@
+"""
+Offline load test of the LLM paths through the provider layer (ml/providers.py) against
+the local stand-in server (ml/standin_server.py): concurrent chat streams, single item
+classification on a thread pool and batched classification.
+
+    python -m scripts.load_test_llm [--streams 32] [--classifications 200] [--tokens-per-second 50] [--latency 0.05]
+"""
+from ml import providers, langchain_classification
+from ml.providers import Provider, ProviderConfig
+from ml.standin_server import StandInServer
+from ml.batch_classification import BatchClassifier, app_item
+from db.models import IApp
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+import statistics
+import argparse
+import asyncio
+import time
+
+CATEGORIES = ['Development', 'Productivity', 'Communication', 'Entertainment', 'Games', 'Education']
+
+def make_apps(count: int) -> List[IApp]:
+    return [IApp(AppId=f"bench | app{i}.exe", ExeFileName=f"app{i}.exe", ExeDirName='bench', IsBrowser=False) for i in range(count)]
+
+async def run_streams(provider: Provider, streams: int) -> Tuple[List[float], int, float]:
+    """Time to first token of every stream, tokens received and wall time."""
+    async def stream(i: int) -> Tuple[float, int]:
+        start, first, tokens = time.perf_counter(), None, 0
+        async for chunk in provider.astream([{'role': 'user', 'content': f"question {i} " + 'lorem ipsum ' * 20}]):
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first is None: first = time.perf_counter() - start
+                tokens += 1
+        return first or 0.0, tokens
+    start = time.perf_counter()
+    results = await asyncio.gather(*(stream(i) for i in range(streams)))
+    return [first for first, _ in results], sum(tokens for _, tokens in results), time.perf_counter() - start
+
+def percentile(values: List[float], q: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(q * len(values)))]
+
+def run_script(streams: int = 32, classifications: int = 200, tokens_per_second: float = 50.0,
+               latency: float = 0.05, concurrency: int = 8):
+    server = StandInServer(tokens_per_second=tokens_per_second, latency=latency).start()
+    provider = Provider('local', ProviderConfig(
+        base_url=server.base_url, api_key_env=None, model='standin',
+        max_concurrency=concurrency, timeout=60.0, connect_timeout=2.0, max_retries=0
+    ))
+    providers.set_provider(provider)
+    try:
+        firsts, tokens, elapsed = asyncio.run(run_streams(provider, streams))
+        print(f"chat streams      : {streams} in {elapsed:.2f}s, {tokens / elapsed:.0f} tokens/s, "
+              f"first token p50 {statistics.median(firsts) * 1000:.0f} ms p95 {percentile(firsts, 0.95) * 1000:.0f} ms")
+
+        apps = make_apps(classifications)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency * 2) as executor:
+            list(executor.map(lambda app: langchain_classification.predict_app_category(app, CATEGORIES), apps))
+        elapsed = time.perf_counter() - start
+        print(f"single classify   : {classifications} items in {elapsed:.2f}s, {classifications / elapsed:.0f} items/s")
+
+        start = time.perf_counter()
+        result = BatchClassifier().classify([app_item(app) for app in apps], CATEGORIES)
+        elapsed = time.perf_counter() - start
+        print(f"batched classify  : {len(result['categories'])}/{classifications} items in {len(result['batches'])} requests, "
+              f"{elapsed:.2f}s, {classifications / elapsed:.0f} items/s")
+        print(f"provider stats    : {provider.stats()}")
+        print(f"server max in flight: {server.max_in_flight} (limit {concurrency})")
+    finally:
+        providers.set_provider(None)
+        server.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--streams', type=int, default=32)
+    parser.add_argument('--classifications', type=int, default=200)
+    parser.add_argument('--tokens-per-second', type=float, default=50.0)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+    run_script(streams=args.streams, classifications=args.classifications, tokens_per_second=args.tokens_per_second,
+               latency=args.latency, concurrency=args.concurrency)
@@ -0,0 +1,137 @@
+"""
+Replays a foreground/idle trace against the tracker's sampling strategies and
+reports accuracy (seconds attributed to the right (app, active) state) versus
+wakeups per hour.
+
+The trace is a list of segments `[duration_sec, app, has_input]`. Inside a segment
+without input the idle duration grows from the last input, exactly like
+get_idle_duration(), so the first INACTIVITY_LIMIT seconds still count as active.
+Like service(), each interval between two ticks is credited to the state observed
+at the start of the interval (the adaptive tracker splits it at the exact active
+state flip), and every tick costs TICK_COST seconds of work.
+
+    python -m scripts.replay_scheduler [--trace trace.json] [--hours 8] [--seed 0]
+    EFFICIA_MAX_INTERVAL=60 python -m scripts.replay_scheduler  # try other settings
+"""
+from services.scheduler import AdaptiveScheduler, transition_offset
+from services.constants import INACTIVITY_LIMIT, INTERVAL, MIN_INTERVAL, MAX_INTERVAL, IDLE_BACKOFF
+from typing import List, Tuple, Callable, Optional
+import argparse
+import random
+import json
+
+Segment = Tuple[float, str, bool] # duration_sec, app, has_input
+
+TICK_COST = 0.05 # sec spent by a tick (win32 calls, ui automation, api post)
+
+def synthetic_trace(hours: float = 8, seed: int = 0) -> List[Segment]:
+    rng = random.Random(seed)
+    apps = [f"app_{i}" for i in range(12)]
+    trace: List[Segment] = []
+    total = 0.0
+    while total < hours * 3600:
+        kind = rng.choices(['focus', 'switching', 'break'], weights=[5, 3, 2])[0]
+        if kind == 'focus':
+            segments = [(rng.uniform(5*60, 40*60), rng.choice(apps), True)]
+        elif kind == 'switching':
+            segments = [(rng.uniform(3, 30), rng.choice(apps), True) for _ in range(rng.randint(5, 15))]
+        else:
+            segments = [(rng.uniform(5*60, 60*60), trace[-1][1] if trace else apps[0], False)]
+        trace.extend(segments)
+        total += sum(segment[0] for segment in segments)
+    return trace
+
+class Replay:
+    def __init__(self, trace: List[Segment]):
+        self.starts: List[float] = []
+        self.last_inputs: List[Optional[float]] = [] # last input time seen at the start of each segment
+        t, last_input = 0.0, None
+        for duration, _, has_input in trace:
+            self.starts.append(t)
+            self.last_inputs.append(last_input)
+            t += duration
+            if has_input: last_input = t
+        self.trace = trace
+        self.duration = t
+        self.index = 0
+
+    def state(self, t: float) -> Tuple[str, float]:
+        """(app, idle_duration) at time t, t must not decrease between calls."""
+        while self.index + 1 < len(self.starts) and self.starts[self.index + 1] <= t: self.index += 1
+        _, app, has_input = self.trace[self.index]
+        if has_input: return app, 0.0
+        last_input = self.last_inputs[self.index]
+        return app, t - (last_input if last_input is not None else 0.0)
+
+def replay(trace: List[Segment], next_tick: Callable[[float, Replay], Tuple[float, float]], split: bool = False):
+    """
+    next_tick(now, replay) -> (real seconds until the next tick, seconds the tracker credits).
+    split: credit the part of the interval after an active state flip to the new state (transition_offset).
+    Returns (accuracy, wakeups per hour, tracked / real duration).
+    """
+    truth, observed = Replay(trace), Replay(trace)
+    t, correct, tracked, wakeups = 0.0, 0.0, 0.0, 0
+    app, idle = observed.state(t)
+    while t < truth.duration:
+        step, credited = next_tick(t, observed)
+        end = min(t + step, truth.duration)
+        next_app, next_idle = observed.state(end)
+        active, next_active = idle <= INACTIVITY_LIMIT, next_idle <= INACTIVITY_LIMIT
+        boundary = end # states before the boundary are credited to the previous observation
+        if split and next_app == app and active != next_active:
+            boundary = end - transition_offset(next_idle, next_active, end - t, idle_limit=INACTIVITY_LIMIT)
+        second = t
+        while second < end: # per second ground truth
+            true_app, true_idle = truth.state(second)
+            expected = (app, active) if second < boundary else (next_app, next_active)
+            if (true_app, true_idle <= INACTIVITY_LIMIT) == expected:
+                correct += min(1.0, end - second)
+            second += 1.0
+        tracked += credited
+        t = end
+        wakeups += 1
+        app, idle = next_app, next_idle
+    hours = truth.duration / 3600
+    return correct / truth.duration, wakeups / hours, tracked / truth.duration
+
+def fixed_strategy():
+    def next_tick(now: float, state: Replay):
+        return INTERVAL + TICK_COST, INTERVAL # time.sleep(INTERVAL), credits INTERVAL
+    return next_tick
+
+def adaptive_strategy():
+    clock = [0.0]
+    scheduler = AdaptiveScheduler(
+        base_interval=INTERVAL, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+        idle_limit=INACTIVITY_LIMIT, backoff=IDLE_BACKOFF,
+        clock=lambda: clock[0], sleep=lambda seconds: clock.__setitem__(0, clock[0] + seconds)
+    )
+    last_app: List[Optional[str]] = [None]
+    def next_tick(now: float, state: Replay):
+        app, idle = state.state(now)
+        scheduler.observe(idle_duration=idle, changed=app != last_app[0])
+        last_app[0] = app
+        clock[0] = now + TICK_COST # the tick's own work
+        elapsed = scheduler.wait()
+        return clock[0] - now, elapsed
+    return next_tick
+
+def run_script(trace: Optional[List[Segment]] = None):
+    trace = trace if trace is not None else synthetic_trace()
+    print(f"trace: {len(trace)} segments, {sum(segment[0] for segment in trace) / 3600:.1f} h")
+    print(f"{'strategy':<10} {'accuracy':>9} {'wakeups/h':>10} {'tracked/real':>13}")
+    for name, strategy, split in (('fixed', fixed_strategy(), False), ('adaptive', adaptive_strategy(), True)):
+        accuracy, wakeups, drift = replay(trace, strategy, split=split)
+        print(f"{name:<10} {accuracy * 100:8.2f}% {wakeups:10.0f} {drift:13.4f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trace', help="json list of [duration_sec, app, has_input]")
+    parser.add_argument('--hours', type=float, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.trace:
+        with open(args.trace, 'r') as f: trace = [tuple(segment) for segment in json.load(f)]
+    else:
+        trace = synthetic_trace(hours=args.hours, seed=args.seed)
+    run_script(trace)
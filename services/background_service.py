@@ -1,10 +1,7 @@
-import os; os.environ["GROQ_API_KEY"] = "None" # to handle DataBase_Api logic
-
 from db import get_database_Api as get_database, DataBase_Api as DataBase, logger
 from db.models import IUrl, IApp, IActivityEntry
-from .background_service_helper import App, SleepError
-from .constants import INTERVAL, INACTIVITY_LIMIT, SAVE_EVERY#, MIN_DURATION_TO_SAVE
-import time
+from .constants import INACTIVITY_LIMIT, SAVE_EVERY#, MIN_DURATION_TO_SAVE
+from .scheduler import AdaptiveScheduler, transition_offset
 from typing import Optional
 
 def modify_iEntry(iEntry: IActivityEntry, active: bool, idleDuration: int, entry_duration: int) -> IActivityEntry:
@@ -18,6 +15,12 @@ def modify_iEntry(iEntry: IActivityEntry, active: bool, idleDuration: int, entry
 # conn.execute('ROLLBACK TO SAVEPOINT sp1')
 
 def service(database: DataBase):
+    # NOTE: imported here as background_service_helper needs win32, rest of the services package is platform independent
+    from .background_service_helper import App, SleepError, load_fileinfo, get_module_file_name
+    from .resource_sampler import ResourceSampler, sampler_cache
+    # not PROCESS_CACHE: a pass over every process would evict the entries of the tracker's tick
+    resource_sampler = ResourceSampler(cache=sampler_cache(fileinfo_provider=load_fileinfo, exe_path_provider=get_module_file_name))
+    resource_sampler.start(database)
     old_app = App.from_active_window()
     old_app_id = old_app.app_id
     old_entry_id = old_app.entry_id
@@ -28,8 +31,9 @@ def service(database: DataBase):
     time_since_update = 0
     old_app_iEntry = old_app.get_iEntry(active=old_active, idleDuration=old_idle_duration, entry_duration=entry_duration)
     is_first: bool = True
+    scheduler = AdaptiveScheduler()
     while True:
-        time.sleep(INTERVAL) # entry_duration + INTERVAL because i am sleeping before this...
+        elapsed = scheduler.wait() # entry_duration + elapsed because i am sleeping before this...
         try:
             new_app = App.from_active_window()
             new_app_id = new_app.app_id
@@ -49,6 +53,9 @@ def service(database: DataBase):
             continue
         
         # new_app.get_window_gui_debug_info()
+        changed = is_first or new_app_id != old_app_id or not (
+            new_entry_id == old_entry_id or (full_screen_entry_id and full_screen_entry_id == old_entry_id)
+        )
         if new_app_id == old_app_id and not is_first: # same app
             if new_entry_id == old_entry_id or (full_screen_entry_id and full_screen_entry_id == old_entry_id): # same window in an app
                 if old_active == new_active: # same app and old one has same active state
@@ -56,7 +63,7 @@ def service(database: DataBase):
                     if time_since_update > SAVE_EVERY:
                         last_activity_index = database.update_or_insert_activity(
                             activity=modify_iEntry(iEntry=old_app_iEntry,
-                                active=old_active, idleDuration=old_idle_duration, entry_duration=entry_duration + INTERVAL
+                                active=old_active, idleDuration=old_idle_duration, entry_duration=entry_duration + elapsed
                             ), 
                             EntryId=last_activity_index,
                             # commit=True # NOTE: SAVE_EVERY
@@ -65,14 +72,16 @@ def service(database: DataBase):
                     # ------------------------
                     old_idle_duration = new_idle_duration
                     old_active = new_active
-                    entry_duration += INTERVAL
-                    time_since_update += INACTIVITY_LIMIT
+                    entry_duration += elapsed
+                    time_since_update += elapsed
                 else: # same app but old one has different active state
                     logger.debug(f"SAME APP AND WINDOW BUT DIFFERENT ACTIVE STATE, new state: {not old_active}")
+                    # the flip happened `offset` sec ago (last input / idle limit crossing), not at this tick
+                    offset = transition_offset(idle_duration=new_idle_duration, active=new_active, elapsed=elapsed)
                     if not entry_duration == 0:
                         database.update_or_insert_activity(
                             activity=modify_iEntry(iEntry=old_app_iEntry,
-                                active=old_active, idleDuration=old_idle_duration, entry_duration=entry_duration + INTERVAL
+                                active=old_active, idleDuration=old_idle_duration, entry_duration=entry_duration + elapsed - offset
                             ), 
                             EntryId=last_activity_index,
                             # commit=True
@@ -81,7 +90,7 @@ def service(database: DataBase):
                     old_active = new_active
                     old_idle_duration = new_idle_duration
                     old_active = new_active
-                    entry_duration = 0
+                    entry_duration = offset
                     last_activity_index = None
                     time_since_update = 0
             else: # same app but different window
@@ -89,7 +98,7 @@ def service(database: DataBase):
                 if not entry_duration == 0:
                     database.update_or_insert_activity(
                         activity=modify_iEntry(iEntry=old_app_iEntry,
-                            active=old_active, idleDuration=old_idle_duration, entry_duration=entry_duration + INTERVAL
+                            active=old_active, idleDuration=old_idle_duration, entry_duration=entry_duration + elapsed
                         ), 
                         EntryId=last_activity_index,
                         # commit=True
@@ -108,7 +117,7 @@ def service(database: DataBase):
             if not entry_duration == 0:
                 database.update_or_insert_activity(
                     activity=modify_iEntry(iEntry=old_app_iEntry,
-                        active=old_active, idleDuration=old_idle_duration, entry_duration=entry_duration + INTERVAL
+                        active=old_active, idleDuration=old_idle_duration, entry_duration=entry_duration + elapsed
                     ), 
                     EntryId=last_activity_index,
                     # commit=True
@@ -128,6 +137,7 @@ def service(database: DataBase):
             time_since_update = 0
             old_app_iEntry = new_app.get_iEntry(active=new_active, idleDuration=new_idle_duration, entry_duration=entry_duration)
             is_first = False
+        scheduler.observe(idle_duration=new_idle_duration, changed=changed)
 
 def run_service(check_server_status: bool = True):
     database = get_database(check_server_status)
@@ -14,10 +14,12 @@ from dataclasses import dataclass
 import json
 from typing import Optional, List, Tuple, Dict, Union, TypeVar, Generic, overload, Callable, NewType, Any, Literal
 
-from db import DataBase, modulepath, logger
+from db import DataBase, modulepath, logger, get_icon_store
 from db.models import IApp, IUrl, IActivityEntry
-from .constants import ICON_LISTDIR, ICON_DIR, SEARCH_BAR_ADDRESS
+from .constants import ICON_DIR, ICON_THUMBNAIL_SIZES, SEARCH_BAR_ADDRESS
 from .fileinfo import FileInfo
+from .process_cache import ProcessMetadataCache, ExeMetadata
+from .icon_pipeline import IconPipeline
 from .utils import cached, try_default, debug
 
 from ctypes import windll
@@ -28,6 +30,60 @@ logger.info(f"SCREEN_RECT: {full_screen_rect}")
 
 class SleepError(Exception): ...
 
+@try_default(default_value=None)
+def load_fileinfo(exe_full_path: str) -> Optional[FileInfo]:
+    ms: List[Tuple[str, str]] = win32api.GetFileVersionInfo(exe_full_path, '\\VarFileInfo\\Translation')
+    if not ms: return None
+    return FileInfo(
+        exe_full_path=exe_full_path,
+        exe_dir_name=os.path.basename(os.path.dirname(exe_full_path)),
+        exe_file_name=os.path.basename(exe_full_path),
+        exe_lang_and_code_page=ms[0]
+    )
+
+def get_module_file_name(process: psutil.Process) -> str:
+    hprocess = win32api.OpenProcess(win32con.PROCESS_QUERY_INFORMATION | win32con.PROCESS_VM_READ, False, process.pid)
+    try:
+        return win32process.GetModuleFileNameEx(hprocess, 0)
+    finally:
+        win32api.CloseHandle(hprocess)
+
+def extract_icon(exe_full_path: str) -> Optional[Image.Image]:
+    ico_x = win32api.GetSystemMetrics(win32con.SM_CXICON)
+    ico_y = win32api.GetSystemMetrics(win32con.SM_CYICON)
+    
+    large, small = win32gui.ExtractIconEx(exe_full_path, 0)
+    if small:
+        win32gui.DestroyIcon(small[0])
+    if not large: return None
+    
+    hwindc = win32gui.GetDC(0)
+    try:
+        hdc = win32ui.CreateDCFromHandle(hwindc)
+        hbmp = win32ui.CreateBitmap()
+        hbmp.CreateCompatibleBitmap(hdc, ico_x, ico_y)
+        hdc_compatible = hdc.CreateCompatibleDC()
+        hdc_compatible.SelectObject(hbmp)
+        hdc_compatible.DrawIcon((0, 0), large[0])
+
+        bmpstr = hbmp.GetBitmapBits(True)
+        icon = Image.frombuffer( 
+            'RGBA',
+            (ico_x, ico_y),
+            bmpstr, 'raw', 'BGRA', 0, 1
+        )
+        hdc_compatible.DeleteDC()
+        win32gui.DeleteObject(hbmp.GetHandle())
+    finally:
+        win32gui.DestroyIcon(large[0])
+        win32gui.ReleaseDC(0, hwindc)
+    return icon
+
+# shared across ticks, see services/process_cache.py
+PROCESS_CACHE = ProcessMetadataCache(fileinfo_provider=load_fileinfo, exe_path_provider=get_module_file_name)
+# icons are extracted on a background thread, see services/icon_pipeline.py
+ICON_PIPELINE = IconPipeline(store=get_icon_store(legacy_icon_dir=ICON_DIR), image_provider=extract_icon, thumbnail_sizes=ICON_THUMBNAIL_SIZES)
+
 class App:
     def __init__(self, hwnd: int, pid: int):
         assert pid >= 0, "pid must be positive integer"
@@ -39,29 +95,24 @@ class App:
         
         self.process = psutil.Process(pid)
         self.exe_file_name = self.process.name()
-        self.fileinfo = FileInfo(
-            exe_full_path=self.exe_full_path,
-            exe_dir_name=self.exe_dir_name,
-            exe_file_name=self.exe_dir_name,
-            exe_lang_and_code_page=self.exe_lang_and_code_page
-        ) if self.exe_lang_and_code_page else None
+        self.metadata: ExeMetadata = PROCESS_CACHE.get_metadata(
+            PROCESS_CACHE.get_exe_full_path(self.process), 
+            exe_file_name=self.exe_file_name
+        )
+        self.fileinfo: Optional[FileInfo] = self.metadata.fileinfo
         
             
     @property
     @cached
-    def cpu_percent(self: "App") -> float: return self.process.cpu_percent(interval=0.1)
+    def cpu_percent(self: "App") -> float: return self.process.cpu_percent(interval=None) # non blocking, per app history is recorded by services.resource_sampler
     
     @property
     @cached
     def memory_info(self: "App") -> "psutil.pmem": return self.process.memory_info()
     
     @property
-    @cached
-    @try_default(default_value=None)
-    def exe_lang_and_code_page(self: "App") -> Tuple[str, str]: 
-        ms: List[Tuple[str, str]] = win32api.GetFileVersionInfo(self.exe_full_path, '\\VarFileInfo\\Translation')
-        language, code_page = ms[0]
-        return language, code_page
+    def exe_lang_and_code_page(self: "App") -> Optional[Tuple[str, str]]: 
+        return self.fileinfo.exe_lang_and_code_page if self.fileinfo else None
     
     @property
     @try_default(default_value=None)
@@ -76,17 +127,12 @@ class App:
         return cls(hwnd, pid)
     
     @property
-    @cached
     def exe_full_path(self) -> str:
-        hprocess = win32api.OpenProcess(win32con.PROCESS_QUERY_INFORMATION | win32con.PROCESS_VM_READ, False, self.pid)
-        return win32process.GetModuleFileNameEx(hprocess, 0)
+        return self.metadata.exe_full_path
     
     @property
-    @cached
     def exe_dir_name(self) -> str:
-        file_path = self.exe_full_path
-        dirname = os.path.dirname(file_path)
-        return os.path.basename(dirname)
+        return self.metadata.exe_dir_name
     
     @property
     def is_browser(self) -> bool:
@@ -113,11 +159,8 @@ class App:
         return f"{self.title}"
     
     @property
-    @cached
     def app_id(self) -> str:
-        if not self.fileinfo or not self.fileinfo.CompanyName or self.fileinfo.CompanyName == 'None' or not self.fileinfo.ProductName or self.fileinfo.ProductName == 'None':
-            return f"{self.exe_dir_name} | {self.exe_file_name}"
-        return f"{self.fileinfo.CompanyName} | {self.fileinfo.ProductName}"
+        return self.metadata.app_id
     
     @property
     @cached
@@ -160,46 +203,9 @@ class App:
         self.last_url = url
         return url
     
-    @cached
-    @try_default(default_value=False)
     def save_icon(self) -> bool:
-        # Check if icon already exists
-        icon_file_name = f"{base64.urlsafe_b64encode(self.app_id.encode('utf-8')).decode('utf-8')}.png"
-        if icon_file_name in ICON_LISTDIR: return True
-        icon_path = os.path.join(ICON_DIR, icon_file_name)
-            
-        # Extract the icon
-        ico_x = win32api.GetSystemMetrics(win32con.SM_CXICON)
-        ico_y = win32api.GetSystemMetrics(win32con.SM_CYICON)
-        
-        large, small = win32gui.ExtractIconEx(self.exe_full_path, 0)
-        
-        if not large: 
-            logger.warning(f"Unable to extract icon for {self.exe_file_name}")
-            return False
-        
-        if small:
-            win32gui.DestroyIcon(small[0])
-            
-        hdc = win32ui.CreateDCFromHandle(win32gui.GetDC(0))
-        hbmp = win32ui.CreateBitmap()
-        hbmp.CreateCompatibleBitmap(hdc, ico_x, ico_y)
-        hdc_compatible = hdc.CreateCompatibleDC()
-        hdc_compatible.SelectObject(hbmp)
-        hdc_compatible.DrawIcon((0, 0), large[0])
-
-        bmpstr = hbmp.GetBitmapBits(True)
-        icon = Image.frombuffer( 
-            'RGBA',
-            (ico_x, ico_y),
-            bmpstr, 'raw', 'BGRA', 0, 1
-        )
-        win32gui.DestroyIcon(large[0])
-        
-        icon.save(icon_path, format="PNG")
-        icon.close()
-        ICON_LISTDIR.append(icon_file_name)
-        return True
+        # never blocks the tick, the icon is extracted and encoded by ICON_PIPELINE's worker
+        return ICON_PIPELINE.submit(app_id=self.app_id, exe_full_path=self.exe_full_path)
     
     def __repr__(self) -> str:
         if self.url:
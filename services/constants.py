@@ -1,6 +1,7 @@
-from typing import NewType
+from typing import NewType, TypeVar
 from db import modulepath, Path
 import json
+import os
 #####################################################################################
 #                                   Types                                           #
 #####################################################################################
@@ -9,17 +10,37 @@ import json
 # Url = NewType('Url', str)
 # Timestamp = NewType('Timestamp', str)
 
+#####################################################################################
+#                                   Helpers                                         #
+#####################################################################################
+
+Number = TypeVar('Number', int, float)
+def env_number(name: str, default: Number) -> Number:
+    """`EFFICIA_<name>` from the environment, parsed with the type of default."""
+    value = os.environ.get(f"EFFICIA_{name}")
+    if not value: return default
+    return type(default)(value)
+
 #####################################################################################
 #                                   Constants                                       #
 #####################################################################################
-INACTIVITY_LIMIT: int = 60*2
-INTERVAL: int = 5
+# every constant below can be overridden with an `EFFICIA_<NAME>` environment variable
+INACTIVITY_LIMIT: int = env_number('INACTIVITY_LIMIT', 60*2)
+INTERVAL: float = env_number('INTERVAL', 5.0)           # base tick of the tracker while active
+MIN_INTERVAL: float = env_number('MIN_INTERVAL', 1.0)   # tick right after a foreground change
+MAX_INTERVAL: float = env_number('MAX_INTERVAL', 15.0)  # upper bound of the idle backoff (python -m scripts.replay_scheduler)
+IDLE_BACKOFF: float = env_number('IDLE_BACKOFF', 1.5)   # interval multiplier per idle tick
 # MIN_DURATION_TO_SAVE: int = 10
-SAVE_EVERY: int = 60*5
+SAVE_EVERY: int = env_number('SAVE_EVERY', 60*5)
+RESOURCE_SAMPLE_INTERVAL: int = env_number('RESOURCE_SAMPLE_INTERVAL', 30)      # sec between two psutil.process_iter passes of the ResourceSampler
+RESOURCE_DOWNSAMPLE_EVERY: int = env_number('RESOURCE_DOWNSAMPLE_EVERY', 60*60) # sec between two rollups of the ResourceSamples tiers
+RESOURCE_MAX_PROCESSES: int = env_number('RESOURCE_MAX_PROCESSES', 4096)          # exe paths cached by the ResourceSampler, the whole process table
+RESOURCE_MAX_EXECUTABLES: int = env_number('RESOURCE_MAX_EXECUTABLES', 1024)      # version infos cached by the ResourceSampler
 ICON_DIR: Path = modulepath.joinpath('..', "instance", "icons")
 
-if not ICON_DIR.exists(): ICON_DIR.mkdir(parents=True, exist_ok=True)
-ICON_LISTDIR = ICON_DIR.listdir()
+ICON_THUMBNAIL_SIZES: tuple = (16, 32)
+
+if not ICON_DIR.exists(): ICON_DIR.mkdir(parents=True, exist_ok=True) # legacy icons, packed into instance/icons.db by db.get_icon_store
 
 if not modulepath.joinpath('..', "instance", "search_bar_address.json").exists():
     with open (modulepath.joinpath("..", 'assets', "search_bar_address.json"), "r") as f:
@@ -0,0 +1,173 @@
+from PIL import Image
+from io import BytesIO
+from queue import Queue
+from threading import Thread, Lock
+from typing import Optional, Callable, Iterable, Set, Dict, Tuple, TypedDict
+import base64
+import time
+import os
+
+from db import IconStore, logger
+
+#####################################################################################
+#                                   Constants                                       #
+#####################################################################################
+
+RETRY_AFTER: float = 60*60      # sec before an executable whose icon could not be extracted is tried again
+
+#####################################################################################
+#                                   Types                                           #
+#####################################################################################
+
+ImageProvider = Callable[[str], Optional[Image.Image]] # exe_full_path -> icon (or None)
+
+class IconPipelineStats(TypedDict):
+    known: int
+    pending: int
+    processed: int
+    shared: int     # icons whose content was already stored for another app
+    failed: int
+    unavailable: int    # executables not retried until RETRY_AFTER (or a new mtime)
+
+#####################################################################################
+#                                   Helpers                                         #
+#####################################################################################
+
+def icon_file_name(app_id: str, size: Optional[int] = None) -> str:
+    name = base64.urlsafe_b64encode(app_id.encode('utf-8')).decode('utf-8')
+    if size is None: return f"{name}.png"
+    return f"{name}.{size}.png" # '.' is not part of the urlsafe base64 alphabet
+
+def thumbnail_file_name(file_name: str, size: int) -> str:
+    return f"{file_name.removesuffix('.png')}.{size}.png"
+
+def get_mtime(path: str) -> Optional[float]:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+def encode_png(image: Image.Image) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+#####################################################################################
+#                                   IconPipeline                                    #
+#####################################################################################
+
+class IconPipeline:
+    """
+    Extracts app icons on a background worker so the tracker tick never waits on
+    Win32 bitmap work or png encoding.
+        - submit() is O(1): a set of known icon names and a set of pending names dedup requests.
+        - icons are written to the content addressed IconStore (db/iconstore.py), so
+          identical icons share one blob.
+        - pre-sized thumbnails are stored next to it as `<base64 AppId>.<size>.png`.
+        - an executable without an icon is remembered by (path, mtime) and not extracted
+          again on every switch to it, until `retry_after` or an update of the file.
+    """
+    def __init__(self, store: IconStore, image_provider: ImageProvider, thumbnail_sizes: Iterable[int] = (16, 32),
+                 known: Optional[Iterable[str]] = None, retry_after: float = RETRY_AFTER):
+        self.store = store
+        self.image_provider = image_provider
+        self.thumbnail_sizes: Tuple[int, ...] = tuple(thumbnail_sizes)
+
+        self.known: Set[str] = set(known) if known is not None else set(store.names())
+        self.pending: Set[str] = set()
+        self.retry_after = retry_after
+        self.unavailable: Dict[str, Tuple[Optional[float], float]] = {} # exe_full_path -> (mtime, time.monotonic() to retry at)
+        self.queue: "Queue[Optional[Tuple[str, str]]]" = Queue()
+        self.lock = Lock()
+        self.worker: Optional[Thread] = None
+
+        self.processed = 0
+        self.shared = 0
+        self.failed = 0
+
+    def submit(self, app_id: str, exe_full_path: str) -> bool:
+        """
+        Queues the icon of app_id for extraction, returns False if it is already known or queued,
+        or failed recently for the same executable.
+        """
+        file_name = icon_file_name(app_id)
+        with self.lock:
+            if file_name in self.known or file_name in self.pending: return False
+            failure = self.unavailable.get(exe_full_path)
+            if failure is not None:
+                mtime, retry_at = failure
+                if time.monotonic() < retry_at and get_mtime(exe_full_path) == mtime: return False
+                del self.unavailable[exe_full_path]
+            self.pending.add(file_name)
+        self.start()
+        self.queue.put((file_name, exe_full_path))
+        return True
+
+    def start(self) -> None:
+        if self.worker is not None and self.worker.is_alive(): return
+        with self.lock:
+            if self.worker is not None and self.worker.is_alive(): return
+            self.worker = Thread(target=self._run, name="IconPipeline", daemon=True)
+            self.worker.start()
+
+    def join(self) -> None:
+        """Blocks until every submitted icon is processed."""
+        self.queue.join()
+
+    def stop(self) -> None:
+        if self.worker is None: return
+        self.queue.put(None)
+        self.worker.join()
+        self.worker = None
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None: return
+                file_name, exe_full_path = item
+                ok = False
+                try:
+                    ok = self.process(file_name, exe_full_path)
+                except Exception as e:
+                    logger.error(f"Error while extracting icon for {exe_full_path} ERROR: {e}")
+                finally:
+                    if ok:
+                        with self.lock: self.known.add(file_name)
+                    else:
+                        self.failed += 1
+                        failure = (get_mtime(exe_full_path), time.monotonic() + self.retry_after)
+                        with self.lock: self.unavailable[exe_full_path] = failure
+                    with self.lock: self.pending.discard(file_name)
+            finally:
+                self.queue.task_done()
+
+    def process(self, file_name: str, exe_full_path: str) -> bool:
+        image = self.image_provider(exe_full_path)
+        if image is None:
+            logger.warning(f"Unable to extract icon for {exe_full_path}")
+            return False
+        try:
+            for size in self.thumbnail_sizes:
+                thumbnail = image.copy()
+                thumbnail.thumbnail((size, size), Image.LANCZOS)
+                self.store.put(thumbnail_file_name(file_name, size), encode_png(thumbnail), commit=False)
+                thumbnail.close()
+            _, is_new = self.store.put(file_name, encode_png(image), commit=False)
+            self.store.commit()
+        finally:
+            image.close()
+        if not is_new: self.shared += 1
+        self.processed += 1
+        return True
+
+    def stats(self) -> IconPipelineStats:
+        with self.lock:
+            return IconPipelineStats(
+                known=len(self.known),
+                pending=len(self.pending),
+                processed=self.processed,
+                shared=self.shared,
+                failed=self.failed,
+                unavailable=len(self.unavailable)
+            )
@@ -0,0 +1,104 @@
+import os
+import psutil
+from dataclasses import dataclass
+from typing import Optional, Callable, Tuple, Any, Protocol, TypedDict
+
+from db.helpers import LRUCache, CacheStats
+
+#####################################################################################
+#                                   Types                                           #
+#####################################################################################
+
+class IFileInfo(Protocol):
+    CompanyName: Optional[str]
+    ProductName: Optional[str]
+
+ExePathProvider = Callable[[psutil.Process], str]
+FileInfoProvider = Callable[[str], Optional[Any]] # exe_full_path -> FileInfo like object (or None)
+
+@dataclass(frozen=True)
+class ExeMetadata:
+    exe_full_path: str
+    exe_dir_name: str
+    exe_file_name: str
+    fileinfo: Optional[Any]
+    app_id: str
+
+class ProcessCacheStats(TypedDict):
+    exe_paths: CacheStats
+    metadata: CacheStats
+
+#####################################################################################
+#                                   Helpers                                         #
+#####################################################################################
+
+def get_app_id(fileinfo: Optional[IFileInfo], exe_dir_name: str, exe_file_name: str) -> str:
+    if not fileinfo or not fileinfo.CompanyName or fileinfo.CompanyName == 'None' or not fileinfo.ProductName or fileinfo.ProductName == 'None':
+        return f"{exe_dir_name} | {exe_file_name}"
+    return f"{fileinfo.CompanyName} | {fileinfo.ProductName}"
+
+def default_exe_path_provider(process: psutil.Process) -> str:
+    return process.exe()
+
+def get_mtime(path: str) -> Optional[float]:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+#####################################################################################
+#                               ProcessMetadataCache                                #
+#####################################################################################
+
+class ProcessMetadataCache:
+    """
+    Process level cache shared across tracker ticks.
+        (pid, create_time)   -> exe_full_path
+        (exe_full_path, mtime) -> ExeMetadata (version info + app_id)
+    The pair (pid, create_time) survives pid reuse and (exe_full_path, mtime) is
+    invalidated as soon as the executable is updated on disk.
+    """
+    def __init__(self, fileinfo_provider: FileInfoProvider, exe_path_provider: ExePathProvider = default_exe_path_provider,
+                 max_processes: int = 256, max_executables: int = 128):
+        self.fileinfo_provider = fileinfo_provider
+        self.exe_path_provider = exe_path_provider
+        self.exe_paths: LRUCache[Tuple[int, float], str] = LRUCache(maxsize=max_processes)
+        self.metadata: LRUCache[Tuple[str, Optional[float]], ExeMetadata] = LRUCache(maxsize=max_executables)
+
+    def get_exe_full_path(self, process: psutil.Process) -> str:
+        key = (process.pid, process.create_time())
+        exe_full_path = self.exe_paths.get(key)
+        if exe_full_path is None:
+            exe_full_path = self.exe_path_provider(process)
+            self.exe_paths.put(key, exe_full_path)
+        return exe_full_path
+
+    def get_metadata(self, exe_full_path: str, exe_file_name: Optional[str] = None) -> ExeMetadata:
+        key = (exe_full_path, get_mtime(exe_full_path))
+        metadata = self.metadata.get(key)
+        if metadata is None:
+            exe_dir_name = os.path.basename(os.path.dirname(exe_full_path))
+            exe_file_name = exe_file_name or os.path.basename(exe_full_path)
+            fileinfo = self.fileinfo_provider(exe_full_path)
+            metadata = ExeMetadata(
+                exe_full_path=exe_full_path,
+                exe_dir_name=exe_dir_name,
+                exe_file_name=exe_file_name,
+                fileinfo=fileinfo,
+                app_id=get_app_id(fileinfo, exe_dir_name=exe_dir_name, exe_file_name=exe_file_name)
+            )
+            self.metadata.put(key, metadata)
+        return metadata
+
+    def get_process_metadata(self, process: psutil.Process) -> ExeMetadata:
+        return self.get_metadata(self.get_exe_full_path(process), exe_file_name=process.name())
+
+    def clear(self) -> None:
+        self.exe_paths.clear()
+        self.metadata.clear()
+
+    def stats(self) -> ProcessCacheStats:
+        return ProcessCacheStats(
+            exe_paths=self.exe_paths.stats(),
+            metadata=self.metadata.stats()
+        )
@@ -0,0 +1,144 @@
+import psutil
+import time
+from threading import Thread, Event
+from typing import Optional, Dict, Tuple, Set, List, Protocol
+
+from db import logger
+from db.models import IResourceSample, RESOURCE_TIERS
+from .process_cache import ProcessMetadataCache, FileInfoProvider, ExePathProvider, default_exe_path_provider
+from .constants import RESOURCE_SAMPLE_INTERVAL, RESOURCE_DOWNSAMPLE_EVERY, RESOURCE_MAX_PROCESSES, RESOURCE_MAX_EXECUTABLES
+
+#####################################################################################
+#                                   Types                                           #
+#####################################################################################
+
+ProcessKey = Tuple[int, float] # (pid, create_time), survives pid reuse
+
+class IResourceDataBase(Protocol): # DataBase_Api
+    def insert_resource_samples(self, samples: List[IResourceSample]) -> None: ...
+    def downsample_resource_samples(self) -> int: ...
+
+class ProcessCounters:
+    __slots__ = ('cpu_time', 'read_bytes', 'write_bytes')
+    def __init__(self, cpu_time: float, read_bytes: int, write_bytes: int):
+        self.cpu_time = cpu_time
+        self.read_bytes = read_bytes
+        self.write_bytes = write_bytes
+
+PROCESS_ATTRS = ['pid', 'name', 'create_time', 'cpu_times', 'memory_info', 'io_counters']
+
+#####################################################################################
+#                                   ResourceSampler                                 #
+#####################################################################################
+
+class ResourceSampler:
+    """
+    Samples cpu time, rss and io of every process in one psutil.process_iter pass
+    and aggregates them per AppId (resolved through its own ProcessMetadataCache, sized for the
+    whole process table: a pass through the tracker's cache would evict its hot entries).
+    cpu/io are reported as the delta since the previous sample, processes seen for the
+    first time count from their start if they were created after the previous sample.
+    """
+    def __init__(self, cache: ProcessMetadataCache, interval: float = RESOURCE_SAMPLE_INTERVAL,
+                 downsample_every: float = RESOURCE_DOWNSAMPLE_EVERY):
+        self.cache = cache
+        self.interval = interval
+        self.downsample_every = downsample_every
+        self.counters: Dict[ProcessKey, ProcessCounters] = {}
+        self.unresolved: Set[ProcessKey] = set() # AccessDenied / exited, not retried for the same process
+        self.last_sample_time: Optional[float] = None
+        self.stop_event = Event()
+        self.worker: Optional[Thread] = None
+
+    def resolve_app_id(self, process: psutil.Process, key: ProcessKey, name: Optional[str]) -> Optional[str]:
+        if key in self.unresolved: return None
+        try:
+            return self.cache.get_metadata(self.cache.get_exe_full_path(process), exe_file_name=name).app_id
+        except Exception as e: # psutil, os and version info (pywintypes.error) errors: skip this process, not the pass
+            if not isinstance(e, (psutil.Error, OSError, ValueError)): logger.warning(msg=f"Resource sampler: unresolved {name}: {e}")
+            self.unresolved.add(key)
+            return None
+
+    def sample(self, now: Optional[float] = None) -> List[IResourceSample]:
+        now = time.time() if now is None else now
+        bucket_start = int(now) - int(now) % RESOURCE_TIERS[0]
+        per_app: Dict[str, IResourceSample] = {}
+        seen: Set[ProcessKey] = set()
+
+        for process in psutil.process_iter(PROCESS_ATTRS):
+            info = process.info
+            if info.get('create_time') is None: continue
+            key: ProcessKey = (info['pid'], info['create_time'])
+            seen.add(key)
+            app_id = self.resolve_app_id(process, key, info.get('name'))
+            if app_id is None: continue
+
+            cpu_times = info.get('cpu_times')
+            memory_info = info.get('memory_info')
+            io_counters = info.get('io_counters') # not available on macOS
+            current = ProcessCounters(
+                cpu_time=(cpu_times.user + cpu_times.system) if cpu_times else 0.0,
+                read_bytes=io_counters.read_bytes if io_counters else 0,
+                write_bytes=io_counters.write_bytes if io_counters else 0
+            )
+            previous = self.counters.get(key)
+            if previous is None and self.last_sample_time is not None and info['create_time'] >= self.last_sample_time:
+                previous = ProcessCounters(0.0, 0, 0) # started since the last sample, count everything
+            self.counters[key] = current
+
+            sample = per_app.get(app_id)
+            if sample is None:
+                sample = per_app[app_id] = IResourceSample(
+                    AppId=app_id, BucketStart=bucket_start, CpuTime=0.0,
+                    RssSum=0, RssMax=0, ReadBytes=0, WriteBytes=0, Samples=1
+                )
+            sample['RssSum'] += memory_info.rss if memory_info else 0
+            if previous is not None: # counters are monotonic, max(0, ...) guards against platform quirks
+                sample['CpuTime'] += max(0.0, current.cpu_time - previous.cpu_time)
+                sample['ReadBytes'] += max(0, current.read_bytes - previous.read_bytes)
+                sample['WriteBytes'] += max(0, current.write_bytes - previous.write_bytes)
+
+        for key in self.counters.keys() - seen: del self.counters[key]
+        self.unresolved &= seen
+        self.last_sample_time = now
+        for sample in per_app.values(): sample['RssMax'] = sample['RssSum'] # all processes of an app at one instant
+        return list(per_app.values())
+
+    def run(self, database: IResourceDataBase) -> None:
+        next_sample = time.monotonic()
+        next_downsample = next_sample + self.downsample_every
+        while not self.stop_event.is_set():
+            try:
+                samples = self.sample()
+                if samples: database.insert_resource_samples(samples)
+                if time.monotonic() >= next_downsample:
+                    database.downsample_resource_samples()
+                    next_downsample = time.monotonic() + self.downsample_every
+            except Exception as e:
+                logger.error(msg=f"Resource sampler error: {e}")
+            next_sample += self.interval
+            self.stop_event.wait(max(0.0, next_sample - time.monotonic()))
+
+    def start(self, database: IResourceDataBase) -> None:
+        if self.worker is not None and self.worker.is_alive(): return
+        self.stop_event.clear()
+        self.worker = Thread(target=self.run, args=(database,), name="ResourceSampler", daemon=True)
+        self.worker.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.worker is not None: self.worker.join()
+        self.worker = None
+
+def sampler_cache(fileinfo_provider: FileInfoProvider, exe_path_provider: ExePathProvider = default_exe_path_provider) -> ProcessMetadataCache:
+    return ProcessMetadataCache(fileinfo_provider=fileinfo_provider, exe_path_provider=exe_path_provider,
+                                max_processes=RESOURCE_MAX_PROCESSES, max_executables=RESOURCE_MAX_EXECUTABLES)
+
+if __name__ == "__main__":
+    # platform independent: without win32 version info the AppId falls back to `<dir> | <exe>`
+    from db import get_database_Api
+    sampler = ResourceSampler(cache=sampler_cache(fileinfo_provider=lambda exe_full_path: None))
+    try:
+        sampler.run(get_database_Api())
+    except KeyboardInterrupt:
+        ...
@@ -0,0 +1,89 @@
+import time
+from typing import Callable, Optional
+
+from db import logger
+from .constants import INTERVAL, MIN_INTERVAL, MAX_INTERVAL, INACTIVITY_LIMIT, IDLE_BACKOFF
+
+#####################################################################################
+#                                   Helpers                                         #
+#####################################################################################
+
+def transition_offset(idle_duration: float, active: bool, elapsed: float, idle_limit: float = INACTIVITY_LIMIT) -> float:
+    """
+    Seconds ago the active state flipped, known exactly from the idle duration:
+    idle -> active at the last input, active -> idle when idle_limit was crossed.
+    Clamped to [0, elapsed] as the flip happened after the previous tick.
+    """
+    offset = idle_duration if active else idle_duration - idle_limit
+    return min(max(0.0, offset), elapsed)
+
+#####################################################################################
+#                                   AdaptiveScheduler                               #
+#####################################################################################
+
+class AdaptiveScheduler:
+    """
+    Decides how long the tracker sleeps between two ticks.
+        - foreground change: drop to min_interval, then relax back to base_interval.
+        - idle (idle_duration > idle_limit): back off by `backoff` per tick up to max_interval.
+        - active: never sleep past the moment the user would cross idle_limit, so the
+          active -> idle transition is recorded when it happens.
+    wait() sleeps towards monotonic deadlines and returns the measured elapsed time,
+    so durations no longer drift by the cost of each tick.
+    """
+    RELAX = 1.5 # interval multiplier per unchanged active tick after a foreground change
+
+    def __init__(self, base_interval: float = INTERVAL, min_interval: float = MIN_INTERVAL,
+                 max_interval: float = MAX_INTERVAL, idle_limit: float = INACTIVITY_LIMIT,
+                 backoff: float = IDLE_BACKOFF,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        assert 0 < min_interval <= base_interval <= max_interval, "expected min_interval <= base_interval <= max_interval"
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.idle_limit = idle_limit
+        self.backoff = backoff
+        self.clock = clock
+        self.sleep = sleep
+
+        self.interval: float = base_interval # upcoming sleep
+        self.active_interval: float = base_interval # relaxes from min_interval back to base_interval
+        self.deadline: Optional[float] = None
+        self.last_tick: Optional[float] = None
+        self.wakeups = 0
+
+    def observe(self, idle_duration: float, changed: bool) -> float:
+        """Updates the schedule with the state seen at this tick, returns the next interval."""
+        if changed:
+            self.active_interval = self.min_interval
+        elif idle_duration > self.idle_limit:
+            self.interval = min(self.max_interval, max(self.interval, self.base_interval) * self.backoff)
+            return self.interval
+        else:
+            self.active_interval = min(self.base_interval, self.active_interval * self.RELAX)
+
+        interval = self.active_interval
+        until_idle = self.idle_limit - idle_duration
+        if 0 <= until_idle < interval: # wake up just after the idle threshold is crossed
+            interval = max(until_idle + 1, self.min_interval)
+        self.interval = interval
+        return self.interval
+
+    def wait(self) -> float:
+        """Sleeps until the next deadline, returns the seconds elapsed since the previous tick."""
+        now = self.clock()
+        if self.last_tick is None: self.last_tick = now
+        if self.deadline is None: self.deadline = now
+        self.deadline += self.interval
+        if self.deadline < now: # the tick overran its slot, re-anchor instead of firing a burst of ticks
+            self.deadline = now
+        self.sleep(self.deadline - now)
+        tick = self.clock()
+        elapsed = tick - self.last_tick
+        self.last_tick = tick
+        self.wakeups += 1
+        if elapsed > self.interval + self.max_interval: # suspended (system sleep), don't credit the gap
+            logger.warning(f"Tracker woke up {elapsed:.0f}s after the previous tick, crediting {self.interval:.0f}s")
+            self.deadline = tick
+            elapsed = self.interval
+        return elapsed
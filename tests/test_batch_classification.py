@@ -0,0 +1,131 @@
+from . import db, models
+from db import classification_queue
+from ml.batch_classification import BatchClassifier, BatchItem, app_item, url_item, chunk_items
+from ml.classification_worker import ClassificationWorkerPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from unittest import TestCase
+from typing import List, Dict, Optional
+from openai import OpenAI
+import tempfile
+import json
+
+class FakeChatServer:
+    """Local OpenAI compatible /v1/chat/completions, answers with `answer(items)`."""
+    def __init__(self):
+        self.requests: List[List[dict]] = [] # items of every request
+        self.drop: set = set()               # keys left out of the answer
+        self.status: int = 200
+        self.garbage: bool = False
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args): pass
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                self.send_response(server.status)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps(server.answer(body)).encode())
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def answer(self, body: dict) -> dict:
+        if self.status != 200: return {"error": {"message": "overloaded"}}
+        items = [json.loads(line) for line in body['messages'][1]['content'].splitlines()]
+        self.requests.append(items)
+        results = [
+            {"id": item['id'], "category": 'Web' if item['kind'] == 'url' else 'Development'}
+            for item in items if (item.get('url') or item.get('ExeFileName')) not in self.drop
+        ]
+        content = "not json" if self.garbage else json.dumps({"results": results})
+        return {
+            "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": body['model'],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 10 * len(items), "total_tokens": 100 + 10 * len(items)}
+        }
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def make_app(name: str) -> models.IApp:
+    return models.IApp(AppId=f"test | {name}", ExeFileName=name, ExeDirName='test', IsBrowser=False)
+
+class TestBatchClassifier(TestCase):
+    def setUp(self):
+        self.server = FakeChatServer()
+        self.addCleanup(self.server.close)
+        client = OpenAI(base_url=self.server.base_url, api_key='test', max_retries=0)
+        self.classifier = BatchClassifier(client=client, token_budget=400)
+
+    def test_chunking_by_token_budget(self):
+        items = [url_item(f'site{i}.com', Title='x' * 150) for i in range(12)]
+        chunks = chunk_items(items, ['Work', 'Games'], token_budget=400)
+        assert len(chunks) > 1 and sum(len(chunk) for chunk in chunks) == 12
+        assert [item['key'] for chunk in chunks for item in chunk] == [item['key'] for item in items] # order kept
+        assert all(len(chunk) == 1 for chunk in chunk_items(items[:3], [], token_budget=1)) # oversized items still go out
+        assert len(chunk_items(items, [], token_budget=10**6, max_items=5)) == 3
+
+    def test_one_request_for_many_items(self):
+        items: List[BatchItem] = [app_item(make_app(f'app{i}.exe')) for i in range(5)] + [url_item('example.com')]
+        result = self.classifier.classify(items + items[:2], ['Development', 'Web']) # duplicates sent once
+        assert len(self.server.requests) == 1 and len(self.server.requests[0]) == 6
+        assert result['categories']['test | app0.exe'] == 'Development' and result['categories']['example.com'] == 'Web'
+        assert result['failed'] == {}
+        stats = result['batches'][0]
+        assert stats['items'] == 6 and stats['classified'] == 6 and stats['prompt_tokens'] == 100 and stats['completion_tokens'] == 60
+
+    def test_missing_items_are_retried_once(self):
+        self.server.drop = {'b.com'}
+        result = self.classifier.classify([url_item('a.com'), url_item('b.com'), url_item('c.com')], [])
+        assert [len(items) for items in self.server.requests] == [3, 1] # only the missing item is sent again
+        assert set(result['categories']) == {'a.com', 'c.com'}
+        assert result['failed'] == {'b.com': "missing from the model answer"}
+
+    def test_failed_request_does_not_raise(self):
+        self.server.garbage = True
+        result = self.classifier.classify([url_item('a.com'), url_item('b.com')], [])
+        assert len(self.server.requests) == 1 # nothing came back at all, no retry storm
+        assert result['categories'] == {} and set(result['failed']) == {'a.com', 'b.com'}
+        assert 'JSONDecodeError' in (result['batches'][0]['error'] or '')
+
+        self.server.status = 500
+        result = self.classifier.classify([url_item('a.com')], [])
+        assert result['failed'] and result['batches'][0]['error'] is not None
+
+class TestBatchWorkerPool(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = db.Path(self.tmpdir.name).joinpath('database.db')
+        self.database = db.DataBase(db_path=self.db_path)
+        self.server = FakeChatServer()
+    def tearDown(self):
+        self.server.close()
+        self.database.close()
+        self.tmpdir.cleanup()
+
+    def test_pool_partial_failure(self):
+        with self.database.cursor_context():
+            for name in ('code.exe', 'term.exe', 'flaky.exe'): self.database.insert_app(make_app(name))
+            self.database.commit()
+        self.server.drop = {'flaky.exe'}
+        client = OpenAI(base_url=self.server.base_url, api_key='test', max_retries=0)
+        pool = ClassificationWorkerPool(db_path=self.db_path, classifier=BatchClassifier(client=client), batch_size=10)
+        pool.open()
+        self.addCleanup(pool.close)
+        assert pool.run_once() == 3
+        assert [len(items) for items in self.server.requests] == [3, 1]
+        with self.database.cursor_context() as cursor:
+            cursor.execute("SELECT AppId, Category FROM Apps ORDER BY AppId")
+            categories: Dict[str, Optional[str]] = {row['AppId']: row['Category'] for row in cursor.fetchall()}
+            assert categories == {'test | code.exe': 'Development', 'test | flaky.exe': None, 'test | term.exe': 'Development'}
+            metrics = classification_queue.metrics(cursor)
+            assert metrics['done'] == 2 and metrics['depth'] == 1 # flaky.exe backs off like any other failure
+        stats = pool.batch_stats()
+        assert stats['requests'] == 2 and stats['items'] == 4 and stats['failed'] == 2
+        assert stats['completion_tokens'] == 40 and stats['latency_avg'] is not None
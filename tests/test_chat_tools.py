@@ -0,0 +1,136 @@
+from . import db, models
+from .test_providers import standin_provider
+from db import activity_rollup
+from ml.chat_tools import ActivityTools, ToolChat, resolve_period, today
+from ml.standin_server import StandInServer
+from datetime import date, timedelta
+from unittest import TestCase
+import asyncio
+import tempfile
+
+APPS = {'code': 'Visual Studio Code', 'chrome': 'Google Chrome'}
+URLS = ['https://www.youtube.com/watch?v=1', 'https://m.youtube.com/watch?v=2', 'https://docs.python.org/3/']
+
+def day(offset: int) -> str:
+    return (today() - timedelta(days=offset)).isoformat()
+
+class TestChatTools(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.db_path = db.Path(self.tmpdir.name).joinpath('database.db')
+        self.database = db.DataBase(db_path=self.db_path)
+        self.addCleanup(self.database.close)
+        self.tools = ActivityTools(db_path=self.db_path)
+        self.addCleanup(self.tools.close)
+        with self.database.cursor_context():
+            for app_id, name in APPS.items():
+                self.database.insert_app(models.IApp(AppId=app_id, ExeFileName=f"{app_id}.exe", ExeDirName='dir',
+                                                     IsBrowser=app_id == 'chrome', ProductName=name), commit=False)
+            for offset in range(20): # 20 days, today included
+                self.add(offset, 'code', 600, is_active=True)
+                self.add(offset, 'code', 120, is_active=False)
+                self.add(offset, 'chrome', 300, url=URLS[offset % 2])
+                self.add(offset, 'chrome', 60, url=URLS[2])
+            self.database.commit()
+
+    def add(self, offset: int, app_id: str, duration: float, is_active: bool = True, url=None):
+        entry_id = self.database.insert_activity(models.IActivityEntry(
+            AppId=app_id, Title='title', URL=url, IsActive=is_active, IdleDuration=0, Duration=duration
+        ), commit=False)
+        self.database.cursor.execute("UPDATE ActivityEntries SET EndTime = ? WHERE EntryId = ?", (f"{day(offset)} 12:00:00", entry_id))
+
+    def test_rollups_match_the_entries(self):
+        with self.database.cursor_context() as cursor:
+            start, end = day(13), day(0)
+            raw = activity_rollup.top_apps(cursor, start, end)
+            raw_trend = activity_rollup.trend(cursor, start, end, 'week')
+            assert activity_rollup.boundary(cursor) == activity_rollup.NO_ROLLUP
+            assert activity_rollup.refresh(cursor) == 18 * 3 # (code, chrome on youtube, on python.org) a day, today and yesterday are not over
+            assert activity_rollup.refresh(cursor) == 0
+            assert activity_rollup.boundary(cursor) == day(1)
+            assert activity_rollup.top_apps(cursor, start, end) == raw
+            assert activity_rollup.trend(cursor, start, end, 'week') == raw_trend
+            assert raw[0]['name'] == 'Visual Studio Code' and raw[0]['ActiveDuration'] == 14 * 600 and raw[0]['Duration'] == 14 * 720
+            assert sum(week['ActiveDuration'] for week in raw_trend) == 14 * (600 + 360)
+            assert sorted(activity_rollup.site_baseurls(cursor, 'https://www.youtube.com/')) == ['m.youtube.com', 'www.youtube.com']
+            # the period is read from the rollups only: the plan does not scan the entries before the boundary
+            sql, params = activity_rollup.usage_rows(cursor, start, day(2))
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            assert any('idx_activity_entries_endtime' in row['detail'] for row in cursor.fetchall())
+
+    def test_tools_and_cache(self):
+        site, call = self.tools.call('time_on_site', {'domain': 'youtube.com', 'period': 'last_7_days'})
+        assert site['active_minutes'] == 7 * 5 and site['sites'] == ['m.youtube.com', 'www.youtube.com'] and not call['cached']
+        assert len(site['by_day']) == 7
+        trend, _ = self.tools.call('usage_trend', {'start_date': day(9), 'end_date': day(5), 'app': 'visual studio'})
+        assert trend['active_minutes'] == 5 * 10 and trend['previous_period_active_minutes'] == 5 * 10 and trend['change_percent'] == 0
+        assert [point['day'] for point in trend['series']] == [day(offset) for offset in range(9, 4, -1)]
+
+        _, call = self.tools.call('time_on_site', {'domain': 'youtube.com', 'period': 'last_7_days'})
+        assert call['cached']
+        past, _ = self.tools.call('top_apps', {'start_date': day(9), 'end_date': day(5)})
+        with self.database.cursor_context(): # the tracker writes: periods reaching today are read again
+            self.add(0, 'chrome', 600, url=URLS[0])
+            self.database.commit()
+        site, call = self.tools.call('time_on_site', {'domain': 'youtube.com', 'period': 'last_7_days'})
+        assert not call['cached'] and site['active_minutes'] == 7 * 5 + 10
+        cached, call = self.tools.call('top_apps', {'start_date': day(9), 'end_date': day(5)})
+        assert call['cached'] and cached == past
+
+        error, call = self.tools.call('top_apps', {'period': 'forever'})
+        assert 'error' in error and call['error'] is not None
+        stats = self.tools.stats()
+        assert stats['calls'] == 7 and stats['cached'] == 2 and stats['errors'] == 1 and stats['rolled_until'] == day(1)
+
+    def test_todos_due(self):
+        with self.database.cursor_context() as cursor:
+            for title, due, completed in (('overdue', day(2), False), ('tomorrow', day(-1), False),
+                                          ('done', day(-1), True), ('later', day(-30), False), ('no date', None, False)):
+                cursor.execute("INSERT INTO Todos (title, duedate, completed) VALUES (?, ?, ?)", (title, due, completed))
+            self.database.commit()
+        todos, _ = self.tools.call('todos_due', {'days': 7})
+        assert [(todo['title'], todo['overdue']) for todo in todos['todos']] == [('overdue', True), ('tomorrow', False)]
+        upcoming, _ = self.tools.call('todos_due', {'days': 7, 'include_overdue': False})
+        assert [todo['title'] for todo in upcoming['todos']] == ['tomorrow']
+        with self.database.cursor_context() as cursor:
+            cursor.execute("UPDATE Todos SET completed = TRUE WHERE title = 'tomorrow'")
+            self.database.commit()
+        todos, call = self.tools.call('todos_due', {'days': 7})
+        assert not call['cached'] and [todo['title'] for todo in todos['todos']] == ['overdue']
+
+    def test_periods(self):
+        now = date(2026, 10, 14) # a wednesday
+        assert resolve_period({'period': 'this_week'}, now) == ('2026-10-12', '2026-10-14')
+        assert resolve_period({'period': 'last_week'}, now) == ('2026-10-05', '2026-10-11')
+        assert resolve_period({'period': 'last_month'}, now) == ('2026-09-01', '2026-09-30')
+        assert resolve_period({}, now) == ('2026-10-08', '2026-10-14')
+        with self.assertRaises(ValueError): resolve_period({'start_date': '2026-10-14', 'end_date': '2026-10-01'}, now)
+
+    def test_tool_round_trip(self):
+        server = StandInServer(tokens_per_second=0).start()
+        self.addCleanup(server.close)
+        provider = standin_provider(server)
+        async def ask(question: str):
+            chat = ToolChat(provider, self.tools, [{'role': 'user', 'content': question}])
+            chunks = [chunk async for chunk in chat.astream()]
+            return ''.join(chunk.choices[0].delta.content or '' for chunk in chunks if chunk.choices), chat
+        answer, chat = asyncio.run(ask("What were my top apps in the last 7 days?"))
+        assert [call['name'] for call in chat.calls] == ['top_apps'] and chat.calls[0]['arguments'] == {'period': 'last_7_days'}
+        assert 'Visual Studio Code' in answer and '70.0' in answer # 7 days of 10 active minutes, from the tool result
+        answer, chat = asyncio.run(ask("Hello there"))
+        assert chat.calls == [] and answer.startswith("This is the stand-in model answering")
+        assert provider.stats()['requests'] == 3
+
+    def test_missing_database(self):
+        db_path = db.Path(self.tmpdir.name).joinpath('missing.db')
+        tools = ActivityTools(db_path=db_path)
+        self.addCleanup(tools.close)
+        result, call = tools.call('top_apps', {'period': 'last_7_days'})
+        assert 'error' in result and call['error'] is not None and not db_path.exists() # not created by a read
+        empty = db.Path(self.tmpdir.name).joinpath('empty.db') # created, the tables not yet
+        db.DataBase(db_path=empty, check_create_table=False).close()
+        tools = ActivityTools(db_path=empty)
+        self.addCleanup(tools.close)
+        result, _ = tools.call('todos_due', {'days': 7})
+        assert 'no such table' in result['error'] and tools.stats()['errors'] == 1
@@ -0,0 +1,103 @@
+from . import models
+from db.chatbot import DataBase
+from unittest import TestCase
+from typing import List, Optional
+import random
+
+def flagged_path(database: DataBase, chat_id: int) -> List[int]:
+    """The visible branch from the is_active flags, the way the recursive queries walk it."""
+    messages = database.get_chat_messages(chat_id)
+    path: List[int] = []
+    parent: Optional[int] = None
+    while True:
+        child = next((m['MessageId'] for m in messages if m['parent_id'] == parent and m['is_active']), None)
+        if child is None: return path
+        path.append(child)
+        parent = child
+
+class TestActivePath(TestCase):
+    def setUp(self):
+        self.database = DataBase(db_path=':memory:')
+        self.addCleanup(self.database.close)
+
+    def check(self, chat_id: int) -> List[int]:
+        database = self.database
+        path = flagged_path(database, chat_id)
+        assert [m['MessageId'] for m in database.get_chats_down(chat_id, None, max_result=10_000)] == path
+        assert database.get_chat_info(chat_id)['leaf_node_id'] == path[-1]
+        assert database.get_chat_info(chat_id)['active_depth'] == len(path)
+        above = database.get_chats_above(chat_id, path[-1], max_result=3)
+        assert [m['MessageId'] for m in above] == path[::-1][:3] and [m['depth'] for m in above] == [1, 2, 3][:len(path)]
+        siblings = {parent: [] for parent in [None] + path[:-1]}
+        for m in database.get_chat_messages(chat_id):
+            if m['parent_id'] in siblings: siblings[m['parent_id']].append(m['MessageId'])
+        assert sorted(m['MessageId'] for m in database.get_lazy_chat_messages(chat_id)) == sorted(sum(siblings.values(), []))
+        for parent, children in siblings.items(): # the pointers agree with the flags
+            assert database.get_children_counter(chat_id, parent) == (len(children), database.get_current_active_child_id(chat_id, parent))
+        return path
+
+    def test_random_edits_and_switches(self):
+        rng = random.Random(7)
+        chats = [self.database.new_chat(title=f"chat {i}") for i in range(2)]
+        for chat_id in chats: self.database.new_message(chat_id, content='root', message_by='USER')
+        for _ in range(300):
+            chat_id = rng.choice(chats)
+            path = self.check(chat_id)
+            action = rng.random()
+            if action < 0.5: # reply
+                self.database.new_message(chat_id, content='reply', message_by='AI', parent_message_id=path[-1])
+            elif action < 0.7: # edit / regenerate: a new branch above the leaf
+                index = rng.randrange(len(path))
+                self.database.new_message(chat_id, content='edit', message_by='USER', parent_message_id=path[index - 1] if index else None)
+            else: # branch picker
+                message = self.database.get_chat_message(chat_id, rng.choice(path))
+                try:
+                    if action < 0.85: self.database.next_message(chat_id, message['MessageId'])
+                    else: self.database.prev_message(chat_id, message['MessageId'])
+                except IndexError: pass
+        for chat_id in chats: self.check(chat_id)
+
+    def test_backfill(self):
+        chat_id = self.database.new_chat(title='old chat')
+        a = self.database.new_message(chat_id, content='a', message_by='USER')
+        b = self.database.new_message(chat_id, content='b', message_by='AI', parent_message_id=a)
+        with self.database.transaction() as cursor:
+            cursor.execute("DELETE FROM ChatActivePath")
+            models.create_chat_active_path(cursor) # as on the first start after an upgrade
+        assert [m['MessageId'] for m in self.database.get_chats_down(chat_id, None)] == [a, b]
+
+    def test_constant_writes(self):
+        for trigger in ('Insert', 'Update', 'Delete'): # the search index merges its segments now and then, counted on its own
+            self.database.conn.execute(f"DROP TRIGGER MessagesSearch{trigger}")
+        chat_id = self.database.new_chat(title='regenerate')
+        question = self.database.new_message(chat_id, content='q', message_by='USER')
+        def changes(function) -> int:
+            before = self.database.conn.total_changes
+            function()
+            return self.database.conn.total_changes - before
+        regenerate = [changes(lambda: self.database.new_message(chat_id, content='a', message_by='AI', parent_message_id=question)) for _ in range(50)]
+        assert len(set(regenerate[1:])) == 1 # the 2nd and the 50th alternative cost the same
+        last = self.database.get_current_active_child_id(chat_id, question)
+        switch = [changes(lambda: self.database.prev_message(chat_id, last)), changes(lambda: self.database.next_message(chat_id, last - 1))]
+        assert switch[0] == switch[1] <= regenerate[-1] + 1
+
+    def test_migrate_older_database(self):
+        database = self.database
+        database.conn.executescript("""
+            DROP TABLE ChatActivePath; DROP TABLE Messages; DROP TABLE Chats;
+            CREATE TABLE Chats (ChatId INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, leaf_node_id INTEGER DEFAULT NULL,
+                                active_depth INTEGER DEFAULT 0, Timestamp DATETIME DEFAULT CURRENT_TIMESTAMP);
+            CREATE TABLE Messages (MessageId INTEGER PRIMARY KEY AUTOINCREMENT, ChatId INTEGER NOT NULL, content TEXT NOT NULL,
+                                   message_by TEXT NOT NULL, message_model TEXT, message_rating TEXT, level INTEGER NOT NULL,
+                                   parent_id INTEGER DEFAULT NULL, siblings INTEGER DEFAULT 0, position INTEGER DEFAULT 0,
+                                   childs INTEGER DEFAULT 0, is_active Boolean DEFAULT TRUE, Timestamp DATETIME DEFAULT CURRENT_TIMESTAMP);
+            INSERT INTO Chats (ChatId, title, leaf_node_id, active_depth) VALUES (1, 'old', 3, 2);
+            INSERT INTO Messages (MessageId, ChatId, content, message_by, level, parent_id, siblings, position, childs, is_active) VALUES
+                (1, 1, 'q', 'USER', 1, NULL, 1, 1, 2, TRUE),
+                (2, 1, 'a', 'AI', 2, 1, 2, 1, 0, FALSE),
+                (3, 1, 'b', 'AI', 2, 1, 2, 2, 0, TRUE);
+        """)
+        database.create_table()
+        assert database.get_children_counter(1, None) == (1, 1) and database.get_children_counter(1, 1) == (2, 3)
+        assert [m['MessageId'] for m in database.get_chats_down(1, None)] == [1, 3]
+        assert database.prev_message(1, 3) == 2 and self.check(1) == [1, 2]
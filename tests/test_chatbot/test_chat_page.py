@@ -0,0 +1,34 @@
+from db.chatbot import DataBase
+from api.chatbot.utils import chat_page, formatted_messages
+from unittest import TestCase
+
+class TestChatPage(TestCase):
+    def setUp(self):
+        self.database = DataBase(db_path=':memory:')
+        self.addCleanup(self.database.close)
+        self.chat_id = self.database.new_chat(title='long chat')
+        leaf = None
+        for i in range(70):
+            leaf = self.database.new_message(self.chat_id, content=f"message {i}", message_by='USER' if i % 2 == 0 else 'AI', parent_message_id=leaf)
+            if i == 11: # a regenerated answer, the visible one from then on
+                parent_id = self.database.get_chat_message(self.chat_id, leaf)['parent_id']
+                leaf = self.branch = self.database.new_message(self.chat_id, content='regenerated', message_by='AI', parent_message_id=parent_id)
+
+    def test_pages(self):
+        pages = [chat_page(self.database, self.chat_id, limit=30)]
+        while pages[-1]['cursor']: pages.append(chat_page(self.database, self.chat_id, limit=30, cursor=pages[-1]['cursor']))
+        assert [len(page['messages']) for page in pages] == [30, 31, 10] # the 2nd page has both answers of message 10
+        ids = [m['message']['id'] for page in reversed(pages) for m in page['messages']]
+        assert ids == [str(m['MessageId']) for m in self.database.get_lazy_chat_messages(self.chat_id)]
+        assert len(pages) == 3 and not pages[-1]['hasMore'] and pages[0]['headId'] == ids[-1]
+
+        hits = formatted_messages.hits
+        chat_page(self.database, self.chat_id, limit=30)
+        assert formatted_messages.hits - hits == len(pages[0]['messages'])
+
+    def test_stale_cursor(self):
+        first = chat_page(self.database, self.chat_id, limit=30)
+        assert first['cursor'] is not None
+        self.database.prev_message(self.chat_id, self.branch) # the cursor's message is below the switched one
+        with self.assertRaises(ValueError): chat_page(self.database, self.chat_id, limit=30, cursor=first['cursor'])
+        with self.assertRaises(ValueError): chat_page(self.database, self.chat_id, cursor='not a cursor')
@@ -0,0 +1,84 @@
+from db.chatbot import DataBase
+from api.chatbot.streaming import ChatStream, AnswerWriter
+from api.chatbot.tasks import ChatTaskWorker, heuristic_title
+from unittest import TestCase
+from typing import List
+import asyncio
+import time
+
+class Tokens:
+    def __init__(self, tokens: List[str]): self.tokens = iter(tokens)
+    def __aiter__(self): return self
+    async def __anext__(self) -> str:
+        try: return next(self.tokens)
+        except StopIteration: raise StopAsyncIteration
+
+class TestChatTasks(TestCase):
+    def setUp(self):
+        self.database = DataBase(db_path=':memory:')
+        self.addCleanup(self.database.close)
+        self.titles: List[str] = []
+        self.fail_titles = False
+        self.worker = ChatTaskWorker(self.database, title_generator=self.generate_title, backoff_base=60)
+        self.chat_id = self.database.new_chat(title=heuristic_title('how do I profile python imports?'))
+
+    async def generate_title(self, query: str) -> str:
+        if self.fail_titles: raise TimeoutError("model did not answer")
+        self.titles.append(query)
+        return "Profiling Python imports"
+
+    def stream(self) -> ChatStream:
+        writer = AnswerWriter(self.database, self.chat_id, user_content='how do I profile python imports?')
+        self.worker.submit_title(self.chat_id, query='how do I profile python imports?', heuristic=heuristic_title('how do I profile python imports?'))
+        return ChatStream(Tokens(['use ', '-X importtime']), writer, finish=self.worker.submit_answer)
+
+    def test_heuristic_title(self):
+        assert heuristic_title('how do I profile python imports?') == 'How do I profile python imports?'
+        assert heuristic_title('\n  **Explain** `asyncio.timeout` in *detail* please, with examples of every single use\nmore') == \
+            'Explain asyncio.timeout in detail please, with…'
+        assert heuristic_title('  ') == 'New Chat'
+
+    def test_written_after_the_response(self):
+        async def main():
+            parts = [part async for part in self.stream().response()]
+            assert self.database.get_chat_info(self.chat_id)['leaf_node_id'] is None # nothing written by the response
+            assert await self.worker.settle(self.chat_id) == 1 and await self.worker.settle(self.chat_id) == 0
+            leaf = self.database.get_chat_info(self.chat_id)['leaf_node_id']
+            assert self.database.get_chat_message(self.chat_id, leaf)['content'] == 'use -X importtime'
+            assert self.database.get_chat_info(self.chat_id)['title'] == 'How do I profile python imports?'
+            assert await self.worker.run_once() == 1 and self.titles == ['how do I profile python imports?']
+            return parts
+        parts = asyncio.run(main())
+        assert parts[-1].startswith('d:') and self.database.get_chat_info(self.chat_id)['title'] == 'Profiling Python imports'
+        assert self.worker.stats()['done'] == 2 and self.worker.stats()['pending'] == 0
+
+    def test_title_never_replaces_a_renamed_chat(self):
+        self.worker.submit_title(self.chat_id, query='q', heuristic=heuristic_title('how do I profile python imports?'))
+        self.database.update_chat_title(self.chat_id, 'my imports')
+        asyncio.run(self.worker.run_once())
+        assert self.database.get_chat_info(self.chat_id)['title'] == 'my imports'
+
+    def test_retry_and_dead_letter(self):
+        self.fail_titles = True
+        self.worker.max_attempts = 2
+        self.worker.submit_title(self.chat_id, query='q', heuristic='q')
+        now = time.time()
+        assert asyncio.run(self.worker.run_once(now=now)) == 0
+        assert self.worker.stats()['pending'] == 1 and asyncio.run(self.worker.run_once(now=now + 30)) == 0 # backing off
+        asyncio.run(self.worker.run_once(now=now + 61))
+        stats = self.worker.stats()
+        assert stats['dead'] == 1 and stats['failed'] == 2 and self.database.get_chat_info(self.chat_id)['title'] == 'How do I profile python imports?'
+
+    def test_claimed_again_after_a_crash(self):
+        async def crash():
+            [part async for part in self.stream().response()]
+            self.worker.persist()
+            self.database.claim_tasks(now=time.time(), limit=10, lease=300) # the process died while running them
+        asyncio.run(crash())
+        restarted = ChatTaskWorker(self.database, title_generator=self.generate_title)
+        async def main():
+            restarted.start()
+            assert await restarted.settle(self.chat_id) == 1
+            await restarted.stop()
+        asyncio.run(main())
+        assert self.database.get_chat_info(self.chat_id)['leaf_node_id'] is not None and restarted.stats()['running'] == 0
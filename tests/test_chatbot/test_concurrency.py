@@ -0,0 +1,37 @@
+from db.chatbot import DataBase
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import os
+
+class TestConcurrency(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.database = DataBase(db_path=os.path.join(tmpdir.name, 'database.db'))
+        self.addCleanup(self.database.close)
+
+    def test_threaded_siblings(self):
+        chat_id = self.database.new_chat(title='threads')
+        question = self.database.new_message(chat_id, content='q', message_by='USER')
+        def answer(i: int) -> int:
+            message_id = self.database.new_message(chat_id, content=f"a {i}", message_by='AI', parent_message_id=question)
+            self.database.get_chats_down(chat_id, None) # reads of the other threads meanwhile
+            return message_id
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            answers = list(executor.map(answer, range(64)))
+        assert len(set(answers)) == 64
+        children = [m for m in self.database.get_chat_messages(chat_id) if m['parent_id'] == question]
+        assert sorted(m['position'] for m in children) == list(range(1, 65))
+        assert self.database.get_children_counter(chat_id, question)[0] == 64
+        assert [m['MessageId'] for m in children if m['is_active']] == [self.database.get_current_active_child_id(chat_id, question)]
+
+    def test_transaction_rollback(self):
+        chat_id = self.database.new_chat(title='rollback')
+        try:
+            with self.database.transaction():
+                self.database.new_message(chat_id, content='q', message_by='USER')
+                raise RuntimeError('write failed')
+        except RuntimeError: pass
+        assert self.database.get_chat_messages(chat_id) == []
+        assert self.database.get_children_counter(chat_id, None) == (0, None)
@@ -0,0 +1,61 @@
+from db.chatbot import DataBase
+from ml.context_builder import ContextBuilder, count_tokens
+from unittest import TestCase
+from typing import List, Dict, Optional
+import asyncio
+
+class StubSummarizer:
+    def __init__(self, fail: bool = False):
+        self.calls: List[tuple] = []
+        self.fail = fail
+    async def __call__(self, previous: Optional[str], messages: List[Dict[str, str]]) -> str:
+        self.calls.append((previous, len(messages)))
+        if self.fail: raise TimeoutError("model did not answer")
+        return f"summary {len(self.calls)}"
+
+class TestContextBuilder(TestCase):
+    def setUp(self):
+        self.database = DataBase(db_path=':memory:')
+        self.addCleanup(self.database.close)
+        self.chat_id = self.database.new_chat(title='long chat')
+        self.leaf: Optional[int] = None
+        self.summarizer = StubSummarizer()
+        self.builder = ContextBuilder(self.database, budget=500, summary_tokens=50, summary_step=8, summarizer=self.summarizer)
+
+    def add(self, count: int, words: int = 20) -> None:
+        for i in range(count):
+            self.leaf = self.database.new_message(self.chat_id, content=' '.join(['word'] * words), message_by='USER' if i % 2 == 0 else 'AI',
+                                                  parent_message_id=self.leaf)
+
+    def build(self):
+        return asyncio.run(self.builder.build(self.chat_id, self.leaf)) # type: ignore
+
+    def test_count_tokens(self):
+        assert count_tokens("Hello world, this is a test.") == 8
+        assert count_tokens("") == 0 and count_tokens("internationalization") == 3
+
+    def test_fits(self):
+        self.add(5)
+        context = self.build()
+        assert len(context['messages']) == 5 and context['stats']['dropped'] == 0 and self.summarizer.calls == []
+
+    def test_rolling_summary(self):
+        self.add(100) # 24 tokens each
+        context = self.build()
+        stats = context['stats']
+        assert stats['tokens'] <= 500 and stats['dropped'] + stats['messages'] == 100
+        assert context['messages'][0] == {'role': 'system', 'content': "Summary of the earlier conversation:\nsummary 1"}
+        assert self.summarizer.calls == [(None, stats['dropped'])] and stats['summarized'] == 1
+
+        self.add(2) # the summary dropped a few messages ahead of need: reused as is
+        again = self.build()['stats']
+        assert again['summarized'] == 0 and again['dropped'] == stats['dropped'] and again['tokens'] <= 500
+        self.add(8) # extended from the previous summary, with the newly dropped messages only
+        extended = self.build()['stats']
+        assert extended['summarized'] == 1 and self.summarizer.calls[-1] == ('summary 1', extended['dropped'] - stats['dropped'])
+
+    def test_summarizer_failure(self):
+        self.builder.summarizer = StubSummarizer(fail=True)
+        self.add(100)
+        context = self.build()
+        assert context['messages'][0]['role'] != 'system' and context['stats']['tokens'] <= 500
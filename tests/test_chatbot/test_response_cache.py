@@ -0,0 +1,86 @@
+from db.chatbot import DataBase
+from api.chatbot.streaming import ChatStream, AnswerWriter
+from ml.response_cache import ResponseCache
+from .test_streaming import Upstream, decode
+from unittest import TestCase
+from typing import List
+import asyncio
+
+def conversation(question: str, history: int = 1) -> List[dict]:
+    messages = []
+    for i in range(history):
+        messages += [{'role': 'user', 'content': f"question {i}"}, {'role': 'assistant', 'content': f"answer {i}"}]
+    return messages + [{'role': 'user', 'content': question}]
+
+class TestResponseCache(TestCase):
+    def setUp(self):
+        self.database = DataBase(db_path=':memory:')
+        self.addCleanup(self.database.close)
+        self.chat_id = self.database.new_chat(title='chat')
+
+    def stream(self, texts) -> List[str]:
+        stream = ChatStream(texts, AnswerWriter(self.database, self.chat_id, user_content='question'), frame_bytes=64)
+        async def main(): return [part async for part in stream.response('msg-1')]
+        return asyncio.run(main())
+
+    def test_record_and_replay(self):
+        cache = ResponseCache()
+        key = cache.key(conversation('What is an index?'), 'groq/model')
+        assert cache.get(key) is None
+        answer = ["An index ", "is a ", "sorted copy ", "of a column, ünïcode ✓\n", "for lookups."] * 10
+        model_parts = self.stream(cache.record(key, Upstream(answer)))
+        cached = cache.get(cache.key(conversation('What is an index?'), 'groq/model'))
+        assert cached is not None and cached['match'] == 'exact' and cached['text'] == ''.join(answer)
+        replay_parts = self.stream(cache.replay(cached))
+        assert decode(replay_parts) == decode(model_parts) and replay_parts[0] == model_parts[0] and replay_parts[-2:] == model_parts[-2:]
+        assert len(replay_parts) > 5 # streamed in frames, not one blob
+
+        assert cache.get(cache.key(conversation('What is an index?'), 'groq/other model')) is None
+        assert cache.get(cache.key(conversation('What is an index?'), 'groq/model', {'temperature': 0})) is None
+        assert cache.get(cache.key(conversation('What is an index?', history=2), 'groq/model')) is None
+        stats = cache.stats()
+        assert stats['hits'] == 1 and stats['misses'] == 4 and stats['stored'] == 1 and stats['hit_rate'] == 0.2
+
+    def test_unfinished_streams_are_not_cached(self):
+        cache = ResponseCache()
+        key = cache.key(conversation('q'), 'groq/model')
+        self.stream(cache.record(key, Upstream(['partial ', 'answer'], fail_at=2)))
+        async def disconnected():
+            texts = cache.record(key, Upstream(['a', 'b', 'c']))
+            assert await texts.__anext__() == 'a'
+            await texts.aclose()
+        asyncio.run(disconnected())
+        self.stream(cache.record(key, Upstream(['from ', 'tool results']), cacheable=lambda: False))
+        assert cache.get(key) is None and cache.stats()['stored'] == 0
+
+    def test_regenerate_skips_shown_answers(self):
+        cache = ResponseCache()
+        key = cache.key(conversation('q'), 'groq/model')
+        cache.put(key, 'first answer')
+        assert cache.get(key, exclude=['first answer']) is None
+        cache.put(key, 'second answer') # the regenerated one replaces it
+        assert cache.get(key, exclude=['first answer'])['text'] == 'second answer' # type: ignore
+        stats = cache.stats()
+        assert stats['skipped'] == 1 and stats['entries'] == 1 and stats['bytes'] == len('second answer')
+
+    def test_lru_limits(self):
+        cache = ResponseCache(max_entries=3, max_bytes=25)
+        keys = [cache.key(conversation(f"question {i}"), 'groq/model') for i in range(4)]
+        for key in keys[:3]: cache.put(key, 'x' * 8)
+        assert cache.get(keys[0]) is not None # now the most recently used
+        cache.put(keys[3], 'x' * 8) # 32 bytes > 25: the least recently used goes
+        assert cache.get(keys[1]) is None and cache.get(keys[0]) is not None
+        assert cache.stats()['entries'] == 3 and cache.stats()['bytes'] == 24 and cache.stats()['evictions'] == 1
+        assert not cache.put(keys[1], 'x' * 26) # larger than the whole cache
+
+    def test_near_duplicates(self):
+        exact_only, near = ResponseCache(near_duplicates=False), ResponseCache(near_duplicates=True)
+        for cache in (exact_only, near):
+            cache.put(cache.key(conversation('How do I create an index in SQLite?'), 'groq/model'), 'CREATE INDEX ...')
+        assert exact_only.get(exact_only.key(conversation('how do I create an index in sqlite'), 'groq/model')) is None
+        cached = near.get(near.key(conversation('how do I create an index in sqlite'), 'groq/model'))
+        assert cached is not None and cached['match'] == 'near' and cached['similarity'] >= 0.9
+        assert near.get(near.key(conversation('How do I drop a table in SQLite?'), 'groq/model')) is None
+        # same question after another history is not the same request
+        assert near.get(near.key(conversation('how do I create an index in sqlite', history=2), 'groq/model')) is None
+        assert near.stats()['near_hits'] == 1
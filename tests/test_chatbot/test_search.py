@@ -0,0 +1,69 @@
+from db.chatbot import DataBase
+from db import search
+from unittest import TestCase
+import tempfile
+import os
+
+class TestSearch(TestCase):
+    def setUp(self):
+        self.database = DataBase(db_path=':memory:')
+        self.addCleanup(self.database.close)
+        self.chat_id = self.database.new_chat(title='Trip to Paris')
+        self.question = self.database.new_message(self.chat_id, content='How do I get from the airport to the Louvre?', message_by='USER')
+        self.answer = self.database.new_message(self.chat_id, content='Take the RER B train, then metro line 1.', message_by='AI', parent_message_id=self.question)
+        self.other_chat_id = self.database.new_chat(title='Train schedules')
+
+    def ids(self, text: str, **filters):
+        return [(hit['kind'], hit['id']) for hit in self.database.search_history(search.match_query(text), 10, **filters)]
+
+    def test_match_query(self):
+        assert search.match_query('louv') == '"louv"*'
+        assert search.match_query('"metro line" tra*') == '"metro line" "tra"*'
+        assert search.match_query('metro AND OR ( -') == '"metro" "AND" "OR"*'
+        assert search.match_query('  " * ') is None
+
+    def test_search(self):
+        assert self.ids('louv') == [('message', self.question)]
+        hit = self.database.search_history(search.match_query('louvre'), 10)[0]
+        assert hit['title'] == 'Trip to Paris' and '<mark>Louvre</mark>' in hit['snippet'] and hit['role'] == 'USER'
+        assert set(self.ids('train')) == {('message', self.answer), ('chat', self.other_chat_id)}
+        assert self.ids('train', role='AI') == [('message', self.answer)]
+        assert self.ids('train', chat_id=self.other_chat_id) == [('chat', self.other_chat_id)]
+        assert self.ids('train', kinds=('chat', )) == [('chat', self.other_chat_id)]
+        assert self.ids('train', since='2999-01-01') == []
+
+    def test_triggers(self):
+        self.database.update_message_content(self.chat_id, self.answer, 'Take a taxi.')
+        assert self.ids('metro') == [] and self.ids('taxi') == [('message', self.answer)]
+        self.database.update_chat_title(self.other_chat_id, 'Bus schedules')
+        assert self.ids('bus') == [('chat', self.other_chat_id)] and self.ids('train') == []
+
+    def test_rebuild(self):
+        self.database.rebuild_search_index()
+        assert self.ids('louvre') == []
+        assert {status['name']: status['pending'] for status in self.database.get_search_status()} == {'Chats': 2, 'Messages': 2}
+        # written while the rebuild is pending: in the index right away, and indexed once
+        self.database.update_message_content(self.chat_id, self.question, 'Louvre or Orsay?')
+        later = self.database.new_message(self.chat_id, content='Louvre first.', message_by='AI', parent_message_id=self.question)
+        assert self.ids('louvre') == [('message', later)]
+        assert self.database.index_pending(batch=1) == 2 # 1 chat, 1 message
+        while self.database.index_pending(batch=1): pass
+        assert set(self.ids('louvre')) == {('message', self.question), ('message', later)}
+        assert self.ids('airport') == []
+        assert all(status['pending'] == 0 for status in self.database.get_search_status())
+
+    def test_rowid_gap_larger_than_a_batch(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'chatbot.db')
+            database = DataBase(db_path=path)
+            with database.transaction():
+                chat_id = database.new_chat(title='Notes')
+                ids = [database.new_message(chat_id, content=f"message {i}", message_by='USER') for i in range(30)]
+                database.conn.execute("DELETE FROM Messages WHERE MessageId <= ?", (ids[19], )) # a gap of 20 rowids
+            database.rebuild_search_index()
+            indexer = search.SearchIndexer({path: ('Messages', )}, batch=5)
+            assert indexer.run_once() == 5 # starts at the first row left, not in the gap
+            while indexer.run_once(): pass
+            assert indexer.indexed == 10 and {s['name']: s['pending'] for s in database.get_search_status()}['Messages'] == 0
+            assert len(database.search_history(search.match_query('message'), 20)) == 10
+            database.close()
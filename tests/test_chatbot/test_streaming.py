@@ -0,0 +1,84 @@
+from db.chatbot import DataBase
+from api.chatbot.streaming import ChatStream, AnswerWriter, failed_texts
+from unittest import TestCase
+from typing import List, Optional
+import asyncio
+import json
+
+class Upstream:
+    """Tokens of a model answer, `stall` sec before the tokens at `stalls`."""
+    def __init__(self, tokens: List[str], stall: float = 0.0, stalls: tuple = (), fail_at: Optional[int] = None):
+        self.tokens, self.stall, self.stalls, self.fail_at = tokens, stall, stalls, fail_at
+        self.sent, self.closed = 0, False
+    def __aiter__(self): return self
+    async def __anext__(self) -> str:
+        if self.sent in self.stalls: await asyncio.sleep(self.stall)
+        if self.sent == self.fail_at: raise ConnectionError("upstream reset")
+        if self.sent == len(self.tokens): raise StopAsyncIteration
+        self.sent += 1
+        return self.tokens[self.sent - 1]
+    async def aclose(self): self.closed = True
+
+def decode(parts: List[str]) -> str:
+    return ''.join(json.loads(part[2:]) for part in parts if part.startswith('0:'))
+
+class TestChatStream(TestCase):
+    def setUp(self):
+        self.database = DataBase(db_path=':memory:')
+        self.addCleanup(self.database.close)
+        self.chat_id = self.database.new_chat(title='chat')
+        self.writer = AnswerWriter(self.database, self.chat_id, user_content='question')
+
+    def run_stream(self, stream: ChatStream) -> List[str]:
+        async def main(): return [part async for part in stream.response('msg-1')]
+        return asyncio.run(main())
+
+    def saved(self) -> str:
+        assert self.writer.message_id is not None
+        return self.database.get_chat_message(self.chat_id, self.writer.message_id)['content']
+
+    def test_coalesced_frames(self):
+        tokens = ['say "hi"\n', '\tback\\slash', ' ünïcode ✓'] * 100
+        stream = ChatStream(Upstream(tokens), self.writer, frame_bytes=256)
+        parts = self.run_stream(stream)
+        assert parts[0] == 'f:{"messageId":"msg-1"}\n' and parts[-1].startswith('d:{"finishReason":"stop"')
+        assert decode(parts) == ''.join(tokens) == self.saved()
+        assert stream.stats['tokens'] == 300 and stream.stats['frames'] < 30 and stream.stats['checkpoints'] == 1
+        user = self.database.get_chat_message(self.chat_id, self.writer.user_message_id) # type: ignore
+        assert user['content'] == 'question' and self.database.get_chat_info(self.chat_id)['leaf_node_id'] == self.writer.message_id
+
+    def test_stalled_model_flushes_on_latency(self):
+        upstream = Upstream(['a', 'b', 'c'], stall=0.2, stalls=(2,))
+        sent = []
+        async def main():
+            async for part in ChatStream(upstream, self.writer, frame_latency=0.02).frames():
+                sent.append((json.loads(part[2:]), upstream.sent))
+        asyncio.run(main())
+        assert sent == [('ab', 2), ('c', 3)] # 'ab' did not wait for the stalled token
+
+    def test_disconnect_saves_partial_answer(self):
+        upstream = Upstream([f"token {i} " for i in range(50)], stall=0.01, stalls=tuple(range(50)))
+        frames = 0
+        async def is_disconnected() -> bool:
+            return frames >= 3
+        stream = ChatStream(upstream, self.writer, is_disconnected=is_disconnected, frame_latency=0.02, checkpoint_interval=0.0)
+        async def main():
+            nonlocal frames
+            async for part in stream.response():
+                frames += part.startswith('0:')
+        asyncio.run(main())
+        assert stream.stats['disconnected'] and upstream.closed and upstream.sent < 50
+        assert self.saved() == stream.text and stream.text.startswith('token 0 token 1 ') and stream.stats['checkpoints'] >= 2
+
+    def test_upstream_error(self):
+        stream = ChatStream(Upstream(['partial ', 'answer'], fail_at=2), self.writer)
+        parts = self.run_stream(stream)
+        assert parts[-3] == '3:"upstream reset"\n' and parts[-1].startswith('d:{"finishReason":"error"')
+        assert self.saved() == 'partial answer'
+
+    def test_error_before_the_first_chunk(self):
+        stream = ChatStream(failed_texts(ConnectionError("no such table: ActivityRollups")), self.writer)
+        parts = self.run_stream(stream)
+        assert parts[1] == '3:"no such table: ActivityRollups"\n' and parts[-1].startswith('d:{"finishReason":"error"')
+        user = self.database.get_chat_message(self.chat_id, self.writer.user_message_id) # type: ignore
+        assert user['content'] == 'question' and self.saved() == ''
@@ -0,0 +1,112 @@
+from . import db, models
+from db import classification_cache, classification_queue
+from ml.classification_worker import ClassificationWorkerPool
+from unittest import TestCase
+from typing import List
+import tempfile
+import time
+
+class StubClassifier:
+    def __init__(self):
+        self.calls: List[str] = []
+    def classify_app(self, app: models.IFetchApp, categories: List[str]) -> str:
+        self.calls.append(app['AppId'])
+        return 'Communication'
+    def classify_url(self, baseurl: models.IFetchBaseUrl, categories: List[str]) -> str:
+        self.calls.append(baseurl['baseURL'])
+        return 'Productivity'
+
+def make_app(version: str) -> models.IApp:
+    return models.IApp(
+        AppId=f"C:\\Users\\me\\AppData\\Local\\Discord\\app-{version} | Discord.exe", ExeFileName='Discord.exe',
+        ExeDirName=f"C:\\Users\\me\\AppData\\Local\\Discord\\app-{version}", IsBrowser=False, ProductName='Discord'
+    )
+
+class TestClassificationCache(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = db.Path(self.tmpdir.name).joinpath('database.db')
+        self.database = db.DataBase(db_path=self.db_path)
+    def tearDown(self):
+        self.database.close()
+        self.tmpdir.cleanup()
+
+    def test_keys(self):
+        assert classification_cache.url_keys('mail.google.com') == ['url:mail.google.com', 'url:google.com']
+        assert classification_cache.url_keys('www.bbc.co.uk:443') == ['url:bbc.co.uk']
+        assert classification_cache.url_keys('thefcraft.github.io') == ['url:thefcraft.github.io']
+        assert classification_cache.url_keys('127.0.0.1:8000') == ['url:127.0.0.1']
+        assert classification_cache.app_key(make_app('1.0.9013')) == classification_cache.app_key(make_app('1.0.9034'))
+        assert classification_cache.app_key({'ProductName': 'Microsoft Visual Studio 2022', 'ExeFileName': 'devenv.exe'}) \
+            == 'app:microsoft visual studio|devenv'
+        assert classification_cache.app_key({'ProductName': 'Python', 'ExeFileName': 'python3.11.exe'}) == 'app:python|python'
+
+    def test_domain_reuse_and_overrides(self):
+        with self.database.cursor_context() as cursor:
+            assert classification_cache.store_url(cursor, 'mail.google.com', 'Communication', 'llm')
+            assert classification_cache.lookup_url(cursor, 'docs.google.com')['Category'] == 'Communication' # type: ignore
+            assert not classification_cache.store_url(cursor, 'drive.google.com', 'Communication', 'llm') # already covered
+            assert classification_cache.store_url(cursor, 'docs.google.com', 'Productivity', 'llm') # differs -> host override
+            assert classification_cache.lookup_url(cursor, 'docs.google.com')['Category'] == 'Productivity' # type: ignore
+            assert classification_cache.lookup_url(cursor, 'maps.google.com')['Category'] == 'Communication' # type: ignore
+
+            assert classification_cache.store_url(cursor, 'youtube.com', 'Learning', 'user')
+            assert not classification_cache.store_url(cursor, 'youtube.com', 'Entertainment', 'llm') # user choice wins
+            assert classification_cache.lookup_url(cursor, 'youtube.com')['Category'] == 'Learning' # type: ignore
+
+    def test_ttl_and_accounting(self):
+        now = time.time()
+        with self.database.cursor_context() as cursor:
+            classification_cache.store_url(cursor, 'example.com', 'Web', 'llm', now=now)
+            before = classification_cache.stats(cursor, now=now)
+            assert classification_cache.lookup_url(cursor, 'example.com', now=now + 10) is not None
+            assert classification_cache.lookup_url(cursor, 'example.com', now=now + classification_cache.TTL) is None
+            assert classification_cache.lookup_url(cursor, 'other.com', now=now) is None
+            after = classification_cache.stats(cursor, now=now + classification_cache.TTL)
+            assert after['hits'] - before['hits'] == 1 and after['misses'] - before['misses'] == 2
+            assert after['expired_hits'] - before['expired_hits'] == 1 and after['expired'] == 1 and after['hits_total'] == 1
+            # an expired entry is replaced even by a lower priority source
+            assert classification_cache.store_url(cursor, 'example.com', 'Tools', 'local', now=now + classification_cache.TTL)
+            assert classification_cache.purge_expired(cursor, now=now + classification_cache.TTL) == 0
+
+    def test_new_version_uses_the_cache(self):
+        with self.database.cursor_context() as cursor:
+            self.database.insert_app(make_app('1.0.9013'))
+            classification_cache.store_app(cursor, make_app('1.0.9013'), 'Communication', 'user')
+            self.database.insert_app(make_app('1.0.9034')) # update installed in a new directory
+            cursor.execute("SELECT Category FROM Apps WHERE AppId = ?", (make_app('1.0.9034')['AppId'], ))
+            assert cursor.fetchone()['Category'] == 'Communication'
+            assert classification_queue.metrics(cursor)['depth'] == 1 # only the first version was queued
+
+    def test_pool_consults_cache_first(self):
+        with self.database.cursor_context() as cursor:
+            for host in ('mail.google.com', 'docs.google.com', 'drive.google.com'):
+                cursor.execute("INSERT INTO BaseURLs (baseURL, is_fetched) VALUES (?, TRUE)", (host, ))
+                classification_queue.enqueue_baseurl(cursor, host)
+            self.database.commit()
+        classifier = StubClassifier()
+        pool = ClassificationWorkerPool(db_path=self.db_path, classifier=classifier, batch_size=1)
+        pool.open()
+        self.addCleanup(pool.close)
+        while pool.run_once(): pass
+        assert classifier.calls == ['mail.google.com'] # the siblings reused the google.com entry
+        with self.database.cursor_context() as cursor:
+            cursor.execute("SELECT COUNT(*) AS count FROM BaseURLs WHERE Category = 'Productivity'")
+            assert cursor.fetchone()['count'] == 3
+
+    def test_export_import(self):
+        with self.database.cursor_context() as cursor:
+            classification_cache.store_url(cursor, 'github.com', 'Development', 'user')
+            classification_cache.store_url(cursor, 'reddit.com', 'Social', 'llm')
+            classification_cache.store_url(cursor, 'example.com', 'Web', 'local')
+            exported = classification_cache.export_entries(cursor)
+        assert [entry['CacheKey'] for entry in exported] == ['url:github.com', 'url:reddit.com'] # local guesses stay here
+
+        other = db.DataBase(db_path=db.Path(self.tmpdir.name).joinpath('other.db'))
+        self.addCleanup(other.close)
+        with other.cursor_context() as cursor:
+            classification_cache.store_url(cursor, 'reddit.com', 'Entertainment', 'user')
+            garbage = [{'CacheKey': 'nope', 'Category': 'x'}, {'CacheKey': 'url:a.com'}]
+            assert classification_cache.import_entries(cursor, [*exported, *garbage]) == 1 # own user choice kept
+            assert classification_cache.lookup_url(cursor, 'github.com')['Source'] == 'import' # type: ignore
+            assert classification_cache.lookup_url(cursor, 'reddit.com')['Category'] == 'Entertainment' # type: ignore
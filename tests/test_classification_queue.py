@@ -0,0 +1,168 @@
+from . import db, models
+from db import classification_queue
+from db.metadata_fetcher import MetadataFetcher
+from ml.classification_worker import ClassificationWorkerPool
+from ml.embedding_classifier import EmbeddingClassifier
+from unittest import TestCase
+from typing import List, Dict
+import tempfile
+import time
+
+class StubClassifier:
+    """Local stand in for the LLM: category by ExeFileName / baseURL, or raises."""
+    def __init__(self, categories: Dict[str, str], delay: float = 0.0):
+        self.categories = categories
+        self.delay = delay
+        self.calls: List[str] = []
+    def classify_app(self, app: models.IFetchApp, categories: List[str]) -> str:
+        return self.predict(app['ExeFileName'])
+    def classify_url(self, baseurl: models.IFetchBaseUrl, categories: List[str]) -> str:
+        return self.predict(baseurl['baseURL'])
+    def predict(self, key: str) -> str:
+        self.calls.append(key)
+        time.sleep(self.delay)
+        if key not in self.categories: raise TimeoutError("model did not answer")
+        return self.categories[key]
+
+def make_app(name: str) -> models.IApp:
+    return models.IApp(AppId=f"test | {name}", ExeFileName=name, ExeDirName='test', IsBrowser=False)
+
+class TestClassificationQueue(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = db.Path(self.tmpdir.name).joinpath('database.db')
+        self.database = db.DataBase(db_path=self.db_path)
+    def tearDown(self):
+        self.database.close()
+        self.tmpdir.cleanup()
+
+    def make_pool(self, classifier: StubClassifier, **kwargs) -> ClassificationWorkerPool:
+        pool = ClassificationWorkerPool(db_path=self.db_path, classifier=classifier, **kwargs)
+        pool.open()
+        self.addCleanup(pool.close)
+        return pool
+
+    def category(self, app_id: str):
+        with self.database.cursor_context() as cursor:
+            cursor.execute("SELECT Category FROM Apps WHERE AppId = ?", (app_id, ))
+            return cursor.fetchone()['Category']
+
+    def test_insert_does_not_wait_for_the_model(self):
+        with self.database.cursor_context() as cursor: # already fetched, so insert_url does no network round trip
+            cursor.execute("INSERT INTO BaseURLs (baseURL, is_fetched) VALUES ('example.com', TRUE)")
+        start = time.perf_counter()
+        with self.database.cursor_context():
+            self.database.insert_app(make_app('code.exe'))
+            self.database.insert_app(make_app('game.exe'))
+            self.database.insert_app(make_app('code.exe')) # already queued
+            self.database.insert_url(models.IUrl(URL='https://example.com/page'))
+        assert time.perf_counter() - start < 0.2
+        assert self.category('test | code.exe') is None
+
+        classifier = StubClassifier({'code.exe': 'Development', 'game.exe': 'Games', 'example.com': 'Web'}, delay=0.2)
+        pool = self.make_pool(classifier, workers=3)
+        start = time.perf_counter()
+        assert pool.run_once() == 3
+        assert time.perf_counter() - start < 0.4 and len(classifier.calls) == 3 # classified concurrently
+        assert self.category('test | code.exe') == 'Development'
+        with self.database.cursor_context() as cursor:
+            cursor.execute("SELECT Category FROM BaseURLs WHERE baseURL = 'example.com'")
+            assert cursor.fetchone()['Category'] == 'Web'
+            cursor.execute("SELECT Category FROM Categories WHERE Category = 'Games'")
+            assert cursor.fetchone() is not None
+            metrics = classification_queue.metrics(cursor)
+        assert metrics['done'] == 3 and metrics['depth'] == 0 and metrics['latency_avg'] is not None
+
+    def test_retry_backoff_and_dead_letter(self):
+        with self.database.cursor_context():
+            self.database.insert_app(make_app('flaky.exe'))
+            self.database.commit()
+        pool = self.make_pool(StubClassifier({}), max_attempts=3, backoff_base=10)
+        now = time.time()
+        assert pool.run_once(now=now) == 1
+        with self.database.cursor_context() as cursor:
+            cursor.execute("SELECT * FROM ClassificationQueue")
+            job = cursor.fetchone()
+            assert job['Status'] == 'pending' and job['NextAttempt'] == now + 10 and 'TimeoutError' in job['LastError']
+        assert pool.run_once(now=now + 5) == 0  # still backing off
+        assert pool.run_once(now=now + 10) == 1 # next retry in 20 sec
+        assert pool.run_once(now=now + 30) == 1 # 3rd attempt -> dead
+        with self.database.cursor_context() as cursor:
+            metrics = classification_queue.metrics(cursor, now=now + 30)
+            assert metrics['dead'] == 1 and metrics['depth'] == 0
+            assert classification_queue.retry_dead(cursor) == 1
+            self.database.commit()
+        pool.classifier = StubClassifier({'flaky.exe': 'Tools'})
+        assert pool.run_once() == 1
+        assert self.category('test | flaky.exe') == 'Tools'
+
+    def test_abandoned_job_is_reclaimed(self):
+        with self.database.cursor_context() as cursor:
+            self.database.insert_app(make_app('code.exe'))
+            now = time.time()
+            assert len(classification_queue.claim(cursor, limit=10, now=now)) == 1 # worker crashed after claiming
+            assert classification_queue.claim(cursor, limit=10, now=now + 1) == []
+            assert len(classification_queue.claim(cursor, limit=10, now=now + classification_queue.LEASE)) == 1
+
+    def test_manual_category_wins(self):
+        with self.database.cursor_context() as cursor:
+            self.database.insert_app(make_app('code.exe'))
+            jobs = classification_queue.claim(cursor, limit=10)
+            cursor.execute("UPDATE Apps SET Category = 'Work' WHERE AppId = 'test | code.exe'") # user edit meanwhile
+            classification_queue.complete(cursor, jobs[0], 'Development')
+            self.database.commit()
+        assert self.category('test | code.exe') == 'Work'
+
+    def test_usage_priority(self):
+        with self.database.cursor_context():
+            for name, durations in (('code.exe', [50, 70]), ('game.exe', [10]), ('setup.exe', [])):
+                self.database.insert_app(make_app(name))
+                for duration in durations:
+                    self.database.insert_activity(models.IActivityEntry(
+                        AppId=f"test | {name}", Title=name, URL=None, IsActive=True, IdleDuration=0, Duration=duration
+                    ))
+            self.database.insert_activity(models.IActivityEntry( # 90 sec on a site, 5 sec on another
+                AppId='test | code.exe', Title='docs', URL='https://docs.python.org/3/', IsActive=True, IdleDuration=0, Duration=90
+            ))
+            self.database.insert_url(models.IUrl(URL='https://once.example.com/'))
+        priority = classification_queue.UsagePriority(min_usage=60, max_defer=3600, offpeak_hours=None)
+        classifier = StubClassifier({'code.exe': 'Development', 'game.exe': 'Games', 'setup.exe': 'Utilities'})
+        pool = self.make_pool(classifier, priority=priority)
+        now = time.time()
+        with self.database.cursor_context() as cursor:
+            assert classification_queue.metrics(cursor, now=now, priority=priority)['deferred'] == 2
+        assert pool.run_once(now=now) == 1 and classifier.calls == ['code.exe'] # one-off apps wait
+        with self.database.cursor_context() as cursor:
+            cursor.execute("UPDATE ActivityEntries SET Duration = 600 WHERE AppId = 'test | game.exe'") # used a lot since
+            self.database.commit()
+        assert pool.run_once(now=now) == 1 and classifier.calls[-1] == 'game.exe'
+        assert pool.run_once(now=now) == 0
+        assert pool.run_once(now=now + 3600) == 1 and classifier.calls[-1] == 'setup.exe' # waited long enough
+        offpeak = classification_queue.UsagePriority(min_usage=60, max_defer=3600, offpeak_hours=(0, 24))
+        with self.database.cursor_context() as cursor:
+            classification_queue.enqueue(cursor, 'url', 'once.example.com', now=now)
+            assert classification_queue.claim(cursor, limit=10, now=now, priority=priority) == []
+            assert len(classification_queue.claim(cursor, limit=10, now=now, priority=offpeak)) == 1 # drained off-peak
+
+        fetcher = MetadataFetcher(db_path=self.db_path, priority=priority)
+        with self.database.cursor_context() as cursor:
+            assert fetcher.due(cursor, now=now) == ['docs.python.org']
+            assert fetcher.stats(cursor, now=now)['deferred'] == 1
+            assert fetcher.due(cursor, now=now + 3600) == ['docs.python.org', 'once.example.com'] # most used first
+
+    def test_dispatcher_waits_for_the_schema(self):
+        db_path = db.Path(self.tmpdir.name).joinpath('fresh.db') # the API creates the tables after the pool started
+        classifier = StubClassifier({'code.exe': 'Development'})
+        pool = ClassificationWorkerPool(db_path=db_path, classifier=classifier, poll_interval=0.05, local=EmbeddingClassifier())
+        pool.start()
+        self.addCleanup(pool.stop)
+        time.sleep(0.2)
+        assert pool.dispatcher is not None and pool.dispatcher.is_alive() and not pool.trained
+        database = db.DataBase(db_path=db_path)
+        self.addCleanup(database.close)
+        with database.cursor_context():
+            database.insert_app(make_app('code.exe'))
+        pool.notify()
+        deadline = time.time() + 5
+        while classifier.calls == [] and time.time() < deadline: time.sleep(0.05)
+        assert classifier.calls == ['code.exe'] and pool.trained
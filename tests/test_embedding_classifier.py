@@ -0,0 +1,117 @@
+from . import db, models
+from ml.batch_classification import url_item, app_item
+from ml.embedding_classifier import EmbeddingClassifier, hashed_ngrams
+from ml.classification_worker import ClassificationWorkerPool
+from unittest import TestCase
+from typing import List
+import numpy as np
+import tempfile
+
+class StubClassifier:
+    def __init__(self):
+        self.calls: List[str] = []
+    def classify_app(self, app: models.IFetchApp, categories: List[str]) -> str:
+        self.calls.append(app['ExeFileName'])
+        return 'Games'
+    def classify_url(self, baseurl: models.IFetchBaseUrl, categories: List[str]) -> str:
+        self.calls.append(baseurl['baseURL'])
+        return 'Web'
+
+def make_app(name: str, description: str) -> models.IApp:
+    return models.IApp(AppId=f"test | {name}", ExeFileName=name, ExeDirName='test', IsBrowser=False, FileDescription=description)
+
+TRAINING = [
+    (url_item('github.com', Title='GitHub code hosting'), 'Development'),
+    (url_item('gitlab.com', Title='GitLab code repository'), 'Development'),
+    (url_item('stackoverflow.com', Title='Stack Overflow programming questions'), 'Development'),
+    (url_item('youtube.com', Title='YouTube watch videos'), 'Entertainment'),
+    (url_item('netflix.com', Title='Netflix watch movies'), 'Entertainment'),
+    (url_item('twitch.tv', Title='Twitch live videos'), 'Entertainment'),
+]
+
+class TestEmbeddingClassifier(TestCase):
+    def setUp(self):
+        self.model = EmbeddingClassifier()
+        for item, category in TRAINING: self.model.learn(item, category)
+
+    def test_features(self):
+        indices, values = hashed_ngrams('github')
+        assert len(indices) == len(set(indices.tolist())) and abs(np.linalg.norm(values) - 1) < 1e-6
+        assert len(hashed_ngrams('')[0]) == 0
+
+    def test_predict_with_confidence(self):
+        prediction = self.model.predict(url_item('gist.github.com', Title='GitHub Gist code snippets'))
+        assert prediction['category'] == 'Development' and self.model.confident(prediction)
+        assert self.model.predict(url_item('vimeo.com', Title='watch videos'))['category'] == 'Entertainment'
+        unknown = self.model.predict(url_item('zzz.qq'))
+        assert not self.model.confident(unknown)
+
+    def test_incremental_relabel(self):
+        item = url_item('youtube.com', Title='YouTube watch videos')
+        self.model.learn(item, 'Development') # user moved it
+        assert self.model.stats()['documents'] == 6
+        assert self.model.counts == {'Development': 4, 'Entertainment': 2}
+        self.model.forget('url', 'youtube.com')
+        self.model.forget('url', 'netflix.com')
+        self.model.forget('url', 'twitch.tv')
+        assert 'Entertainment' not in self.model.sums and self.model.stats()['categories'] == 1
+        assert int(self.model.df.sum()) == sum(len(vector[0]) for _, vector in self.model.labels.values())
+
+class TestLocalCascade(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = db.Path(self.tmpdir.name).joinpath('database.db')
+        self.database = db.DataBase(db_path=self.db_path)
+    def tearDown(self):
+        self.database.close()
+        self.tmpdir.cleanup()
+
+    def test_confident_jobs_skip_the_llm(self):
+        with self.database.cursor_context() as cursor:
+            for category in ('Development', 'Entertainment'):
+                cursor.execute("INSERT INTO Categories (Category) VALUES (?)", (category, ))
+            for item, category in TRAINING:
+                cursor.execute("INSERT INTO BaseURLs (baseURL, Title, Category, is_fetched) VALUES (?, ?, ?, TRUE)",
+                               (item['key'], item['data']['title'], category))
+            self.database.insert_app(make_app('steam.exe', 'Steam'))
+            cursor.execute("INSERT INTO BaseURLs (baseURL, Title, is_fetched) VALUES ('gist.github.com', 'GitHub Gist code', TRUE)")
+            cursor.execute("INSERT INTO ClassificationQueue (Kind, Key, NextAttempt, EnqueuedAt) VALUES ('url', 'gist.github.com', 0, 0)")
+            self.database.commit()
+
+        llm = StubClassifier()
+        local = EmbeddingClassifier()
+        pool = ClassificationWorkerPool(db_path=self.db_path, classifier=llm, local=local)
+        pool.open()
+        self.addCleanup(pool.close)
+        assert local.stats()['documents'] == 6 # trained from the database on open
+        assert pool.run_once() == 2
+        assert llm.calls == ['steam.exe'] # the url was answered locally
+        with self.database.cursor_context() as cursor:
+            cursor.execute("SELECT Category FROM BaseURLs WHERE baseURL = 'gist.github.com'")
+            assert cursor.fetchone()['Category'] == 'Development'
+            cursor.execute("UPDATE Apps SET Category = 'Entertainment' WHERE AppId = 'test | steam.exe'") # user correction
+            local.sync(cursor, 'app', 'test | steam.exe')
+        assert local.labels[('app', 'test | steam.exe')][0] == 'Entertainment' # LLM answer learned, then relabelled
+        stats = pool.local_stats()
+        assert stats is not None and stats['predicted'] == 1 and stats['deferred'] == 1 and stats['documents'] == 7
+        assert local.predict(app_item(make_app('steam.exe', 'Steam')))['category'] == 'Entertainment'
+
+class TestColdStart(TestCase):
+    def test_one_category_is_not_trusted(self):
+        model = EmbeddingClassifier()
+        model.learn(url_item('github.com', Title='GitHub code hosting'), 'Development')
+        model.learn(url_item('gitlab.com', Title='GitLab code repository'), 'Development')
+        prediction = model.predict(url_item('gist.github.com', Title='GitHub Gist code snippets'))
+        assert prediction['category'] == 'Development' and prediction['confidence'] == prediction['similarity']
+        assert not model.confident(prediction) # the margin over no 2nd category is the raw similarity
+        model.learn(url_item('youtube.com', Title='YouTube watch videos'), 'Entertainment')
+        assert not model.confident(model.predict(url_item('gist.github.com', Title='GitHub Gist code snippets'))) # 1 document
+        model.learn(url_item('netflix.com', Title='Netflix watch movies'), 'Entertainment')
+        assert model.confident(model.predict(url_item('gist.github.com', Title='GitHub Gist code snippets')))
+
+    def test_low_similarity_best_match(self):
+        model = EmbeddingClassifier(min_confidence=0.0)
+        for item, category in TRAINING: model.learn(item, category)
+        prediction = model.predict(url_item('example.com', Title='Example domain'))
+        assert prediction['category'] is not None and prediction['similarity'] < model.min_similarity
+        assert not model.confident(prediction)
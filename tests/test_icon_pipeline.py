@@ -0,0 +1,164 @@
+from . import db
+from db.iconstore import IconStore, content_hash
+from services.icon_pipeline import IconPipeline, icon_file_name
+from unittest import TestCase
+from threading import Event
+from PIL import Image
+import tempfile
+from io import BytesIO
+import time
+import os
+
+COLORS = {
+    'red.exe': (255, 0, 0, 255),
+    'red_copy.exe': (255, 0, 0, 255),
+    'blue.exe': (0, 0, 255, 255),
+}
+
+class FakeImageProvider:
+    def __init__(self, release: Event = None):
+        self.calls = 0
+        self.release = release
+    def __call__(self, exe_full_path: str):
+        if self.release is not None: self.release.wait(timeout=5)
+        self.calls += 1
+        color = COLORS.get(os.path.basename(exe_full_path))
+        if color is None: return None
+        return Image.new('RGBA', (32, 32), color)
+
+class TestIconPipeline(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = IconStore(db.Path(self.tmpdir.name).joinpath('icons.db'))
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_submit_does_not_wait(self):
+        release = Event()
+        provider = FakeImageProvider(release=release)
+        pipeline = IconPipeline(store=self.store, image_provider=provider)
+        start = time.perf_counter()
+        assert pipeline.submit('Red | App', '/apps/red.exe')
+        assert not pipeline.submit('Red | App', '/apps/red.exe') # already pending
+        assert time.perf_counter() - start < 0.5
+        assert provider.calls == 0
+        release.set()
+        pipeline.join()
+        assert provider.calls == 1
+        assert not pipeline.submit('Red | App', '/apps/red.exe') # already known
+        pipeline.stop()
+
+    def test_content_dedup_and_thumbnails(self):
+        provider = FakeImageProvider()
+        pipeline = IconPipeline(store=self.store, image_provider=provider, thumbnail_sizes=(16,))
+        pipeline.submit('Red | App', '/apps/red.exe')
+        pipeline.submit('Red | Copy', '/apps/red_copy.exe')
+        pipeline.submit('Blue | App', '/apps/blue.exe')
+        pipeline.submit('Missing | App', '/apps/missing.exe')
+        pipeline.join()
+        pipeline.stop()
+
+        stats = pipeline.stats()
+        assert stats['processed'] == 3 and stats['shared'] == 1 and stats['failed'] == 1 and stats['pending'] == 0
+        hashes = self.store.get_hashes(self.store.names())
+        assert len(set(hashes.values())) == 4 # red, blue and their 16px thumbnails
+
+        red = self.store.get_hash(icon_file_name('Red | App'))
+        assert red is not None and red == self.store.get_hash(icon_file_name('Red | Copy'))
+        assert self.store.get_hash(icon_file_name('Missing | App')) is None
+        blue = self.store.get_blob(self.store.get_hash(icon_file_name('Blue | App', size=16)))
+        with Image.open(BytesIO(blue)) as thumbnail:
+            assert thumbnail.size == (16, 16)
+
+    def test_failures_are_not_retried_on_every_switch(self):
+        provider = FakeImageProvider()
+        pipeline = IconPipeline(store=self.store, image_provider=provider, retry_after=60)
+        path = os.path.join(self.tmpdir.name, 'broken.exe')
+        with open(path, 'wb') as f: f.write(b'MZ')
+        assert pipeline.submit('Broken | App', path)
+        pipeline.join()
+        for _ in range(5): assert not pipeline.submit('Broken | App', path) # app switches
+        assert provider.calls == 1 and pipeline.stats()['unavailable'] == 1
+        os.utime(path, (time.time() + 10, time.time() + 10)) # updated executable: tried again
+        assert pipeline.submit('Broken | App', path)
+        pipeline.join()
+        pipeline.unavailable[path] = (pipeline.unavailable[path][0], time.monotonic()) # retry-after passed
+        assert pipeline.submit('Broken | App', path)
+        pipeline.join()
+        pipeline.stop()
+        assert provider.calls == 3
+
+    def test_known_from_store(self):
+        self.store.put(icon_file_name('Red | App'), b'png')
+        provider = FakeImageProvider()
+        pipeline = IconPipeline(store=self.store, image_provider=provider)
+        assert not pipeline.submit('Red | App', '/apps/red.exe')
+        assert provider.calls == 0
+
+class TestIconStore(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = IconStore(db.Path(self.tmpdir.name).joinpath('icons.db'))
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_put_dedups_content(self):
+        digest, is_new = self.store.put('a.png', b'same')
+        assert is_new and digest == content_hash(b'same')
+        assert self.store.put('b.png', b'same') == (digest, False)
+        assert self.store.get_hashes(['a.png', 'b.png', 'c.png']) == {'a.png': digest, 'b.png': digest}
+        assert self.store.get_blob(digest) == b'same'
+        assert self.store.get_blobs([digest, 'unknown']) == {digest: b'same'}
+        digest2, _ = self.store.put('a.png', b'changed') # names can be repointed
+        assert self.store.get_hash('a.png') == digest2 != digest
+
+    def test_import_directory(self):
+        icon_dir = db.Path(self.tmpdir.name).joinpath('icons')
+        icon_dir.mkdir()
+        with open(icon_dir.joinpath('x.png'), 'wb') as f: f.write(b'x')
+        with open(icon_dir.joinpath('notes.txt'), 'wb') as f: f.write(b'ignored')
+        assert self.store.import_directory(icon_dir) == 1
+        assert self.store.import_directory(icon_dir) == 0
+        assert self.store.get_blob(self.store.get_hash('x.png')) == b'x'
+
+class TestIconEndpoints(TestCase):
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        import api
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = IconStore(db.Path(self.tmpdir.name).joinpath('icons.db'))
+        self.previous_store, db.global_icon_store = db.global_icon_store, self.store
+        self.client = TestClient(api.app)
+        self.digest, _ = self.store.put('a.png', b'full')
+        self.thumbnail_digest, _ = self.store.put('a.16.png', b'thumb')
+    def tearDown(self):
+        db.global_icon_store = self.previous_store
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_etag_and_not_modified(self):
+        response = self.client.get('/api/static/icons/a.png')
+        assert response.status_code == 200 and response.content == b'full'
+        assert response.headers['etag'] == f'"{self.digest}"'
+        response = self.client.get('/api/static/icons/a.png', headers={'If-None-Match': f'"{self.digest}"'})
+        assert response.status_code == 304 and response.content == b''
+        assert self.client.get('/api/static/icons/a.png', params={'size': 16}).content == b'thumb'
+        assert self.client.get('/api/static/icons/a.png', params={'size': 32}).content == b'full'
+
+    def test_blob_is_immutable(self):
+        response = self.client.get(f'/api/static/icons/blob/{self.digest}')
+        assert response.content == b'full' and 'immutable' in response.headers['cache-control']
+        assert self.client.get('/api/static/icons/blob/unknown').status_code == 404
+
+    def test_batch(self):
+        response = self.client.get('/api/static/icons/batch', params={'names': ['a.png', 'b.png'], 'size': 16})
+        body = response.json()
+        assert body['icons']['a.png']['hash'] == self.thumbnail_digest and body['missing'] == ['b.png']
+        etag = response.headers['etag']
+        assert self.client.get('/api/static/icons/batch', params={'names': ['b.png', 'a.png'], 'size': 16},
+                               headers={'If-None-Match': etag}).status_code == 304
+        self.store.put('a.16.png', b'thumb v2')
+        assert self.client.get('/api/static/icons/batch', params={'names': ['a.png', 'b.png'], 'size': 16},
+                               headers={'If-None-Match': etag}).status_code == 200
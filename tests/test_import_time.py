@@ -0,0 +1,12 @@
+from scripts.benchmark_import_time import measure, summarize, LLM_MODULES
+from unittest import TestCase
+
+class TestImportTime(TestCase):
+    def test_no_llm_libraries_at_import(self):
+        # fresh interpreters without GROQ_API_KEY: importing must neither need it nor load an llm client
+        for module in ('services.background_service', 'db', 'api'):
+            rows = measure(module)
+            total, heaviest, llm = summarize(rows, module, top=5)
+            assert total > 0 and heaviest
+            assert llm == [], f"import {module} loaded {llm}"
+            assert not any(row['module'].split('.')[0] in LLM_MODULES + ('bs4', ) for row in rows)
@@ -0,0 +1,182 @@
+from . import db, models
+from db import classification_queue
+from db.metadata_fetcher import MetadataFetcher, HeadParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+from unittest import TestCase
+from typing import List
+import asyncio
+import tempfile
+import socket
+import time
+
+HEAD = b"""<!doctype html><html><head>
+<meta charset="utf-8"><title> Example &amp; Co </title>
+<meta name="description" content="An example site">
+<link rel="shortcut icon" href="/static/icon.png">
+</head>"""
+
+class StandInServer:
+    """Local http server, `mode` picks the behaviour of every request."""
+    def __init__(self, mode: str, delay: float = 0.0):
+        self.mode = mode
+        self.delay = delay
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = Lock()
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args): pass
+            def do_GET(self):
+                with server.lock:
+                    server.requests += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    time.sleep(server.delay)
+                    server.respond(self)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass # the client stopped reading, as it should
+                finally:
+                    with server.lock: server.in_flight -= 1
+        self.httpd = ThreadingHTTPServer(('', 0), Handler)
+        self.httpd.daemon_threads = True
+        Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def respond(self, handler: BaseHTTPRequestHandler) -> None:
+        if self.mode == 'missing':
+            handler.send_error(404)
+            return
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/json' if self.mode == 'json' else 'text/html; charset=utf-8')
+        handler.end_headers()
+        if self.mode == 'json':
+            handler.wfile.write(b'{}')
+        elif self.mode == 'endless_head': # never closes the head
+            handler.wfile.write(b"<html><head><title>Big</title>")
+            for _ in range(200): handler.wfile.write(b"<meta name='x' content='" + b'x' * 65536 + b"'>")
+        else: # a normal head followed by a huge body
+            handler.wfile.write(HEAD)
+            for _ in range(200): handler.wfile.write(b"<body><p>" + b'x' * 65536)
+
+    def host(self, ip: str = '127.0.0.1') -> str:
+        return f"{ip}:{self.httpd.server_address[1]}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def dead_host() -> str:
+    with socket.socket() as sock: # a port nothing listens on
+        sock.bind(('127.0.0.1', 0))
+        return f"127.0.0.1:{sock.getsockname()[1]}"
+
+class TestHeadParser(TestCase):
+    def test_head_only(self):
+        parser = HeadParser()
+        for i in range(0, len(HEAD), 7): parser.feed(HEAD[i:i + 7].decode()) # arbitrary chunk boundaries
+        parser.feed("<body><title>not this</title>")
+        assert parser.done
+        info = parser.result('https://example.com/home')
+        assert info == {'title': 'Example & Co', 'description': 'An example site', 'favicon_url': 'https://example.com/static/icon.png'}
+        fallback = HeadParser()
+        fallback.feed("<head><meta property='og:title' content='OG'></head>")
+        assert fallback.result('http://a.com:8080/x') == {'title': 'OG', 'description': None, 'favicon_url': 'http://a.com:8080/favicon.ico'}
+
+class TestMetadataFetcher(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = db.Path(self.tmpdir.name).joinpath('database.db')
+        self.database = db.DataBase(db_path=self.db_path)
+        self.servers: List[StandInServer] = []
+    def tearDown(self):
+        for server in self.servers: server.close()
+        self.database.close()
+        self.tmpdir.cleanup()
+
+    def server(self, mode: str, delay: float = 0.0) -> StandInServer:
+        server = StandInServer(mode, delay=delay)
+        self.servers.append(server)
+        return server
+
+    def make_fetcher(self, **kwargs) -> MetadataFetcher:
+        fetcher = MetadataFetcher(db_path=self.db_path, schemes=('http', ), retry_base=60, **kwargs)
+        fetcher.open()
+        self.addCleanup(fetcher.close)
+        return fetcher
+
+    def run_once(self, fetcher: MetadataFetcher, now: float) -> int:
+        async def main():
+            async with fetcher.make_client() as client:
+                return await fetcher.run_once(client, now=now)
+        return asyncio.run(main())
+
+    def test_fetch_and_negative_cache(self):
+        ok, slow, missing, json = self.server('ok'), self.server('ok', delay=2), self.server('missing'), self.server('json')
+        endless, dead = self.server('endless_head'), dead_host()
+        hosts = [ok.host(), slow.host(), missing.host(), json.host(), endless.host(), dead]
+        start = time.perf_counter()
+        with self.database.cursor_context():
+            for host in hosts: self.database.insert_url(models.IUrl(URL=f"https://{host}/page"))
+        assert time.perf_counter() - start < 0.2 # the insert path does no network round trip
+
+        fetcher = self.make_fetcher(deadline=0.5, max_bytes=64 * 1024)
+        now = time.time()
+        start = time.perf_counter()
+        assert self.run_once(fetcher, now=now) == 6
+        assert time.perf_counter() - start < 1.5 # bounded by the deadline, not by the slow server or the huge bodies
+        with self.database.cursor_context() as cursor:
+            cursor.execute("SELECT * FROM BaseURLs")
+            rows = {row['baseURL']: row for row in cursor.fetchall()}
+            assert rows[ok.host()]['is_fetched'] and rows[ok.host()]['Title'] == 'Example & Co'
+            assert rows[ok.host()]['icon_url'] == f"http://{ok.host()}/static/icon.png"
+            assert rows[endless.host()]['is_fetched'] and rows[endless.host()]['Title'] == 'Big' # capped at max_bytes
+            cursor.execute("SELECT * FROM UrlFetchState")
+            failures = {row['baseURL']: row for row in cursor.fetchall()}
+            assert set(failures) == {slow.host(), missing.host(), json.host(), dead}
+            assert 'TimeoutError' in failures[slow.host()]['LastError'] and 'HTTP 404' in failures[missing.host()]['LastError']
+            assert 'not html' in failures[json.host()]['LastError'] and 'ConnectError' in failures[dead]['LastError']
+            assert failures[dead]['NextFetch'] == now + 60
+            assert classification_queue.metrics(cursor)['depth'] == 6 # every attempt queues the classification
+            stats = fetcher.stats(cursor, now=now)
+            assert stats['fetched'] == 2 and stats['failed'] == 4 and stats['backing_off'] == 4 and stats['pending'] == 0
+
+        assert self.run_once(fetcher, now=now + 30) == 0 # negative cache
+        assert self.run_once(fetcher, now=now + 60) == 4
+        with self.database.cursor_context() as cursor:
+            cursor.execute("SELECT Attempts, NextFetch FROM UrlFetchState WHERE baseURL = ?", (dead, ))
+            row = cursor.fetchone()
+            assert row['Attempts'] == 2 and row['NextFetch'] == now + 60 + 120 # exponential re-fetch
+
+        slow.delay = 0
+        assert self.run_once(fetcher, now=now + 180) == 4
+        with self.database.cursor_context() as cursor:
+            cursor.execute("SELECT is_fetched FROM BaseURLs WHERE baseURL = ?", (slow.host(), ))
+            assert cursor.fetchone()['is_fetched']
+            cursor.execute("SELECT COUNT(*) AS count FROM UrlFetchState WHERE baseURL = ?", (slow.host(), ))
+            assert cursor.fetchone()['count'] == 0
+
+    def test_per_host_concurrency(self):
+        server = self.server('ok', delay=0.2)
+        fetcher = self.make_fetcher(per_host=1)
+        async def main(hosts: List[str]):
+            async with fetcher.make_client() as client:
+                return await fetcher.fetch_all(client, hosts)
+        results = asyncio.run(main([server.host()] * 4))
+        assert all(info is not None for _, info, _ in results) and server.max_in_flight == 1
+        server.max_in_flight = 0
+        asyncio.run(main([server.host(f"127.0.0.{i}") for i in range(1, 5)])) # 4 different hosts
+        assert server.max_in_flight > 1
+
+    def test_busy_host_does_not_hold_the_global_limit(self):
+        slow, fast = self.server('ok', delay=0.2), self.server('ok')
+        fetcher = self.make_fetcher(per_host=1, concurrency=2)
+        async def main():
+            async with fetcher.make_client() as client:
+                task = asyncio.create_task(fetcher.fetch_all(client, [slow.host()] * 4 + [fast.host('127.0.0.2')]))
+                await asyncio.sleep(0.15) # the first fetch of the slow host is still running
+                served = fast.requests
+                await task
+                return served
+        assert asyncio.run(main()) == 1 and slow.max_in_flight == 1
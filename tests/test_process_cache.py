@@ -0,0 +1,68 @@
+from . import db
+from services.process_cache import ProcessMetadataCache, get_app_id
+from unittest import TestCase
+import psutil
+import tempfile
+import os
+
+class FakeFileInfo:
+    def __init__(self, CompanyName, ProductName):
+        self.CompanyName = CompanyName
+        self.ProductName = ProductName
+
+class FakeFileInfoProvider:
+    def __init__(self):
+        self.calls = 0
+    def __call__(self, exe_full_path: str):
+        self.calls += 1
+        if exe_full_path.endswith('unknown.exe'): return None
+        return FakeFileInfo(CompanyName='Test Corp', ProductName=os.path.basename(exe_full_path))
+
+class TestProcessCache(TestCase):
+    def test_app_id(self):
+        assert get_app_id(None, exe_dir_name='bin', exe_file_name='a.exe') == 'bin | a.exe'
+        assert get_app_id(FakeFileInfo('None', 'X'), exe_dir_name='bin', exe_file_name='a.exe') == 'bin | a.exe'
+        assert get_app_id(FakeFileInfo('Corp', 'X'), exe_dir_name='bin', exe_file_name='a.exe') == 'Corp | X'
+
+    def test_exe_path_cached_per_process(self):
+        provider = FakeFileInfoProvider()
+        cache = ProcessMetadataCache(fileinfo_provider=provider)
+        for _ in range(5):
+            metadata = cache.get_process_metadata(psutil.Process(os.getpid()))
+        assert metadata.exe_full_path == psutil.Process(os.getpid()).exe()
+        assert provider.calls == 1
+        stats = cache.stats()
+        assert stats['exe_paths']['misses'] == 1 and stats['exe_paths']['hits'] == 4
+        assert stats['metadata']['misses'] == 1 and stats['metadata']['hits'] == 4
+
+    def test_metadata_invalidated_on_mtime(self):
+        provider = FakeFileInfoProvider()
+        cache = ProcessMetadataCache(fileinfo_provider=provider)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            exe = os.path.join(tmpdir, 'app.exe')
+            with open(exe, 'w') as f: f.write('v1')
+            os.utime(exe, (1_000_000, 1_000_000))
+            first = cache.get_metadata(exe)
+            assert cache.get_metadata(exe) is first
+            os.utime(exe, (2_000_000, 2_000_000)) # app updated
+            second = cache.get_metadata(exe)
+            assert second is not first
+            assert second.app_id == 'Test Corp | app.exe'
+            assert provider.calls == 2
+
+            unknown = cache.get_metadata(os.path.join(tmpdir, 'unknown.exe'))
+            assert unknown.fileinfo is None
+            assert unknown.app_id == f"{os.path.basename(tmpdir)} | unknown.exe"
+
+    def test_eviction(self):
+        provider = FakeFileInfoProvider()
+        cache = ProcessMetadataCache(fileinfo_provider=provider, max_executables=2)
+        cache.get_metadata('/a/1.exe')
+        cache.get_metadata('/a/2.exe')
+        cache.get_metadata('/a/1.exe') # 1 is now most recently used
+        cache.get_metadata('/a/3.exe') # evicts 2
+        assert cache.metadata.stats()['evictions'] == 1
+        cache.get_metadata('/a/1.exe')
+        assert provider.calls == 3
+        cache.get_metadata('/a/2.exe')
+        assert provider.calls == 4
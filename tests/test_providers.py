@@ -0,0 +1,58 @@
+from . import models
+from ml import providers, langchain_classification, langchain_generate_title
+from ml.providers import Provider, ProviderConfig
+from ml.standin_server import StandInServer
+from ml.batch_classification import BatchClassifier, app_item, url_item
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+import asyncio
+import time
+
+def standin_provider(server: StandInServer, max_concurrency: int = 4) -> Provider:
+    return Provider('local', ProviderConfig(
+        base_url=server.base_url, api_key_env=None, model='standin',
+        max_concurrency=max_concurrency, timeout=5.0, connect_timeout=1.0, max_retries=0
+    ))
+
+class TestProviders(TestCase):
+    def setUp(self):
+        self.server = StandInServer(tokens_per_second=0).start()
+        self.addCleanup(self.server.close)
+        self.provider = standin_provider(self.server)
+        providers.set_provider(self.provider)
+        self.addCleanup(providers.set_provider, None)
+
+    def test_classification_and_title_paths(self):
+        app = models.IApp(AppId='dir | code.exe', ExeFileName='code.exe', ExeDirName='dir', IsBrowser=False)
+        category = langchain_classification.predict_app_category(app, ['Work', 'Fun'])
+        assert category in ('Work', 'Fun') and langchain_classification.predict_app_category(app, ['Work', 'Fun']) == category
+        assert langchain_classification.predict_url_category('github.com', 'GitHub', None, []) == 'Other'
+        title = asyncio.run(langchain_generate_title.generate_title("how do I profile python imports"))
+        assert title == "how do I profile python imports"
+        result = BatchClassifier().classify([app_item(app), url_item('github.com')], ['Work', 'Fun'])
+        assert set(result['categories']) == {'dir | code.exe', 'github.com'} and result['failed'] == {}
+        stats = self.provider.stats()
+        assert stats['requests'] == 5 and stats['errors'] == 0 and stats['in_flight'] == 0
+
+    def test_streaming_rate(self):
+        self.server.tokens_per_second = 100
+        async def main():
+            start, tokens = time.perf_counter(), []
+            async for chunk in self.provider.astream([{'role': 'user', 'content': ' '.join(['word'] * 20)}]):
+                if chunk.choices and chunk.choices[0].delta.content: tokens.append(chunk.choices[0].delta.content)
+            return tokens, time.perf_counter() - start
+        tokens, elapsed = asyncio.run(main())
+        assert ''.join(tokens) == "This is the stand-in model answering: " + ' '.join(['word'] * 20)
+        assert len(tokens) == 26 and elapsed >= 26 / 100
+
+    def test_concurrency_limit(self):
+        self.server.latency = 0.1
+        limited = standin_provider(self.server, max_concurrency=2)
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            list(executor.map(lambda i: limited.create([{'role': 'user', 'content': str(i)}]), range(6)))
+        assert self.server.max_in_flight == 2 and limited.stats()['max_in_flight'] == 2
+        async def burst():
+            await asyncio.gather(*(limited.acreate([{'role': 'user', 'content': str(i)}]) for i in range(6)))
+        self.server.max_in_flight = 0
+        asyncio.run(burst())
+        assert self.server.max_in_flight == 2 and limited.stats()['requests'] == 12
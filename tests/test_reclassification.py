@@ -0,0 +1,103 @@
+from . import db, models
+from db import classification_cache
+from ml import reclassification
+from unittest import TestCase
+from typing import List, Dict
+import tempfile
+import time
+
+class StubClassifier:
+    def __init__(self, categories: Dict[str, str], delay: float = 0.0):
+        self.categories = categories
+        self.delay = delay
+        self.calls: List[str] = []
+    def classify_app(self, app: models.IFetchApp, categories: List[str]) -> str:
+        return self.predict(app['ExeFileName'])
+    def classify_url(self, baseurl: models.IFetchBaseUrl, categories: List[str]) -> str:
+        return self.predict(baseurl['baseURL'])
+    def predict(self, key: str) -> str:
+        self.calls.append(key)
+        time.sleep(self.delay)
+        if key not in self.categories: raise TimeoutError("model did not answer")
+        return self.categories[key]
+
+class TestReclassification(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = db.Path(self.tmpdir.name).joinpath('database.db')
+        self.database = db.DataBase(db_path=self.db_path)
+        with self.database.cursor_context() as cursor:
+            for category in ('Work', 'Fun'): cursor.execute("INSERT INTO Categories (Category) VALUES (?)", (category, ))
+            for name, category in (('code.exe', 'Fun'), ('game.exe', 'Fun'), ('mail.exe', None), ('chat.exe', 'Fun')):
+                cursor.execute("INSERT INTO Apps (AppId, ExeFileName, ExeDirName, IsBrowser, Category) VALUES (?, ?, 'dir', FALSE, ?)",
+                               (f"dir | {name}", name, category))
+            cursor.execute("INSERT INTO BaseURLs (baseURL, is_fetched, Category) VALUES ('github.com', TRUE, 'Fun')")
+            classification_cache.store_app(cursor, {'ExeFileName': 'chat.exe'}, 'Fun', 'user') # a manual choice
+            self.database.commit()
+        self.classifier = StubClassifier({
+            'code.exe': 'Work', 'game.exe': 'Fun', 'mail.exe': 'Work', 'chat.exe': 'Work', 'github.com': 'Work'
+        })
+    def tearDown(self):
+        self.database.close()
+        self.tmpdir.cleanup()
+
+    def start(self, scope: models.ReclassificationScope = 'all', dry_run: bool = True, category=None, **kwargs) -> reclassification.ReclassificationJob:
+        with self.database.cursor_context() as cursor:
+            run_id = reclassification.create_run(cursor, models.IReclassificationRun(
+                Scope=scope, Category=category, Kinds='app,url', DryRun=dry_run, IncludeManual=False
+            ))
+            self.database.commit()
+        job = reclassification.ReclassificationJob(db_path=self.db_path, classifier=kwargs.pop('classifier', self.classifier),
+                                                   run_id=run_id, **kwargs)
+        job.start()
+        return job
+
+    def categories(self) -> Dict[str, str]:
+        with self.database.cursor_context() as cursor:
+            cursor.execute("SELECT AppId AS key, Category FROM Apps UNION ALL SELECT baseURL, Category FROM BaseURLs")
+            return {row['key']: row['Category'] for row in cursor.fetchall()}
+
+    def test_dry_run_then_apply(self):
+        before = self.categories()
+        job = self.start(chunk_size=2, workers=2)
+        job.join()
+        assert self.categories() == before # nothing written
+        with self.database.cursor_context() as cursor:
+            run = reclassification.get_run(cursor, job.run_id)
+            assert run is not None and run['Status'] == 'done'
+            assert run['Total'] == 4 and run['Processed'] == 4 and run['Changed'] == 3 # chat.exe is a manual choice
+            changes = reclassification.get_changes(cursor, job.run_id)
+            assert {(change['Key'], change['OldCategory'], change['NewCategory']) for change in changes} == {
+                ('dir | code.exe', 'Fun', 'Work'), ('dir | mail.exe', None, 'Work'), ('github.com', 'Fun', 'Work')
+            }
+            cursor.execute("UPDATE Apps SET Category = 'Fun' WHERE AppId = 'dir | mail.exe'") # edited during the review
+            self.database.commit()
+        assert reclassification.apply_changes(self.database, job.run_id, chunk_size=1) == 2
+        categories = self.categories()
+        assert categories['dir | code.exe'] == 'Work' and categories['github.com'] == 'Work'
+        assert categories['dir | mail.exe'] == 'Fun' and categories['dir | chat.exe'] == 'Fun'
+        with self.database.cursor_context() as cursor:
+            assert reclassification.get_run(cursor, job.run_id)['Status'] == 'applied' # type: ignore
+            assert classification_cache.lookup_url(cursor, 'github.com')['Category'] == 'Work' # type: ignore
+
+    def test_write_scope_and_failures(self):
+        self.classifier.categories.pop('game.exe')
+        job = self.start(scope='category', category='Fun', dry_run=False, chunk_size=1)
+        job.join()
+        with self.database.cursor_context() as cursor:
+            run = reclassification.get_run(cursor, job.run_id)
+            assert run is not None and run['Total'] == 3 and run['Changed'] == 2 and run['Failed'] == 1
+            assert all(change['Applied'] for change in reclassification.get_changes(cursor, job.run_id))
+        categories = self.categories()
+        assert categories['dir | code.exe'] == 'Work' and categories['dir | game.exe'] == 'Fun' and categories['dir | mail.exe'] is None
+
+    def test_cancel(self):
+        slow = StubClassifier(self.classifier.categories, delay=0.2)
+        job = self.start(classifier=slow, chunk_size=1, workers=1)
+        time.sleep(0.3)
+        job.cancel()
+        job.join()
+        with self.database.cursor_context() as cursor:
+            run = reclassification.get_run(cursor, job.run_id)
+            assert run is not None and run['Status'] == 'cancelled' and 1 <= run['Processed'] < run['Total']
+        assert len(slow.calls) < 4
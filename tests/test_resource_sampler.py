@@ -0,0 +1,104 @@
+from . import db, models
+from services.process_cache import ProcessMetadataCache
+from services.resource_sampler import ResourceSampler, sampler_cache
+from unittest import TestCase
+import psutil
+import time
+import os
+
+HOUR, DAY = 60*60, 60*60*24
+
+def sample(app_id: str, bucket_start: int, cpu_time: float = 1.0, rss: int = 100) -> models.IResourceSample:
+    return models.IResourceSample(
+        AppId=app_id, BucketStart=bucket_start, CpuTime=cpu_time,
+        RssSum=rss, RssMax=rss, ReadBytes=10, WriteBytes=5, Samples=1
+    )
+
+class TestResourceSamples(TestCase):
+    def setUp(self):
+        self.database = db.DataBase(db_path=':memory:')
+    def tearDown(self):
+        self.database.close()
+
+    def rows(self):
+        with self.database.cursor_context() as cursor:
+            cursor.execute("SELECT * FROM ResourceSamples ORDER BY Resolution, BucketStart")
+            return [dict(row) for row in cursor.fetchall()]
+
+    def test_insert_accumulates_per_minute(self):
+        with self.database.cursor_context():
+            self.database.insert_resource_samples([sample('a', 120), sample('a', 150, rss=300), sample('b', 150)])
+        rows = self.rows()
+        assert len(rows) == 2
+        a = next(row for row in rows if row['AppId'] == 'a')
+        assert a['BucketStart'] == 120 and a['Samples'] == 2 and a['CpuTime'] == 2.0
+        assert a['RssSum'] == 400 and a['RssMax'] == 300 and a['ReadBytes'] == 20
+
+    def test_downsample_tiers(self):
+        now = 100*DAY
+        with self.database.cursor_context():
+            self.database.insert_resource_samples([
+                sample('a', now - 40*DAY), sample('a', now - 40*DAY + 60),  # -> 1 day tier
+                sample('a', now - 2*DAY), sample('a', now - 2*DAY + 60),    # -> 1 hour tier
+                sample('a', now - 60),                                      # stays at 1 min
+            ])
+            assert self.database.downsample_resource_samples(now=now) == 4 + 1 # 4 minutes, then 1 hour bucket
+            # a later rollup merges into the existing coarse bucket
+            self.database.insert_resource_samples([sample('a', now - 2*DAY + 120)])
+            self.database.downsample_resource_samples(now=now)
+        rows = self.rows()
+        assert [(row['Resolution'], row['Samples']) for row in rows] == [(60, 1), (HOUR, 3), (DAY, 2)]
+        assert sum(row['CpuTime'] for row in rows) == 6.0 # nothing is lost or counted twice
+
+class TestResourceSampler(TestCase):
+    def test_sample_current_process(self):
+        cache = ProcessMetadataCache(fileinfo_provider=lambda exe_full_path: None)
+        sampler = ResourceSampler(cache=cache)
+        first = sampler.sample(now=1000.0)
+        app_id = cache.get_metadata(cache.get_exe_full_path(psutil.Process(os.getpid()))).app_id
+        me = next(item for item in first if item['AppId'] == app_id)
+        assert me['CpuTime'] == 0.0 and me['RssSum'] > 0 and me['BucketStart'] == 960 # baseline only
+        sum(i*i for i in range(200000)) # burn some cpu
+        second = sampler.sample(now=1030.0)
+        me = next(item for item in second if item['AppId'] == app_id)
+        assert me['CpuTime'] > 0.0 and me['Samples'] == 1
+        assert len({item['AppId'] for item in second}) == len(second) # aggregated per app
+
+    def test_version_info_errors_skip_the_process(self):
+        me = psutil.Process(os.getpid())
+        def fileinfo(exe_full_path: str):
+            if exe_full_path == me.exe(): raise RuntimeError("pywintypes.error") # not psutil / os
+            return None
+        sampler = ResourceSampler(cache=sampler_cache(fileinfo_provider=fileinfo))
+        samples = sampler.sample(now=1000.0) # the pass goes on without this process
+        assert (me.pid, me.create_time()) in sampler.unresolved
+        assert sampler.cache.exe_paths.maxsize >= 4096 # its own cache, the whole process table
+        assert all(item['AppId'] for item in samples)
+
+class TestResourceEndpoints(TestCase):
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        import api
+        self.api = api
+        self.database = db.DataBase(db_path=':memory:')
+        def get_db():
+            yield self.database
+        api.app.dependency_overrides[api.get_db] = get_db
+        self.client = TestClient(api.app)
+    def tearDown(self):
+        self.api.app.dependency_overrides.clear()
+        self.database.close()
+
+    def test_usage_next_to_resources(self):
+        bucket = int(time.time()) // 60 * 60
+        response = self.client.post('/api/resources/samples', json={'samples': [sample('a', bucket, cpu_time=3.0), sample('b', bucket)]})
+        assert response.status_code == 200
+        with self.database.cursor_context():
+            self.database.insert_activity(models.IActivityEntry(
+                AppId='a', Title='t', URL=None, IsActive=True, IdleDuration=0, Duration=42
+            ))
+        rows = self.client.get('/api/resources/apps').json()
+        assert [row['AppId'] for row in rows] == ['a', 'b'] # most expensive first
+        assert rows[0]['UsageDuration'] == 42 and rows[0]['RssAvg'] == 100 and rows[1]['UsageDuration'] == 0
+        assert self.client.get('/api/resources/apps', params={'start_date': '2000-01-01', 'end_date': '2000-01-02'}).json() == []
+        assert self.client.post('/api/resources/downsample').json()['rolled'] == 0
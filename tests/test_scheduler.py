@@ -0,0 +1,59 @@
+from services.scheduler import AdaptiveScheduler, transition_offset
+from unittest import TestCase
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self) -> float:
+        return self.now
+    def sleep(self, seconds: float) -> None:
+        assert seconds >= 0
+        self.now += seconds
+
+def make_scheduler(clock: FakeClock) -> AdaptiveScheduler:
+    return AdaptiveScheduler(
+        base_interval=5, min_interval=1, max_interval=60, idle_limit=120, backoff=2,
+        clock=clock, sleep=clock.sleep
+    )
+
+class TestAdaptiveScheduler(TestCase):
+    def test_tighten_after_change_then_relax(self):
+        scheduler = make_scheduler(FakeClock())
+        assert scheduler.observe(idle_duration=0, changed=True) == 1
+        intervals = [scheduler.observe(idle_duration=0, changed=False) for _ in range(6)]
+        assert intervals == sorted(intervals) and intervals[0] > 1 and intervals[-1] == 5
+
+    def test_idle_backoff(self):
+        scheduler = make_scheduler(FakeClock())
+        intervals = [scheduler.observe(idle_duration=200 + i, changed=False) for i in range(6)]
+        assert intervals == [10, 20, 40, 60, 60, 60]
+        assert scheduler.observe(idle_duration=0, changed=True) == 1 # back to work
+
+    def test_aligns_with_idle_threshold(self):
+        scheduler = make_scheduler(FakeClock())
+        assert scheduler.observe(idle_duration=118, changed=False) == 3 # wakes up just after crossing 120
+        assert scheduler.observe(idle_duration=100, changed=False) == 5
+
+    def test_wait_does_not_drift(self):
+        clock = FakeClock()
+        scheduler = make_scheduler(clock)
+        total = 0.0
+        for _ in range(100):
+            total += scheduler.wait()
+            clock.now += 0.3 # the tick's own work
+        assert abs(clock.now - 0.3 - 500) < 1e-6 # deadlines stay on the 5 sec grid
+        assert abs(total - 500) < 1e-6 and scheduler.wakeups == 100
+
+    def test_wait_after_overrun_and_suspend(self):
+        clock = FakeClock()
+        scheduler = make_scheduler(clock)
+        scheduler.wait()
+        clock.now += 8 # slow tick, longer than the interval
+        assert scheduler.wait() == 8 # no catch up burst, the real time is credited
+        clock.now += 3600 # system sleep
+        assert scheduler.wait() == 5
+
+    def test_transition_offset(self):
+        assert transition_offset(idle_duration=3, active=True, elapsed=60) == 3      # input 3 sec ago
+        assert transition_offset(idle_duration=150, active=False, elapsed=60) == 30  # crossed 120 sec, 30 sec ago
+        assert transition_offset(idle_duration=500, active=False, elapsed=60) == 60
@@ -0,0 +1,144 @@
+from . import db, models
+from ml.title_classifier import TitleClassifier, normalize_title, title_key, category_split
+from ml.batch_classification import BatchResult, BatchItem
+from unittest import TestCase
+from typing import List, Dict
+import tempfile
+import time
+
+class StubBatchClassifier:
+    def __init__(self, categories: Dict[str, str]):
+        self.categories = categories # normalized title -> category
+        self.calls: List[List[str]] = []
+    def classify(self, items: List[BatchItem], categories: List[str]) -> BatchResult:
+        self.calls.append([item['key'] for item in items])
+        return BatchResult(
+            categories={item['key']: self.categories[item['key'].partition('|')[2]] for item in items if item['key'].partition('|')[2] in self.categories},
+            failed={}, batches=[{'items': len(items)}] # type: ignore
+        )
+
+class TestTitleClassifier(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = db.Path(self.tmpdir.name).joinpath('database.db')
+        self.database = db.DataBase(db_path=self.db_path)
+        with self.database.cursor_context() as cursor:
+            for category in ('Education', 'Entertainment', 'Work'): cursor.execute("INSERT INTO Categories (Category) VALUES (?)", (category, ))
+            cursor.execute("INSERT INTO Apps (AppId, ExeFileName, ExeDirName, IsBrowser, Category) VALUES ('dir | chrome.exe', 'chrome.exe', 'dir', TRUE, 'Work')")
+            self.database.commit()
+        self.llm = StubBatchClassifier({'deep dive into transformers': 'Education', 'intro to neural networks': 'Education',
+                                        'cat compilation #': 'Entertainment', 'skateboard fails #': 'Entertainment'})
+        self.classifier = TitleClassifier(db_path=self.db_path, classifier=self.llm) # type: ignore
+        self.classifier.open()
+        self.addCleanup(self.classifier.close)
+    def tearDown(self):
+        self.database.close()
+        self.tmpdir.cleanup()
+
+    def add(self, title: str, url: str = 'https://www.youtube.com/watch', duration: float = 60.0) -> int:
+        with self.database.cursor_context() as cursor:
+            return self.database.insert_activity(models.IActivityEntry( # type: ignore
+                AppId='dir | chrome.exe', Title=title, URL=url, IsActive=True, IdleDuration=0.0, Duration=duration
+            ))
+
+    def stats(self):
+        with self.database.cursor_context() as cursor: return self.classifier.stats(cursor)
+
+    def rows(self) -> Dict[int, tuple]:
+        with self.database.cursor_context() as cursor:
+            cursor.execute("SELECT EntryId, Category, Source FROM ActivityTitleCategories")
+            return {row['EntryId']: (row['Category'], row['Source']) for row in cursor.fetchall()}
+
+    def test_keys(self):
+        assert normalize_title("(3) Lecture 12: Graphs - YouTube") == "lecture #: graphs"
+        assert normalize_title("Pull requests · efficia/efficia · GitHub") == "pull requests"
+        assert title_key("Lecture 12 - YouTube", "m.youtube.com") == title_key("lecture 13 - YouTube", "www.youtube.com") == "youtube.com|lecture #"
+
+    def test_tiers(self):
+        lecture = self.add("Lecture 4 - Linear Algebra Course - YouTube")
+        deep = self.add("Deep dive into transformers - YouTube")
+        cats = [self.add(f"Cat compilation {i} - YouTube") for i in range(3)]
+        self.add("Intro to neural networks - YouTube")
+        self.add("Skateboard fails 2 - YouTube")
+        assert self.classifier.run_once() == 7 + 4
+        rows = self.rows()
+        assert rows[lecture] == ('Education', 'keyword')
+        assert rows[deep] == ('Education', 'llm') and all(rows[entry] == ('Entertainment', 'llm') for entry in cats)
+        assert len(self.llm.calls) == 1 and sorted(self.llm.calls[0]) == [
+            'youtube.com|cat compilation #', 'youtube.com|deep dive into transformers', 'youtube.com|intro to neural networks', 'youtube.com|skateboard fails #'
+        ]
+
+        # streaming past the watermark: cache hits and the local model trained on the LLM answers skip the LLM
+        again = self.add("Cat compilation 9 - YouTube")
+        similar = self.add("Cat compilation vol 2 - YouTube")
+        assert self.classifier.run_once() == 2
+        rows = self.rows()
+        assert rows[again] == ('Entertainment', 'llm') and rows[similar] == ('Entertainment', 'local')
+        assert len(self.llm.calls) == 1 and self.classifier.run_once() == 0
+        stats = self.stats()
+        assert stats['processed'] == 9 and stats['cached'] == 1 and stats['keyword'] == 1 and stats['local'] == 1
+        assert stats['llm'] == 4 and stats['pending'] == 0
+
+        # a new process resumes at the watermark
+        self.classifier.close()
+        self.classifier = TitleClassifier(db_path=self.db_path, classifier=self.llm) # type: ignore
+        self.classifier.open()
+        assert self.classifier.watermark == similar and self.stats()['documents'] == 4
+
+    def test_override_and_rollup(self):
+        deep = self.add("Deep dive into transformers - YouTube", duration=100)
+        other = self.add("Deep dive into transformers - YouTube", duration=50)
+        self.add("Inbox", url=None, duration=30) # type: ignore # not a browser tab, counted by its app
+        self.classifier.run_once()
+        key = title_key("Deep dive into transformers - YouTube", 'youtube.com')
+        with self.database.cursor_context() as cursor:
+            assert self.classifier.set_category(cursor, key, 'Work') == 2
+            assert self.classifier.apply(cursor, key, 'Education', 'llm') == 0 # the user's choice wins
+            self.database.commit()
+        assert self.rows()[deep] == self.rows()[other] == ('Work', 'user')
+        with self.database.cursor_context() as cursor:
+            split = {row['Category']: (row['Duration'], row['TitleDuration']) for row in category_split(cursor)}
+            assert split == {'Work': (180.0, 150.0)}
+            assert category_split(cursor, start_date='2000-01-01', end_date='2000-01-02') == []
+
+    def test_unanswered_titles_back_off(self):
+        deep = self.add("Deep dive into transformers - YouTube")
+        unknown = [self.add(f"Mystery video {name} - YouTube") for name in ('one', 'two')]
+        now = time.time()
+        self.classifier.process_new()
+        assert self.classifier.resolve_pending(now=now) == 1 and self.rows()[deep] == ('Education', 'llm')
+        assert self.classifier.resolve_pending(now=now) == 0 and len(self.llm.calls) == 1 # not asked again right away
+        self.classifier.max_attempts = 2
+        assert self.classifier.resolve_pending(now=now + 3600) == 0 and len(self.llm.calls) == 2
+        assert self.classifier.resolve_pending(now=now + 7200) == 0 and len(self.llm.calls) == 2 # given up
+        assert all(self.rows()[entry] == (None, 'pending') for entry in unknown)
+        assert self.stats()['dead'] == 2 and self.stats()['llm'] == 1
+        key = title_key("Mystery video one - YouTube", 'youtube.com')
+        with self.database.cursor_context() as cursor: # the user's answer still lands
+            assert self.classifier.set_category(cursor, key, 'Work') == 1
+            self.database.commit()
+        assert self.stats()['dead'] == 1
+
+    def test_starts_before_the_schema(self):
+        db_path = db.Path(self.tmpdir.name).joinpath('upgraded.db') # the API creates the tables after the thread started
+        classifier = TitleClassifier(db_path=db_path, classifier=self.llm, poll_interval=0.05) # type: ignore
+        classifier.start()
+        self.addCleanup(classifier.stop)
+        time.sleep(0.2)
+        assert classifier.thread is not None and classifier.thread.is_alive() and not classifier.loaded
+        database = db.DataBase(db_path=db_path)
+        self.addCleanup(database.close)
+        deadline = time.time() + 5
+        while not classifier.loaded and time.time() < deadline: time.sleep(0.05)
+        assert classifier.loaded and classifier.watermark == 0
+
+    def test_local_tier_cold_start(self):
+        self.add("Deep dive into transformers - YouTube")
+        self.classifier.run_once()
+        assert self.stats()['documents'] == 1
+        cat = self.add("Cat compilation 1 - YouTube") # shares only the site with the one title learned
+        calls = len(self.llm.calls)
+        assert self.classifier.process_new() == 1 and self.rows()[cat] == (None, 'pending') # the local model does not answer
+        self.classifier.resolve_pending()
+        assert len(self.llm.calls) == calls + 1 and self.rows()[cat] == ('Entertainment', 'llm')
+        assert self.stats()['local'] == 0